@@ -1,14 +1,35 @@
 import asyncio
+import hmac
 import os
 from functools import lru_cache
 from pathlib import Path
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Dict, Optional
 
 from dotenv import load_dotenv
+from fastapi import Header, HTTPException, status
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+from app.services.admission import AdmissionController
+from app.services.cache import CacheBackend, create_cache
+from app.services.container import ServiceContainer
+from app.services.drain import DrainCoordinator
+from app.services.idempotency import IdempotencyStore
+from app.services.job_events import JobEventHub
+from app.services.jobs import JobQueue
+from app.services.llm import LLMService
+from app.services.llm_batch import ScriptBatcher
+from app.services.llm_routing import ModelRouter, parse_prices, parse_routes
+from app.services.pipeline import PIPELINE_STAGES
+from app.services.profiling import LoopLagMonitor, Profiler
+from app.services.reuse import ReuseHierarchy, parse_specialty_prefixes
+from app.services.scheduler import FairPolicy, parse_weights
+from app.services.stage_graph import TraceLog, parse_stage_timeouts
+from app.services.storage import StorageService
 from app.services.supabase import SupabaseService
+from app.services.video_cache import VideoCache
+from app.services.video_generator import VideoGeneratorService
+from app.services.warming import CacheWarmer
 
 
 # Determine backend directory and .env file path
@@ -28,6 +49,7 @@ class Settings(BaseSettings):
 
   # Database configuration (local or Supabase)
   database_path: str = Field(default="amma_health.db", alias="DATABASE_PATH")
+  database_pool_size: int = Field(default=5, alias="DATABASE_POOL_SIZE")  # idle SQLite connections kept for reuse
   supabase_url: str | None = Field(default=None, alias="SUPABASE_URL")
   supabase_anon_key: str | None = Field(default=None, alias="SUPABASE_ANON_KEY")
   supabase_service_key: str | None = Field(default=None, alias="SUPABASE_SERVICE_KEY")
@@ -35,10 +57,22 @@ class Settings(BaseSettings):
   # Storage configuration
   storage_dir: str = Field(default="storage", alias="STORAGE_DIR")
   storage_bucket: str = Field(default="patient-files", alias="STORAGE_BUCKET")
+  video_cache_max_bytes: int = Field(default=5 * 1024**3, alias="VIDEO_CACHE_MAX_BYTES")
+  video_cache_policy: str = Field(default="lru", alias="VIDEO_CACHE_POLICY")  # lru | lfu
   
   # OpenAI configuration
   openai_api_key: str = Field(..., alias="OPENAI_API_KEY")  # Required
   openai_model: str = Field(default="gpt-4o", alias="OPENAI_MODEL")
+  openai_base_url: str | None = Field(default=None, alias="OPENAI_BASE_URL")
+  # Models tried before OPENAI_MODEL per request class (explainer | recovery_day | milestone | generic)
+  llm_routes: str = Field(default="recovery_day=gpt-4o-mini", alias="LLM_ROUTES")  # e.g. "recovery_day=gpt-4o-mini,milestone=gpt-4o-mini"
+  llm_model_prices: str = Field(default="gpt-4o=2.50/10.00,gpt-4o-mini=0.15/0.60", alias="LLM_MODEL_PRICES")  # USD per 1M prompt/completion tokens
+
+  # Batch API for queued jobs: cheaper and higher limits, answers within hours instead of seconds
+  llm_batch_enabled: bool = Field(default=False, alias="LLM_BATCH_ENABLED")
+  llm_batch_max_requests: int = Field(default=500, alias="LLM_BATCH_MAX_REQUESTS")
+  llm_batch_max_wait: int = Field(default=300, alias="LLM_BATCH_MAX_WAIT")  # seconds a request waits for more to batch with
+  llm_batch_poll_interval: int = Field(default=60, alias="LLM_BATCH_POLL_INTERVAL")
   
   # HeyGen configuration
   heygen_api_key: str = Field(..., alias="HEYGEN_API_KEY")
@@ -49,8 +83,77 @@ class Settings(BaseSettings):
   heygen_poll_interval: int = Field(default=5, alias="HEYGEN_POLL_INTERVAL")
   heygen_poll_timeout: int = Field(default=300, alias="HEYGEN_POLL_TIMEOUT")
   
+  # Prompt construction
+  notes_token_budget: int = Field(default=1500, alias="NOTES_TOKEN_BUDGET")
+  notes_max_files: int = Field(default=5, alias="NOTES_MAX_FILES")
+
+  # Shared cache: memory://, sqlite:///path.db or redis://host:6379/0
+  cache_url: str = Field(default="memory://", alias="CACHE_URL")
+
   # Feature flags
   reuse_case_enabled: bool = Field(default=True, alias="REUSE_CASE_ENABLED")
+  reuse_mode: str = Field(default="exact", alias="REUSE_MODE")  # exact | hierarchical (related ICD-10 codes); per-request override
+  reuse_min_prefix: int = Field(default=3, alias="REUSE_MIN_PREFIX")  # shared code characters: 4 subcategory, 3 category, 1 chapter
+  reuse_specialty_prefix: str = Field(default="", alias="REUSE_SPECIALTY_PREFIX")  # e.g. "oncology=exact,endocrinology=4"
+
+  # Durable job queue (SQLite file shared by all workers on the node)
+  jobs_db_path: str = Field(default="jobs.db", alias="JOBS_DB_PATH")
+  job_worker_concurrency: int = Field(default=2, alias="JOB_WORKER_CONCURRENCY")  # 0 disables the worker
+  job_visibility_timeout: int = Field(default=60, alias="JOB_VISIBILITY_TIMEOUT")
+  job_max_attempts: int = Field(default=3, alias="JOB_MAX_ATTEMPTS")
+  job_events_poll_interval: float = Field(default=0.5, alias="JOB_EVENTS_POLL_INTERVAL")  # one query per interval per process, however many clients wait
+  job_events_heartbeat: float = Field(default=15.0, alias="JOB_EVENTS_HEARTBEAT")  # seconds between keep-alives on a quiet stream
+  job_event_retention: int = Field(default=604800, alias="JOB_EVENT_RETENTION")  # seconds events are kept for resuming streams
+
+  # Admission control: concurrent holders per stage, shared wait queue bounds
+  admission_max_pipelines: int = Field(default=8, alias="ADMISSION_MAX_PIPELINES")
+  admission_max_llm_calls: int = Field(default=4, alias="ADMISSION_MAX_LLM_CALLS")
+  admission_max_renders: int = Field(default=4, alias="ADMISSION_MAX_RENDERS")
+  admission_max_downloads: int = Field(default=2, alias="ADMISSION_MAX_DOWNLOADS")
+  admission_queue_size: int = Field(default=16, alias="ADMISSION_QUEUE_SIZE")  # waiters per stage before 429
+  admission_queue_timeout: float = Field(default=10.0, alias="ADMISSION_QUEUE_TIMEOUT")  # seconds before 503
+  admission_interactive_reserve: int = Field(default=1, alias="ADMISSION_INTERACTIVE_RESERVE")  # slots per stage background work may not use
+
+  # Pipeline stage graph: optional per-stage time limits and recent run traces for /admin/pipeline/traces
+  pipeline_stage_timeouts: str = Field(default="", alias="PIPELINE_STAGE_TIMEOUTS")  # seconds, e.g. "context=10,script=120,render=1800"
+  pipeline_trace_history: int = Field(default=200, alias="PIPELINE_TRACE_HISTORY")
+
+  # Scheduling between priority classes (interactive > recovery > warming) and tenants
+  scheduler_aging_seconds: float = Field(default=300.0, alias="SCHEDULER_AGING_SECONDS")  # wait that promotes one class
+  scheduler_tenant: str = Field(default="doctor", alias="SCHEDULER_TENANT")  # doctor | domain (clinic email domain)
+  scheduler_tenant_weights: str = Field(default="", alias="SCHEDULER_TENANT_WEIGHTS")  # e.g. "clinic-a.org=2,clinic-b.org=1"
+
+  # Popularity-driven pre-generation of videos while the job queue is idle
+  warming_enabled: bool = Field(default=False, alias="WARMING_ENABLED")
+  warming_interval: int = Field(default=900, alias="WARMING_INTERVAL")
+  warming_daily_budget: int = Field(default=10, alias="WARMING_DAILY_BUDGET")  # warm renders per 24h
+  warming_min_daily_demand: float = Field(default=1.0, alias="WARMING_MIN_DAILY_DEMAND")
+  warming_half_life_days: float = Field(default=7.0, alias="WARMING_HALF_LIFE_DAYS")
+  warming_lookback_days: int = Field(default=30, alias="WARMING_LOOKBACK_DAYS")
+  warming_render_cost: float = Field(default=1.0, alias="WARMING_RENDER_COST")  # cost of one render, for reporting
+
+  # Idempotency-Key support on POST /videos/generate
+  idempotency_ttl: int = Field(default=86400, alias="IDEMPOTENCY_TTL")  # seconds a key and its response are kept
+  idempotency_lease: int = Field(default=60, alias="IDEMPOTENCY_LEASE")  # an in-progress key is taken over once its owner stops renewing for this long
+  idempotency_wait_timeout: int = Field(default=300, alias="IDEMPOTENCY_WAIT_TIMEOUT")  # how long a retry waits on the original before 409
+  idempotency_purge_interval: int = Field(default=3600, alias="IDEMPOTENCY_PURGE_INTERVAL")  # expired keys are deleted at most this often
+
+  # Shutdown: how long in-flight generations get before they are handed off to another instance
+  drain_timeout: int = Field(default=25, alias="DRAIN_TIMEOUT")
+
+  # Request deadlines for POST /videos/generate; X-Request-Timeout can only shorten this (0 = no limit)
+  generate_request_timeout: float = Field(default=600, alias="GENERATE_REQUEST_TIMEOUT")
+  detach_submitted_renders: bool = Field(default=True, alias="DETACH_SUBMITTED_RENDERS")  # an abandoned request whose render was already submitted finishes as a background job
+
+  # Startup
+  warmup_on_startup: bool = Field(default=False, alias="WARMUP_ON_STARTUP")
+
+  # Diagnostics: /admin routes and X-Profile request captures are disabled while ADMIN_TOKEN is empty
+  admin_token: str = Field(default="", alias="ADMIN_TOKEN")
+  loop_lag_monitor_enabled: bool = Field(default=True, alias="LOOP_LAG_MONITOR_ENABLED")
+  loop_lag_threshold: float = Field(default=0.1, alias="LOOP_LAG_THRESHOLD")  # seconds of blocking recorded as a stall
+  profile_sample_interval: float = Field(default=0.005, alias="PROFILE_SAMPLE_INTERVAL")
+  profile_max_seconds: int = Field(default=60, alias="PROFILE_MAX_SECONDS")
 
   model_config = SettingsConfigDict(
     env_file=str(_env_file) if _env_file.exists() else ".env",
@@ -67,20 +170,266 @@ def get_settings() -> Settings:
   return Settings()  # type: ignore[arg-type]
 
 
-async def get_supabase_service() -> AsyncGenerator[SupabaseService, None]:
-  """Provide a database service instance per-request."""
+@lru_cache
+def get_service_container() -> ServiceContainer:
+  """Return the process-wide clients; the app lifespan starts and closes them."""
   settings = get_settings()
-  
-  # Use service key for admin operations if available, otherwise use anon key
-  supabase_key = settings.supabase_service_key or settings.supabase_anon_key
-  
-  service = SupabaseService(
+  return ServiceContainer(
+    openai_api_key=settings.openai_api_key,
+    openai_base_url=settings.openai_base_url or None,
+    supabase_url=settings.supabase_url,
+    # Use service key for admin operations if available, otherwise use anon key
+    supabase_key=settings.supabase_service_key or settings.supabase_anon_key,
+    database_path=settings.database_path,
+    database_pool_size=settings.database_pool_size,
+    storage_bucket=settings.storage_bucket,
+    video_cache_factory=get_video_cache,
+  )
+
+
+def get_storage_service() -> StorageService:
+  return get_service_container().storage
+
+
+@lru_cache
+def get_model_router() -> ModelRouter:
+  """Return the process-wide model routing table and its per-route statistics."""
+  settings = get_settings()
+  return ModelRouter(
+    settings.openai_model,
+    parse_routes(settings.llm_routes),
+    parse_prices(settings.llm_model_prices),
+  )
+
+
+def get_llm_service() -> LLMService:
+  """LLM service over the shared OpenAI client."""
+  settings = get_settings()
+  return LLMService(
+    settings.openai_api_key,
+    settings.openai_model,
+    client=get_service_container().openai,
+    router=get_model_router(),
+  )
+
+
+@lru_cache
+def get_script_batcher() -> ScriptBatcher:
+  """Return the process-wide Batch API submitter; its table lives in the job queue's SQLite file."""
+  from openai import AsyncOpenAI
+
+  settings = get_settings()
+  return ScriptBatcher(
+    AsyncOpenAI(api_key=settings.openai_api_key, base_url=settings.openai_base_url or None),
+    settings.jobs_db_path,
+    max_requests=settings.llm_batch_max_requests,
+    max_wait=settings.llm_batch_max_wait,
+    poll_interval=settings.llm_batch_poll_interval,
+  )
+
+
+def get_job_llm_service() -> LLMService:
+  """LLM service for queued jobs: goes through the Batch API when ``LLM_BATCH_ENABLED``."""
+  settings = get_settings()
+  if not settings.llm_batch_enabled:
+    return get_llm_service()
+  return LLMService(
+    settings.openai_api_key,
+    settings.openai_model,
+    batcher=get_script_batcher(),
+    client=get_service_container().openai,
+    router=get_model_router(),
+  )
+
+
+def get_video_service() -> VideoGeneratorService:
+  """Lazy initialization of video service."""
+  settings = get_settings()
+  return VideoGeneratorService(
+    api_key=settings.heygen_api_key,
+    avatar_id=settings.heygen_avatar_id,
+    voice_id=settings.heygen_voice_id,
+    ratio=settings.heygen_ratio,
+    background=settings.heygen_background or None,
+    poll_interval=settings.heygen_poll_interval,
+    poll_timeout=settings.heygen_poll_timeout,
+    http_client=get_service_container().http,
+  )
+
+
+@lru_cache
+def get_drain_coordinator() -> DrainCoordinator:
+  """Return the process-wide shutdown coordinator."""
+  return DrainCoordinator(timeout=get_settings().drain_timeout)
+
+
+@lru_cache
+def get_fair_policy() -> FairPolicy:
+  """Return the priority/tenant policy shared by admission control and the job queue."""
+  settings = get_settings()
+  return FairPolicy(
+    aging_seconds=settings.scheduler_aging_seconds,
+    weights=parse_weights(settings.scheduler_tenant_weights),
+    tenant_mode=settings.scheduler_tenant,
+  )
+
+
+@lru_cache
+def get_profiler() -> Profiler:
+  """Return the process-wide profiler and event-loop lag monitor."""
+  settings = get_settings()
+  return Profiler(
+    monitor=LoopLagMonitor(threshold=settings.loop_lag_threshold),
+    sample_interval=settings.profile_sample_interval,
+  )
+
+
+def verify_admin_token(token: Optional[str]) -> bool:
+  expected = get_settings().admin_token
+  return bool(expected and token) and hmac.compare_digest(token.encode("utf-8"), expected.encode("utf-8"))
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(default=None)) -> None:
+  """Gate diagnostics routes; they do not exist at all until ADMIN_TOKEN is set."""
+  if not get_settings().admin_token:
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+  if not verify_admin_token(x_admin_token):
+    raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid admin token.")
+
+
+@lru_cache
+def get_reuse_hierarchy() -> ReuseHierarchy:
+  settings = get_settings()
+  return ReuseHierarchy(
+    default_mode=settings.reuse_mode,
+    min_prefix=settings.reuse_min_prefix,
+    specialty_prefix=parse_specialty_prefixes(settings.reuse_specialty_prefix),
+  )
+
+
+@lru_cache
+def get_admission_controller() -> AdmissionController:
+  """Return the process-wide stage limiters for video generation."""
+  settings = get_settings()
+  return AdmissionController(
+    {
+      "pipeline": settings.admission_max_pipelines,
+      "llm": settings.admission_max_llm_calls,
+      "render": settings.admission_max_renders,
+      "download": settings.admission_max_downloads,
+    },
+    queue_size=settings.admission_queue_size,
+    queue_timeout=settings.admission_queue_timeout,
+    policy=get_fair_policy(),
+    interactive_reserve=settings.admission_interactive_reserve,
+  )
+
+
+@lru_cache
+def get_stage_timeouts() -> Dict[str, float]:
+  timeouts = parse_stage_timeouts(get_settings().pipeline_stage_timeouts)
+  unknown = sorted(set(timeouts) - set(PIPELINE_STAGES))
+  if unknown:
+    raise ValueError(f"PIPELINE_STAGE_TIMEOUTS names unknown stage(s) {unknown}; stages are {', '.join(PIPELINE_STAGES)}")
+  return timeouts
+
+
+@lru_cache
+def get_trace_log() -> TraceLog:
+  """Return the process-wide log of recent pipeline run traces."""
+  return TraceLog(get_settings().pipeline_trace_history)
+
+
+@lru_cache
+def get_job_queue() -> JobQueue:
+  """Return the process-wide handle on the shared job table."""
+  settings = get_settings()
+  return JobQueue(
+    settings.jobs_db_path,
+    visibility_timeout=settings.job_visibility_timeout,
+    max_attempts=settings.job_max_attempts,
+    policy=get_fair_policy(),
+    event_retention=settings.job_event_retention,
+  )
+
+
+@lru_cache
+def get_job_event_hub() -> JobEventHub:
+  """Return the process-wide fan-out of job progress; it ends every stream once draining starts."""
+  hub = JobEventHub(get_job_queue(), poll_interval=get_settings().job_events_poll_interval)
+  get_drain_coordinator().on_begin(hub.close)
+  return hub
+
+
+@lru_cache
+def get_cache() -> CacheBackend:
+  """Return the process-wide cache backend selected by ``CACHE_URL``."""
+  return create_cache(get_settings().cache_url)
+
+
+@lru_cache
+def get_video_cache() -> VideoCache:
+  """Return the process-wide video cache under ``STORAGE_DIR/videos``."""
+  settings = get_settings()
+  return VideoCache(
+    Path(settings.storage_dir) / "videos",
+    max_bytes=settings.video_cache_max_bytes,
+    policy=settings.video_cache_policy,
+    supabase_client=get_service_container().supabase,
+    storage_bucket=settings.storage_bucket,
+    http_client=get_service_container().http,
+  )
+
+
+@lru_cache
+def get_cache_warmer() -> CacheWarmer:
+  """Return the process-wide cache warmer; it only runs when started by the app."""
+  settings = get_settings()
+  return CacheWarmer(
+    get_job_queue(),
+    build_supabase_service,
+    interval=settings.warming_interval,
+    daily_budget=settings.warming_daily_budget,
+    batch_size=max(1, settings.job_worker_concurrency),
+    min_daily_demand=settings.warming_min_daily_demand,
+    half_life_days=settings.warming_half_life_days,
+    lookback_days=settings.warming_lookback_days,
+    render_cost=settings.warming_render_cost,
+  )
+
+
+@lru_cache
+def get_idempotency_store() -> IdempotencyStore:
+  """Return the process-wide idempotency key store; it keeps its own database connection."""
+  settings = get_settings()
+  return IdempotencyStore(
+    build_supabase_service,
+    ttl=settings.idempotency_ttl,
+    lease=settings.idempotency_lease,
+    wait_timeout=settings.idempotency_wait_timeout,
+    purge_interval=settings.idempotency_purge_interval,
+  )
+
+
+def build_supabase_service() -> SupabaseService:
+  """Create a database service over the shared client or connection pool; the caller must ``close`` it."""
+  settings = get_settings()
+  container = get_service_container()
+  return SupabaseService(
     db_path=settings.database_path,
     storage_bucket=settings.storage_bucket,
     reuse_case_enabled=settings.reuse_case_enabled,
-    supabase_url=settings.supabase_url,
-    supabase_key=supabase_key,
+    notes_token_budget=settings.notes_token_budget,
+    notes_max_files=settings.notes_max_files,
+    cache=get_cache(),
+    supabase_client=container.supabase,
+    database_pool=container.database,
   )
+
+
+async def get_supabase_service() -> AsyncGenerator[SupabaseService, None]:
+  """Provide a database service instance per-request."""
+  service = build_supabase_service()
   try:
     yield service
   finally:
@@ -0,0 +1,71 @@
+"""Runs queued video generation jobs inside each app process."""
+
+from typing import Any, Awaitable, Callable, Dict
+
+from app.dependencies import (
+  build_supabase_service,
+  get_admission_controller,
+  get_job_llm_service,
+  get_job_queue,
+  get_reuse_hierarchy,
+  get_settings,
+  get_stage_timeouts,
+  get_storage_service,
+  get_trace_log,
+  get_video_cache,
+  get_video_service,
+)
+from app.models.requests import VideoGenerationRequest
+from app.services.jobs import Job, JobWorker
+from app.services.pipeline import VideoPipeline, VideoProviderError
+from app.services.scheduler import Ticket, scheduled_as
+
+
+async def run_video_job(job: Job, checkpoint: Callable[[str, Dict[str, Any]], Awaitable[None]]) -> Dict[str, Any]:
+  """Run (or resume from ``job.state``) the generation pipeline, or a warm render, for one job."""
+  supabase_service = build_supabase_service()
+  job_queue = get_job_queue()
+
+  async def notify(event: str, data: Dict[str, Any]) -> None:
+    # Progress for GET /videos/jobs/{id}/events; never worth failing the job over.
+    try:
+      await job_queue.publish(job.id, event, data)
+    except Exception as e:
+      print(f"[WARN] Could not record {event} event for job {job.id}: {e}")
+
+  try:
+    pipeline = VideoPipeline(
+      supabase_service=supabase_service,
+      llm_service_factory=get_job_llm_service,
+      video_service_factory=get_video_service,
+      video_cache=get_video_cache(),
+      admission=get_admission_controller(),
+      reuse_hierarchy=get_reuse_hierarchy(),
+      storage_service=get_storage_service(),
+      stage_timeouts=get_stage_timeouts(),
+      trace_log=get_trace_log(),
+    )
+    with scheduled_as(Ticket(job.priority_class, job.tenant)):
+      if "warming" in job.request:
+        response = await pipeline.warm(job.request["warming"], state=job.state, checkpoint=checkpoint, notify=notify)
+      else:
+        response = await pipeline.run(
+          VideoGenerationRequest(**job.request), state=job.state, checkpoint=checkpoint, notify=notify
+        )
+    return response.model_dump()
+  finally:
+    await supabase_service.close()
+
+
+def _is_retryable(error: BaseException) -> bool:
+  # Bad input or configuration fails the same way every time.
+  return not isinstance(error, (ValueError, VideoProviderError))
+
+
+def create_job_worker() -> JobWorker:
+  return JobWorker(
+    get_job_queue(),
+    run_video_job,
+    concurrency=get_settings().job_worker_concurrency,
+    is_retryable=_is_retryable,
+  )
@@ -1,21 +1,87 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 
-from app.routers import health, videos
+import asyncio
+
+from app.dependencies import (
+  get_cache,
+  get_cache_warmer,
+  get_drain_coordinator,
+  get_idempotency_store,
+  get_job_queue,
+  get_profiler,
+  get_script_batcher,
+  get_service_container,
+  get_settings,
+  verify_admin_token,
+)
+from app.routers import admin, epic, health, patients, storage, videos, warming
+from app.services.profiling import ProfileMiddleware
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+  app.state.ready = False
+  # Shared OpenAI/HTTP/database clients; the first database connection applies pending migrations.
+  await get_service_container().start()
+  if get_settings().loop_lag_monitor_enabled:
+    get_profiler().monitor.start()
+  if get_settings().warmup_on_startup:
+    from app.warmup import warm_up
+
+    await warm_up()
+  worker = None
+  if get_settings().job_worker_concurrency > 0:
+    from app.job_runner import create_job_worker
+
+    worker = create_job_worker()
+    worker.start()
+    if get_settings().llm_batch_enabled:
+      get_script_batcher().start()
+    if get_settings().warming_enabled:
+      get_cache_warmer().start()
+  drain = get_drain_coordinator()
+  drain.install_signal_handlers()
+  app.state.ready = True
+  yield
+  # Readiness already fails once draining starts (on SIGTERM); finish or hand off what is running.
+  app.state.ready = False
+  await get_cache_warmer().stop()
+  drain.begin()
+  await asyncio.gather(
+    drain.drain(),
+    worker.stop(timeout=drain.timeout) if worker else asyncio.sleep(0),
+  )
+  if get_settings().llm_batch_enabled:
+    await get_script_batcher().close()
+  await get_idempotency_store().close()
+  await get_job_queue().close()
+  await get_cache().close()
+  await get_service_container().close()
+  await get_profiler().monitor.stop()
 
 
 app = FastAPI(
   title="Amma Health Video Service",
   version="0.1.0",
   description="Generates personalized medical explanation videos.",
+  lifespan=lifespan,
 )
 
 app.include_router(health.router)
 app.include_router(videos.router)
+app.include_router(epic.router)
+app.include_router(patients.router)
+app.include_router(storage.router)
+app.include_router(warming.router)
+app.include_router(admin.router)
 
-# Serve static files (videos) from storage directory
+app.add_middleware(ProfileMiddleware, profiler=get_profiler, authorize=verify_admin_token)
+
+# Serve remaining static files from the storage directory; videos go through the cache route above.
 storage_path = Path("storage")
 if storage_path.exists():
   app.mount("/storage", StaticFiles(directory=str(storage_path)), name="storage")
-
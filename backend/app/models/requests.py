@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Literal, Optional
 
 from pydantic import BaseModel, Field, constr
 
@@ -20,4 +20,8 @@ class VideoGenerationRequest(BaseModel):
     False,
     description="Skip cache reuse and force a fresh video generation.",
   )
+  reuse_mode: Optional[Literal["exact", "hierarchical"]] = Field(
+    default=None,
+    description="exact reuses only this case's video; hierarchical may also reuse a related ICD-10 code's. Defaults to REUSE_MODE.",
+  )
 
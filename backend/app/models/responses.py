@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 
 from pydantic import BaseModel
 
@@ -8,4 +8,96 @@ class VideoGenerationResponse(BaseModel):
   case_key: str
   reused: bool
   metadata_id: Optional[int] = None
+  matched_diagnosis_code: Optional[str] = None  # set when a related code's video was reused
 
+
+class VideoJobResponse(BaseModel):
+  job_id: str
+  status: str
+  stage: str
+  priority: str
+  attempts: int
+  result: Optional[VideoGenerationResponse] = None
+  error: Optional[str] = None
+
+
+class BundleIngestResponse(BaseModel):
+  entries: int
+  patients: int
+  conditions: int
+  medications: int
+  epic_patient_data_ids: List[Optional[int]]
+
+
+class PatientsByDiagnosisResponse(BaseModel):
+  code: str
+  patient_emails: List[str]
+
+
+class FileSearchHit(BaseModel):
+  id: int
+  file_name: Optional[str] = None
+  file_url: str
+  created_at: Optional[str] = None
+  rank: float
+  snippet: str
+
+
+class FileSearchResponse(BaseModel):
+  query: str
+  results: List[FileSearchHit]
+  limit: int
+  offset: int
+  next_offset: Optional[int] = None
+
+
+class PatientVideo(BaseModel):
+  id: int
+  doctor_email: str
+  file_url: str
+  file_name: Optional[str] = None
+  case_key: Optional[str] = None
+  created_at: Optional[str] = None
+
+
+class PatientVideosResponse(BaseModel):
+  videos: List[PatientVideo]
+  next_cursor: Optional[str] = None
+
+
+class WarmingCase(BaseModel):
+  case_key: str
+  diagnosis_code: str
+  procedure_code: str
+  recovery_milestone: Optional[str] = None
+  doctor_specialty: Optional[str] = None
+  requests: int
+  predicted_daily_demand: float
+  available: bool
+
+
+class WarmingSavings(BaseModel):
+  warmed_videos: int
+  warmed_in_window: int
+  reuse_hits: int
+  render_cost: float
+  saved: float
+  spent: float
+  net: float
+
+
+class WarmingReport(BaseModel):
+  window_days: int
+  requests: int
+  observed_hit_rate: float
+  predicted_daily_requests: float
+  expected_hit_rate: float
+  expected_hit_rate_after_warming: float
+  candidates: List[WarmingCase]
+  savings: WarmingSavings
+  budget_remaining: int
+  in_flight: List[str]
+
+
+class WarmingRunResponse(BaseModel):
+  job_ids: List[str]
@@ -0,0 +1,130 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+
+from app.dependencies import get_model_router, get_profiler, get_settings, get_trace_log, require_admin
+from app.services.llm_routing import ModelRouter
+from app.services.profiling import PROFILE_FORMATS, Artifact, Profiler, ProfilerBusy
+from app.services.stage_graph import TraceLog
+
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin)])
+
+_FORMAT_PATTERN = "^(" + "|".join(PROFILE_FORMATS) + ")$"
+
+
+def _download(artifact: Artifact) -> Response:
+  return Response(
+    content=artifact.content,
+    media_type=artifact.media_type,
+    headers={"Content-Disposition": f'attachment; filename="{artifact.filename}"', "X-Profile-Id": artifact.id},
+  )
+
+
+@router.get("/loop-lag")
+async def loop_lag(profiler: Profiler = Depends(get_profiler)) -> dict:
+  """Heartbeat lag percentiles and the most recent stalls over the threshold, with their stacks."""
+  return profiler.monitor.snapshot()
+
+
+@router.post("/profile")
+async def profile_window(
+  seconds: float = Query(default=10.0, gt=0),
+  format: str = Query(default="speedscope", pattern=_FORMAT_PATTERN),
+  profiler: Profiler = Depends(get_profiler),
+) -> Response:
+  """Profile the event loop for ``seconds`` and download the result."""
+  seconds = min(seconds, get_settings().profile_max_seconds)
+  try:
+    artifact = await profiler.profile_window(seconds, format)
+  except ProfilerBusy as e:
+    raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e)) from e
+  return _download(artifact)
+
+
+@router.get("/profiles")
+async def list_profiles(profiler: Profiler = Depends(get_profiler)) -> dict:
+  """Retained window and per-request (``X-Profile``) captures, newest last."""
+  return {"profiles": [artifact.describe() for artifact in profiler.artifacts.values()]}
+
+
+@router.get("/profiles/{profile_id}")
+async def download_profile(profile_id: str, profiler: Profiler = Depends(get_profiler)) -> Response:
+  artifact = profiler.artifacts.get(profile_id)
+  if artifact is None:
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found.")
+  return _download(artifact)
+
+
+@router.get("/pipeline/traces")
+async def pipeline_traces(
+  limit: int = Query(default=20, ge=1, le=1000),
+  trace_log: TraceLog = Depends(get_trace_log),
+) -> dict:
+  """Stage timings of recent generation and warm runs, newest last."""
+  return {"traces": [trace.describe() for trace in trace_log.recent(limit)]}
+
+
+@router.get("/llm/routes")
+async def llm_routes(model_router: ModelRouter = Depends(get_model_router)) -> dict:
+  """Models per request class with their calls, escalations, latency and cost since startup."""
+  return model_router.report()
+
+
+@router.get("/memory")
+async def memory_status(profiler: Profiler = Depends(get_profiler)) -> dict:
+  return profiler.tracing_status()
+
+
+@router.post("/memory/start")
+async def start_memory_tracing(
+  frames: int = Query(default=25, ge=1, le=100),
+  profiler: Profiler = Depends(get_profiler),
+) -> dict:
+  """Start tracemalloc; allocations made before this are not attributed."""
+  return profiler.start_tracing(frames)
+
+
+@router.post("/memory/stop")
+async def stop_memory_tracing(profiler: Profiler = Depends(get_profiler)) -> dict:
+  """Stop tracemalloc and drop the retained snapshots."""
+  return profiler.stop_tracing()
+
+
+@router.post("/memory/snapshots")
+async def take_memory_snapshot(
+  top: int = Query(default=20, ge=1, le=200),
+  profiler: Profiler = Depends(get_profiler),
+) -> dict:
+  """Take a snapshot and return its largest allocation sites."""
+  try:
+    return await profiler.take_snapshot(top=top)
+  except RuntimeError as e:
+    raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e)) from e
+
+
+@router.get("/memory/snapshots/{snapshot_id}/diff")
+async def diff_memory_snapshots(
+  snapshot_id: str,
+  base: str = Query(..., description="Id of the earlier snapshot."),
+  group_by: str = Query(default="lineno", pattern="^(lineno|filename|traceback)$"),
+  top: int = Query(default=20, ge=1, le=200),
+  profiler: Profiler = Depends(get_profiler),
+) -> dict:
+  """Allocation growth from ``base`` to this snapshot, largest first."""
+  try:
+    return await profiler.diff_snapshots(base, snapshot_id, group_by=group_by, top=top)
+  except KeyError as e:
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Snapshot {e.args[0]} not found.") from e
+
+
+@router.get("/memory/snapshots/{snapshot_id}")
+async def download_memory_snapshot(snapshot_id: str, profiler: Profiler = Depends(get_profiler)) -> Response:
+  """The raw snapshot; load it with ``tracemalloc.Snapshot.load``."""
+  try:
+    content = await profiler.dump_snapshot(snapshot_id)
+  except KeyError as e:
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot not found.") from e
+  return Response(
+    content=content,
+    media_type="application/octet-stream",
+    headers={"Content-Disposition": f'attachment; filename="tracemalloc-{snapshot_id}.snapshot"'},
+  )
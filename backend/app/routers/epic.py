@@ -0,0 +1,53 @@
+import json
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+
+from app.dependencies import get_supabase_service
+from app.models.responses import BundleIngestResponse, PatientsByDiagnosisResponse
+from app.services.fhir import ingest_bundle_stream
+from app.services.supabase import SupabaseService
+
+
+router = APIRouter(prefix="/epic", tags=["epic"])
+
+
+@router.post("/bundles", response_model=BundleIngestResponse)
+async def ingest_bundle(
+  request: Request,
+  doctor_email: str = Query(..., description="Doctor who pulled the bundle from Epic."),
+  patient_email: str | None = Query(
+    default=None,
+    description="Patient account to link every Patient in the bundle to (defaults to the FHIR telecom email).",
+  ),
+  supabase_service: SupabaseService = Depends(get_supabase_service),
+) -> BundleIngestResponse:
+  """Stream a FHIR R4 Bundle (application/fhir+json) into epic_patient_data."""
+  try:
+    summary = await ingest_bundle_stream(
+      request.stream(),
+      supabase_service=supabase_service,
+      doctor_email=doctor_email.strip().lower(),
+      patient_email=patient_email.strip().lower() if patient_email else None,
+    )
+  except (json.JSONDecodeError, ValueError) as e:
+    raise HTTPException(
+      status_code=status.HTTP_400_BAD_REQUEST,
+      detail=f"Invalid FHIR bundle: {e}",
+    ) from e
+
+  print(
+    f"[INFO] Ingested FHIR bundle for {doctor_email}: {summary['entries']} entries, "
+    f"{summary['patients']} patients"
+  )
+  return BundleIngestResponse(**summary)
+
+
+@router.get("/diagnoses/{code}/patients", response_model=PatientsByDiagnosisResponse)
+async def patients_by_diagnosis(
+  code: str,
+  limit: int = Query(default=500, ge=1, le=5000),
+  supabase_service: SupabaseService = Depends(get_supabase_service),
+) -> PatientsByDiagnosisResponse:
+  """List patients whose Epic snapshot includes the diagnosis code (served by the code index)."""
+  emails = await supabase_service.find_patients_by_diagnosis(code, limit=limit)
+  return PatientsByDiagnosisResponse(code=code, patient_emails=emails)
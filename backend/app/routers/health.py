@@ -1,4 +1,6 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request, Response, status
+
+from app.dependencies import get_admission_controller, get_drain_coordinator
 
 
 router = APIRouter()
@@ -8,3 +10,24 @@ router = APIRouter()
 async def health_check() -> dict[str, str]:
   return {"status": "ok"}
 
+
+@router.get("/health/ready", tags=["health"])
+async def readiness_check(request: Request, response: Response) -> dict[str, str]:
+  if not getattr(request.app.state, "ready", False):
+    response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"status": "starting"}
+  if get_drain_coordinator().draining:
+    response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"status": "draining"}
+  return {"status": "ready"}
+
+
+@router.get("/health/load", tags=["health"])
+async def load_metrics() -> dict:
+  """Live admission metrics per stage: slots in use, waiters, rejections and the current Retry-After."""
+  drain = get_drain_coordinator()
+  return {
+    "draining": drain.draining,
+    "in_flight": drain.in_flight,
+    "stages": get_admission_controller().snapshot(),
+  }
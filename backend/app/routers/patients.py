@@ -0,0 +1,112 @@
+import base64
+import hashlib
+import json
+from typing import Optional, Tuple
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+
+from app.dependencies import get_supabase_service
+from app.models.responses import FileSearchHit, FileSearchResponse, PatientVideo, PatientVideosResponse
+from app.services.supabase import SupabaseService
+
+
+router = APIRouter(prefix="/patients", tags=["patients"])
+
+
+def _encode_cursor(created_at: str, video_id: int) -> str:
+  raw = json.dumps([created_at, video_id], separators=(",", ":")).encode("utf-8")
+  return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Tuple[str, int]:
+  try:
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    created_at, video_id = json.loads(raw)
+    return str(created_at), int(video_id)
+  except (ValueError, TypeError) as e:
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.") from e
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+  if not if_none_match:
+    return False
+  candidates = {tag.strip() for tag in if_none_match.split(",")}
+  return "*" in candidates or etag in candidates or etag.removeprefix("W/") in candidates
+
+
+@router.get(
+  "/{email}/videos",
+  response_model=PatientVideosResponse,
+  responses={304: {"description": "Page unchanged since the ETag in If-None-Match."}},
+)
+async def list_patient_videos(
+  email: str,
+  response: Response,
+  limit: int = Query(default=20, ge=1, le=100),
+  cursor: Optional[str] = Query(default=None, description="next_cursor from the previous page."),
+  if_none_match: Optional[str] = Header(default=None),
+  supabase_service: SupabaseService = Depends(get_supabase_service),
+):
+  """Keyset-paginated video library for a patient, newest first."""
+  before = _decode_cursor(cursor) if cursor else None
+  rows = await supabase_service.list_patient_videos(
+    email.strip().lower(),
+    limit=limit + 1,
+    before=before,
+  )
+
+  videos = [
+    PatientVideo(**{**row, "created_at": str(row["created_at"]) if row.get("created_at") else None})
+    for row in rows[:limit]
+  ]
+  next_cursor = None
+  if len(rows) > limit and videos:
+    last = videos[-1]
+    next_cursor = _encode_cursor(last.created_at or "", last.id)
+  page = PatientVideosResponse(videos=videos, next_cursor=next_cursor)
+
+  body = page.model_dump_json()
+  etag = f'W/"{hashlib.sha1(body.encode("utf-8")).hexdigest()}"'
+  headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+  if _etag_matches(if_none_match, etag):
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+  response.headers.update(headers)
+  return page
+
+
+@router.get("/{email}/files/search", response_model=FileSearchResponse)
+async def search_patient_files(
+  email: str,
+  q: str = Query(..., min_length=1, max_length=256, description="Words to find in the patient's documents."),
+  limit: int = Query(default=20, ge=1, le=100),
+  offset: int = Query(default=0, ge=0, le=10_000),
+  supabase_service: SupabaseService = Depends(get_supabase_service),
+) -> FileSearchResponse:
+  """Rank the patient's documents by relevance; snippets are HTML-escaped with <mark> highlights."""
+  # Fetch one extra row to know whether another page exists without counting every match.
+  rows = await supabase_service.search_patient_files(
+    email.strip().lower(),
+    q,
+    limit=limit + 1,
+    offset=offset,
+  )
+  has_more = len(rows) > limit
+  results = [
+    FileSearchHit(
+      id=row["id"],
+      file_name=row.get("file_name"),
+      file_url=row["file_url"],
+      created_at=str(row["created_at"]) if row.get("created_at") else None,
+      rank=row.get("rank") or 0.0,
+      snippet=row["snippet"],
+    )
+    for row in rows[:limit]
+  ]
+  return FileSearchResponse(
+    query=q,
+    results=results,
+    limit=limit,
+    offset=offset,
+    next_offset=offset + limit if has_more else None,
+  )
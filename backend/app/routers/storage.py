@@ -0,0 +1,27 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+
+from app.dependencies import get_video_cache
+from app.services.video_cache import VideoCache
+
+
+router = APIRouter(prefix="/storage", tags=["storage"])
+
+
+@router.get("/videos/{filename}")
+async def serve_video(
+  filename: str,
+  video_cache: VideoCache = Depends(get_video_cache),
+):
+  """Serve a video from the local cache, reading through from Supabase Storage on a miss."""
+  try:
+    response = await video_cache.response(
+      filename,
+      media_type="video/mp4",
+      # Personalized videos are PHI: browsers may keep them, shared proxies and CDNs must not.
+      headers={"Cache-Control": "private, max-age=86400"},
+    )
+  except ValueError as e:
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Video not found.") from e
+  if response is None:
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Video not found.")
+  return response
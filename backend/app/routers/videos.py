@@ -1,162 +1,470 @@
-from typing import Any, Dict
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, Literal, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import JSONResponse, StreamingResponse
 
-from app.dependencies import get_settings, get_supabase_service
+from app.dependencies import (
+  get_admission_controller,
+  get_drain_coordinator,
+  get_fair_policy,
+  get_idempotency_store,
+  get_job_event_hub,
+  get_job_queue,
+  get_llm_service,
+  get_reuse_hierarchy,
+  get_settings,
+  get_stage_timeouts,
+  get_storage_service,
+  get_supabase_service,
+  get_trace_log,
+  get_video_cache,
+  get_video_service,
+)
 from app.models.requests import VideoGenerationRequest
-from app.models.responses import VideoGenerationResponse
-from app.services import recovery_plan
-from app.services.llm import LLMService
-from app.services.storage import StorageService
-from app.services.supabase import PatientContext, SupabaseService
-from app.services.video_generator import VideoGeneratorService
+from app.models.responses import VideoGenerationResponse, VideoJobResponse
+from app.services.admission import AdmissionController, Overloaded
+from app.services.deadline import DeadlineExceeded, deadline_after
+from app.services.drain import DrainCoordinator, ShuttingDown
+from app.services.idempotency import (
+  IdempotencyMismatch,
+  IdempotencyPending,
+  IdempotencyStore,
+  IdempotentRun,
+  request_fingerprint,
+  storage_key,
+)
+from app.services.job_events import JobEventHub
+from app.services.jobs import TERMINAL_EVENTS, Job, JobQueue
+from app.services.pipeline import VideoPipeline, VideoProviderError
+from app.services.scheduler import FairPolicy, Ticket, scheduled_as
+from app.services.stage_graph import StageTimeout
+from app.services.supabase import SupabaseService
 
 
 router = APIRouter(prefix="/videos", tags=["videos"])
 
 
-def get_llm_service() -> LLMService:
-  """Lazy initialization of LLM service."""
-  settings = get_settings()
-  return LLMService(settings.openai_api_key, settings.openai_model)
+def _job_response(job: Job) -> VideoJobResponse:
+  return VideoJobResponse(
+    job_id=job.id,
+    status=job.status,
+    stage=job.stage,
+    priority=job.priority_class,
+    attempts=job.attempts,
+    result=VideoGenerationResponse(**job.result) if job.result else None,
+    error=job.error if job.status == "failed" else None,
+  )
+
+
+async def _queue_as_job(
+  job_queue: JobQueue,
+  request: VideoGenerationRequest,
+  *,
+  stage: str,
+  state: Dict[str, Any],
+  priority: str,
+  idempotent: Optional[IdempotentRun] = None,
+) -> Job:
+  """Queue an interrupted run with its progress so a worker finishes it."""
+  job = await asyncio.shield(
+    job_queue.enqueue(request.model_dump(), stage=stage, state=state, priority=priority)
+  )
+  print(f"[INFO] Handed off in-flight generation as job {job.id} at stage {stage}")
+  if idempotent is not None:
+    # Retries with the same key follow the job instead of rendering again.
+    await asyncio.shield(idempotent.hand_off(job.id))
+  return job
+
+
+async def _hand_off(
+  job_queue: JobQueue,
+  request: VideoGenerationRequest,
+  *,
+  stage: str,
+  state: Dict[str, Any],
+  message: str,
+  retry_after: int,
+  idempotent: Optional[IdempotentRun] = None,
+) -> HTTPException:
+  """Queue an interrupted run for a worker to finish; returns the 503 to raise."""
+  # It was an interactive request, so it keeps interactive priority in the queue.
+  job = await _queue_as_job(job_queue, request, stage=stage, state=state, priority="interactive", idempotent=idempotent)
+  return _handed_off_error(job.id, message, retry_after)
+
+
+async def _abandon(
+  job_queue: JobQueue,
+  request: VideoGenerationRequest,
+  *,
+  stage: str,
+  state: Dict[str, Any],
+  reason: str,
+  idempotent: Optional[IdempotentRun] = None,
+) -> Optional[Job]:
+  """Release a run nobody is waiting for any more, or detach it as a background job if its render is paid for.
+
+  HeyGen bills a render once it is submitted, so finishing it costs only the
+  polling and the download, and the video then serves later requests for the
+  same case from the reuse cache. Anything earlier is simply dropped.
+  """
+  if "video_id" not in state or not get_settings().detach_submitted_renders:
+    print(f"[INFO] {reason}; dropped the generation (last checkpoint: {stage})")
+    return None
+  print(f"[INFO] {reason}; detaching the submitted render")
+  return await _queue_as_job(job_queue, request, stage=stage, state=state, priority="recovery", idempotent=idempotent)
+
+
+def _handed_off_error(job_id: str, message: str, retry_after: int) -> HTTPException:
+  return HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail={"message": message, "job_id": job_id},
+    headers={"Location": f"/videos/jobs/{job_id}", "Retry-After": str(retry_after)},
+  )
 
 
-def get_video_service() -> VideoGeneratorService:
-  """Lazy initialization of video service."""
-  settings = get_settings()
-  return VideoGeneratorService(
-    api_key=settings.heygen_api_key,
-    avatar_id=settings.heygen_avatar_id,
-    voice_id=settings.heygen_voice_id,
-    ratio=settings.heygen_ratio,
-    background=settings.heygen_background or None,
-    poll_interval=settings.heygen_poll_interval,
-    poll_timeout=settings.heygen_poll_timeout,
+def _abandoned_error(status_code: int, message: str, job: Optional[Job]) -> HTTPException:
+  if job is None:
+    return HTTPException(status_code=status_code, detail=message)
+  return HTTPException(
+    status_code=status_code,
+    detail={"message": f"{message} The submitted render continues as a job.", "job_id": job.id},
+    headers={"Location": f"/videos/jobs/{job.id}"},
   )
 
 
-def _context_to_prompt_payload(context: PatientContext, request: VideoGenerationRequest) -> Dict[str, Any]:
-  patient = context.patient
-  doctor = context.doctor
-  diagnoses = []
-  medications = []
-
-  if context.epic_snapshot:
-    diagnoses = [entry.get("display") for entry in context.epic_snapshot.get("diagnoses", [])]
-    medications = [entry.get("name") for entry in context.epic_snapshot.get("medications", [])]
-
-  recovery_details = None
-  prior_recovery = []
-  if request.recovery_day:
-    recovery_details = recovery_plan.get_plan_for_day(request.recovery_day)
-    prior_recovery = recovery_plan.get_prior_plans(request.recovery_day)
-    if recovery_details and request.recovery_milestone:
-      recovery_details["milestone_label"] = request.recovery_milestone
-
-  payload = {
-    "patient": patient,
-    "doctor": doctor,
-    "diagnoses": list(filter(None, diagnoses)),
-    "medications": list(filter(None, medications)),
-    "notes": context.recent_notes,
-    "recovery_plan": recovery_details,
-    "prior_recovery_context": prior_recovery,
-    "recovery_day": request.recovery_day,
-    "recovery_milestone": request.recovery_milestone,
-  }
-  return payload
+# nginx's "client closed request"; nobody reads it, but access logs show why the run stopped.
+CLIENT_CLOSED_REQUEST = 499
+
+
+class _DisconnectWatch:
+  """Cancels the request's task once its client disconnects, so nobody's generation stops holding slots."""
+
+  def __init__(self, http_request: Request) -> None:
+    self.disconnected = False
+    self._receive = http_request.receive
+    self._task = asyncio.current_task()
+    self._watcher: Optional[asyncio.Task] = None
+
+  async def _watch(self) -> None:
+    # The body has been read, so the next message is the disconnect (as for StreamingResponse).
+    while (await self._receive())["type"] != "http.disconnect":
+      pass
+    self.disconnected = True
+    self._task.cancel()
+
+  def stop(self) -> None:
+    if self._watcher is not None:
+      self._watcher.cancel()
+
+  def __enter__(self) -> "_DisconnectWatch":
+    self._watcher = asyncio.create_task(self._watch())
+    return self
+
+  def __exit__(self, *exc_info) -> None:
+    self.stop()
+
+
+def _request_timeout(requested: Optional[float]) -> Optional[float]:
+  """The caller's ``X-Request-Timeout``, never longer than ``GENERATE_REQUEST_TIMEOUT``."""
+  limits = [limit for limit in (requested, get_settings().generate_request_timeout) if limit]
+  return min(limits) if limits else None
 
 
 @router.post("/generate", response_model=VideoGenerationResponse, status_code=status.HTTP_201_CREATED)
 async def generate_video(
   request: VideoGenerationRequest,
+  http_request: Request,
+  idempotency_key: Optional[str] = Header(
+    default=None,
+    max_length=255,
+    description="Retries with the same key replay the first request's response instead of rendering again.",
+  ),
+  x_request_timeout: Optional[float] = Header(
+    default=None,
+    gt=0,
+    description="Seconds the caller will wait; every stage of the generation stops when they run out.",
+  ),
   supabase_service: SupabaseService = Depends(get_supabase_service),
-) -> VideoGenerationResponse:
-  context = await supabase_service.fetch_patient_context(request.doctor_email, request.patient_email)
-  prompt_payload = _context_to_prompt_payload(context, request)
-
-  llm_service = get_llm_service()
-  prompt = await llm_service.build_prompt(prompt_payload)
-  script = await llm_service.request_script(prompt)
-
-  case_key = llm_service.compute_case_key(
-    diagnosis_code=request.diagnosis_code,
-    procedure_code=request.procedure_code,
-    recovery_milestone=request.recovery_milestone,
-    doctor_specialty=context.doctor.get("specialty"),
+  drain: DrainCoordinator = Depends(get_drain_coordinator),
+  job_queue: JobQueue = Depends(get_job_queue),
+  admission: AdmissionController = Depends(get_admission_controller),
+  policy: FairPolicy = Depends(get_fair_policy),
+  idempotency: IdempotencyStore = Depends(get_idempotency_store),
+):
+  pipeline = VideoPipeline(
+    supabase_service=supabase_service,
+    llm_service_factory=get_llm_service,
+    video_service_factory=get_video_service,
+    video_cache=get_video_cache(),
+    admission=admission,
+    reuse_hierarchy=get_reuse_hierarchy(),
+    storage_service=get_storage_service(),
+    stage_timeouts=get_stage_timeouts(),
+    trace_log=get_trace_log(),
   )
 
-  if not request.force_regenerate:
-    reusable = await supabase_service.find_reusable_video(case_key)
-    if reusable:
-      return VideoGenerationResponse(
-        video_url=reusable["file_url"],
-        case_key=case_key,
-        reused=True,
-        metadata_id=reusable.get("id"),
-      )
-
-  video_service = get_video_service()
-  video_payload = await video_service.create_video(
-    script_payload=script,
-    metadata={
-      "patient_email": request.patient_email,
-      "doctor_email": request.doctor_email,
-      "diagnosis_code": request.diagnosis_code,
-      "procedure_code": request.procedure_code,
-      "recovery_milestone": request.recovery_milestone,
-    },
-  )
+  async def generate(idempotent: Optional[IdempotentRun] = None) -> VideoGenerationResponse:
+    return await _generate(
+      request,
+      pipeline,
+      http_request=http_request,
+      drain=drain,
+      job_queue=job_queue,
+      admission=admission,
+      policy=policy,
+      idempotent=idempotent,
+    )
+
+  with deadline_after(_request_timeout(x_request_timeout)):
+    if idempotency_key is None:
+      return await generate()
+
+    key = storage_key(request.doctor_email, idempotency_key)
+    request_hash = request_fingerprint(request.model_dump())
+    try:
+      while True:
+        row = await idempotency.claim(key, request_hash)
+        if row is None:
+          async with idempotency.run(key) as idempotent:
+            result = await generate(idempotent)
+            await idempotent.complete(status.HTTP_201_CREATED, result.model_dump())
+            return result
+        if row["status"] == "in_progress":
+          # Attach to the running request rather than starting a second render.
+          row = await idempotency.wait(key)
+          if row is None:
+            continue
+        if row["status"] == "completed":
+          return _replay(row["status_code"], row["response"])
+        job = await job_queue.get(row["job_id"])
+        if job is None or job.status == "failed":
+          await idempotency.release_hand_off(key)
+          continue
+        if job.status == "succeeded":
+          await idempotency.settle_hand_off(key, status.HTTP_201_CREATED, job.result)
+          return _replay(status.HTTP_201_CREATED, job.result)
+        raise _handed_off_error(job.id, "Generation continues as a job.", retry_after=5)
+    except IdempotencyMismatch as e:
+      raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e)) from e
+    except IdempotencyPending as e:
+      raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=str(e),
+        headers={"Retry-After": str(e.retry_after)},
+      ) from e
+    except DeadlineExceeded as e:
+      raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e)) from e
+
 
-  output_url = video_payload.get("video_url")
-  if not output_url:
+def _replay(status_code: int, body: Dict[str, Any]) -> JSONResponse:
+  return JSONResponse(status_code=status_code, content=body, headers={"Idempotent-Replayed": "true"})
+
+
+async def _generate(
+  request: VideoGenerationRequest,
+  pipeline: VideoPipeline,
+  *,
+  http_request: Request,
+  drain: DrainCoordinator,
+  job_queue: JobQueue,
+  admission: AdmissionController,
+  policy: FairPolicy,
+  idempotent: Optional[IdempotentRun] = None,
+) -> VideoGenerationResponse:
+  state: Dict[str, Any] = {}
+  progress = {"stage": "queued"}
+
+  async def checkpoint(stage: str, _state: Dict[str, Any]) -> None:
+    progress["stage"] = stage
+
+  watch = _DisconnectWatch(http_request)
+  try:
+    with scheduled_as(Ticket("interactive", policy.tenant(request.doctor_email))), watch:
+      async with drain.track(), admission.slot("pipeline"):
+        try:
+          return await pipeline.run(request, state=state, checkpoint=checkpoint)
+        except asyncio.CancelledError:
+          watch.stop()
+          if watch.disconnected:
+            job = await _abandon(
+              job_queue,
+              request,
+              stage=progress["stage"],
+              state=state,
+              reason="Client disconnected",
+              idempotent=idempotent,
+            )
+            asyncio.current_task().uncancel()
+            raise _abandoned_error(CLIENT_CLOSED_REQUEST, "Client closed the request.", job)
+          if not drain.draining:
+            raise
+          # Shutdown cut the run short: queue its progress so another instance finishes it.
+          error = await _hand_off(
+            job_queue,
+            request,
+            stage=progress["stage"],
+            state=state,
+            message="Server shut down mid-generation; it continues as a job.",
+            retry_after=5,
+            idempotent=idempotent,
+          )
+          asyncio.current_task().uncancel()
+          raise error
+        except DeadlineExceeded as e:
+          watch.stop()
+          job = await _abandon(
+            job_queue,
+            request,
+            stage=progress["stage"],
+            state=state,
+            reason=str(e),
+            idempotent=idempotent,
+          )
+          raise _abandoned_error(status.HTTP_504_GATEWAY_TIMEOUT, f"{e}.", job) from e
+        except Overloaded as e:
+          watch.stop()
+          if "script" not in state:
+            raise
+          # A later stage is saturated: keep the paid-for script and let a worker continue.
+          raise await _hand_off(
+            job_queue,
+            request,
+            stage=progress["stage"],
+            state=state,
+            message=f"Generation paused because {e.stage} is saturated; it continues as a job.",
+            retry_after=e.retry_after,
+            idempotent=idempotent,
+          ) from e
+  except asyncio.CancelledError:
+    if not watch.disconnected:
+      raise
+    # Gone while still queued for a pipeline slot.
+    print("[INFO] Client disconnected before its generation started")
+    asyncio.current_task().uncancel()
+    raise _abandoned_error(CLIENT_CLOSED_REQUEST, "Client closed the request.", None)
+  except Overloaded as e:
     raise HTTPException(
-      status_code=status.HTTP_502_BAD_GATEWAY,
-      detail="Video provider did not return a video URL.",
-    )
+      status_code=e.status_code,
+      detail=str(e),
+      headers={"Retry-After": str(e.retry_after)},
+    ) from e
+  except ShuttingDown as e:
+    raise HTTPException(
+      status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+      detail=str(e),
+      headers={"Retry-After": "5"},
+    ) from e
+  except VideoProviderError as e:
+    raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(e)) from e
+  except StageTimeout as e:
+    raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e)) from e
+  except DeadlineExceeded as e:
+    raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e)) from e
 
-  # Handle mock videos (skip download/upload for placeholder URLs)
-  if video_payload.get("mock"):
-    # For mock videos, use a placeholder video file
-    # In production, this would be replaced with actual video from Sora
-    supabase_client = supabase_service.client if supabase_service.use_supabase else None
-    storage_service = StorageService(
-      storage_dir=supabase_service.storage_bucket,
-      storage_bucket=supabase_service.storage_bucket,
-      supabase_client=supabase_client,
-    )
-    # Use demo video or create a placeholder
-    if not storage_service.use_supabase:
-      demo_video_path = storage_service.videos_dir / "demo_video.mp4"
-      if not demo_video_path.exists():
-        # Create an empty placeholder file (or copy from public folder)
-        demo_video_path.touch()
-      public_url = f"/storage/videos/demo_video.mp4"
-    else:
-      # For Supabase, we'd need to upload the demo video, but for now use a placeholder URL
-      public_url = f"/storage/videos/demo_video.mp4"
-  else:
-    # Real video: download and upload to storage
-    supabase_client = supabase_service.client if supabase_service.use_supabase else None
-    storage_service = StorageService(
-      storage_dir=supabase_service.storage_bucket,
-      storage_bucket=supabase_service.storage_bucket,
-      supabase_client=supabase_client,
-    )
-    public_url = await storage_service.upload_from_url(output_url, case_key=case_key)
-
-  metadata = await supabase_service.save_video_metadata(
-    doctor_email=request.doctor_email,
-    patient_email=request.patient_email,
-    file_url=public_url,
-    file_name=f"{case_key}.mp4",
-    case_key=case_key,
+
+@router.post("/jobs", response_model=VideoJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def enqueue_video_job(
+  request: VideoGenerationRequest,
+  priority: Literal["interactive", "recovery"] = Query(
+    "recovery",
+    description="`interactive` for a doctor waiting on the result, `recovery` for scheduled or bulk series.",
+  ),
+  job_queue: JobQueue = Depends(get_job_queue),
+) -> VideoJobResponse:
+  """Queue a generation that survives worker restarts; poll ``GET /videos/jobs/{job_id}`` for the result."""
+  job = await job_queue.enqueue(request.model_dump(), priority=priority)
+  return _job_response(job)
+
+
+@router.get("/jobs/{job_id}", response_model=VideoJobResponse)
+async def get_video_job(
+  job_id: str,
+  job_queue: JobQueue = Depends(get_job_queue),
+) -> VideoJobResponse:
+  job = await job_queue.get(job_id)
+  if job is None:
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found.")
+  return _job_response(job)
+
+
+_FINISHED = ("succeeded", "failed")
+
+
+def _sse(event: str, data: Dict[str, Any], event_id: Optional[int] = None) -> str:
+  head = f"id: {event_id}\n" if event_id is not None else ""
+  return f"{head}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.get("/jobs/{job_id}/events", response_class=StreamingResponse)
+async def stream_video_job_events(
+  job_id: str,
+  last_event_id: Optional[int] = Header(
+    default=None,
+    description="Resume after this event id; EventSource sends it when it reconnects.",
+  ),
+  after: Optional[int] = Query(default=None, description="Same as `Last-Event-ID`, for clients that cannot set headers."),
+  job_queue: JobQueue = Depends(get_job_queue),
+  hub: JobEventHub = Depends(get_job_event_hub),
+) -> Response:
+  """Server-Sent Events for one job: a ``status`` snapshot, then its progress until ``done`` or ``failed``."""
+  job = await job_queue.get(job_id)
+  if job is None:
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found.")
+  resume = last_event_id if last_event_id is not None else after
+  if job.status in _FINISHED and resume is not None and not await job_queue.events(job_id, after=resume):
+    # The client has seen the end already; 204 tells EventSource to stop reconnecting.
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+  events = hub.subscribe(
+    job_id,
+    after=resume,
+    live=job.status not in _FINISHED,
+    heartbeat=get_settings().job_events_heartbeat,
   )
 
-  return VideoGenerationResponse(
-    video_url=public_url,
-    case_key=case_key,
-    reused=False,
-    metadata_id=metadata.get("id"),
+  async def stream() -> AsyncIterator[str]:
+    # ``retry`` is how soon EventSource reconnects when the stream ends early (e.g. on drain).
+    yield "retry: 2000\n" + _sse("status", _job_response(job).model_dump(mode="json"))
+    async for event in events:
+      yield ": heartbeat\n\n" if event is None else _sse(event.event, event.data, event.id)
+
+  return StreamingResponse(
+    stream(),
+    media_type="text/event-stream",
+    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
   )
 
+
+@router.websocket("/jobs/{job_id}/ws")
+async def video_job_events_socket(
+  websocket: WebSocket,
+  job_id: str,
+  last_event_id: Optional[int] = Query(default=None),
+  job_queue: JobQueue = Depends(get_job_queue),
+  hub: JobEventHub = Depends(get_job_event_hub),
+) -> None:
+  """The same stream as JSON messages ``{"id", "event", "data"}``; closed with 1000 after ``done`` or ``failed``."""
+  await websocket.accept()
+  job = await job_queue.get(job_id)
+  if job is None:
+    await websocket.close(code=4404, reason="Job not found.")
+    return
+  finished = job.status in _FINISHED
+  try:
+    await websocket.send_json({"id": None, "event": "status", "data": _job_response(job).model_dump(mode="json")})
+    async for event in hub.subscribe(
+      job_id,
+      after=last_event_id,
+      live=not finished,
+      heartbeat=get_settings().job_events_heartbeat,
+    ):
+      if event is None:
+        await websocket.send_json({"id": None, "event": "heartbeat", "data": {}})
+        continue
+      await websocket.send_json({"id": event.id, "event": event.event, "data": event.data})
+      finished = finished or event.event in TERMINAL_EVENTS
+    # 1012 (service restart): the instance is draining; reconnect with the last id seen.
+    await websocket.close(code=1000 if finished else 1012)
+  except WebSocketDisconnect:
+    return
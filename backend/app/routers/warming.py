@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Depends, status
+
+from app.dependencies import get_cache_warmer
+from app.models.responses import WarmingReport, WarmingRunResponse
+from app.services.warming import CacheWarmer
+
+
+router = APIRouter(prefix="/warming", tags=["warming"])
+
+
+@router.get("/report", response_model=WarmingReport)
+async def warming_report(warmer: CacheWarmer = Depends(get_cache_warmer)) -> WarmingReport:
+  """Predicted demand, expected reuse hit rate before/after warming and the savings so far."""
+  return WarmingReport(**await warmer.report())
+
+
+@router.post("/run", response_model=WarmingRunResponse, status_code=status.HTTP_202_ACCEPTED)
+async def run_warming(
+  force: bool = False,
+  warmer: CacheWarmer = Depends(get_cache_warmer),
+) -> WarmingRunResponse:
+  """Queue one warming pass now; ``force`` skips the idle-queue check (the daily budget still applies)."""
+  return WarmingRunResponse(job_ids=await warmer.run_once(force=force))
@@ -0,0 +1,224 @@
+"""Admission control for video generation.
+
+Each stage (whole pipelines, LLM calls, renders, downloads) has its own cap
+on concurrent holders and a bounded queue of waiters, served by priority
+class and tenant (see ``app.services.scheduler``). A caller that finds the
+queue full is rejected at once (``429``); one that waits past the queue
+deadline gives up (``503``). Both carry a ``Retry-After`` estimated from how
+long slots are currently held, so a burst turns into fast refusals instead of
+unbounded OpenAI/HeyGen calls, downloads and database connections. A waiter
+whose request deadline comes first gives up with ``DeadlineExceeded``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from app.services.deadline import DeadlineExceeded, bounded
+from app.services.jobs import Deferred
+from app.services.scheduler import INTERACTIVE, PRIORITY_CLASSES, Candidate, FairPolicy, Ticket, current_ticket
+
+
+# Weight of the newest sample in the moving averages.
+_EWMA_ALPHA = 0.2
+_MAX_RETRY_AFTER = 300
+
+
+class Overloaded(Deferred):
+  """A stage is saturated; ``status_code`` is 429 (queue full) or 503 (waited too long)."""
+
+  def __init__(self, stage: str, reason: str, *, retry_after: int, status_code: int) -> None:
+    super().__init__(f"{stage} is saturated: {reason}", delay=retry_after)
+    self.stage = stage
+    self.retry_after = retry_after
+    self.status_code = status_code
+
+
+class StageLimiter:
+  """At most ``limit`` concurrent holders and ``queue_size`` waiters, granted by ``FairPolicy``.
+
+  Background classes may only fill ``limit - interactive_reserve`` slots, so an
+  interactive caller never queues behind minutes-long background renders.
+  """
+
+  def __init__(
+    self,
+    name: str,
+    limit: int,
+    *,
+    queue_size: int,
+    queue_timeout: float,
+    policy: Optional[FairPolicy] = None,
+    interactive_reserve: int = 0,
+  ) -> None:
+    self.name = name
+    self.limit = max(1, limit)
+    self.queue_size = max(0, queue_size)
+    self.queue_timeout = queue_timeout
+    self.policy = policy or FairPolicy()
+    self.background_limit = max(1, self.limit - max(0, interactive_reserve))
+    self.active = 0
+    self._active_background = 0
+    self._held: Dict[str, int] = {}
+    self._waiters: List[Candidate] = []
+    self.admitted = 0
+    self.rejected = 0
+    self.timed_out = 0
+    self._avg_wait = 0.0
+    self._avg_hold: Optional[float] = None
+
+  @property
+  def waiting(self) -> int:
+    return len(self._waiters)
+
+  def retry_after(self) -> int:
+    """Seconds until a new caller would likely get a slot."""
+    hold = self._avg_hold if self._avg_hold is not None else self.queue_timeout
+    estimate = hold * (self.waiting + 1) / self.limit
+    return max(1, min(_MAX_RETRY_AFTER, math.ceil(estimate)))
+
+  @asynccontextmanager
+  async def slot(self, *, timeout: Optional[float] = None) -> AsyncIterator[None]:
+    ticket = current_ticket()
+    await self._acquire(ticket, self.queue_timeout if timeout is None else timeout)
+    started = time.monotonic()
+    try:
+      yield
+    finally:
+      held = time.monotonic() - started
+      self._avg_hold = held if self._avg_hold is None else _ewma(self._avg_hold, held)
+      self._release(ticket)
+
+  def _has_room(self, rank: int) -> bool:
+    if self.active >= self.limit:
+      return False
+    return rank == INTERACTIVE or self._active_background < self.background_limit
+
+  def _take(self, rank: int, tenant: str) -> None:
+    self.active += 1
+    if rank != INTERACTIVE:
+      self._active_background += 1
+    self._held[tenant] = self._held.get(tenant, 0) + 1
+    self.admitted += 1
+
+  async def _acquire(self, ticket: Ticket, timeout: float) -> None:
+    rank = ticket.rank
+    if not self._waiters and self._has_room(rank):
+      self._take(rank, ticket.tenant)
+      return
+    if len(self._waiters) >= self.queue_size:
+      self.rejected += 1
+      raise Overloaded(self.name, "wait queue is full", retry_after=self.retry_after(), status_code=429)
+
+    waiter = Candidate(rank=rank, tenant=ticket.tenant, since=time.monotonic(), item=asyncio.get_running_loop().create_future())
+    self._waiters.append(waiter)
+    # Room may exist for this class even though others (e.g. background at its cap) are queued.
+    self._dispatch()
+    future: asyncio.Future = waiter.item
+    where = f"the wait for a {self.name} slot"
+    try:
+      limit = bounded(timeout, where)
+      await asyncio.wait({future}, timeout=limit)
+    except asyncio.CancelledError:
+      if future.done() and not future.cancelled():
+        # The slot was granted just as we were cancelled; give it back.
+        self._release(ticket)
+      raise
+    finally:
+      if not future.done():
+        future.cancel()
+      if waiter in self._waiters:
+        self._waiters.remove(waiter)
+
+    self._avg_wait = _ewma(self._avg_wait, time.monotonic() - waiter.since)
+    if future.cancelled():
+      if limit < timeout:
+        raise DeadlineExceeded(where)
+      self.timed_out += 1
+      raise Overloaded(
+        self.name,
+        f"no slot within {timeout:.0f}s",
+        retry_after=self.retry_after(),
+        status_code=503,
+      )
+
+  def _release(self, ticket: Ticket) -> None:
+    self.active -= 1
+    if ticket.rank != INTERACTIVE:
+      self._active_background -= 1
+    remaining = self._held.get(ticket.tenant, 0) - 1
+    if remaining > 0:
+      self._held[ticket.tenant] = remaining
+    else:
+      self._held.pop(ticket.tenant, None)
+    self._dispatch()
+
+  def _dispatch(self) -> None:
+    """Grant free slots to the waiters the policy ranks first."""
+    now = time.monotonic()
+    while True:
+      eligible = [w for w in self._waiters if not w.item.done() and self._has_room(w.rank)]
+      chosen = self.policy.pick(eligible, self._held, now=now)
+      if chosen is None:
+        return
+      self._waiters.remove(chosen)
+      self._take(chosen.rank, chosen.tenant)
+      chosen.item.set_result(None)
+
+  def snapshot(self) -> Dict[str, Any]:
+    return {
+      "limit": self.limit,
+      "background_limit": self.background_limit,
+      "active": self.active,
+      "active_background": self._active_background,
+      "waiting": self.waiting,
+      "waiting_by_class": {
+        name: sum(1 for w in self._waiters if w.rank == rank) for rank, name in enumerate(PRIORITY_CLASSES)
+      },
+      "queue_size": self.queue_size,
+      "admitted": self.admitted,
+      "rejected": self.rejected,
+      "timed_out": self.timed_out,
+      "avg_wait_ms": round(self._avg_wait * 1000),
+      "avg_hold_ms": round(self._avg_hold * 1000) if self._avg_hold is not None else None,
+      "retry_after": self.retry_after(),
+    }
+
+
+def _ewma(current: float, sample: float) -> float:
+  return current + _EWMA_ALPHA * (sample - current)
+
+
+class AdmissionController:
+  """Named stage limiters shared by the HTTP routes and the job workers of one process."""
+
+  def __init__(
+    self,
+    limits: Dict[str, int],
+    *,
+    queue_size: int,
+    queue_timeout: float,
+    policy: Optional[FairPolicy] = None,
+    interactive_reserve: int = 0,
+  ) -> None:
+    self.stages = {
+      name: StageLimiter(
+        name,
+        limit,
+        queue_size=queue_size,
+        queue_timeout=queue_timeout,
+        policy=policy,
+        interactive_reserve=interactive_reserve,
+      )
+      for name, limit in limits.items()
+    }
+
+  def slot(self, stage: str, *, timeout: Optional[float] = None):
+    return self.stages[stage].slot(timeout=timeout)
+
+  def snapshot(self) -> Dict[str, Dict[str, Any]]:
+    return {name: limiter.snapshot() for name, limiter in self.stages.items()}
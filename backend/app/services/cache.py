@@ -0,0 +1,472 @@
+"""Pluggable cache backends shared by request handlers.
+
+``CACHE_URL`` selects the backend:
+
+- ``memory://?max_entries=4096`` – per-process LRU (the default).
+- ``sqlite:///cache.db?max_entries=100000`` – one WAL-mode SQLite file shared
+  by every worker on the node.
+- ``redis://[:password@]host:6379/0?default_ttl=86400`` – any server speaking
+  the Redis protocol, shared across nodes.
+
+Values must be JSON-serializable. Namespaces can be invalidated as a whole,
+and ``get_or_compute`` runs ``compute`` at most once per key at a time,
+across processes for the shared backends.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+
+# How often a waiter re-checks for a value another process is computing.
+_LEASE_POLL_INTERVAL = 0.05
+
+# Compare-and-delete, so a lease that expired and was taken over by another worker is never released by us.
+_RELEASE_LEASE_SCRIPT = "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end return 0"
+
+
+class CacheBackend(ABC):
+  """Async key/value cache with TTLs and namespaced invalidation."""
+
+  def __init__(self, *, default_ttl: Optional[float] = None, lease_ttl: float = 30.0) -> None:
+    self.default_ttl = default_ttl
+    self.lease_ttl = lease_ttl
+    # Per-key locks (with waiter counts) so one coroutine per process computes a missing key.
+    self._flights: Dict[Tuple[str, str], List[Any]] = {}
+
+  @abstractmethod
+  async def get(self, namespace: str, key: str) -> Tuple[bool, Any]:
+    """Return ``(hit, value)``; ``value`` may legitimately be ``None`` on a hit."""
+
+  @abstractmethod
+  async def set(self, namespace: str, key: str, value: Any, *, ttl: Optional[float] = None) -> None: ...
+
+  @abstractmethod
+  async def delete(self, namespace: str, key: str) -> None: ...
+
+  @abstractmethod
+  async def invalidate(self, namespace: str) -> None:
+    """Drop every entry in ``namespace``."""
+
+  async def close(self) -> None:
+    return None
+
+  async def _acquire_lease(self, namespace: str, key: str) -> Optional[str]:
+    """Claim the right to compute ``key`` across processes; ``None`` if someone else holds it."""
+    return ""
+
+  async def _release_lease(self, namespace: str, key: str, token: str) -> None:
+    return None
+
+  async def get_or_compute(
+    self,
+    namespace: str,
+    key: str,
+    compute: Callable[[], Awaitable[Any]],
+    *,
+    ttl: Optional[float] = None,
+    miss_ttl: Optional[float] = None,
+  ) -> Any:
+    """Return the cached value or compute, store and return it exactly once.
+
+    ``miss_ttl`` overrides ``ttl`` for an empty result (``None``, ``[]``, ...)
+    of a lookup whose answer another process can change; ``0`` does not cache it.
+    """
+    hit, value = await self.get(namespace, key)
+    if hit:
+      return value
+
+    flight_key = (namespace, key)
+    flight = self._flights.setdefault(flight_key, [asyncio.Lock(), 0])
+    flight[1] += 1
+    lock = flight[0]
+    try:
+      async with lock:
+        hit, value = await self.get(namespace, key)
+        if hit:
+          return value
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.lease_ttl
+        token = await self._acquire_lease(namespace, key)
+        while token is None:
+          await asyncio.sleep(_LEASE_POLL_INTERVAL)
+          hit, value = await self.get(namespace, key)
+          if hit:
+            return value
+          if loop.time() >= deadline:
+            # The holder died or is very slow; compute without the lease.
+            break
+          token = await self._acquire_lease(namespace, key)
+
+        try:
+          if token is not None:
+            hit, value = await self.get(namespace, key)
+            if hit:
+              return value
+          value = await compute()
+          if miss_ttl is None or value:
+            await self.set(namespace, key, value, ttl=ttl)
+          elif miss_ttl > 0:
+            await self.set(namespace, key, value, ttl=miss_ttl)
+          return value
+        finally:
+          if token:
+            await self._release_lease(namespace, key, token)
+    finally:
+      flight[1] -= 1
+      if not flight[1]:
+        del self._flights[flight_key]
+
+  def _expiry(self, ttl: Optional[float]) -> Optional[float]:
+    ttl = self.default_ttl if ttl is None else ttl
+    return time.time() + ttl if ttl else None
+
+
+class MemoryCache(CacheBackend):
+  """In-process LRU cache; entries are stored as JSON so callers never share mutable state."""
+
+  def __init__(self, *, max_entries: int = 4096, default_ttl: Optional[float] = None) -> None:
+    super().__init__(default_ttl=default_ttl)
+    self.max_entries = max_entries
+    self._entries: "OrderedDict[Tuple[str, str], Tuple[Optional[float], str]]" = OrderedDict()
+
+  async def get(self, namespace: str, key: str) -> Tuple[bool, Any]:
+    entry = self._entries.get((namespace, key))
+    if entry is None:
+      return False, None
+    expires_at, payload = entry
+    if expires_at is not None and expires_at <= time.time():
+      del self._entries[(namespace, key)]
+      return False, None
+    self._entries.move_to_end((namespace, key))
+    return True, json.loads(payload)
+
+  async def set(self, namespace: str, key: str, value: Any, *, ttl: Optional[float] = None) -> None:
+    self._entries[(namespace, key)] = (self._expiry(ttl), json.dumps(value, separators=(",", ":")))
+    self._entries.move_to_end((namespace, key))
+    while len(self._entries) > self.max_entries:
+      self._entries.popitem(last=False)
+
+  async def delete(self, namespace: str, key: str) -> None:
+    self._entries.pop((namespace, key), None)
+
+  async def invalidate(self, namespace: str) -> None:
+    for entry_key in [entry_key for entry_key in self._entries if entry_key[0] == namespace]:
+      del self._entries[entry_key]
+
+
+class SQLiteCache(CacheBackend):
+  """Cache in a WAL-mode SQLite file shared by all workers on a node."""
+
+  # Refresh ``accessed_at`` on reads at most this often, to keep hits read-only.
+  _ACCESS_RESOLUTION = 30.0
+  # Trim to ``max_entries`` after this many writes from this process.
+  _TRIM_EVERY = 64
+
+  def __init__(self, path: str, *, max_entries: int = 100_000, default_ttl: Optional[float] = None) -> None:
+    super().__init__(default_ttl=default_ttl)
+    self.path = path
+    self.max_entries = max_entries
+    self._conn = None
+    self._connect_lock = asyncio.Lock()
+    self._writes = 0
+
+  async def _connection(self):
+    if self._conn is not None:
+      return self._conn
+    async with self._connect_lock:
+      if self._conn is None:
+        import aiosqlite
+
+        conn = await aiosqlite.connect(self.path, isolation_level=None)
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute("PRAGMA busy_timeout=5000")
+        await conn.execute(
+          "CREATE TABLE IF NOT EXISTS cache_entries ("
+          " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+          " expires_at REAL, accessed_at REAL NOT NULL,"
+          " PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+        )
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed ON cache_entries(accessed_at)")
+        await conn.execute(
+          "CREATE TABLE IF NOT EXISTS cache_leases ("
+          " namespace TEXT NOT NULL, key TEXT NOT NULL, token TEXT NOT NULL, expires_at REAL NOT NULL,"
+          " PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+        )
+        self._conn = conn
+    return self._conn
+
+  async def get(self, namespace: str, key: str) -> Tuple[bool, Any]:
+    conn = await self._connection()
+    async with conn.execute(
+      "SELECT value, expires_at, accessed_at FROM cache_entries WHERE namespace = ? AND key = ?",
+      (namespace, key),
+    ) as cursor:
+      row = await cursor.fetchone()
+    if row is None:
+      return False, None
+    payload, expires_at, accessed_at = row
+    now = time.time()
+    if expires_at is not None and expires_at <= now:
+      await conn.execute(
+        "DELETE FROM cache_entries WHERE namespace = ? AND key = ? AND expires_at <= ?",
+        (namespace, key, now),
+      )
+      return False, None
+    if now - accessed_at >= self._ACCESS_RESOLUTION:
+      await conn.execute(
+        "UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+        (now, namespace, key),
+      )
+    return True, json.loads(payload)
+
+  async def set(self, namespace: str, key: str, value: Any, *, ttl: Optional[float] = None) -> None:
+    conn = await self._connection()
+    await conn.execute(
+      "INSERT INTO cache_entries (namespace, key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)"
+      " ON CONFLICT (namespace, key) DO UPDATE SET"
+      " value = excluded.value, expires_at = excluded.expires_at, accessed_at = excluded.accessed_at",
+      (namespace, key, json.dumps(value, separators=(",", ":")), self._expiry(ttl), time.time()),
+    )
+    self._writes += 1
+    if self._writes % self._TRIM_EVERY == 0:
+      await self._trim(conn)
+
+  async def _trim(self, conn) -> None:
+    await conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (time.time(),))
+    async with conn.execute("SELECT COUNT(*) FROM cache_entries") as cursor:
+      (count,) = await cursor.fetchone()
+    excess = count - self.max_entries
+    if excess > 0:
+      await conn.execute(
+        "DELETE FROM cache_entries WHERE (namespace, key) IN"
+        " (SELECT namespace, key FROM cache_entries ORDER BY accessed_at LIMIT ?)",
+        (excess,),
+      )
+
+  async def delete(self, namespace: str, key: str) -> None:
+    conn = await self._connection()
+    await conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+  async def invalidate(self, namespace: str) -> None:
+    conn = await self._connection()
+    await conn.execute("DELETE FROM cache_entries WHERE namespace = ?", (namespace,))
+
+  async def _acquire_lease(self, namespace: str, key: str) -> Optional[str]:
+    conn = await self._connection()
+    token = uuid.uuid4().hex
+    now = time.time()
+    cursor = await conn.execute(
+      "INSERT INTO cache_leases (namespace, key, token, expires_at) VALUES (?, ?, ?, ?)"
+      " ON CONFLICT (namespace, key) DO UPDATE SET token = excluded.token, expires_at = excluded.expires_at"
+      " WHERE cache_leases.expires_at <= ?",
+      (namespace, key, token, now + self.lease_ttl, now),
+    )
+    acquired = cursor.rowcount == 1
+    await cursor.close()
+    return token if acquired else None
+
+  async def _release_lease(self, namespace: str, key: str, token: str) -> None:
+    conn = await self._connection()
+    await conn.execute(
+      "DELETE FROM cache_leases WHERE namespace = ? AND key = ? AND token = ?",
+      (namespace, key, token),
+    )
+
+  async def close(self) -> None:
+    if self._conn is not None:
+      await self._conn.close()
+      self._conn = None
+
+
+class RedisProtocolError(Exception):
+  """Error reply from a Redis-protocol server."""
+
+
+class _RespConnection:
+  """Minimal RESP2 client: one connection, one request in flight at a time."""
+
+  def __init__(self, host: str, port: int, *, password: Optional[str], db: int) -> None:
+    self.host = host
+    self.port = port
+    self.password = password
+    self.db = db
+    self._reader: Optional[asyncio.StreamReader] = None
+    self._writer: Optional[asyncio.StreamWriter] = None
+    self._lock = asyncio.Lock()
+
+  async def _open(self) -> None:
+    self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+    if self.password:
+      await self._roundtrip("AUTH", self.password)
+    if self.db:
+      await self._roundtrip("SELECT", self.db)
+
+  @staticmethod
+  def _encode(args: Tuple[Any, ...]) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+      data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+      parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(parts)
+
+  async def _read_reply(self) -> Any:
+    line = await self._reader.readline()
+    if not line:
+      raise ConnectionError("Redis connection closed")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+      return rest.decode("utf-8")
+    if kind == b"-":
+      raise RedisProtocolError(rest.decode("utf-8"))
+    if kind == b":":
+      return int(rest)
+    if kind == b"$":
+      length = int(rest)
+      if length < 0:
+        return None
+      data = await self._reader.readexactly(length + 2)
+      return data[:-2]
+    if kind == b"*":
+      count = int(rest)
+      if count < 0:
+        return None
+      return [await self._read_reply() for _ in range(count)]
+    raise RedisProtocolError(f"Unexpected reply type: {line!r}")
+
+  async def _roundtrip(self, *args: Any) -> Any:
+    self._writer.write(self._encode(args))
+    await self._writer.drain()
+    return await self._read_reply()
+
+  async def execute(self, *args: Any) -> Any:
+    async with self._lock:
+      for attempt in range(2):
+        try:
+          if self._writer is None:
+            await self._open()
+          return await self._roundtrip(*args)
+        except (ConnectionError, asyncio.IncompleteReadError, OSError):
+          await self._reset()
+          if attempt:
+            raise
+        except BaseException:
+          # Cancelled or failed between writing the command and reading all of its reply: the rest
+          # would be read as the next command's reply, so this socket cannot be reused.
+          self._discard()
+          raise
+
+  def _discard(self) -> Optional[asyncio.StreamWriter]:
+    writer, self._reader, self._writer = self._writer, None, None
+    if writer is not None:
+      writer.close()
+    return writer
+
+  async def _reset(self) -> None:
+    writer = self._discard()
+    if writer is not None:
+      try:
+        await writer.wait_closed()
+      except (ConnectionError, OSError):
+        pass
+
+  async def close(self) -> None:
+    async with self._lock:
+      await self._reset()
+
+
+class RedisCache(CacheBackend):
+  """Cache on a Redis-protocol server.
+
+  Each namespace has a version counter embedded in its keys, so invalidating a
+  namespace is a single ``INCR``; orphaned entries age out through their TTL.
+  Size bounds are the server's job (``maxmemory`` with an ``allkeys-lru``
+  policy), which is why a default TTL is always applied.
+  """
+
+  def __init__(
+    self,
+    host: str = "localhost",
+    port: int = 6379,
+    *,
+    password: Optional[str] = None,
+    db: int = 0,
+    prefix: str = "amma:",
+    default_ttl: float = 86400,
+  ) -> None:
+    super().__init__(default_ttl=default_ttl)
+    self.prefix = prefix
+    self._conn = _RespConnection(host, port, password=password, db=db)
+
+  def _version_key(self, namespace: str) -> str:
+    return f"{self.prefix}{namespace}:version"
+
+  async def _entry_key(self, namespace: str, key: str) -> str:
+    version = await self._conn.execute("GET", self._version_key(namespace))
+    return f"{self.prefix}{namespace}:{int(version or 0)}:{key}"
+
+  async def get(self, namespace: str, key: str) -> Tuple[bool, Any]:
+    payload = await self._conn.execute("GET", await self._entry_key(namespace, key))
+    if payload is None:
+      return False, None
+    return True, json.loads(payload)
+
+  async def set(self, namespace: str, key: str, value: Any, *, ttl: Optional[float] = None) -> None:
+    args: List[Any] = ["SET", await self._entry_key(namespace, key), json.dumps(value, separators=(",", ":"))]
+    ttl = self.default_ttl if ttl is None else ttl
+    if ttl:
+      args += ["PX", max(1, int(ttl * 1000))]
+    await self._conn.execute(*args)
+
+  async def delete(self, namespace: str, key: str) -> None:
+    await self._conn.execute("DEL", await self._entry_key(namespace, key))
+
+  async def invalidate(self, namespace: str) -> None:
+    await self._conn.execute("INCR", self._version_key(namespace))
+
+  async def _acquire_lease(self, namespace: str, key: str) -> Optional[str]:
+    token = uuid.uuid4().hex
+    reply = await self._conn.execute(
+      "SET", f"{self.prefix}lease:{namespace}:{key}", token, "NX", "PX", int(self.lease_ttl * 1000)
+    )
+    return token if reply == "OK" else None
+
+  async def _release_lease(self, namespace: str, key: str, token: str) -> None:
+    await self._conn.execute("EVAL", _RELEASE_LEASE_SCRIPT, 1, f"{self.prefix}lease:{namespace}:{key}", token)
+
+  async def close(self) -> None:
+    await self._conn.close()
+
+
+def create_cache(url: str) -> CacheBackend:
+  """Build a backend from a ``CACHE_URL``."""
+  parts = urlsplit(url or "memory://")
+  options = {name: values[-1] for name, values in parse_qs(parts.query).items()}
+  default_ttl = float(options["default_ttl"]) if "default_ttl" in options else None
+
+  if parts.scheme == "memory":
+    return MemoryCache(max_entries=int(options.get("max_entries", 4096)), default_ttl=default_ttl)
+  if parts.scheme == "sqlite":
+    path = unquote(parts.path[1:] if parts.path.startswith("/") else parts.path)
+    if not path:
+      raise ValueError("sqlite cache URL needs a file path, e.g. sqlite:///cache.db")
+    return SQLiteCache(path, max_entries=int(options.get("max_entries", 100_000)), default_ttl=default_ttl)
+  if parts.scheme == "redis":
+    return RedisCache(
+      parts.hostname or "localhost",
+      parts.port or 6379,
+      password=unquote(parts.password) if parts.password else None,
+      db=int(parts.path.lstrip("/") or 0),
+      prefix=options.get("prefix", "amma:"),
+      default_ttl=default_ttl if default_ttl is not None else 86400,
+    )
+  raise ValueError(f"Unsupported CACHE_URL scheme: {parts.scheme!r}")
@@ -0,0 +1,128 @@
+"""Application-scoped clients shared by every request.
+
+Building an ``AsyncOpenAI`` client, a Supabase client or an SQLite connection
+(which also checks migrations) costs more per request than most of the queries
+that request then makes, and each new client starts with a cold connection
+pool. The container builds each client once, the request-scoped services
+borrow them, and the app lifespan closes them on shutdown. A closed container
+builds its clients again if it is used afterwards.
+"""
+
+from __future__ import annotations
+
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Optional
+
+from app.services.database import LocalDatabasePool
+from app.services.video_cache import VideoCache
+
+if TYPE_CHECKING:
+  from app.services.storage import StorageService
+
+
+def create_supabase_client(supabase_url: Optional[str], supabase_key: Optional[str]):
+  """Return a Supabase client, or ``None`` to use the local database instead."""
+  if not (supabase_url and supabase_key):
+    return None
+  try:
+    from supabase import create_client
+
+    return create_client(supabase_url, supabase_key)
+  except ImportError:
+    print("[WARN] supabase-py not installed, falling back to local database")
+  except Exception as e:
+    print(f"[WARN] Failed to initialize Supabase: {e}, falling back to local database")
+  return None
+
+
+@asynccontextmanager
+async def http_session(client: Any = None) -> AsyncIterator[Any]:
+  """Yield the shared ``httpx.AsyncClient`` if there is one, else a client closed on exit."""
+  if client is not None:
+    yield client
+    return
+  import httpx
+
+  async with httpx.AsyncClient() as owned:
+    yield owned
+
+
+class ServiceContainer:
+  """The process's OpenAI, HTTP, Supabase (or pooled SQLite) and storage clients."""
+
+  def __init__(
+    self,
+    *,
+    openai_api_key: str,
+    openai_base_url: Optional[str] = None,
+    supabase_url: Optional[str] = None,
+    supabase_key: Optional[str] = None,
+    database_path: str = "amma_health.db",
+    database_pool_size: int = 5,
+    storage_bucket: str = "patient-files",
+    video_cache_factory: Optional[Callable[[], VideoCache]] = None,
+  ) -> None:
+    self.openai_api_key = openai_api_key
+    self.openai_base_url = openai_base_url
+    self.storage_bucket = storage_bucket
+    self.video_cache_factory = video_cache_factory
+    self.supabase = create_supabase_client(supabase_url, supabase_key)
+    self.database: Optional[LocalDatabasePool] = None
+    if self.supabase is not None:
+      print("[INFO] Using Supabase database")
+    else:
+      self.database = LocalDatabasePool(database_path, max_idle=database_pool_size)
+      print("[INFO] Using local SQLite database")
+    self._openai = None
+    self._http = None
+    self._storage: Optional[StorageService] = None
+
+  @property
+  def openai(self):
+    if self._openai is None:
+      # Imported here so the SDK only loads once a script is actually requested.
+      from openai import AsyncOpenAI
+
+      self._openai = AsyncOpenAI(api_key=self.openai_api_key, base_url=self.openai_base_url)
+    return self._openai
+
+  @property
+  def http(self):
+    """HTTP client for HeyGen and video downloads; each call sets its own timeout."""
+    if self._http is None:
+      import httpx
+
+      self._http = httpx.AsyncClient(timeout=120)
+    return self._http
+
+  @property
+  def storage(self) -> StorageService:
+    if self._storage is None:
+      # Imported here because storage uses ``http_session`` from this module.
+      from app.services.storage import StorageService
+
+      video_cache = self.video_cache_factory() if self.video_cache_factory else None
+      self._storage = StorageService(
+        storage_dir=self.storage_bucket,
+        storage_bucket=self.storage_bucket,
+        supabase_client=self.supabase,
+        video_cache=video_cache,
+        http_client=self.http,
+      )
+    return self._storage
+
+  async def start(self) -> None:
+    """Open the first database connection, applying pending migrations, before requests arrive."""
+    if self.database is not None:
+      await self.database.release(await self.database.acquire())
+
+  async def close(self) -> None:
+    self._storage = None
+    if self._openai is not None:
+      await self._openai.close()
+      self._openai = None
+    if self._http is not None:
+      await self._http.aclose()
+      self._http = None
+    if self.database is not None:
+      await self.database.close()
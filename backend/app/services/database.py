@@ -1,10 +1,27 @@
 """Local SQLite database service to replace Supabase."""
 
 import aiosqlite
+import asyncio
 import os
 from typing import Any, Dict, List, Optional
 from datetime import datetime
 
+from app.services.migrations import apply_sqlite_migrations
+
+
+# SQLite's default SQLITE_MAX_VARIABLE_NUMBER for 3.32+.
+_MAX_SQL_PARAMS = 32766
+
+
+def _shared_columns(rows: List[Dict[str, Any]]) -> List[str]:
+  """Return the column list shared by every row in a batch."""
+  columns = list(rows[0].keys())
+  expected = set(columns)
+  for row in rows:
+    if set(row.keys()) != expected:
+      raise ValueError(f"All rows in a batch must have the same columns: {columns}")
+  return columns
+
 
 class LocalDatabase:
   """SQLite database wrapper for local development."""
@@ -13,66 +30,22 @@ class LocalDatabase:
     self.db_path = db_path
     self._conn: Optional[aiosqlite.Connection] = None
 
-  async def connect(self):
+  async def connect(self, *, migrate: bool = True):
     """Initialize database connection and create tables if needed."""
     self._conn = await aiosqlite.connect(self.db_path)
-    await self._init_schema()
+    if migrate:
+      await self._init_schema()
     return self
 
   async def close(self):
     """Close database connection."""
     if self._conn:
       await self._conn.close()
+      self._conn = None
 
   async def _init_schema(self):
-    """Create tables if they don't exist."""
-    await self._conn.execute("""
-      CREATE TABLE IF NOT EXISTS users (
-        email TEXT PRIMARY KEY,
-        first_name TEXT NOT NULL,
-        last_name TEXT NOT NULL,
-        user_type TEXT NOT NULL CHECK (user_type IN ('patient', 'doctor')),
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-      )
-    """)
-
-    await self._conn.execute("""
-      CREATE TABLE IF NOT EXISTS epic_patient_data (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        doctor_email TEXT NOT NULL,
-        patient_email TEXT,
-        epic_patient_id TEXT NOT NULL,
-        epic_mrn TEXT,
-        patient_name TEXT,
-        patient_dob DATE,
-        clinical_notes TEXT,
-        diagnoses TEXT,
-        medications TEXT,
-        last_synced TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        UNIQUE(doctor_email, epic_patient_id)
-      )
-    """)
-
-    await self._conn.execute("""
-      CREATE TABLE IF NOT EXISTS patient_files (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        doctor_email TEXT NOT NULL,
-        patient_email TEXT NOT NULL,
-        file_type TEXT NOT NULL CHECK (file_type IN ('file', 'video')),
-        file_url TEXT NOT NULL,
-        file_name TEXT,
-        extracted_text TEXT,
-        case_key TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-      )
-    """)
-
-    await self._conn.execute("CREATE INDEX IF NOT EXISTS idx_patient_files_email ON patient_files(patient_email)")
-    await self._conn.execute("CREATE INDEX IF NOT EXISTS idx_patient_files_case_key ON patient_files(case_key)")
-    await self._conn.execute("CREATE INDEX IF NOT EXISTS idx_epic_patient_email ON epic_patient_data(patient_email)")
-
-    await self._conn.commit()
+    """Bring the schema up to date by applying pending migrations."""
+    await apply_sqlite_migrations(self._conn)
 
   async def fetch_one(self, table: str, filters: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     """Fetch a single row from a table."""
@@ -111,6 +84,13 @@ class LocalDatabase:
       columns = [desc[0] for desc in cursor.description]
       return [dict(zip(columns, row)) for row in rows]
 
+  async def query(self, query: str, params: tuple = ()) -> List[Dict[str, Any]]:
+    """Run a raw SELECT and return the rows as dicts."""
+    async with self._conn.execute(query, params) as cursor:
+      rows = await cursor.fetchall()
+      columns = [desc[0] for desc in cursor.description]
+      return [dict(zip(columns, row)) for row in rows]
+
   async def insert(self, table: str, data: Dict[str, Any]) -> Dict[str, Any]:
     """Insert a row and return it."""
     columns = ", ".join(data.keys())
@@ -132,8 +112,109 @@ class LocalDatabase:
       # Return the data we inserted
       return data
 
-  async def execute(self, query: str, params: tuple = ()):
-    """Execute a raw SQL query."""
-    await self._conn.execute(query, params)
+  async def insert_many(self, table: str, rows: List[Dict[str, Any]]) -> List[int]:
+    """Insert rows in one transaction and return their row ids in input order."""
+    if not rows:
+      return []
+    columns = _shared_columns(rows)
+    return await self._insert_returning(f"INSERT INTO {table} ({', '.join(columns)})", "", columns, rows)
+
+  async def upsert_many(
+    self,
+    table: str,
+    rows: List[Dict[str, Any]],
+    conflict_columns: List[str],
+    update_columns: Optional[List[str]] = None,
+  ) -> List[int]:
+    """Insert or update rows in one transaction (``ON CONFLICT ... DO UPDATE``) and return their row ids."""
+    if not rows:
+      return []
+    columns = _shared_columns(rows)
+    if update_columns is None:
+      update_columns = [c for c in columns if c not in conflict_columns]
+
+    # DO NOTHING returns no row for existing keys; a no-op update still reports the rowid.
+    assignments = [f"{c} = excluded.{c}" for c in update_columns] or [f"{conflict_columns[0]} = {conflict_columns[0]}"]
+    conflict = f" ON CONFLICT ({', '.join(conflict_columns)}) DO UPDATE SET " + ", ".join(assignments)
+    return await self._insert_returning(f"INSERT INTO {table} ({', '.join(columns)})", conflict, columns, rows)
+
+  async def _insert_returning(self, insert: str, conflict: str, columns: List[str], rows: List[Dict[str, Any]]) -> List[int]:
+    """Run ``insert`` as multi-row ``VALUES ... RETURNING rowid`` statements, chunked under the parameter limit."""
+    chunk_size = max(1, _MAX_SQL_PARAMS // len(columns))
+    row_placeholder = "(" + ", ".join(["?" for _ in columns]) + ")"
+    ids: List[int] = []
+    try:
+      for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        query = f"{insert} VALUES {', '.join([row_placeholder] * len(chunk))}{conflict} RETURNING rowid"
+        params = [row[c] for row in chunk for c in columns]
+        async with self._conn.execute(query, params) as cursor:
+          # SQLite emits the RETURNING rows of an INSERT in VALUES order; its docs leave the order open, so
+          # the count is checked here and the order is pinned by tests/test_database.py.
+          returned = [row[0] for row in await cursor.fetchall()]
+        if len(returned) != len(chunk):
+          raise RuntimeError(f"Expected {len(chunk)} row ids from {insert!r}, got {len(returned)}")
+        ids.extend(returned)
+      await self._conn.commit()
+    except Exception:
+      await self._conn.rollback()
+      raise
+    return ids
+
+  async def execute(self, query: str, params: tuple = ()) -> int:
+    """Execute a raw SQL query and return the number of rows it changed."""
+    cursor = await self._conn.execute(query, params)
     await self._conn.commit()
+    return cursor.rowcount
+
 
+class LocalDatabasePool:
+  """Open ``LocalDatabase`` connections reused across requests.
+
+  Migrations are checked by the first connection only. Acquiring never waits:
+  when every connection is in use a new one is opened, and connections beyond
+  ``max_idle`` are closed on release.
+  """
+
+  def __init__(self, db_path: str = "amma_health.db", *, max_idle: int = 5):
+    self.db_path = db_path
+    self.max_idle = max_idle
+    self._idle: List[LocalDatabase] = []
+    self._migrated = False
+    self._migrate_lock = asyncio.Lock()
+    self._closed = False
+
+  async def acquire(self) -> LocalDatabase:
+    self._closed = False
+    if self._idle:
+      return self._idle.pop()
+    db = LocalDatabase(self.db_path)
+    if self._migrated:
+      return await db.connect(migrate=False)
+    async with self._migrate_lock:
+      await db.connect(migrate=not self._migrated)
+      self._migrated = True
+    return db
+
+  async def release(self, db: LocalDatabase) -> None:
+    try:
+      if db._conn is not None and db._conn.in_transaction:
+        # Whatever the last user left uncommitted must not leak into the next request.
+        await db._conn.rollback()
+    except Exception as e:
+      print(f"[WARN] Dropping pooled database connection: {e}")
+      await db.close()
+      return
+    # Connections returned after ``close`` would keep their threads alive past shutdown.
+    if db._conn is not None and not self._closed and len(self._idle) < self.max_idle:
+      self._idle.append(db)
+    else:
+      await db.close()
+
+  async def close(self) -> None:
+    """Close the idle connections, and those still in use once released; the pool reopens if used again."""
+    self._closed = True
+    self._migrated = False
+    idle, self._idle = self._idle, []
+    for db in idle:
+      await db.close()
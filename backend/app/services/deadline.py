@@ -0,0 +1,70 @@
+"""End-to-end request deadlines.
+
+A request's deadline is set once at the edge (``X-Request-Timeout``, capped
+by ``GENERATE_REQUEST_TIMEOUT``) and everything the request waits on bounds
+itself by the time left: stage-graph stages (and with them every database
+call), admission queues, the OpenAI call, HeyGen submit and polling, and the
+video download. Like the scheduling ``Ticket`` it travels in a context
+variable, so it reaches the tasks a request spawns without being passed
+through every signature. Code running outside a deadline (jobs, warming) is
+unaffected.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+
+class DeadlineExceeded(TimeoutError):
+  """The request's deadline passed before ``where`` finished."""
+
+  def __init__(self, where: str) -> None:
+    super().__init__(f"Request deadline expired during {where}")
+    self.where = where
+
+
+# Absolute event-loop time (``loop.time()``), so it can be handed to ``asyncio.timeout_at``.
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+def current_deadline() -> Optional[float]:
+  return _deadline.get()
+
+
+def remaining(where: str = "the request") -> Optional[float]:
+  """Seconds left before the deadline, ``None`` without one; raises once it has passed."""
+  deadline = _deadline.get()
+  if deadline is None:
+    return None
+  left = deadline - asyncio.get_running_loop().time()
+  if left <= 0:
+    raise DeadlineExceeded(where)
+  return left
+
+
+def bounded(timeout: float, where: str) -> float:
+  """``timeout`` clipped to the time left before the deadline."""
+  left = remaining(where)
+  return timeout if left is None else min(timeout, left)
+
+
+def expired() -> bool:
+  deadline = _deadline.get()
+  return deadline is not None and asyncio.get_running_loop().time() >= deadline
+
+
+@contextmanager
+def deadline_after(seconds: Optional[float]) -> Iterator[Optional[float]]:
+  """Run the enclosed code under a deadline ``seconds`` from now; a nested deadline can only be earlier."""
+  deadline = _deadline.get()
+  if seconds is not None:
+    candidate = asyncio.get_running_loop().time() + seconds
+    deadline = candidate if deadline is None else min(deadline, candidate)
+  token = _deadline.set(deadline)
+  try:
+    yield deadline
+  finally:
+    _deadline.reset(token)
@@ -0,0 +1,463 @@
+"""Streaming FHIR R4 Bundle ingestion into ``epic_patient_data``.
+
+Bundles from Epic can be hundreds of megabytes, so ``iter_bundle_entries``
+scans the byte stream incrementally and only ever materializes one
+``entry`` at a time, and ``ingest_bundle_stream`` upserts patients in batches.
+Resources are normalized to the same shape the frontend parser
+(``src/utils/fhirParser.js``) stores, minus the ``raw`` payloads. A bundle
+that is not valid JSON, or a resource whose structure is not what FHIR R4
+prescribes, raises ``ValueError`` before anything is written.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import codecs
+import json
+import re
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+
+_STRUCTURAL = re.compile(r'[{}\[\]":]')
+_STRING = re.compile(r'"((?:[^"\\]|\\.)*)"', re.S)
+_ENTRY_GAP = re.compile(r'[\s,]*')
+_DECODER = json.JSONDecoder()
+
+# A single entry larger than this is treated as a malformed document.
+MAX_ENTRY_CHARS = 64 * 1024 * 1024
+# Normalized resources buffered before the patients they belong to are upserted.
+FLUSH_RESOURCES = 5000
+_SPOOL_READ = 1024 * 1024
+
+_SEEK, _EXPECT_ARRAY, _IN_ENTRIES = range(3)
+
+
+class _BundleEntryScanner:
+  """Incremental scanner yielding the elements of a Bundle's top-level ``entry`` array.
+
+  Outside ``entry`` it tracks nesting with a regex tokenizer; each entry is
+  decoded with the C JSON decoder once enough text has arrived for it.
+  """
+
+  def __init__(self) -> None:
+    self._buf = ""
+    self._depth = 0
+    self._state = _SEEK
+    self._last_key: Optional[str] = None
+    self._retry_len = 0
+
+  def feed(self, text: str, final: bool = False) -> List[Any]:
+    """Consume more text and return every entry completed by it."""
+    buf = self._buf + text
+    pos = 0
+    found: List[Any] = []
+
+    while True:
+      if self._state == _IN_ENTRIES:
+        pos = _ENTRY_GAP.match(buf, pos).end()
+        if pos >= len(buf):
+          break
+        if buf[pos] == "]":
+          self._state = _SEEK
+          self._depth -= 1
+          pos += 1
+          continue
+        pending = len(buf) - pos
+        if pending < self._retry_len and not final:
+          break
+        try:
+          entry, pos = _DECODER.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+          if final or pending > MAX_ENTRY_CHARS:
+            raise
+          # Most likely the entry continues in the next chunk; wait for the buffer to double.
+          self._retry_len = 2 * pending
+          break
+        self._retry_len = 0
+        found.append(entry)
+        continue
+
+      match = _STRUCTURAL.search(buf, pos)
+      if not match:
+        pos = len(buf)
+        break
+      ch = match.group()
+      i = match.start()
+
+      if self._state == _EXPECT_ARRAY and ch != "[":
+        self._state = _SEEK
+
+      if ch == '"':
+        string = _STRING.match(buf, i)
+        if not string:
+          # String continues in the next chunk.
+          pos = i
+          break
+        if self._depth == 1 and self._state == _SEEK:
+          self._last_key = string.group(1)
+        pos = string.end()
+        continue
+
+      if ch == ":":
+        if self._depth == 1 and self._state == _SEEK and self._last_key == "entry":
+          self._state = _EXPECT_ARRAY
+      elif ch in "{[":
+        if self._state == _EXPECT_ARRAY:
+          self._state = _IN_ENTRIES
+        self._depth += 1
+      else:
+        self._depth -= 1
+      pos = i + 1
+
+    self._buf = buf[pos:]
+    if final and (self._depth != 0 or self._buf.strip()):
+      raise ValueError("FHIR bundle ended before the JSON document was complete")
+    return found
+
+
+async def iter_bundle_entries(chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+  """Yield each ``entry`` object of a FHIR Bundle from a stream of byte chunks."""
+  decoder = codecs.getincrementaldecoder("utf-8")()
+  scanner = _BundleEntryScanner()
+  async for chunk in chunks:
+    for entry in scanner.feed(decoder.decode(chunk)):
+      yield _object(entry, "entry")
+  for entry in scanner.feed(decoder.decode(b"", final=True), final=True):
+    yield _object(entry, "entry")
+
+
+def _object(value: Any, where: str) -> Dict[str, Any]:
+  if value is None:
+    return {}
+  if not isinstance(value, dict):
+    raise ValueError(f"{where} must be a JSON object, got {type(value).__name__}")
+  return value
+
+
+def _objects(value: Any, where: str) -> List[Dict[str, Any]]:
+  if value is None:
+    return []
+  if not isinstance(value, list):
+    raise ValueError(f"{where} must be a JSON array, got {type(value).__name__}")
+  return [_object(item, f"{where}[{i}]") for i, item in enumerate(value)]
+
+
+def _string(value: Any, where: str) -> Optional[str]:
+  if value is not None and not isinstance(value, str):
+    raise ValueError(f"{where} must be a string, got {type(value).__name__}")
+  return value
+
+
+def _first_coding(concept: Any, where: str) -> Dict[str, Any]:
+  codings = _objects(_object(concept, where).get("coding"), f"{where}.coding")
+  return codings[0] if codings else {}
+
+
+def _extract_mrn(identifiers: Any) -> Optional[str]:
+  identifiers = _objects(identifiers, "Patient.identifier")
+  if not identifiers:
+    return None
+  for identifier in identifiers:
+    id_type = _object(identifier.get("type"), "Patient.identifier.type")
+    if (
+      any(coding.get("code") == "MR" for coding in _objects(id_type.get("coding"), "Patient.identifier.type.coding"))
+      or "mrn" in (_string(id_type.get("text"), "Patient.identifier.type.text") or "").lower()
+      or "mrn" in (_string(identifier.get("system"), "Patient.identifier.system") or "")
+    ):
+      return identifier.get("value")
+  return identifiers[0].get("value")
+
+
+def parse_patient(resource: Dict[str, Any]) -> Dict[str, Any]:
+  names = _objects(resource.get("name"), "Patient.name")
+  name = names[0] if names else {}
+  given = name.get("given") or []
+  if not isinstance(given, list):
+    raise ValueError("Patient.name.given must be a JSON array")
+  first_name = " ".join(_string(part, "Patient.name.given[]") or "" for part in given)
+  last_name = _string(name.get("family"), "Patient.name.family") or ""
+  email = next(
+    (t.get("value") for t in _objects(resource.get("telecom"), "Patient.telecom") if t.get("system") == "email"),
+    None,
+  )
+  email = _string(email, "Patient.telecom.value")
+  return {
+    "id": resource.get("id"),
+    "name": f"{first_name} {last_name}".strip() or None,
+    "birthDate": resource.get("birthDate"),
+    "mrn": _extract_mrn(resource.get("identifier")),
+    "email": email.strip().lower() if email else None,
+  }
+
+
+def parse_condition(resource: Dict[str, Any]) -> Dict[str, Any]:
+  concept = _object(resource.get("code"), "Condition.code")
+  coding = _first_coding(concept, "Condition.code")
+  return {
+    "id": resource.get("id"),
+    "code": coding.get("code"),
+    "system": coding.get("system"),
+    "display": coding.get("display") or concept.get("text") or "Unknown condition",
+    "clinicalStatus": _first_coding(resource.get("clinicalStatus"), "Condition.clinicalStatus").get("code"),
+    "onsetDate": resource.get("onsetDateTime") or resource.get("recordedDate"),
+  }
+
+
+def parse_medication(resource: Dict[str, Any]) -> Dict[str, Any]:
+  """Normalize a MedicationStatement or MedicationRequest."""
+  kind = resource.get("resourceType")
+  concept = _object(
+    resource.get("medicationCodeableConcept") or resource.get("medicationReference"), f"{kind}.medication"
+  )
+  coding = _first_coding(concept, f"{kind}.medication")
+  dosages = _objects(resource.get("dosage") or resource.get("dosageInstruction"), f"{kind}.dosage")
+  dosage = dosages[0] if dosages else {}
+  rates = _objects(dosage.get("doseAndRate"), f"{kind}.dosage.doseAndRate")
+  dose = _object(rates[0].get("doseQuantity") if rates else None, f"{kind}.dosage.doseAndRate.doseQuantity")
+  timing = _object(dosage.get("timing"), f"{kind}.dosage.timing")
+  return {
+    "id": resource.get("id"),
+    "name": coding.get("display") or concept.get("text") or concept.get("display") or "Unknown medication",
+    "code": coding.get("code"),
+    "status": resource.get("status") or "unknown",
+    "dosage": dosage.get("text") or (f"{dose.get('value')} {dose.get('unit')}" if dose else None),
+    "frequency": _object(timing.get("code"), f"{kind}.dosage.timing.code").get("text"),
+    "route": _first_coding(dosage.get("route"), f"{kind}.dosage.route").get("display"),
+  }
+
+
+@dataclass
+class _PatientBucket:
+  # Normalized resources are kept as JSON fragments: far smaller than dicts for large bundles.
+  patient: Optional[Dict[str, Any]] = None
+  diagnoses: List[str] = field(default_factory=list)
+  medications: List[str] = field(default_factory=list)
+
+  def merge(self, other: "_PatientBucket") -> None:
+    self.patient = self.patient or other.patient
+    self.diagnoses.extend(other.diagnoses)
+    self.medications.extend(other.medications)
+
+
+@dataclass
+class BundleAccumulator:
+  """Groups normalized resources by patient while entries stream in; ``drain`` hands them off in batches."""
+
+  entries: int = 0
+  conditions: int = 0
+  medications: int = 0
+  # Resources added since the last drain.
+  pending: int = 0
+  _patients: Dict[str, _PatientBucket] = field(default_factory=dict)
+  _aliases: Dict[str, str] = field(default_factory=dict)
+  _current: Optional[str] = None
+
+  def add(self, entry: Dict[str, Any]) -> None:
+    self.entries += 1
+    where = f"entry[{self.entries - 1}]"
+    resource = _object(entry.get("resource"), f"{where}.resource")
+    resource_type = resource.get("resourceType")
+
+    if resource_type == "Patient" and resource.get("id"):
+      patient_id = _string(resource["id"], "Patient.id")
+      bucket = self._bucket(patient_id)
+      bucket.patient = parse_patient(resource)
+      full_url = _string(entry.get("fullUrl"), f"{where}.fullUrl")
+      if full_url:
+        self._aliases[full_url] = patient_id
+        # Resources that referenced the Patient by fullUrl before it arrived.
+        if full_url in self._patients:
+          bucket.merge(self._patients.pop(full_url))
+      self.pending += 1
+    elif resource_type == "Condition":
+      self.conditions += 1
+      self._bucket(self._subject(resource)).diagnoses.append(json.dumps(parse_condition(resource)))
+      self.pending += 1
+    elif resource_type in ("MedicationStatement", "MedicationRequest"):
+      self.medications += 1
+      self._bucket(self._subject(resource)).medications.append(json.dumps(parse_medication(resource)))
+      self.pending += 1
+
+  def _bucket(self, key: str) -> _PatientBucket:
+    self._current = key
+    return self._patients.setdefault(key, _PatientBucket())
+
+  def _subject(self, resource: Dict[str, Any]) -> str:
+    kind = resource.get("resourceType")
+    subject = _object(resource.get("subject") or resource.get("patient"), f"{kind}.subject")
+    reference = _string(subject.get("reference"), f"{kind}.subject.reference") or ""
+    reference = self._aliases.get(reference, reference)
+    return reference.split("Patient/", 1)[1] if "Patient/" in reference else reference
+
+  def drain(self, *, final: bool = False) -> Dict[str, _PatientBucket]:
+    """Take the buffered buckets, keyed by patient id.
+
+    Until ``final``, two kinds of bucket stay buffered: the patient whose
+    entries are arriving right now (bundles usually group a patient's
+    resources, so this avoids writing its row twice), and buckets keyed by a
+    ``urn:uuid`` reference whose Patient entry has not arrived yet.
+    """
+    drained: Dict[str, _PatientBucket] = {}
+    kept: Dict[str, _PatientBucket] = {}
+    for key, bucket in self._patients.items():
+      if not key:
+        continue
+      if not final and (key == self._current or key.startswith("urn:")):
+        kept[key] = bucket
+      else:
+        drained[key] = bucket
+    self._patients = kept
+    self.pending = 0
+    return drained
+
+
+def _stored_fragments(value: Any) -> List[str]:
+  """JSON fragments of a stored diagnoses/medications column (TEXT locally, jsonb on Supabase)."""
+  if isinstance(value, str):
+    try:
+      value = json.loads(value)
+    except json.JSONDecodeError:
+      return []
+  return [json.dumps(item) for item in value] if isinstance(value, list) else []
+
+
+def bucket_rows(
+  buckets: Dict[str, _PatientBucket],
+  *,
+  doctor_email: str,
+  patient_email: Optional[str] = None,
+  stored: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> List[Dict[str, Any]]:
+  """Build one ``epic_patient_data`` row per bucket.
+
+  ``stored`` holds the rows already written for patients flushed earlier in
+  the same bundle; their resources are kept ahead of the new ones.
+  """
+  synced_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+  rows = []
+  for patient_id, bucket in buckets.items():
+    earlier = (stored or {}).get(patient_id) or {}
+    diagnoses = _stored_fragments(earlier.get("diagnoses")) + bucket.diagnoses
+    medications = _stored_fragments(earlier.get("medications")) + bucket.medications
+    row: Dict[str, Any] = {
+      "doctor_email": doctor_email,
+      "epic_patient_id": patient_id,
+      "diagnoses": "[" + ", ".join(diagnoses) + "]",
+      "medications": "[" + ", ".join(medications) + "]",
+      "last_synced": synced_at,
+    }
+    # Only overwrite demographics when the bundle actually carried the Patient resource.
+    if bucket.patient:
+      row.update({
+        "patient_email": patient_email or bucket.patient["email"],
+        "epic_mrn": bucket.patient["mrn"],
+        "patient_name": bucket.patient["name"],
+        "patient_dob": bucket.patient["birthDate"],
+      })
+    elif patient_email:
+      row["patient_email"] = patient_email
+    rows.append(row)
+  return rows
+
+
+async def ingest_bundle_stream(
+  chunks: AsyncIterator[bytes],
+  *,
+  supabase_service,
+  doctor_email: str,
+  patient_email: Optional[str] = None,
+  batch_size: int = 500,
+  flush_resources: int = FLUSH_RESOURCES,
+) -> Dict[str, Any]:
+  """Parse a streamed Bundle and bulk-upsert one ``epic_patient_data`` row per patient.
+
+  The body is spooled to a temp file while a first pass parses and validates
+  every entry, so a malformed bundle is rejected before any row is written.
+  The second pass reads the spool back and upserts patients every
+  ``flush_resources`` resources, so memory stays bounded by the flush size
+  rather than the bundle size. A patient whose resources span several
+  flushes is read back and extended.
+  """
+  with tempfile.TemporaryFile() as spool:
+    await _validate_and_spool(chunks, spool, flush_resources)
+    await asyncio.to_thread(spool.seek, 0)
+    return await _upsert_bundle(
+      _replay(spool),
+      supabase_service=supabase_service,
+      doctor_email=doctor_email,
+      patient_email=patient_email,
+      batch_size=batch_size,
+      flush_resources=flush_resources,
+    )
+
+
+async def _validate_and_spool(chunks: AsyncIterator[bytes], spool, flush_resources: int) -> None:
+  async def spooled() -> AsyncIterator[bytes]:
+    async for chunk in chunks:
+      await asyncio.to_thread(spool.write, chunk)
+      yield chunk
+
+  checker = BundleAccumulator()
+  async for entry in iter_bundle_entries(spooled()):
+    checker.add(entry)
+    if checker.pending >= flush_resources:
+      checker.drain()
+
+
+async def _replay(spool) -> AsyncIterator[bytes]:
+  while True:
+    chunk = await asyncio.to_thread(spool.read, _SPOOL_READ)
+    if not chunk:
+      return
+    yield chunk
+
+
+async def _upsert_bundle(
+  chunks: AsyncIterator[bytes],
+  *,
+  supabase_service,
+  doctor_email: str,
+  patient_email: Optional[str],
+  batch_size: int,
+  flush_resources: int,
+) -> Dict[str, Any]:
+  accumulator = BundleAccumulator()
+  ids_by_patient: Dict[str, int] = {}
+
+  async def flush(final: bool) -> None:
+    buckets = accumulator.drain(final=final)
+    if not buckets:
+      return
+    seen = [patient_id for patient_id in buckets if patient_id in ids_by_patient]
+    stored = await supabase_service.fetch_epic_resources(doctor_email, seen) if seen else {}
+    rows = bucket_rows(buckets, doctor_email=doctor_email, patient_email=patient_email, stored=stored)
+
+    # Rows with and without demographics have different columns; upsert each shape as its own batch.
+    by_shape: Dict[tuple, List[Dict[str, Any]]] = {}
+    for row in rows:
+      by_shape.setdefault(tuple(row.keys()), []).append(row)
+    for shaped_rows in by_shape.values():
+      ids = await supabase_service.bulk_upsert(
+        "epic_patient_data",
+        shaped_rows,
+        conflict_columns=["doctor_email", "epic_patient_id"],
+        batch_size=batch_size,
+      )
+      ids_by_patient.update(zip((row["epic_patient_id"] for row in shaped_rows), ids))
+
+  async for entry in iter_bundle_entries(chunks):
+    accumulator.add(entry)
+    if accumulator.pending >= flush_resources:
+      await flush(final=False)
+  await flush(final=True)
+
+  return {
+    "entries": accumulator.entries,
+    "patients": len(ids_by_patient),
+    "conditions": accumulator.conditions,
+    "medications": accumulator.medications,
+    "epic_patient_data_ids": list(ids_by_patient.values()),
+  }
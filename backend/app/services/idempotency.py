@@ -0,0 +1,208 @@
+"""Idempotency keys for ``POST /videos/generate``.
+
+The first request with a key claims it as ``in_progress``. It holds a lease
+that it keeps renewing, and it records how the run ended:
+
+- ``completed``: the response, replayed verbatim to every retry until the key
+  expires;
+- ``handed_off``: the job that took over the run (on drain or saturation),
+  which retries follow instead of starting another render.
+
+A failed run releases its key so that a retry runs again. A retry arriving
+while the key is in progress waits for the outcome: on the owner's future in
+the same process, or by polling the row from another one. If the owner dies,
+its lease lapses and the next retry of the same request takes over.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+from app.services.deadline import DeadlineExceeded, bounded, expired
+from app.services.supabase import SupabaseService
+
+
+class IdempotencyMismatch(Exception):
+  """The key was already used for a different request."""
+
+
+class IdempotencyPending(Exception):
+  """The key's first request is still running after the wait timeout."""
+
+  def __init__(self, message: str, *, retry_after: int) -> None:
+    super().__init__(message)
+    self.retry_after = retry_after
+
+
+def request_fingerprint(body: Dict[str, Any]) -> str:
+  return hashlib.sha256(json.dumps(body, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def storage_key(scope: str, key: str) -> str:
+  """Keys are scoped to the caller (the doctor), so two clients cannot collide on the same value."""
+  return hashlib.sha256(f"{scope}\n{key}".encode("utf-8")).hexdigest()
+
+
+class IdempotentRun:
+  """The owner's handle on a claimed key; a run that records no outcome releases the key."""
+
+  def __init__(self, store: "IdempotencyStore", key: str) -> None:
+    self.store = store
+    self.key = key
+    self.outcome: Optional[Dict[str, Any]] = None
+
+  async def complete(self, status_code: int, response: Dict[str, Any]) -> None:
+    self.outcome = {"status": "completed", "status_code": status_code, "response": response}
+    await self.store._finish(self.key, self.outcome)
+
+  async def hand_off(self, job_id: str) -> None:
+    self.outcome = {"status": "handed_off", "job_id": job_id}
+    await self.store._finish(self.key, self.outcome)
+
+
+class IdempotencyStore:
+  """Process-wide access to ``idempotency_keys`` over one dedicated database connection."""
+
+  def __init__(
+    self,
+    service_factory: Callable[[], SupabaseService],
+    *,
+    ttl: float = 24 * 3600,
+    lease: float = 60.0,
+    wait_timeout: float = 300.0,
+    poll_interval: float = 1.0,
+    purge_interval: float = 3600.0,
+  ) -> None:
+    self.service_factory = service_factory
+    self.ttl = ttl
+    self.lease = lease
+    self.wait_timeout = wait_timeout
+    self.poll_interval = poll_interval
+    self.purge_interval = purge_interval
+    self._service: Optional[SupabaseService] = None
+    self._connect_lock = asyncio.Lock()
+    self._inflight: Dict[str, asyncio.Future] = {}
+    self._last_purge = 0.0
+
+  async def _connection(self) -> SupabaseService:
+    if self._service is None:
+      async with self._connect_lock:
+        if self._service is None:
+          service = self.service_factory()
+          await service._ensure_connected()
+          self._service = service
+    return self._service
+
+  async def close(self) -> None:
+    if self._service is not None:
+      await self._service.close()
+      self._service = None
+
+  async def claim(self, key: str, request_hash: str) -> Optional[Dict[str, Any]]:
+    """Return ``None`` when the caller now owns ``key``, else the row of its earlier request."""
+    service = await self._connection()
+    now = time.time()
+    if now - self._last_purge >= self.purge_interval:
+      self._last_purge = now
+      await service.purge_idempotency_keys(now)
+    while True:
+      if await service.claim_idempotency_key(
+        key,
+        request_hash,
+        now=now,
+        lease_until=now + self.lease,
+        expires_at=now + self.ttl,
+      ):
+        return None
+      row = await service.get_idempotency_key(key)
+      if row is None:
+        # Released between the two statements; try again.
+        now = time.time()
+        continue
+      if row["request_hash"] != request_hash:
+        raise IdempotencyMismatch("Idempotency-Key was already used with a different request.")
+      return row
+
+  @asynccontextmanager
+  async def run(self, key: str) -> AsyncIterator[IdempotentRun]:
+    """Hold a claimed key while the request runs; same-process retries wait on its outcome."""
+    handle = IdempotentRun(self, key)
+    future = asyncio.get_running_loop().create_future()
+    self._inflight[key] = future
+    renewer = asyncio.create_task(self._renew(key))
+    try:
+      yield handle
+    finally:
+      renewer.cancel()
+      self._inflight.pop(key, None)
+      try:
+        if handle.outcome is None:
+          # Shielded so a cancelled request still frees its key for the retry.
+          service = await self._connection()
+          await asyncio.shield(service.delete_idempotency_key(key, status="in_progress"))
+      finally:
+        # Wake same-process waiters even if the release failed or was cancelled; they retry the claim.
+        if not future.done():
+          future.set_result(handle.outcome)
+
+  async def _renew(self, key: str) -> None:
+    while True:
+      await asyncio.sleep(self.lease / 3)
+      try:
+        service = await self._connection()
+        await service.update_idempotency_key(key, {"lease_expires_at": time.time() + self.lease})
+      except Exception as e:
+        print(f"[WARN] Failed to renew idempotency lease: {e}")
+
+  async def _finish(self, key: str, outcome: Dict[str, Any]) -> None:
+    try:
+      service = await self._connection()
+      await service.update_idempotency_key(key, {**outcome, "lease_expires_at": None})
+    except Exception as e:
+      # The response itself is fine; retries re-run once the lease lapses.
+      print(f"[WARN] Failed to record idempotency outcome: {e}")
+
+  async def wait(self, key: str) -> Optional[Dict[str, Any]]:
+    """Wait for an in-progress key's outcome; ``None`` once it was released and may be claimed."""
+    where = "the wait for the original request"
+    local = self._inflight.get(key)
+    if local is not None:
+      try:
+        return await asyncio.wait_for(asyncio.shield(local), bounded(self.wait_timeout, where))
+      except asyncio.TimeoutError:
+        if expired():
+          raise DeadlineExceeded(where) from None
+        raise IdempotencyPending("The original request is still running.", retry_after=30) from None
+
+    service = await self._connection()
+    deadline = time.monotonic() + bounded(self.wait_timeout, where)
+    while time.monotonic() < deadline:
+      row = await service.get_idempotency_key(key)
+      if row is None or row["status"] != "in_progress":
+        return row
+      if (row.get("lease_expires_at") or 0) < time.time():
+        # The owner stopped renewing; the caller takes over.
+        return None
+      await asyncio.sleep(self.poll_interval)
+    if expired():
+      raise DeadlineExceeded(where)
+    raise IdempotencyPending("The original request is still running.", retry_after=30)
+
+  async def settle_hand_off(self, key: str, status_code: int, response: Dict[str, Any]) -> None:
+    """Record the result of the job a handed-off key points to, so later retries replay it."""
+    service = await self._connection()
+    await service.update_idempotency_key(
+      key,
+      {"status": "completed", "status_code": status_code, "response": response},
+      status="handed_off",
+    )
+
+  async def release_hand_off(self, key: str) -> None:
+    """Forget a key whose job failed, so the next retry generates again."""
+    service = await self._connection()
+    await service.delete_idempotency_key(key, status="handed_off")
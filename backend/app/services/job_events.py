@@ -0,0 +1,125 @@
+"""Push job progress to the clients waiting on it.
+
+Whichever process runs a job records its progress in ``job_events`` (see
+``JobQueue.publish``). Each app process runs one ``JobEventHub``: a single
+poller reads the new rows for all of its subscribers at once, so a thousand
+clients waiting on jobs cost one small query per ``poll_interval`` rather
+than a thousand. Events published by this process wake the poller at once.
+
+Event ids increase across the whole table. A client that reconnects with
+the last id it saw (``Last-Event-ID``) resumes without gaps or repeats.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import AsyncIterator, Dict, Optional, Set
+
+from app.services.jobs import TERMINAL_EVENTS, JobEvent, JobQueue
+
+
+class JobEventHub:
+  def __init__(self, queue: JobQueue, *, poll_interval: float = 0.5, batch_size: int = 500) -> None:
+    self.queue = queue
+    self.poll_interval = poll_interval
+    self.batch_size = batch_size
+    self.closed = False
+    # ``None`` in an inbox tells its subscriber that the hub is closing.
+    self._inboxes: Dict[str, Set[asyncio.Queue]] = {}
+    self._cursor: Optional[int] = None
+    self._wake = asyncio.Event()
+    self._poller: Optional[asyncio.Task] = None
+    queue.add_listener(self._wake.set)
+
+  @property
+  def subscribers(self) -> int:
+    return sum(len(inboxes) for inboxes in self._inboxes.values())
+
+  async def subscribe(
+    self,
+    job_id: str,
+    *,
+    after: Optional[int] = None,
+    live: bool = True,
+    heartbeat: float = 15.0,
+  ) -> AsyncIterator[Optional[JobEvent]]:
+    """Yield the job's events after ``after``, then new ones as they are published.
+
+    Yields ``None`` after ``heartbeat`` quiet seconds so the caller can keep its
+    connection alive. Stops after a terminal event, when the hub closes, or,
+    with ``live=False`` (a job that already finished), once the history is out.
+    """
+    if self.closed:
+      return
+    if self._cursor is None:
+      latest = await self.queue.last_event_id()
+      if self._cursor is None:
+        self._cursor = latest
+    # Registered before reading the history, so nothing published in between is lost.
+    inbox: asyncio.Queue = asyncio.Queue()
+    self._inboxes.setdefault(job_id, set()).add(inbox)
+    if self._poller is None or self._poller.done():
+      self._poller = asyncio.create_task(self._poll())
+    try:
+      last = after or 0
+      for event in await self.queue.events(job_id, after=last):
+        last = event.id
+        yield event
+        if event.event in TERMINAL_EVENTS:
+          return
+      if not live:
+        return
+      while True:
+        try:
+          event = await asyncio.wait_for(inbox.get(), heartbeat)
+        except asyncio.TimeoutError:
+          yield None
+          continue
+        if event is None:
+          return
+        if event.id <= last:
+          continue
+        last = event.id
+        yield event
+        if event.event in TERMINAL_EVENTS:
+          return
+    finally:
+      inboxes = self._inboxes.get(job_id)
+      if inboxes is not None:
+        inboxes.discard(inbox)
+        if not inboxes:
+          del self._inboxes[job_id]
+
+  async def _poll(self) -> None:
+    while not self.closed:
+      try:
+        await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+      except asyncio.TimeoutError:
+        pass
+      self._wake.clear()
+      if not self._inboxes:
+        # Idle: the next subscriber starts from the newest event instead of the backlog.
+        self._cursor = None
+        continue
+      try:
+        events = await self.queue.events_after(self._cursor, limit=self.batch_size)
+      except Exception as e:
+        print(f"[WARN] Reading job events failed: {e}")
+        continue
+      for event in events:
+        self._cursor = event.id
+        for inbox in self._inboxes.get(event.job_id, ()):
+          inbox.put_nowait(event)
+      if len(events) == self.batch_size:
+        self._wake.set()
+
+  def close(self) -> None:
+    """End every subscription (clients reconnect elsewhere with their last event id) and stop polling."""
+    if self.closed:
+      return
+    self.closed = True
+    for inboxes in self._inboxes.values():
+      for inbox in inboxes:
+        inbox.put_nowait(None)
+    if self._poller is not None:
+      self._poller.cancel()
@@ -0,0 +1,558 @@
+"""Durable video generation jobs in a SQLite file shared by every worker process.
+
+Workers claim jobs with a lease (``lease_owner`` + ``lease_expires_at``) and
+extend it with heartbeats. A job whose lease lapses becomes visible again, so
+another process picks it up and resumes from its last checkpointed ``state``;
+after a crash mid-render that means polling the stored HeyGen ``video_id``
+rather than rendering again. Jobs carry a priority class and a tenant, and
+``claim`` picks among them with ``scheduler.FairPolicy``.
+
+Progress is also appended to ``job_events`` (lifecycle changes here, pipeline
+stages through ``publish``), which ``JobEventHub`` pushes to waiting clients.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import socket
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.services.scheduler import PRIORITY_CLASSES, Candidate, FairPolicy, priority_rank
+
+
+_SCHEMA = (
+  """
+  CREATE TABLE IF NOT EXISTS video_jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'queued',
+    request TEXT NOT NULL,
+    stage TEXT NOT NULL DEFAULT 'queued',
+    state TEXT NOT NULL DEFAULT '{}',
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    lease_owner TEXT,
+    lease_expires_at REAL,
+    available_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+  )
+  """,
+  "CREATE INDEX IF NOT EXISTS idx_video_jobs_queued ON video_jobs(available_at) WHERE status = 'queued'",
+  "CREATE INDEX IF NOT EXISTS idx_video_jobs_running ON video_jobs(lease_expires_at) WHERE status = 'running'",
+  # AUTOINCREMENT keeps ids increasing even after purges, so an id is a safe resume point.
+  """
+  CREATE TABLE IF NOT EXISTS job_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL DEFAULT '{}',
+    created_at REAL NOT NULL
+  )
+  """,
+  "CREATE INDEX IF NOT EXISTS idx_job_events_job ON job_events(job_id, id)",
+  "CREATE INDEX IF NOT EXISTS idx_job_events_created ON job_events(created_at)",
+)
+
+# Columns added after the first release; added in place to existing job files.
+_ADDED_COLUMNS = (
+  ("priority", "INTEGER NOT NULL DEFAULT 1"),
+  ("tenant", "TEXT NOT NULL DEFAULT 'anonymous'"),
+)
+
+_ADDED_INDEXES = (
+  # Head of each tenant's queue per priority class, for fair claiming.
+  "CREATE INDEX IF NOT EXISTS idx_video_jobs_queued_tenant ON video_jobs(tenant, priority, available_at)"
+  " WHERE status = 'queued'",
+)
+
+_JOB_COLUMNS = (
+  "id, status, request, stage, state, result, error, attempts, max_attempts, "
+  "lease_owner, lease_expires_at, available_at, created_at, updated_at, priority, tenant"
+)
+
+
+class Deferred(Exception):
+  """Raised by a job handler that is waiting on something slow; the job is retried after ``delay`` seconds."""
+
+  def __init__(self, message: str = "", *, delay: float = 60.0) -> None:
+    super().__init__(message)
+    self.delay = delay
+
+
+class LeaseLost(Exception):
+  """Another worker took over the job after this worker's lease expired."""
+
+
+@dataclass
+class Job:
+  id: str
+  status: str
+  request: Dict[str, Any]
+  stage: str
+  state: Dict[str, Any]
+  result: Optional[Dict[str, Any]]
+  error: Optional[str]
+  attempts: int
+  max_attempts: int
+  lease_owner: Optional[str]
+  lease_expires_at: Optional[float]
+  available_at: float
+  created_at: float
+  updated_at: float
+  priority: int = 1
+  tenant: str = "anonymous"
+
+  @property
+  def priority_class(self) -> str:
+    return PRIORITY_CLASSES[self.priority] if 0 <= self.priority < len(PRIORITY_CLASSES) else str(self.priority)
+
+  @classmethod
+  def from_row(cls, row) -> "Job":
+    data = dict(row)
+    data["request"] = json.loads(data["request"])
+    data["state"] = json.loads(data["state"])
+    data["result"] = json.loads(data["result"]) if data["result"] else None
+    return cls(**data)
+
+
+@dataclass
+class JobEvent:
+  id: int
+  job_id: str
+  event: str
+  data: Dict[str, Any]
+  created_at: float
+
+  @classmethod
+  def from_row(cls, row) -> "JobEvent":
+    data = dict(row)
+    data["data"] = json.loads(data["data"])
+    return cls(**data)
+
+
+# A job's stream ends with one of these.
+TERMINAL_EVENTS = ("done", "failed")
+
+
+class JobQueue:
+  """Lease-based job table; every method is a single short transaction."""
+
+  def __init__(
+    self,
+    path: str,
+    *,
+    visibility_timeout: float = 60.0,
+    max_attempts: int = 3,
+    retry_backoff: float = 5.0,
+    policy: Optional[FairPolicy] = None,
+    event_retention: float = 7 * 86400,
+    purge_interval: float = 3600.0,
+  ) -> None:
+    self.path = path
+    self.visibility_timeout = visibility_timeout
+    self.max_attempts = max_attempts
+    self.retry_backoff = retry_backoff
+    self.policy = policy or FairPolicy()
+    self.event_retention = event_retention
+    self.purge_interval = purge_interval
+    self._conn = None
+    self._connect_lock = asyncio.Lock()
+    self._listeners: List[Callable[[], None]] = []
+    self._last_purge = 0.0
+
+  async def _connection(self):
+    if self._conn is not None:
+      return self._conn
+    async with self._connect_lock:
+      if self._conn is None:
+        import aiosqlite
+
+        conn = await aiosqlite.connect(self.path, isolation_level=None)
+        conn.row_factory = aiosqlite.Row
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute("PRAGMA busy_timeout=5000")
+        for statement in _SCHEMA:
+          await conn.execute(statement)
+        async with conn.execute("PRAGMA table_info(video_jobs)") as cursor:
+          existing = {row["name"] for row in await cursor.fetchall()}
+        for column, definition in _ADDED_COLUMNS:
+          if column not in existing:
+            try:
+              await conn.execute(f"ALTER TABLE video_jobs ADD COLUMN {column} {definition}")
+            except Exception as e:
+              # Another process added it first.
+              if "duplicate column" not in str(e):
+                raise
+        for statement in _ADDED_INDEXES:
+          await conn.execute(statement)
+        self._conn = conn
+    return self._conn
+
+  async def close(self) -> None:
+    if self._conn is not None:
+      await self._conn.close()
+      self._conn = None
+
+  async def enqueue(
+    self,
+    request: Dict[str, Any],
+    *,
+    stage: str = "queued",
+    state: Optional[Dict[str, Any]] = None,
+    priority: str = "recovery",
+    tenant: Optional[str] = None,
+  ) -> Job:
+    """Queue a job; ``stage``/``state`` let an interrupted inline run be resumed by a worker."""
+    conn = await self._connection()
+    now = time.time()
+    if now - self._last_purge >= self.purge_interval:
+      self._last_purge = now
+      await conn.execute("DELETE FROM job_events WHERE created_at < ?", (now - self.event_retention,))
+    job_id = uuid.uuid4().hex
+    tenant = tenant or self.policy.tenant(request.get("doctor_email"))
+    async with conn.execute(
+      "INSERT INTO video_jobs"
+      " (id, request, stage, state, max_attempts, available_at, created_at, updated_at, priority, tenant)"
+      f" VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING {_JOB_COLUMNS}",
+      (
+        job_id, json.dumps(request), stage, json.dumps(state or {}), self.max_attempts,
+        now, now, now, priority_rank(priority), tenant,
+      ),
+    ) as cursor:
+      row = await cursor.fetchone()
+    await self.publish(job_id, "queued", {"priority": priority, "stage": stage})
+    return Job.from_row(row)
+
+  def add_listener(self, callback: Callable[[], None]) -> None:
+    """Call ``callback`` after this process records an event, so subscribers need not wait for a poll."""
+    self._listeners.append(callback)
+
+  async def publish(self, job_id: str, event: str, data: Optional[Dict[str, Any]] = None) -> int:
+    """Append an event to the job's progress stream; returns its id."""
+    conn = await self._connection()
+    async with conn.execute(
+      "INSERT INTO job_events (job_id, event, data, created_at) VALUES (?, ?, ?, ?) RETURNING id",
+      (job_id, event, json.dumps(data or {}), time.time()),
+    ) as cursor:
+      row = await cursor.fetchone()
+    for callback in self._listeners:
+      callback()
+    return row["id"]
+
+  async def events(self, job_id: str, *, after: int = 0) -> List[JobEvent]:
+    """The job's events with an id above ``after``, oldest first."""
+    conn = await self._connection()
+    async with conn.execute(
+      "SELECT id, job_id, event, data, created_at FROM job_events WHERE job_id = ? AND id > ? ORDER BY id",
+      (job_id, after),
+    ) as cursor:
+      return [JobEvent.from_row(row) for row in await cursor.fetchall()]
+
+  async def events_after(self, cursor_id: int, *, limit: int = 500) -> List[JobEvent]:
+    """Every job's events with an id above ``cursor_id``, oldest first."""
+    conn = await self._connection()
+    async with conn.execute(
+      "SELECT id, job_id, event, data, created_at FROM job_events WHERE id > ? ORDER BY id LIMIT ?",
+      (cursor_id, limit),
+    ) as cursor:
+      return [JobEvent.from_row(row) for row in await cursor.fetchall()]
+
+  async def last_event_id(self) -> int:
+    conn = await self._connection()
+    async with conn.execute("SELECT COALESCE(MAX(id), 0) FROM job_events") as cursor:
+      row = await cursor.fetchone()
+    return row[0]
+
+  async def get(self, job_id: str) -> Optional[Job]:
+    conn = await self._connection()
+    async with conn.execute(f"SELECT {_JOB_COLUMNS} FROM video_jobs WHERE id = ?", (job_id,)) as cursor:
+      row = await cursor.fetchone()
+    return Job.from_row(row) if row else None
+
+  async def pending_count(self) -> int:
+    """Number of jobs queued or running right now, across all workers."""
+    conn = await self._connection()
+    async with conn.execute(
+      "SELECT (SELECT COUNT(*) FROM video_jobs WHERE status = 'queued')"
+      " + (SELECT COUNT(*) FROM video_jobs WHERE status = 'running')"
+    ) as cursor:
+      row = await cursor.fetchone()
+    return row[0]
+
+  async def requests_since(self, since: float, *, key: str) -> List[Dict[str, Any]]:
+    """Return ``{"status", "value"}`` for jobs created since ``since`` whose request carries ``key``."""
+    conn = await self._connection()
+    async with conn.execute(
+      "SELECT status, json_extract(request, ?) AS value FROM video_jobs"
+      " WHERE created_at >= ? AND json_extract(request, ?) IS NOT NULL",
+      (f"$.{key}", since, f"$.{key}"),
+    ) as cursor:
+      rows = await cursor.fetchall()
+    return [{"status": row["status"], "value": json.loads(row["value"])} for row in rows]
+
+  async def claim(self, owner: str) -> Optional[Job]:
+    """Lease the next runnable job (queued and due, or running with an expired lease) chosen by the fair policy.
+
+    Expired leases go first: that work was already admitted once. Among queued
+    jobs only each tenant's oldest due job per priority class is a candidate.
+    """
+    conn = await self._connection()
+    now = time.time()
+    await self._fail_exhausted(conn, now)
+    for _ in range(5):
+      async with conn.execute(
+        "SELECT id FROM video_jobs WHERE status = 'running' AND lease_expires_at < ? ORDER BY lease_expires_at LIMIT 1",
+        (now,),
+      ) as cursor:
+        expired = await cursor.fetchone()
+      if expired:
+        job_id = expired["id"]
+      else:
+        async with conn.execute(
+          "SELECT id, tenant, priority, created_at, MIN(available_at) FROM video_jobs"
+          " WHERE status = 'queued' AND available_at <= ? GROUP BY tenant, priority",
+          (now,),
+        ) as cursor:
+          heads = [
+            Candidate(rank=row["priority"], tenant=row["tenant"], since=row["created_at"], item=row["id"])
+            for row in await cursor.fetchall()
+          ]
+        if not heads:
+          return None
+        async with conn.execute(
+          "SELECT tenant, COUNT(*) AS running FROM video_jobs WHERE status = 'running' GROUP BY tenant"
+        ) as cursor:
+          held = {row["tenant"]: row["running"] for row in await cursor.fetchall()}
+        job_id = self.policy.pick(heads, held, now=now).item
+
+      # Another worker may have claimed it between the read and this write; then pick again.
+      async with conn.execute(
+        f"""
+        UPDATE video_jobs
+        SET status = 'running', lease_owner = ?, lease_expires_at = ?, attempts = attempts + 1, updated_at = ?
+        WHERE id = ? AND (
+          (status = 'queued' AND available_at <= ?) OR (status = 'running' AND lease_expires_at < ?)
+        )
+        RETURNING {_JOB_COLUMNS}
+        """,
+        (owner, now + self.visibility_timeout, now, job_id, now, now),
+      ) as cursor:
+        row = await cursor.fetchone()
+      if row:
+        job = Job.from_row(row)
+        await self.publish(job.id, "started", {"attempt": job.attempts, "stage": job.stage})
+        return job
+    return None
+
+  async def _fail_exhausted(self, conn, now: float) -> None:
+    # A job whose lease keeps expiring (e.g. it crashes its worker) must not be retried forever.
+    async with conn.execute(
+      "UPDATE video_jobs SET status = 'failed', error = COALESCE(error, 'Lease expired too many times'),"
+      " lease_owner = NULL, lease_expires_at = NULL, updated_at = ?"
+      " WHERE status = 'running' AND lease_expires_at < ? AND attempts >= max_attempts"
+      " RETURNING id, error",
+      (now, now),
+    ) as cursor:
+      failed = await cursor.fetchall()
+    for row in failed:
+      await self.publish(row["id"], "failed", {"error": row["error"]})
+
+  async def _update_leased(self, job_id: str, owner: str, assignments: str, params: tuple) -> None:
+    conn = await self._connection()
+    cursor = await conn.execute(
+      f"UPDATE video_jobs SET {assignments}, updated_at = ?"
+      " WHERE id = ? AND lease_owner = ? AND status = 'running'",
+      (*params, time.time(), job_id, owner),
+    )
+    updated = cursor.rowcount
+    await cursor.close()
+    if updated != 1:
+      raise LeaseLost(job_id)
+
+  async def heartbeat(self, job_id: str, owner: str) -> None:
+    await self._update_leased(
+      job_id, owner, "lease_expires_at = ?", (time.time() + self.visibility_timeout,)
+    )
+
+  async def checkpoint(self, job_id: str, owner: str, stage: str, state: Dict[str, Any]) -> None:
+    """Persist progress and extend the lease in one write."""
+    await self._update_leased(
+      job_id,
+      owner,
+      "stage = ?, state = ?, lease_expires_at = ?",
+      (stage, json.dumps(state), time.time() + self.visibility_timeout),
+    )
+
+  async def complete(self, job_id: str, owner: str, result: Dict[str, Any]) -> None:
+    await self._update_leased(
+      job_id,
+      owner,
+      "status = 'succeeded', stage = 'done', result = ?, error = NULL, lease_owner = NULL, lease_expires_at = NULL",
+      (json.dumps(result),),
+    )
+    await self.publish(job_id, "done", {"result": result})
+
+  async def fail(self, job_id: str, owner: str, error: str, *, retry: bool) -> None:
+    """Requeue with linear backoff while attempts remain, otherwise mark the job failed."""
+    job = await self.get(job_id)
+    if job is None or job.lease_owner != owner:
+      raise LeaseLost(job_id)
+    if retry and job.attempts < job.max_attempts:
+      delay = self.retry_backoff * job.attempts
+      await self._update_leased(
+        job_id,
+        owner,
+        "status = 'queued', error = ?, lease_owner = NULL, lease_expires_at = NULL, available_at = ?",
+        (error, time.time() + delay),
+      )
+      await self.publish(job_id, "retrying", {"error": error, "attempt": job.attempts, "delay": delay})
+    else:
+      await self._update_leased(
+        job_id,
+        owner,
+        "status = 'failed', error = ?, lease_owner = NULL, lease_expires_at = NULL",
+        (error,),
+      )
+      await self.publish(job_id, "failed", {"error": error})
+
+  async def release(
+    self,
+    job_id: str,
+    owner: str,
+    *,
+    stage: str,
+    state: Dict[str, Any],
+    delay: float = 0.0,
+  ) -> None:
+    """Hand a running job back with its latest state, without counting the attempt (e.g. on shutdown)."""
+    await self._update_leased(
+      job_id,
+      owner,
+      "status = 'queued', stage = ?, state = ?, attempts = MAX(attempts - 1, 0),"
+      " lease_owner = NULL, lease_expires_at = NULL, available_at = ?",
+      (stage, json.dumps(state), time.time() + delay),
+    )
+    await self.publish(job_id, "requeued", {"stage": stage, "delay": delay})
+
+
+JobHandler = Callable[[Job, Callable[[str, Dict[str, Any]], Awaitable[None]]], Awaitable[Dict[str, Any]]]
+
+
+class JobWorker:
+  """Claims jobs from the queue and runs them with heartbeats, ``concurrency`` at a time."""
+
+  def __init__(
+    self,
+    queue: JobQueue,
+    handler: JobHandler,
+    *,
+    concurrency: int = 2,
+    poll_interval: float = 1.0,
+    is_retryable: Callable[[BaseException], bool] = lambda e: True,
+  ) -> None:
+    self.queue = queue
+    self.handler = handler
+    self.concurrency = concurrency
+    self.poll_interval = poll_interval
+    self.is_retryable = is_retryable
+    self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    self._tasks: List[asyncio.Task] = []
+    self._stopping = False
+
+  def start(self) -> None:
+    self._tasks = [asyncio.create_task(self._loop()) for _ in range(self.concurrency)]
+    print(f"[INFO] Job worker {self.owner} started with concurrency {self.concurrency}")
+
+  async def stop(self, timeout: float = 0.0) -> None:
+    """Stop claiming, give running jobs ``timeout`` seconds, then hand the rest back to the queue."""
+    self._stopping = True
+    if self._tasks:
+      _, pending = await asyncio.wait(self._tasks, timeout=max(timeout, 0))
+      for task in pending:
+        task.cancel()
+      await asyncio.gather(*self._tasks, return_exceptions=True)
+    self._tasks = []
+
+  async def _loop(self) -> None:
+    while not self._stopping:
+      try:
+        job = await self.queue.claim(self.owner)
+      except Exception as e:
+        print(f"[ERROR] Job claim failed: {e}")
+        job = None
+      if job is None:
+        await asyncio.sleep(self.poll_interval)
+        continue
+      await self._run(job)
+
+  async def _run(self, job: Job) -> None:
+    resumed = f" (resuming at {job.stage})" if job.stage != "queued" else ""
+    print(f"[INFO] Job {job.id} attempt {job.attempts}{resumed}")
+
+    async def checkpoint(stage: str, state: Dict[str, Any]) -> None:
+      job.stage = stage
+      await self.queue.checkpoint(job.id, self.owner, stage, state)
+
+    work = asyncio.create_task(self.handler(job, checkpoint))
+    heartbeat = asyncio.create_task(self._heartbeat(job.id, work))
+    try:
+      result = await work
+    except asyncio.CancelledError:
+      if not work.done():
+        work.cancel()
+        await asyncio.gather(work, return_exceptions=True)
+      if heartbeat.done() and isinstance(heartbeat.exception(), LeaseLost):
+        print(f"[WARN] Job {job.id} lease lost; another worker will resume it")
+        return
+      # Shutting down: hand the job back so another process resumes it right away.
+      try:
+        await asyncio.shield(self.queue.release(job.id, self.owner, stage=job.stage, state=job.state))
+        print(f"[INFO] Job {job.id} handed back at stage {job.stage}")
+      except LeaseLost:
+        pass
+      raise
+    except LeaseLost:
+      print(f"[WARN] Job {job.id} lease lost; another worker will resume it")
+      return
+    except Deferred as e:
+      # Not a failure: free the slot and come back once the awaited work has had time to finish.
+      try:
+        await self.queue.release(job.id, self.owner, stage=job.stage, state=job.state, delay=e.delay)
+        print(f"[INFO] Job {job.id} deferred {e.delay:.0f}s: {e}")
+      except LeaseLost:
+        pass
+      return
+    except Exception as e:
+      print(f"[ERROR] Job {job.id} failed: {e}")
+      try:
+        await self.queue.fail(job.id, self.owner, str(e) or type(e).__name__, retry=self.is_retryable(e))
+      except LeaseLost:
+        pass
+      return
+    finally:
+      heartbeat.cancel()
+
+    try:
+      await self.queue.complete(job.id, self.owner, result)
+    except LeaseLost:
+      print(f"[WARN] Job {job.id} finished after its lease was lost")
+
+  async def _heartbeat(self, job_id: str, work: asyncio.Task) -> None:
+    interval = max(1.0, self.queue.visibility_timeout / 3)
+    while True:
+      await asyncio.sleep(interval)
+      try:
+        await self.queue.heartbeat(job_id, self.owner)
+      except LeaseLost:
+        work.cancel()
+        raise
+      except Exception as e:
+        print(f"[WARN] Heartbeat for job {job_id} failed: {e}")
@@ -1,20 +1,103 @@
 import asyncio
 import hashlib
 import json
-from typing import Any, Dict
+import re
+import time
+from typing import Any, Dict, Optional, Tuple
 
-from openai import AsyncOpenAI
+from app.services.deadline import DeadlineExceeded, remaining
+from app.services.jobs import Deferred
+from app.services.llm_routing import ModelRouter, classify
+
+
+# Storyboard scenes in playback order. Generic scenes depend only on the diagnosis and are
+# shared across patients; personalized ones are written per request.
+SCENE_PLAN = {
+  "intro": "Opening (0-5s): friendly cartoon hospital, narrator says “Today, let’s understand what a brain tumour is.”",
+  "brain_intro": "Brain introduction (5-10s): glowing cartoon brain highlighting functions.",
+  "what_is": "What is a brain tumour? (10-20s): soft visualization of cells growing.",
+  "benign_vs_malignant": "Benign vs Malignant (20-27s): split screen characters, calm vs assertive.",
+  "symptoms": "Symptoms (27-35s): illustrate headaches, blurry vision, speech difficulty, balance issues.",
+  "diagnosis": "Diagnosis (35-42s): MRI/CT scan animation with doctor explaining gently.",
+  "closing": "Closing (42-45s): hopeful hospital scene, emphasize early diagnosis & care plan.",
+}
+SCENE_ORDER = tuple(SCENE_PLAN)
+PERSONALIZED_SCENES = ("intro", "closing")
+GENERIC_SCENES = tuple(scene for scene in SCENE_ORDER if scene not in PERSONALIZED_SCENES)
+STYLE_KEYS = ("narrator_tone", "visual_style")
+
+# Bump whenever SCENE_PLAN or the generic prompt changes so cached scenes are regenerated.
+STORYBOARD_VERSION = 1
+SCENE_CACHE_TTL = 30 * 24 * 3600
+
+_STYLE_GUIDE = """Tone: compassionate, plain language, reassuring.
+Visual style: gentle colors, smooth motion, friendly cartoon aesthetic, no frightening imagery.
+Never mention JSON or technical instructions inside narration."""
+
+
+def _scene_plan(scenes) -> str:
+  return "\n".join(f"{SCENE_ORDER.index(scene) + 1}. {SCENE_PLAN[scene]}" for scene in scenes)
+
+
+def _narration(scene: Any) -> str:
+  if isinstance(scene, dict):
+    return str(scene.get("narration") or "").strip()
+  return ""
+
+
+def check_script(request_class: str, answer: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> Optional[str]:
+  """Why ``answer`` is not a usable script for ``request_class``; ``None`` when it is."""
+  scenes = GENERIC_SCENES if request_class == "generic" else PERSONALIZED_SCENES
+  missing = [scene for scene in scenes if not _narration(answer.get(scene))]
+  if missing:
+    return f"no narration for {', '.join(missing)}"
+  if request_class == "generic":
+    return None
+  if not str(answer.get("title") or "").strip():
+    return "no title"
+  plan = (context or {}).get("recovery_plan")
+  if plan:
+    # The prompt asks for today's objectives explicitly; a script that names none of them is too generic.
+    narration = " ".join(_narration(answer[scene]) for scene in scenes).lower()
+    sources = [plan.get("title") or "", plan.get("focus") or "", *plan.get("checklist", [])]
+    words = {word for text in sources for word in re.findall(r"[a-z]{6,}", text.lower())}
+    if f"day {plan.get('day')}" not in narration and not any(word in narration for word in words):
+      return f"does not mention day {plan.get('day')}'s objectives"
+  return None
 
 
 class LLMService:
   """Handles prompt construction and dispatching to OpenAI."""
 
-  def __init__(self, api_key: str, model_name: str) -> None:
-    self._client = AsyncOpenAI(api_key=api_key)
+  def __init__(
+    self,
+    api_key: str,
+    model_name: str,
+    *,
+    base_url: str | None = None,
+    batcher=None,
+    client=None,
+    router: ModelRouter | None = None,
+  ) -> None:
+    if client is None:
+      # Imported here so the SDK only loads once a script is actually requested.
+      from openai import AsyncOpenAI
+
+      client = AsyncOpenAI(api_key=api_key, base_url=base_url)
+    # Usually the app's shared client, so every request reuses one connection pool.
+    self._client = client
     self._model = model_name
+    # With a ScriptBatcher, requests go through the Batch API and raise ScriptPending until answered.
+    self._batcher = batcher
+    # Picks the model per request class; without one every request goes to ``model_name``.
+    self._router = router
+
+  def models(self, request_class: str) -> Tuple[str, ...]:
+    """Models tried in order for ``request_class``, escalating while answers fail ``check_script``."""
+    return self._router.models(request_class) if self._router is not None else (self._model,)
 
   async def build_prompt(self, context: Dict[str, Any]) -> str:
-    """Return a deterministic prompt string for the provided patient context."""
+    """Return a deterministic prompt for the personalized scenes of the provided patient context."""
     patient = context["patient"]
     doctor = context["doctor"]
     diagnoses = context.get("diagnoses", [])
@@ -28,22 +111,18 @@ class LLMService:
     diagnoses_text = ", ".join(diagnoses) or "Not specified"
     medications_text = ", ".join(medications) or "No active medications listed"
 
-    storyboard = """
-You are a medical video script writer crafting a 45-second animated explainer for patients. 
-Output JSON with keys: intro, brain_intro, what_is, benign_vs_malignant, symptoms, diagnosis, closing, narrator_tone, visual_style.
-Each of intro through closing must be an object like {"narration": "...", "visuals": "..."}.
-Follow this scene plan:
-1. Opening (0-5s): friendly cartoon hospital, narrator says “Today, let’s understand what a brain tumour is.”
-2. Brain introduction (5-10s): glowing cartoon brain highlighting functions.
-3. What is a brain tumour? (10-20s): soft visualization of cells growing.
-4. Benign vs Malignant (20-27s): split screen characters, calm vs assertive.
-5. Symptoms (27-35s): illustrate headaches, blurry vision, speech difficulty, balance issues.
-6. Diagnosis (35-42s): MRI/CT scan animation with doctor explaining gently.
-7. Closing (42-45s): hopeful hospital scene, emphasize early diagnosis & care plan.
-Tone: compassionate, plain language, reassuring.
-Visual style: gentle colors, smooth motion, friendly cartoon aesthetic, no frightening imagery.
-Never mention JSON or technical instructions inside narration.
-"""
+    keys = ", ".join(PERSONALIZED_SCENES)
+    storyboard = (
+      "You are a medical video script writer crafting a 45-second animated explainer for patients.\n"
+      f"Output JSON with keys: {keys}, title.\n"
+      f"Each of {keys} must be an object like {{\"narration\": \"...\", \"visuals\": \"...\"}}; title is a short string.\n"
+      "Write only these personalized scenes, speaking to the patient directly:\n"
+      f"{_scene_plan(PERSONALIZED_SCENES)}\n"
+      "The scenes in between are shared by every patient with this condition and are written separately:\n"
+      f"{_scene_plan(GENERIC_SCENES)}\n"
+      "Make the opening lead into them and the closing follow on from them.\n"
+      f"{_STYLE_GUIDE}\n"
+    )
 
     prompt = (
       f"{storyboard}\n"
@@ -75,11 +154,141 @@ Never mention JSON or technical instructions inside narration.
 
     return prompt
 
-  async def request_script(self, prompt: str) -> Dict[str, Any]:
+  def build_generic_prompt(self, *, condition: str, diagnosis_code: str) -> str:
+    """Prompt for the diagnosis-only scenes; contains no patient data so the result can be shared."""
+    keys = ", ".join(GENERIC_SCENES)
+    return (
+      "You are a medical video script writer crafting a 45-second animated explainer for patients.\n"
+      f"Output JSON with keys: {keys}, {', '.join(STYLE_KEYS)}.\n"
+      f"Each of {keys} must be an object like {{\"narration\": \"...\", \"visuals\": \"...\"}}.\n"
+      "Write only these scenes of the storyboard:\n"
+      f"{_scene_plan(GENERIC_SCENES)}\n"
+      "They are reused for every patient with this condition: never address the viewer by name or mention "
+      "personal details, medications or dates.\n"
+      f"{_STYLE_GUIDE}\n\n"
+      f"Condition: {condition} ({diagnosis_code})\n"
+    )
+
+  async def generate_script(
+    self,
+    context: Dict[str, Any],
+    *,
+    diagnosis_code: str,
+    cache=None,
+  ) -> Dict[str, Any]:
+    """Write the personalized scenes and fetch (or write once) the generic scenes for the diagnosis."""
+    code = (diagnosis_code or "unknown").strip().upper()
+    condition = next(
+      (entry.get("display") for entry in context.get("diagnosis_entries", []) if (entry.get("code") or "").upper() == code),
+      None,
+    ) or code
+
+    async def write_generic() -> Dict[str, Any]:
+      prompt = self.build_generic_prompt(condition=condition, diagnosis_code=code)
+      scenes = await self.routed_script(prompt, request_class="generic", label=f"generic scenes for {code}")
+      if not any(key in scenes for key in GENERIC_SCENES):
+        # Never cache an unusable answer for a month.
+        raise RuntimeError(f"LLM returned no generic scenes for {code}")
+      return {key: scenes[key] for key in (*GENERIC_SCENES, *STYLE_KEYS) if key in scenes}
+
+    generic_key = f"{'>'.join(self.models('generic'))}:v{STORYBOARD_VERSION}:{code}"
+    if cache is not None:
+      generic_call = cache.get_or_compute("script_scenes", generic_key, write_generic, ttl=SCENE_CACHE_TTL)
+    else:
+      generic_call = write_generic()
+
+    personalized_prompt = await self.build_prompt(context)
+    generic, personalized = await asyncio.gather(
+      generic_call,
+      self.routed_script(personalized_prompt, request_class=classify(context), context=context, label="personalized scenes"),
+    )
+
+    script: Dict[str, Any] = {}
+    for scene in SCENE_ORDER:
+      source = personalized if scene in PERSONALIZED_SCENES else generic
+      if scene in source:
+        script[scene] = source[scene]
+    for key in STYLE_KEYS:
+      if key in generic:
+        script[key] = generic[key]
+    if personalized.get("title"):
+      script["title"] = personalized["title"]
+    if not any(scene in personalized for scene in PERSONALIZED_SCENES) and personalized.get("content"):
+      # Unparseable answer: keep the raw text so the video still has a script.
+      script["content"] = personalized["content"]
+    return script
+
+  async def routed_script(
+    self,
+    prompt: str,
+    *,
+    request_class: str,
+    context: Optional[Dict[str, Any]] = None,
+    label: str = "script",
+  ) -> Dict[str, Any]:
+    """Ask each model of the route in turn until one answers with a usable script.
+
+    The last model's answer is returned even if it fails validation, as before routing.
+    """
+    models = self.models(request_class)
+    started = time.perf_counter()
+    cost = 0.0
+    for attempt, model in enumerate(models, 1):
+      final = attempt == len(models)
+      call_started = time.perf_counter()
+      try:
+        answer, usage, batched = await self._complete(prompt, model=model, label=label)
+      except (Deferred, DeadlineExceeded):
+        raise
+      except Exception as e:
+        self._record_call(request_class, model, "error", call_started, None)
+        if final:
+          raise
+        print(f"[WARN] LLM {label} on {model} failed ({type(e).__name__}: {e}); escalating to {models[attempt]}")
+        continue
+
+      problem = check_script(request_class, answer, context)
+      if problem is None or final:
+        if not batched:
+          cost += self._record_call(request_class, model, "accepted", call_started, usage)
+          if self._router is not None:
+            self._router.record_request(
+              request_class,
+              model,
+              attempts=attempt,
+              latency_ms=(time.perf_counter() - started) * 1000,
+              cost=cost,
+            )
+        if problem is not None and len(models) > 1:
+          print(f"[WARN] LLM {label}: {model} answer kept although it {problem}")
+        return answer
+      if not batched:
+        cost += self._record_call(request_class, model, "rejected", call_started, usage)
+      print(f"[INFO] LLM {label}: {model} answer rejected ({problem}); escalating to {models[attempt]}")
+
+  def _record_call(self, request_class: str, model: str, outcome: str, started: float, usage) -> float:
+    if self._router is None:
+      return 0.0
+    return self._router.record_call(
+      request_class,
+      model,
+      outcome=outcome,
+      latency_ms=(time.perf_counter() - started) * 1000,
+      prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+      completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+    )
+
+  async def request_script(self, prompt: str, *, label: str = "script", model: str | None = None) -> Dict[str, Any]:
     """Call OpenAI with the prepared prompt."""
-    response = await self._client.chat.completions.create(
-      model=self._model,
-      messages=[
+    answer, _, _ = await self._complete(prompt, model=model or self._model, label=label)
+    return answer
+
+  async def _complete(self, prompt: str, *, model: str, label: str) -> Tuple[Dict[str, Any], Any, bool]:
+    """Parsed answer, token usage, and whether it came from a batch (so its latency means nothing)."""
+    started = time.perf_counter()
+    body = {
+      "model": model,
+      "messages": [
         {
           "role": "system",
           "content": "You are a medical video script writer. Generate clear, compassionate, patient-friendly explanations. Always return valid JSON."
@@ -89,22 +298,38 @@ Never mention JSON or technical instructions inside narration.
           "content": prompt
         }
       ],
-      response_format={"type": "json_object"},
-      temperature=0.7
-    )
+      "response_format": {"type": "json_object"},
+      "temperature": 0.7,
+    }
+    if self._batcher is not None:
+      from openai.types.chat import ChatCompletion
+
+      response = ChatCompletion.model_validate(await self._batcher.result(body))
+      label += " (batch)"
+      batched = True
+    else:
+      batched = False
+      left = remaining(f"the LLM {label} request")
+      response = await self._client.chat.completions.create(**body, **({"timeout": left} if left is not None else {}))
     
     text = response.choices[0].message.content or ""
     text = text.strip()
+    usage = getattr(response, "usage", None)
+    if usage:
+      print(
+        f"[INFO] LLM {label} on {model}: {usage.prompt_tokens} prompt / {usage.completion_tokens} completion tokens"
+        f" in {(time.perf_counter() - started) * 1000:.0f} ms"
+      )
 
     try:
       parsed = json.loads(text)
       if isinstance(parsed, dict):
         parsed.setdefault("content", text)
-        return parsed
+        return parsed, usage, batched
     except json.JSONDecodeError:
       pass
 
-    return {"content": text}
+    return {"content": text}, usage, batched
 
   @staticmethod
   def compute_case_key(
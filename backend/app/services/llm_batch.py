@@ -0,0 +1,275 @@
+"""Offline script generation through the OpenAI Batch API for non-urgent jobs.
+
+Job workers do not wait on a batch. ``ScriptBatcher.result`` records the chat
+completion request in a SQLite table next to the job queue and raises
+``ScriptPending``; the worker hands the job back to the queue and retries it
+later. One ``ScriptBatcher`` loop per process uploads pending requests as
+JSONL batches, polls them and stores each response under its ``custom_id``,
+which is a hash of the request body: a resumed or retried job finds its answer
+instead of paying for it again, and identical prompts share one request.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from app.services.jobs import Deferred
+
+
+_SCHEMA = (
+  """
+  CREATE TABLE IF NOT EXISTS script_batch_requests (
+    custom_id TEXT PRIMARY KEY,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    batch_id TEXT,
+    response TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+  )
+  """,
+  "CREATE INDEX IF NOT EXISTS idx_script_batch_pending ON script_batch_requests(created_at) WHERE status = 'pending'",
+  "CREATE INDEX IF NOT EXISTS idx_script_batch_batch ON script_batch_requests(batch_id) WHERE status IN ('submitting', 'submitted')",
+)
+
+_ENDPOINT = "/v1/chat/completions"
+_FINAL_BATCH_STATES = ("completed", "failed", "expired", "cancelled")
+# A process that died mid-upload leaves rows in 'submitting'; others reclaim them after this long.
+_SUBMIT_TIMEOUT = 600.0
+# Answered requests are kept this long so resumed jobs still find them.
+_RETENTION = 7 * 24 * 3600
+
+
+class ScriptPending(Deferred):
+  """The script request is queued in a provider batch; retry the job later."""
+
+
+def request_id(body: Dict[str, Any]) -> str:
+  return hashlib.sha256(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+
+
+class ScriptBatcher:
+  """Collects chat completion requests into provider batches and stores their answers."""
+
+  def __init__(
+    self,
+    client,
+    path: str,
+    *,
+    max_requests: int = 500,
+    max_wait: float = 300.0,
+    poll_interval: float = 60.0,
+  ) -> None:
+    self._client = client
+    self.path = path
+    self.max_requests = max_requests
+    self.max_wait = max_wait
+    self.poll_interval = poll_interval
+    self._conn = None
+    self._connect_lock = asyncio.Lock()
+    self._task: Optional[asyncio.Task] = None
+
+  async def _connection(self):
+    if self._conn is not None:
+      return self._conn
+    async with self._connect_lock:
+      if self._conn is None:
+        import aiosqlite
+
+        conn = await aiosqlite.connect(self.path, isolation_level=None)
+        conn.row_factory = aiosqlite.Row
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute("PRAGMA busy_timeout=5000")
+        for statement in _SCHEMA:
+          await conn.execute(statement)
+        self._conn = conn
+    return self._conn
+
+  async def close(self) -> None:
+    await self.stop()
+    if self._conn is not None:
+      await self._conn.close()
+      self._conn = None
+
+  async def result(self, body: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the chat completion for ``body`` once its batch has finished, else raise ``ScriptPending``."""
+    conn = await self._connection()
+    custom_id = request_id(body)
+    async with conn.execute(
+      "SELECT status, response, error FROM script_batch_requests WHERE custom_id = ?", (custom_id,)
+    ) as cursor:
+      row = await cursor.fetchone()
+
+    if row is None:
+      now = time.time()
+      await conn.execute(
+        "INSERT OR IGNORE INTO script_batch_requests (custom_id, body, created_at, updated_at) VALUES (?, ?, ?, ?)",
+        (custom_id, json.dumps(body), now, now),
+      )
+      raise ScriptPending(f"Script request {custom_id} queued for the next batch", delay=self.max_wait)
+    if row["status"] == "done":
+      return json.loads(row["response"])
+    if row["status"] == "failed":
+      # Forget the failure so the job's retry queues the request again.
+      await conn.execute("DELETE FROM script_batch_requests WHERE custom_id = ? AND status = 'failed'", (custom_id,))
+      raise RuntimeError(f"Batch script request failed: {row['error']}")
+    raise ScriptPending(f"Script request {custom_id} is {row['status']}", delay=self.poll_interval)
+
+  def start(self) -> None:
+    if self._task is None:
+      self._task = asyncio.create_task(self._loop())
+
+  async def stop(self) -> None:
+    if self._task is not None:
+      self._task.cancel()
+      try:
+        await self._task
+      except asyncio.CancelledError:
+        pass
+      self._task = None
+
+  async def _loop(self) -> None:
+    while True:
+      try:
+        # One batch per model, and more than one when the backlog exceeds max_requests.
+        while await self.flush():
+          pass
+        await self.poll()
+      except Exception as e:
+        print(f"[WARN] Script batch pass failed: {e}")
+      await asyncio.sleep(min(self.poll_interval, self.max_wait))
+
+  async def flush(self, *, force: bool = False) -> Optional[str]:
+    """Submit pending requests as one batch once enough have piled up or the oldest has waited long enough."""
+    conn = await self._connection()
+    now = time.time()
+    await conn.execute(
+      "UPDATE script_batch_requests SET status = 'pending', batch_id = NULL, updated_at = ?"
+      " WHERE status = 'submitting' AND updated_at < ?",
+      (now, now - _SUBMIT_TIMEOUT),
+    )
+    async with conn.execute(
+      "SELECT COUNT(*), MIN(created_at) FROM script_batch_requests WHERE status = 'pending'"
+    ) as cursor:
+      count, oldest = await cursor.fetchone()
+    if not count or not (force or count >= self.max_requests or now - oldest >= self.max_wait):
+      return None
+
+    # A provider batch takes one model, and routing sends requests to several: submit the oldest's model first.
+    async with conn.execute(
+      "SELECT json_extract(body, '$.model') FROM script_batch_requests WHERE status = 'pending'"
+      " ORDER BY created_at LIMIT 1"
+    ) as cursor:
+      row = await cursor.fetchone()
+    if row is None:
+      return None
+    model = row[0]
+
+    # Claim the rows first so concurrent processes never upload the same request twice.
+    token = f"local-{uuid.uuid4().hex}"
+    async with conn.execute(
+      "UPDATE script_batch_requests SET status = 'submitting', batch_id = ?, updated_at = ?"
+      " WHERE custom_id IN (SELECT custom_id FROM script_batch_requests WHERE status = 'pending'"
+      " AND json_extract(body, '$.model') IS ? ORDER BY created_at LIMIT ?) RETURNING custom_id, body",
+      (token, now, model, self.max_requests),
+    ) as cursor:
+      rows = await cursor.fetchall()
+    if not rows:
+      return None
+
+    lines = [
+      json.dumps({"custom_id": row["custom_id"], "method": "POST", "url": _ENDPOINT, "body": json.loads(row["body"])})
+      for row in rows
+    ]
+    try:
+      upload = await self._client.files.create(
+        file=("scripts.jsonl", "\n".join(lines).encode("utf-8")),
+        purpose="batch",
+      )
+      batch = await self._client.batches.create(
+        input_file_id=upload.id,
+        endpoint=_ENDPOINT,
+        completion_window="24h",
+      )
+    except Exception:
+      await conn.execute(
+        "UPDATE script_batch_requests SET status = 'pending', batch_id = NULL, updated_at = ? WHERE batch_id = ?",
+        (time.time(), token),
+      )
+      raise
+    await conn.execute(
+      "UPDATE script_batch_requests SET status = 'submitted', batch_id = ?, updated_at = ? WHERE batch_id = ?",
+      (batch.id, time.time(), token),
+    )
+    print(f"[INFO] Submitted script batch {batch.id} with {len(rows)} {model} request(s)")
+    return batch.id
+
+  async def poll(self) -> None:
+    """Check every submitted batch and store the answers of finished ones."""
+    conn = await self._connection()
+    await conn.execute(
+      "DELETE FROM script_batch_requests WHERE status = 'done' AND updated_at < ?", (time.time() - _RETENTION,)
+    )
+    async with conn.execute(
+      "SELECT DISTINCT batch_id FROM script_batch_requests WHERE status = 'submitted'"
+    ) as cursor:
+      batch_ids = [row[0] for row in await cursor.fetchall()]
+    for batch_id in batch_ids:
+      batch = await self._client.batches.retrieve(batch_id)
+      if batch.status in _FINAL_BATCH_STATES:
+        await self._collect(batch)
+
+  async def _collect(self, batch) -> None:
+    conn = await self._connection()
+    now = time.time()
+    answered = 0
+    tokens = 0
+    for file_id in (batch.output_file_id, batch.error_file_id):
+      if not file_id:
+        continue
+      content = await self._client.files.content(file_id)
+      for line in content.text.splitlines():
+        if not line.strip():
+          continue
+        item = json.loads(line)
+        response = item.get("response") or {}
+        body = response.get("body") or {}
+        if response.get("status_code") == 200:
+          tokens += (body.get("usage") or {}).get("total_tokens", 0)
+          await conn.execute(
+            "UPDATE script_batch_requests SET status = 'done', response = ?, error = NULL, updated_at = ?"
+            " WHERE custom_id = ? AND batch_id = ?",
+            (json.dumps(body), now, item["custom_id"], batch.id),
+          )
+          answered += 1
+        else:
+          error = item.get("error") or body.get("error") or {"status_code": response.get("status_code")}
+          await conn.execute(
+            "UPDATE script_batch_requests SET status = 'failed', error = ?, updated_at = ?"
+            " WHERE custom_id = ? AND batch_id = ?",
+            (json.dumps(error), now, item["custom_id"], batch.id),
+          )
+
+    if batch.status == "failed":
+      errors = getattr(getattr(batch, "errors", None), "data", None) or []
+      message = "; ".join(getattr(error, "message", "") or "" for error in errors) or "batch failed"
+      await conn.execute(
+        "UPDATE script_batch_requests SET status = 'failed', error = ?, updated_at = ?"
+        " WHERE batch_id = ? AND status = 'submitted'",
+        (message, now, batch.id),
+      )
+    else:
+      # Expired or cancelled before these ran: put them in the next batch.
+      await conn.execute(
+        "UPDATE script_batch_requests SET status = 'pending', batch_id = NULL, created_at = ?, updated_at = ?"
+        " WHERE batch_id = ? AND status = 'submitted'",
+        (now - self.max_wait, now, batch.id),
+      )
+    print(f"[INFO] Script batch {batch.id} {batch.status}: {answered} answer(s), {tokens} tokens")
@@ -0,0 +1,180 @@
+"""Choose the model for each script request and keep score of the choice.
+
+Script requests fall into classes of very different difficulty. The shared
+diagnosis scenes (``generic``) are written once per diagnosis and cached for a
+month. An ``explainer`` is the first personalized video. A ``recovery_day``
+follow-up mostly restates the day's checklist, and a ``milestone`` video
+marks a named milestone. ``LLM_ROUTES`` lists the cheaper models to try first
+for a class, e.g. ``recovery_day=gpt-4o-mini``. ``OPENAI_MODEL`` always ends
+the chain. An answer that fails validation (see ``llm.check_script``) or a
+call that errors escalates to the next model, so a fast model only keeps the
+requests it answers well.
+
+``ModelRouter`` records, per route and model, calls, rejections, latency
+percentiles, tokens and cost (from ``LLM_MODEL_PRICES``) for
+``GET /admin/llm/routes``.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Optional, Tuple
+
+
+REQUEST_CLASSES = ("explainer", "recovery_day", "milestone", "generic")
+# Latencies kept per model for percentiles.
+_LATENCY_WINDOW = 500
+
+
+def classify(context: Dict[str, Any]) -> str:
+  """Request class of a personalized script prompt payload."""
+  if (context.get("recovery_milestone") or "").strip():
+    return "milestone"
+  if context.get("recovery_plan") or context.get("recovery_day"):
+    return "recovery_day"
+  return "explainer"
+
+
+def parse_routes(spec: str) -> Dict[str, Tuple[str, ...]]:
+  """Parse ``"recovery_day=gpt-4o-mini,milestone=gpt-4o-mini>gpt-4.1-mini"`` into models tried per class."""
+  routes: Dict[str, Tuple[str, ...]] = {}
+  for part in (spec or "").split(","):
+    if "=" not in part:
+      continue
+    name, models = part.split("=", 1)
+    name = name.strip().lower()
+    if name not in REQUEST_CLASSES:
+      raise ValueError(f"Unknown LLM route {name!r}; expected one of {', '.join(REQUEST_CLASSES)}")
+    routes[name] = tuple(model.strip() for model in models.split(">") if model.strip())
+  return routes
+
+
+def parse_prices(spec: str) -> Dict[str, Tuple[float, float]]:
+  """Parse ``"gpt-4o=2.50/10.00"`` into USD per million prompt and completion tokens."""
+  prices: Dict[str, Tuple[float, float]] = {}
+  for part in (spec or "").split(","):
+    if "=" not in part:
+      continue
+    model, value = part.rsplit("=", 1)
+    prompt, _, completion = value.partition("/")
+    prices[model.strip()] = (float(prompt), float(completion or prompt))
+  return prices
+
+
+def _percentile(values, q: float) -> Optional[float]:
+  ordered = sorted(values)
+  return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1) if ordered else None
+
+
+@dataclass
+class _ModelStats:
+  calls: int = 0
+  accepted: int = 0
+  rejected: int = 0
+  errors: int = 0
+  prompt_tokens: int = 0
+  completion_tokens: int = 0
+  cost: float = 0.0
+  latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=_LATENCY_WINDOW))
+
+  def describe(self) -> Dict[str, Any]:
+    return {
+      "calls": self.calls,
+      "accepted": self.accepted,
+      "rejected": self.rejected,
+      "errors": self.errors,
+      "latency_ms": {"p50": _percentile(self.latencies, 0.5), "p95": _percentile(self.latencies, 0.95)},
+      "prompt_tokens": self.prompt_tokens,
+      "completion_tokens": self.completion_tokens,
+      "cost_usd": round(self.cost, 6),
+    }
+
+
+@dataclass
+class _RouteStats:
+  requests: int = 0
+  escalated: int = 0
+  cost: float = 0.0
+  served_by: Dict[str, int] = field(default_factory=dict)
+  latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=_LATENCY_WINDOW))
+  models: Dict[str, _ModelStats] = field(default_factory=dict)
+
+
+class ModelRouter:
+  """Process-wide routing table and per-route statistics."""
+
+  def __init__(
+    self,
+    default_model: str,
+    routes: Optional[Dict[str, Tuple[str, ...]]] = None,
+    prices: Optional[Dict[str, Tuple[float, float]]] = None,
+  ) -> None:
+    self.default_model = default_model
+    self.routes = dict(routes or {})
+    self.prices = dict(prices or {})
+    self._stats: Dict[str, _RouteStats] = {}
+
+  def models(self, request_class: str) -> Tuple[str, ...]:
+    """Models to try in order; always ends with ``default_model``."""
+    chain = [model for model in self.routes.get(request_class, ()) if model != self.default_model]
+    return (*dict.fromkeys(chain), self.default_model)
+
+  def cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    price = self.prices.get(model)
+    if price is None:
+      return None
+    return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+
+  def record_call(
+    self,
+    request_class: str,
+    model: str,
+    *,
+    outcome: str,
+    latency_ms: float,
+    prompt_tokens: int = 0,
+    completion_tokens: int = 0,
+  ) -> float:
+    """Count one call (``accepted`` | ``rejected`` | ``error``); returns its cost, 0 when unpriced."""
+    cost = self.cost(model, prompt_tokens, completion_tokens) or 0.0
+    stats = self._stats.setdefault(request_class, _RouteStats()).models.setdefault(model, _ModelStats())
+    stats.calls += 1
+    if outcome == "accepted":
+      stats.accepted += 1
+    elif outcome == "rejected":
+      stats.rejected += 1
+    else:
+      stats.errors += 1
+    stats.latencies.append(latency_ms)
+    stats.prompt_tokens += prompt_tokens
+    stats.completion_tokens += completion_tokens
+    stats.cost += cost
+    return cost
+
+  def record_request(self, request_class: str, model: str, *, attempts: int, latency_ms: float, cost: float) -> None:
+    """Count one routed request that ``model`` finally answered after ``attempts`` calls."""
+    route = self._stats.setdefault(request_class, _RouteStats())
+    route.requests += 1
+    if attempts > 1:
+      route.escalated += 1
+    route.cost += cost
+    route.served_by[model] = route.served_by.get(model, 0) + 1
+    route.latencies.append(latency_ms)
+
+  def report(self) -> Dict[str, Any]:
+    routes = {}
+    for name in REQUEST_CLASSES:
+      route = self._stats.get(name) or _RouteStats()
+      routes[name] = {
+        "models": list(self.models(name)),
+        "requests": route.requests,
+        "escalated": route.escalated,
+        "served_by": dict(route.served_by),
+        "latency_ms": {"p50": _percentile(route.latencies, 0.5), "p95": _percentile(route.latencies, 0.95)},
+        "cost_usd": round(route.cost, 6),
+        "cost_per_request_usd": round(route.cost / route.requests, 6) if route.requests else None,
+        "calls": {model: stats.describe() for model, stats in route.models.items()},
+      }
+    unpriced = sorted({model for route in routes.values() for model in route["models"] if model not in self.prices})
+    return {"default_model": self.default_model, "unpriced_models": unpriced, "routes": routes}
@@ -0,0 +1,729 @@
+"""Versioned schema migrations for the local SQLite database and Supabase.
+
+Each migration carries the SQLite statements applied by ``LocalDatabase`` on
+connect and the matching PostgreSQL statements for Supabase. Run
+``python -m app.services.migrations`` to print the Supabase script (paste it
+into the Supabase SQL editor) or ``--check`` to verify that the hot queries
+are served by their indexes.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import aiosqlite
+
+
+@dataclass(frozen=True)
+class Migration:
+  version: int
+  name: str
+  sqlite: Tuple[str, ...]
+  postgres: Tuple[str, ...] = ()
+
+
+# Trigger body projecting one epic_patient_data row's JSON columns into the child tables.
+_SQLITE_PROJECT_EPIC_ROW = """
+        INSERT INTO epic_diagnoses (epic_patient_data_id, position, patient_email, code, display, clinical_status)
+        SELECT NEW.id, key, NEW.patient_email,
+               json_extract(value, '$.code'), json_extract(value, '$.display'), json_extract(value, '$.clinicalStatus')
+        FROM json_each(CASE WHEN NOT json_valid(NEW.diagnoses) THEN '[]'
+                            WHEN json_type(NEW.diagnoses) = 'array' THEN NEW.diagnoses ELSE '[]' END);
+        INSERT INTO epic_medications (epic_patient_data_id, position, patient_email, code, name, status)
+        SELECT NEW.id, key, NEW.patient_email,
+               json_extract(value, '$.code'), COALESCE(json_extract(value, '$.name'), json_extract(value, '$.display')),
+               json_extract(value, '$.status')
+        FROM json_each(CASE WHEN NOT json_valid(NEW.medications) THEN '[]'
+                            WHEN json_type(NEW.medications) = 'array' THEN NEW.medications ELSE '[]' END);"""
+
+
+MIGRATIONS: List[Migration] = [
+  Migration(
+    version=1,
+    name="baseline",
+    sqlite=(
+      """
+      CREATE TABLE IF NOT EXISTS users (
+        email TEXT PRIMARY KEY,
+        first_name TEXT NOT NULL,
+        last_name TEXT NOT NULL,
+        user_type TEXT NOT NULL CHECK (user_type IN ('patient', 'doctor')),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+      )
+      """,
+      """
+      CREATE TABLE IF NOT EXISTS epic_patient_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        doctor_email TEXT NOT NULL,
+        patient_email TEXT,
+        epic_patient_id TEXT NOT NULL,
+        epic_mrn TEXT,
+        patient_name TEXT,
+        patient_dob DATE,
+        clinical_notes TEXT,
+        diagnoses TEXT,
+        medications TEXT,
+        last_synced TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(doctor_email, epic_patient_id)
+      )
+      """,
+      """
+      CREATE TABLE IF NOT EXISTS patient_files (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        doctor_email TEXT NOT NULL,
+        patient_email TEXT NOT NULL,
+        file_type TEXT NOT NULL CHECK (file_type IN ('file', 'video')),
+        file_url TEXT NOT NULL,
+        file_name TEXT,
+        extracted_text TEXT,
+        case_key TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+      )
+      """,
+      "CREATE INDEX IF NOT EXISTS idx_patient_files_email ON patient_files(patient_email)",
+      "CREATE INDEX IF NOT EXISTS idx_patient_files_case_key ON patient_files(case_key)",
+      "CREATE INDEX IF NOT EXISTS idx_epic_patient_email ON epic_patient_data(patient_email)",
+    ),
+  ),
+  Migration(
+    version=2,
+    name="hot_query_indexes",
+    sqlite=(
+      "CREATE INDEX IF NOT EXISTS idx_patient_files_type_case_created"
+      " ON patient_files(file_type, case_key, created_at DESC)",
+      "CREATE INDEX IF NOT EXISTS idx_patient_files_email_type_created"
+      " ON patient_files(patient_email, file_type, created_at DESC)",
+      "CREATE INDEX IF NOT EXISTS idx_epic_patient_email_created"
+      " ON epic_patient_data(patient_email, created_at DESC)",
+      # Both are left-prefixes of the composite indexes above.
+      "DROP INDEX IF EXISTS idx_patient_files_email",
+      "DROP INDEX IF EXISTS idx_epic_patient_email",
+      "ANALYZE",
+    ),
+    postgres=(
+      "CREATE INDEX IF NOT EXISTS idx_patient_files_type_case_created"
+      " ON patient_files(file_type, case_key, created_at DESC)",
+      "CREATE INDEX IF NOT EXISTS idx_patient_files_email_type_created"
+      " ON patient_files(patient_email, file_type, created_at DESC)",
+      "CREATE INDEX IF NOT EXISTS idx_epic_patient_email_created"
+      " ON epic_patient_data(patient_email, created_at DESC)",
+      "ANALYZE patient_files",
+      "ANALYZE epic_patient_data",
+    ),
+  ),
+  Migration(
+    version=3,
+    name="epic_clinical_projection",
+    sqlite=(
+      """
+      CREATE TABLE IF NOT EXISTS epic_diagnoses (
+        epic_patient_data_id INTEGER NOT NULL REFERENCES epic_patient_data(id) ON DELETE CASCADE,
+        position INTEGER NOT NULL,
+        patient_email TEXT,
+        code TEXT,
+        display TEXT,
+        clinical_status TEXT,
+        PRIMARY KEY (epic_patient_data_id, position)
+      ) WITHOUT ROWID
+      """,
+      """
+      CREATE TABLE IF NOT EXISTS epic_medications (
+        epic_patient_data_id INTEGER NOT NULL REFERENCES epic_patient_data(id) ON DELETE CASCADE,
+        position INTEGER NOT NULL,
+        patient_email TEXT,
+        code TEXT,
+        name TEXT,
+        status TEXT,
+        PRIMARY KEY (epic_patient_data_id, position)
+      ) WITHOUT ROWID
+      """,
+      "CREATE INDEX IF NOT EXISTS idx_epic_diagnoses_code ON epic_diagnoses(code, patient_email)",
+      "CREATE INDEX IF NOT EXISTS idx_epic_medications_code ON epic_medications(code, patient_email)",
+      # The JSON columns stay the source of truth; triggers keep the projection in step with every writer.
+      f"""
+      CREATE TRIGGER IF NOT EXISTS trg_epic_patient_data_project_insert
+      AFTER INSERT ON epic_patient_data
+      BEGIN
+        {_SQLITE_PROJECT_EPIC_ROW}
+      END
+      """,
+      f"""
+      CREATE TRIGGER IF NOT EXISTS trg_epic_patient_data_project_update
+      AFTER UPDATE OF diagnoses, medications, patient_email ON epic_patient_data
+      BEGIN
+        DELETE FROM epic_diagnoses WHERE epic_patient_data_id = OLD.id;
+        DELETE FROM epic_medications WHERE epic_patient_data_id = OLD.id;
+        {_SQLITE_PROJECT_EPIC_ROW}
+      END
+      """,
+      """
+      CREATE TRIGGER IF NOT EXISTS trg_epic_patient_data_project_delete
+      AFTER DELETE ON epic_patient_data
+      BEGIN
+        DELETE FROM epic_diagnoses WHERE epic_patient_data_id = OLD.id;
+        DELETE FROM epic_medications WHERE epic_patient_data_id = OLD.id;
+      END
+      """,
+      # Backfill existing rows through the update trigger.
+      "UPDATE epic_patient_data SET diagnoses = diagnoses",
+    ),
+    postgres=(
+      """
+      CREATE TABLE IF NOT EXISTS epic_diagnoses (
+        epic_patient_data_id INTEGER NOT NULL REFERENCES epic_patient_data(id) ON DELETE CASCADE,
+        position INTEGER NOT NULL,
+        patient_email TEXT,
+        code TEXT,
+        display TEXT,
+        clinical_status TEXT,
+        PRIMARY KEY (epic_patient_data_id, position)
+      )
+      """,
+      """
+      CREATE TABLE IF NOT EXISTS epic_medications (
+        epic_patient_data_id INTEGER NOT NULL REFERENCES epic_patient_data(id) ON DELETE CASCADE,
+        position INTEGER NOT NULL,
+        patient_email TEXT,
+        code TEXT,
+        name TEXT,
+        status TEXT,
+        PRIMARY KEY (epic_patient_data_id, position)
+      )
+      """,
+      "CREATE INDEX IF NOT EXISTS idx_epic_diagnoses_code ON epic_diagnoses(code, patient_email)",
+      "CREATE INDEX IF NOT EXISTS idx_epic_medications_code ON epic_medications(code, patient_email)",
+      """
+      CREATE OR REPLACE FUNCTION epic_json_array(value JSONB) RETURNS JSONB AS $$
+      BEGIN
+        -- The frontend stores JSON.stringify() output, i.e. a JSON string wrapping the array.
+        IF jsonb_typeof(value) = 'string' THEN
+          value := (value #>> '{}')::jsonb;
+        END IF;
+        RETURN CASE WHEN jsonb_typeof(value) = 'array' THEN value ELSE '[]'::jsonb END;
+      EXCEPTION WHEN others THEN
+        RETURN '[]'::jsonb;
+      END;
+      $$ LANGUAGE plpgsql IMMUTABLE
+      """,
+      """
+      CREATE OR REPLACE FUNCTION project_epic_patient_data() RETURNS trigger AS $$
+      BEGIN
+        DELETE FROM epic_diagnoses WHERE epic_patient_data_id = NEW.id;
+        DELETE FROM epic_medications WHERE epic_patient_data_id = NEW.id;
+        INSERT INTO epic_diagnoses (epic_patient_data_id, position, patient_email, code, display, clinical_status)
+        SELECT NEW.id, e.ordinality - 1, NEW.patient_email, e.value->>'code', e.value->>'display', e.value->>'clinicalStatus'
+        FROM jsonb_array_elements(epic_json_array(NEW.diagnoses)) WITH ORDINALITY AS e(value, ordinality);
+        INSERT INTO epic_medications (epic_patient_data_id, position, patient_email, code, name, status)
+        SELECT NEW.id, e.ordinality - 1, NEW.patient_email, e.value->>'code', COALESCE(e.value->>'name', e.value->>'display'), e.value->>'status'
+        FROM jsonb_array_elements(epic_json_array(NEW.medications)) WITH ORDINALITY AS e(value, ordinality);
+        RETURN NEW;
+      END;
+      $$ LANGUAGE plpgsql
+      """,
+      "DROP TRIGGER IF EXISTS trg_epic_patient_data_project ON epic_patient_data",
+      """
+      CREATE TRIGGER trg_epic_patient_data_project
+      AFTER INSERT OR UPDATE OF diagnoses, medications, patient_email ON epic_patient_data
+      FOR EACH ROW EXECUTE FUNCTION project_epic_patient_data()
+      """,
+      "UPDATE epic_patient_data SET diagnoses = diagnoses",
+      "GRANT ALL ON epic_diagnoses, epic_medications TO anon, authenticated",
+    ),
+  ),
+  Migration(
+    version=4,
+    name="patient_files_full_text_search",
+    sqlite=(
+      # Per-patient token so MATCH can intersect with the owner's doclist instead of filtering after the fact.
+      "ALTER TABLE patient_files ADD COLUMN search_owner TEXT"
+      " GENERATED ALWAYS AS ('p' || hex(patient_email)) VIRTUAL",
+      """
+      CREATE VIRTUAL TABLE IF NOT EXISTS patient_files_fts USING fts5(
+        search_owner, file_name, extracted_text,
+        content='patient_files', content_rowid='id', tokenize='porter unicode61'
+      )
+      """,
+      """
+      CREATE TRIGGER IF NOT EXISTS trg_patient_files_fts_insert AFTER INSERT ON patient_files
+      BEGIN
+        INSERT INTO patient_files_fts (rowid, search_owner, file_name, extracted_text)
+        VALUES (NEW.id, NEW.search_owner, NEW.file_name, NEW.extracted_text);
+      END
+      """,
+      """
+      CREATE TRIGGER IF NOT EXISTS trg_patient_files_fts_delete AFTER DELETE ON patient_files
+      BEGIN
+        INSERT INTO patient_files_fts (patient_files_fts, rowid, search_owner, file_name, extracted_text)
+        VALUES ('delete', OLD.id, OLD.search_owner, OLD.file_name, OLD.extracted_text);
+      END
+      """,
+      """
+      CREATE TRIGGER IF NOT EXISTS trg_patient_files_fts_update
+      AFTER UPDATE OF patient_email, file_name, extracted_text ON patient_files
+      BEGIN
+        INSERT INTO patient_files_fts (patient_files_fts, rowid, search_owner, file_name, extracted_text)
+        VALUES ('delete', OLD.id, OLD.search_owner, OLD.file_name, OLD.extracted_text);
+        INSERT INTO patient_files_fts (rowid, search_owner, file_name, extracted_text)
+        VALUES (NEW.id, NEW.search_owner, NEW.file_name, NEW.extracted_text);
+      END
+      """,
+      "INSERT INTO patient_files_fts (patient_files_fts) VALUES ('rebuild')",
+    ),
+    postgres=(
+      "ALTER TABLE patient_files ADD COLUMN IF NOT EXISTS extracted_text TEXT",
+      """
+      ALTER TABLE patient_files ADD COLUMN IF NOT EXISTS search_vector tsvector
+      GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(file_name, '')), 'A')
+        || setweight(to_tsvector('english', coalesce(extracted_text, '')), 'B')
+      ) STORED
+      """,
+      "CREATE EXTENSION IF NOT EXISTS btree_gin",
+      "CREATE INDEX IF NOT EXISTS idx_patient_files_search"
+      " ON patient_files USING GIN (patient_email, search_vector)",
+      """
+      CREATE OR REPLACE FUNCTION search_patient_files(
+        p_patient_email TEXT, p_query TEXT, p_limit INTEGER, p_offset INTEGER
+      )
+      RETURNS TABLE (id INTEGER, file_name TEXT, file_url TEXT, created_at TIMESTAMP WITH TIME ZONE, rank REAL, snippet TEXT)
+      AS $$
+        -- Rank and page first so ts_headline only runs on the returned rows.
+        SELECT f.id, f.file_name, f.file_url, f.created_at, hits.rank,
+               ts_headline('english', coalesce(f.extracted_text, ''), hits.q,
+                           'StartSel=' || chr(2) || ', StopSel=' || chr(3) || ', MaxWords=24, MinWords=8, MaxFragments=2')
+        FROM (
+          SELECT pf.id, ts_rank_cd(pf.search_vector, q) AS rank, q
+          FROM patient_files pf, websearch_to_tsquery('english', p_query) q
+          WHERE pf.patient_email = p_patient_email AND pf.file_type = 'file' AND pf.search_vector @@ q
+          ORDER BY rank DESC, pf.id DESC
+          LIMIT p_limit OFFSET p_offset
+        ) hits
+        JOIN patient_files f ON f.id = hits.id
+        ORDER BY hits.rank DESC, f.id DESC
+      $$ LANGUAGE sql STABLE
+      """,
+      "GRANT EXECUTE ON FUNCTION search_patient_files(TEXT, TEXT, INTEGER, INTEGER) TO anon, authenticated",
+    ),
+  ),
+  Migration(
+    version=5,
+    name="patient_video_keyset_index",
+    sqlite=(
+      # Trailing id DESC lets ORDER BY created_at DESC, id DESC keyset pages walk the index without sorting.
+      "CREATE INDEX IF NOT EXISTS idx_patient_files_email_type_created_id"
+      " ON patient_files(patient_email, file_type, created_at DESC, id DESC)",
+      "DROP INDEX IF EXISTS idx_patient_files_email_type_created",
+      "ANALYZE",
+    ),
+    postgres=(
+      "CREATE INDEX IF NOT EXISTS idx_patient_files_email_type_created_id"
+      " ON patient_files(patient_email, file_type, created_at DESC, id DESC)",
+      "DROP INDEX IF EXISTS idx_patient_files_email_type_created",
+    ),
+  ),
+  Migration(
+    version=6,
+    name="generation_request_log",
+    sqlite=(
+      # One row per generation request; the demand signal for cache warming.
+      """
+      CREATE TABLE IF NOT EXISTS generation_requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        case_key TEXT NOT NULL,
+        diagnosis_code TEXT NOT NULL,
+        procedure_code TEXT NOT NULL,
+        recovery_milestone TEXT,
+        doctor_specialty TEXT,
+        reused INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+      )
+      """,
+      "CREATE INDEX IF NOT EXISTS idx_generation_requests_created ON generation_requests(created_at)",
+      # Pre-generated, patient-agnostic videos; not tied to a patient's library.
+      """
+      CREATE TABLE IF NOT EXISTS warmed_videos (
+        case_key TEXT PRIMARY KEY,
+        file_url TEXT NOT NULL,
+        diagnosis_code TEXT NOT NULL,
+        procedure_code TEXT NOT NULL,
+        recovery_milestone TEXT,
+        doctor_specialty TEXT,
+        predicted_daily_demand REAL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+      )
+      """,
+    ),
+    postgres=(
+      """
+      CREATE TABLE IF NOT EXISTS generation_requests (
+        id BIGSERIAL PRIMARY KEY,
+        case_key TEXT NOT NULL,
+        diagnosis_code TEXT NOT NULL,
+        procedure_code TEXT NOT NULL,
+        recovery_milestone TEXT,
+        doctor_specialty TEXT,
+        reused BOOLEAN NOT NULL DEFAULT FALSE,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+      )
+      """,
+      "CREATE INDEX IF NOT EXISTS idx_generation_requests_created ON generation_requests(created_at)",
+      """
+      CREATE TABLE IF NOT EXISTS warmed_videos (
+        case_key TEXT PRIMARY KEY,
+        file_url TEXT NOT NULL,
+        diagnosis_code TEXT NOT NULL,
+        procedure_code TEXT NOT NULL,
+        recovery_milestone TEXT,
+        doctor_specialty TEXT,
+        predicted_daily_demand DOUBLE PRECISION,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+      )
+      """,
+    ),
+  ),
+  Migration(
+    version=7,
+    name="video_reuse_index",
+    sqlite=(
+      # Reusable videos by normalized case parts, for hierarchical ICD-10 reuse (app.services.reuse).
+      """
+      CREATE TABLE IF NOT EXISTS video_reuse_index (
+        case_key TEXT PRIMARY KEY,
+        file_url TEXT NOT NULL,
+        metadata_id INTEGER,
+        diagnosis_code TEXT NOT NULL,
+        procedure_code TEXT NOT NULL,
+        recovery_milestone TEXT NOT NULL DEFAULT '',
+        doctor_specialty TEXT NOT NULL DEFAULT 'general',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+      )
+      """,
+      # Diagnosis code last so a code prefix is a range scan within one procedure/milestone/specialty.
+      "CREATE INDEX IF NOT EXISTS idx_video_reuse_lookup"
+      " ON video_reuse_index(procedure_code, recovery_milestone, doctor_specialty, diagnosis_code)",
+      # Backfill patient videos whose case is known from the request log, newest per case_key first.
+      """
+      INSERT OR IGNORE INTO video_reuse_index
+        (case_key, file_url, metadata_id, diagnosis_code, procedure_code, recovery_milestone, doctor_specialty, created_at)
+      SELECT pf.case_key, pf.file_url, pf.id,
+        UPPER(REPLACE(REPLACE(gr.diagnosis_code, '.', ''), ' ', '')), LOWER(TRIM(gr.procedure_code)),
+        LOWER(TRIM(COALESCE(gr.recovery_milestone, ''))), COALESCE(NULLIF(LOWER(TRIM(gr.doctor_specialty)), ''), 'general'),
+        pf.created_at
+      FROM patient_files pf
+      JOIN (SELECT case_key, MAX(id) AS id FROM generation_requests GROUP BY case_key) latest ON latest.case_key = pf.case_key
+      JOIN generation_requests gr ON gr.id = latest.id
+      WHERE pf.file_type = 'video'
+      ORDER BY pf.created_at DESC
+      """,
+      """
+      INSERT OR IGNORE INTO video_reuse_index
+        (case_key, file_url, diagnosis_code, procedure_code, recovery_milestone, doctor_specialty, created_at)
+      SELECT case_key, file_url,
+        UPPER(REPLACE(REPLACE(diagnosis_code, '.', ''), ' ', '')), LOWER(TRIM(procedure_code)),
+        LOWER(TRIM(COALESCE(recovery_milestone, ''))), COALESCE(NULLIF(LOWER(TRIM(doctor_specialty)), ''), 'general'),
+        created_at
+      FROM warmed_videos
+      """,
+      "ANALYZE",
+    ),
+    postgres=(
+      # COLLATE "C" keeps prefix range scans byte-ordered regardless of the database locale.
+      """
+      CREATE TABLE IF NOT EXISTS video_reuse_index (
+        case_key TEXT PRIMARY KEY,
+        file_url TEXT NOT NULL,
+        metadata_id BIGINT,
+        diagnosis_code TEXT COLLATE "C" NOT NULL,
+        procedure_code TEXT NOT NULL,
+        recovery_milestone TEXT NOT NULL DEFAULT '',
+        doctor_specialty TEXT NOT NULL DEFAULT 'general',
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+      )
+      """,
+      "CREATE INDEX IF NOT EXISTS idx_video_reuse_lookup"
+      " ON video_reuse_index(procedure_code, recovery_milestone, doctor_specialty, diagnosis_code)",
+      """
+      INSERT INTO video_reuse_index
+        (case_key, file_url, metadata_id, diagnosis_code, procedure_code, recovery_milestone, doctor_specialty, created_at)
+      SELECT DISTINCT ON (pf.case_key) pf.case_key, pf.file_url, pf.id,
+        UPPER(REGEXP_REPLACE(gr.diagnosis_code, '[^0-9A-Za-z]', '', 'g')), LOWER(TRIM(gr.procedure_code)),
+        LOWER(TRIM(COALESCE(gr.recovery_milestone, ''))), COALESCE(NULLIF(LOWER(TRIM(gr.doctor_specialty)), ''), 'general'),
+        pf.created_at
+      FROM patient_files pf
+      JOIN (SELECT case_key, MAX(id) AS id FROM generation_requests GROUP BY case_key) latest ON latest.case_key = pf.case_key
+      JOIN generation_requests gr ON gr.id = latest.id
+      WHERE pf.file_type = 'video'
+      ORDER BY pf.case_key, pf.created_at DESC
+      ON CONFLICT (case_key) DO NOTHING
+      """,
+      """
+      INSERT INTO video_reuse_index
+        (case_key, file_url, diagnosis_code, procedure_code, recovery_milestone, doctor_specialty, created_at)
+      SELECT case_key, file_url,
+        UPPER(REGEXP_REPLACE(diagnosis_code, '[^0-9A-Za-z]', '', 'g')), LOWER(TRIM(procedure_code)),
+        LOWER(TRIM(COALESCE(recovery_milestone, ''))), COALESCE(NULLIF(LOWER(TRIM(doctor_specialty)), ''), 'general'),
+        created_at
+      FROM warmed_videos
+      ON CONFLICT (case_key) DO NOTHING
+      """,
+    ),
+  ),
+  Migration(
+    version=8,
+    name="idempotency_keys",
+    sqlite=(
+      # Idempotency-Key state for POST /videos/generate; times are epoch seconds.
+      """
+      CREATE TABLE IF NOT EXISTS idempotency_keys (
+        key TEXT PRIMARY KEY,
+        request_hash TEXT NOT NULL,
+        status TEXT NOT NULL,
+        status_code INTEGER,
+        response TEXT,
+        job_id TEXT,
+        lease_expires_at REAL,
+        expires_at REAL NOT NULL,
+        created_at REAL NOT NULL
+      )
+      """,
+      "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys(expires_at)",
+    ),
+    postgres=(
+      """
+      CREATE TABLE IF NOT EXISTS idempotency_keys (
+        key TEXT PRIMARY KEY,
+        request_hash TEXT NOT NULL,
+        status TEXT NOT NULL,
+        status_code INTEGER,
+        response JSONB,
+        job_id TEXT,
+        lease_expires_at DOUBLE PRECISION,
+        expires_at DOUBLE PRECISION NOT NULL,
+        created_at DOUBLE PRECISION NOT NULL
+      )
+      """,
+      "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys(expires_at)",
+      # Same conditional upsert as the SQLite path; PostgREST cannot express ON CONFLICT ... WHERE.
+      """
+      CREATE OR REPLACE FUNCTION claim_idempotency_key(
+        p_key TEXT, p_request_hash TEXT, p_now DOUBLE PRECISION, p_lease_until DOUBLE PRECISION, p_expires_at DOUBLE PRECISION
+      )
+      RETURNS BOOLEAN
+      AS $$
+        WITH claimed AS (
+          INSERT INTO idempotency_keys AS k (key, request_hash, status, lease_expires_at, expires_at, created_at)
+          VALUES (p_key, p_request_hash, 'in_progress', p_lease_until, p_expires_at, p_now)
+          ON CONFLICT (key) DO UPDATE SET
+            request_hash = EXCLUDED.request_hash, status = 'in_progress', status_code = NULL, response = NULL,
+            job_id = NULL, lease_expires_at = EXCLUDED.lease_expires_at, expires_at = EXCLUDED.expires_at,
+            created_at = EXCLUDED.created_at
+          WHERE k.expires_at < p_now
+            OR (k.status = 'in_progress' AND k.lease_expires_at < p_now AND k.request_hash = EXCLUDED.request_hash)
+          RETURNING 1
+        )
+        SELECT EXISTS (SELECT 1 FROM claimed)
+      $$ LANGUAGE sql VOLATILE
+      """,
+      "GRANT EXECUTE ON FUNCTION claim_idempotency_key(TEXT, TEXT, DOUBLE PRECISION, DOUBLE PRECISION, DOUBLE PRECISION)"
+      " TO anon, authenticated",
+    ),
+  ),
+  Migration(
+    version=9,
+    name="patient_files_text_revision",
+    sqlite=(
+      # Bumped whenever extracted_text changes, so cached notes digests notice in-place edits.
+      "ALTER TABLE patient_files ADD COLUMN text_revision INTEGER NOT NULL DEFAULT 0",
+      """
+      CREATE TRIGGER IF NOT EXISTS trg_patient_files_text_revision
+      AFTER UPDATE OF extracted_text ON patient_files
+      WHEN NEW.extracted_text IS NOT OLD.extracted_text
+      BEGIN
+        UPDATE patient_files SET text_revision = OLD.text_revision + 1 WHERE id = NEW.id;
+      END
+      """,
+      # Rebuilt with text_revision so the notes digest signature lookup stays index-only.
+      "DROP INDEX IF EXISTS idx_patient_files_email_type_created_id",
+      "CREATE INDEX idx_patient_files_email_type_created_id"
+      " ON patient_files(patient_email, file_type, created_at DESC, id DESC, text_revision)",
+    ),
+    postgres=(
+      "ALTER TABLE patient_files ADD COLUMN IF NOT EXISTS text_revision INTEGER NOT NULL DEFAULT 0",
+      """
+      CREATE OR REPLACE FUNCTION bump_patient_file_text_revision() RETURNS trigger AS $$
+      BEGIN
+        IF NEW.extracted_text IS DISTINCT FROM OLD.extracted_text THEN
+          NEW.text_revision := OLD.text_revision + 1;
+        END IF;
+        RETURN NEW;
+      END;
+      $$ LANGUAGE plpgsql
+      """,
+      "DROP TRIGGER IF EXISTS trg_patient_files_text_revision ON patient_files",
+      """
+      CREATE TRIGGER trg_patient_files_text_revision
+      BEFORE UPDATE OF extracted_text ON patient_files
+      FOR EACH ROW EXECUTE FUNCTION bump_patient_file_text_revision()
+      """,
+      "DROP INDEX IF EXISTS idx_patient_files_email_type_created_id",
+      "CREATE INDEX idx_patient_files_email_type_created_id"
+      " ON patient_files(patient_email, file_type, created_at DESC, id DESC, text_revision)",
+    ),
+  ),
+]
+
+
+# Queries issued on every video request, with the index each one must use.
+HOT_QUERIES: Dict[str, Tuple[str, str]] = {
+  "find_reusable_video": (
+    "SELECT * FROM patient_files WHERE file_type = ? AND case_key = ? ORDER BY created_at DESC LIMIT 1",
+    "idx_patient_files_type_case_created",
+  ),
+  "recent_patient_files": (
+    "SELECT id, created_at, text_revision FROM patient_files WHERE patient_email = ? AND file_type = ?"
+    " ORDER BY created_at DESC LIMIT ?",
+    "idx_patient_files_email_type_created_id",
+  ),
+  "patient_videos_page": (
+    "SELECT id, doctor_email, file_url, file_name, case_key, created_at FROM patient_files"
+    " WHERE patient_email = ? AND file_type = ? AND (created_at, id) < (?, ?)"
+    " ORDER BY created_at DESC, id DESC LIMIT ?",
+    "idx_patient_files_email_type_created_id",
+  ),
+  "demand_window": (
+    "SELECT case_key, diagnosis_code, procedure_code, recovery_milestone, doctor_specialty, created_at"
+    " FROM generation_requests WHERE created_at >= ?",
+    "idx_generation_requests_created",
+  ),
+  "related_videos": (
+    "SELECT case_key, file_url, metadata_id, diagnosis_code, created_at FROM video_reuse_index"
+    " WHERE procedure_code = ? AND recovery_milestone = ? AND doctor_specialty = ?"
+    " AND diagnosis_code >= ? AND diagnosis_code < ? LIMIT ?",
+    "idx_video_reuse_lookup",
+  ),
+  "latest_epic_snapshot": (
+    "SELECT * FROM epic_patient_data WHERE patient_email = ? ORDER BY created_at DESC LIMIT 1",
+    "idx_epic_patient_email_created",
+  ),
+  "patients_by_diagnosis": (
+    "SELECT DISTINCT patient_email FROM epic_diagnoses WHERE code = ?",
+    "idx_epic_diagnoses_code",
+  ),
+}
+
+
+async def current_version(conn: aiosqlite.Connection) -> int:
+  """Return the highest applied migration version (0 for a fresh database)."""
+  await conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+      version INTEGER PRIMARY KEY,
+      name TEXT NOT NULL,
+      applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+  """)
+  async with conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations") as cursor:
+    row = await cursor.fetchone()
+  return int(row[0])
+
+
+async def apply_sqlite_migrations(conn: aiosqlite.Connection) -> int:
+  """Apply pending migrations in order, one transaction each. Returns the new version."""
+  version = await current_version(conn)
+  await conn.commit()
+
+  for migration in MIGRATIONS:
+    if migration.version <= version:
+      continue
+    try:
+      # Take the write lock before re-checking, so concurrent connections apply each migration once.
+      await conn.execute("BEGIN IMMEDIATE")
+      async with conn.execute("SELECT 1 FROM schema_migrations WHERE version = ?", (migration.version,)) as cursor:
+        applied = await cursor.fetchone() is not None
+      if applied:
+        await conn.rollback()
+        version = migration.version
+        continue
+      for statement in migration.sqlite:
+        await conn.execute(statement)
+      await conn.execute(
+        "INSERT INTO schema_migrations (version, name) VALUES (?, ?)",
+        (migration.version, migration.name),
+      )
+      await conn.commit()
+    except Exception:
+      await conn.rollback()
+      raise
+    print(f"[INFO] Applied schema migration {migration.version:03d}_{migration.name}")
+    version = migration.version
+
+  return version
+
+
+async def explain_query_plan(conn: aiosqlite.Connection, query: str) -> List[str]:
+  """Return the ``EXPLAIN QUERY PLAN`` detail lines for a parameterized query."""
+  params = [None] * query.count("?")
+  async with conn.execute(f"EXPLAIN QUERY PLAN {query}", params) as cursor:
+    rows = await cursor.fetchall()
+  return [row[-1] for row in rows]
+
+
+async def check_query_plans(conn: aiosqlite.Connection) -> List[str]:
+  """Return a list of problems; empty when every hot query uses its index without sorting."""
+  problems = []
+  for name, (query, index) in HOT_QUERIES.items():
+    plan = await explain_query_plan(conn, query)
+    if not any(f"INDEX {index} " in line for line in plan):
+      problems.append(f"{name}: expected index {index}, got {plan}")
+    if any("TEMP B-TREE" in line for line in plan):
+      problems.append(f"{name}: sorts in memory: {plan}")
+  return problems
+
+
+def render_postgres_script(since: int = 0) -> str:
+  """Render the Supabase SQL for all migrations newer than ``since``."""
+  lines = [
+    "-- Generated by `python -m app.services.migrations`; run in the Supabase SQL editor.",
+    "CREATE TABLE IF NOT EXISTS schema_migrations (",
+    "  version INTEGER PRIMARY KEY,",
+    "  name TEXT NOT NULL,",
+    "  applied_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()",
+    ");",
+  ]
+  for migration in MIGRATIONS:
+    if migration.version <= since or not migration.postgres:
+      continue
+    lines.append("")
+    lines.append(f"-- {migration.version:03d}_{migration.name}")
+    lines.append("BEGIN;")
+    lines.extend(f"{statement.strip()};" for statement in migration.postgres)
+    lines.append(
+      f"INSERT INTO schema_migrations (version, name) VALUES ({migration.version}, '{migration.name}')"
+      " ON CONFLICT (version) DO NOTHING;"
+    )
+    lines.append("COMMIT;")
+  return "\n".join(lines) + "\n"
+
+
+async def _check() -> int:
+  async with aiosqlite.connect(":memory:") as conn:
+    await apply_sqlite_migrations(conn)
+    problems = await check_query_plans(conn)
+  for problem in problems:
+    print(f"[ERROR] {problem}")
+  if not problems:
+    print(f"[INFO] All {len(HOT_QUERIES)} hot queries use their indexes")
+  return 1 if problems else 0
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--check", action="store_true", help="verify hot-query plans against a fresh SQLite schema")
+  parser.add_argument("--since", type=int, default=0, help="only render Supabase migrations newer than this version")
+  args = parser.parse_args()
+  if args.check:
+    raise SystemExit(asyncio.run(_check()))
+  print(render_postgres_script(args.since), end="")
@@ -0,0 +1,145 @@
+"""Token-budgeted digest of a patient's recent clinical notes for prompt construction."""
+
+from __future__ import annotations
+
+import hashlib
+import math
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+# Rough chars-per-token ratio for English clinical prose with OpenAI tokenizers.
+CHARS_PER_TOKEN = 4
+
+# Below this many tokens a truncated section is more noise than signal.
+MIN_TRUNCATED_TOKENS = 24
+
+_HEADING = re.compile(r"^\s*(?:#+\s*\S.*|[A-Z][A-Z0-9 /&()-]{2,60}:?|[A-Z][A-Za-z0-9 /&()-]{2,60}:)\s*$")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset({"and", "the", "of", "with", "without", "for", "unspecified", "other", "type"})
+
+
+def estimate_tokens(text: str) -> int:
+  return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+@dataclass
+class _Section:
+  file_rank: int
+  order: int
+  heading: Optional[str]
+  body: str
+  score: float = 0.0
+
+  @property
+  def text(self) -> str:
+    return f"{self.heading}\n{self.body}" if self.heading else self.body
+
+
+def split_sections(text: str) -> List[Tuple[Optional[str], str]]:
+  """Split a note into (heading, body) sections on heading lines and blank-line paragraphs."""
+  sections: List[Tuple[Optional[str], str]] = []
+  heading: Optional[str] = None
+  lines: List[str] = []
+
+  def flush() -> None:
+    body = "\n".join(lines).strip()
+    if body:
+      sections.append((heading, body))
+    lines.clear()
+
+  for line in text.splitlines():
+    if _HEADING.match(line) and len(line.split()) <= 8:
+      flush()
+      heading = line.strip().lstrip("#").strip()
+    elif not line.strip():
+      flush()
+    else:
+      lines.append(line.rstrip())
+  flush()
+  return sections
+
+
+def relevance_terms(phrases: Iterable[Optional[str]]) -> List[str]:
+  """Turn diagnosis/medication names into lowercase match terms."""
+  terms = set()
+  for phrase in phrases:
+    for word in _WORD.findall((phrase or "").lower()):
+      if len(word) > 2 and word not in _STOPWORDS:
+        terms.add(word)
+  return sorted(terms)
+
+
+def _truncate(text: str, token_budget: int) -> str:
+  """Cut at the last sentence boundary that fits, falling back to a hard cut."""
+  limit = token_budget * CHARS_PER_TOKEN
+  kept = ""
+  for sentence in _SENTENCE_END.split(text):
+    candidate = f"{kept} {sentence}".strip()
+    if len(candidate) > limit:
+      break
+    kept = candidate
+  return kept or text[: max(0, limit - 1)].rstrip() + "…"
+
+
+def build_notes_digest(
+  texts: Sequence[Optional[str]],
+  *,
+  token_budget: int,
+  terms: Sequence[str] = (),
+) -> Optional[str]:
+  """Build a digest from note texts ordered newest first.
+
+  Sections are deduplicated across files, ranked by recency and by overlap
+  with ``terms``, and selected greedily until ``token_budget`` is spent. The
+  chosen sections are emitted in their original order; the first section that
+  does not fit is truncated at a sentence boundary if enough budget remains.
+  """
+  seen = set()
+  sections: List[_Section] = []
+  for file_rank, text in enumerate(texts):
+    for order, (heading, body) in enumerate(split_sections(text or "")):
+      fingerprint = hashlib.sha1(" ".join(body.lower().split()).encode("utf-8")).digest()
+      if fingerprint in seen:
+        continue
+      seen.add(fingerprint)
+      sections.append(_Section(file_rank=file_rank, order=order, heading=heading, body=body))
+
+  if not sections:
+    return None
+
+  term_set = set(terms)
+  for section in sections:
+    words = _WORD.findall(section.text.lower())
+    hits = sum(1 for word in words if word in term_set)
+    recency = 1.0 / (1 + section.file_rank)
+    relevance = hits / math.sqrt(len(words) or 1)
+    section.score = recency + relevance
+
+  remaining = token_budget
+  chosen: List[_Section] = []
+  for section in sorted(sections, key=lambda s: (-s.score, s.file_rank, s.order)):
+    cost = estimate_tokens(section.text)
+    if cost <= remaining:
+      chosen.append(section)
+      remaining -= cost
+    elif remaining >= MIN_TRUNCATED_TOKENS:
+      heading_cost = estimate_tokens(section.heading or "")
+      body = _truncate(section.body, remaining - heading_cost - 1)
+      chosen.append(_Section(section.file_rank, section.order, section.heading, body))
+      remaining = 0
+    if remaining < MIN_TRUNCATED_TOKENS:
+      break
+
+  chosen.sort(key=lambda s: (s.file_rank, s.order))
+  return "\n\n".join(section.text for section in chosen) or None
+
+
+def digest_signature(files: Sequence[Dict[str, Any]], *, token_budget: int, terms: Sequence[str]) -> str:
+  """Fingerprint of the inputs a digest depends on; a new, replaced or edited file changes it."""
+  parts = [f"{file.get('id')}@{file.get('created_at')}#{file.get('text_revision') or 0}" for file in files]
+  parts.append(f"budget={token_budget}")
+  parts.append("terms=" + ",".join(terms))
+  return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
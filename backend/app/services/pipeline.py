@@ -0,0 +1,481 @@
+"""Video generation pipeline shared by the synchronous route and the job workers.
+
+The pipeline records its progress in a plain ``state`` dict and reports each
+completed stage through ``checkpoint``. Passing a previously checkpointed
+state back in resumes after the last completed stage; in particular a job
+that already has a HeyGen ``video_id`` goes straight back to polling.
+
+Each run is a ``StageGraph`` (see ``app.services.stage_graph``): a stage
+starts as soon as the stages it needs have finished, a reuse hit cancels the
+script still being generated, ``PIPELINE_STAGE_TIMEOUTS`` bounds single
+stages, and every run leaves a trace in the ``TraceLog``.
+
+``notify`` receives progress that is not worth a checkpoint (context loaded,
+HeyGen's render status, upload started) for the job event stream.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from contextlib import nullcontext
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.models.requests import VideoGenerationRequest
+from app.models.responses import VideoGenerationResponse
+from app.services import recovery_plan
+from app.services.admission import AdmissionController
+from app.services.llm import LLMService
+from app.services.reuse import ReuseHierarchy, is_icd10
+from app.services.stage_graph import Finish, Stage, StageFn, StageGraph, TraceLog
+from app.services.storage import StorageService
+from app.services.supabase import PatientContext, SupabaseService
+from app.services.video_cache import VideoCache
+from app.services.video_generator import VideoGeneratorService, VideoRenderFailed
+
+
+Checkpoint = Callable[[str, Dict[str, Any]], Awaitable[None]]
+Notify = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+# Stage names of ``run`` (``warm`` uses a subset); ``PIPELINE_STAGE_TIMEOUTS`` keys must be one of these.
+PIPELINE_STAGES = ("context", "script", "reuse", "demand", "render", "store", "save")
+
+
+class VideoProviderError(RuntimeError):
+  """The video provider finished without a usable video."""
+
+
+def context_to_prompt_payload(context: PatientContext, request: VideoGenerationRequest) -> Dict[str, Any]:
+  patient = context.patient
+  doctor = context.doctor
+  diagnoses = []
+  medications = []
+
+  if context.epic_snapshot:
+    diagnoses = [entry.get("display") for entry in context.epic_snapshot.get("diagnoses", [])]
+    medications = [entry.get("name") for entry in context.epic_snapshot.get("medications", [])]
+
+  recovery_details = None
+  prior_recovery = []
+  if request.recovery_day:
+    recovery_details = recovery_plan.get_plan_for_day(request.recovery_day)
+    prior_recovery = recovery_plan.get_prior_plans(request.recovery_day)
+    if recovery_details and request.recovery_milestone:
+      recovery_details["milestone_label"] = request.recovery_milestone
+
+  payload = {
+    "patient": patient,
+    "doctor": doctor,
+    "diagnoses": list(filter(None, diagnoses)),
+    "diagnosis_entries": (context.epic_snapshot or {}).get("diagnoses", []),
+    "medications": list(filter(None, medications)),
+    "notes": context.recent_notes,
+    "recovery_plan": recovery_details,
+    "prior_recovery_context": prior_recovery,
+    "recovery_day": request.recovery_day,
+    "recovery_milestone": request.recovery_milestone,
+  }
+  return payload
+
+
+async def is_servable(file_url: str, video_cache: VideoCache) -> bool:
+  """Local ``/storage/videos`` URLs are only reusable while the file is still cached."""
+  prefix = "/storage/videos/"
+  if not file_url.startswith(prefix):
+    return True
+  if video_cache.use_read_through:
+    return True
+  try:
+    return await video_cache.contains(file_url[len(prefix):])
+  except ValueError:
+    return False
+
+
+class VideoPipeline:
+  """Runs context → script ∥ reuse check → render → store → save for one request."""
+
+  def __init__(
+    self,
+    *,
+    supabase_service: SupabaseService,
+    llm_service_factory: Callable[[], LLMService],
+    video_service_factory: Callable[[], VideoGeneratorService],
+    video_cache: VideoCache,
+    admission: Optional[AdmissionController] = None,
+    reuse_hierarchy: Optional[ReuseHierarchy] = None,
+    storage_service: Optional[StorageService] = None,
+    stage_timeouts: Optional[Dict[str, float]] = None,
+    trace_log: Optional[TraceLog] = None,
+  ) -> None:
+    self.supabase_service = supabase_service
+    self.llm_service_factory = llm_service_factory
+    self.video_service_factory = video_service_factory
+    self.video_cache = video_cache
+    self.admission = admission
+    self.reuse_hierarchy = reuse_hierarchy
+    self.storage_service = storage_service
+    self.stage_timeouts = stage_timeouts or {}
+    self.trace_log = trace_log
+
+  def _stage(self, name: str):
+    """Hold an admission slot for one stage; raises ``Overloaded`` when it is saturated."""
+    return self.admission.slot(name) if self.admission else nullcontext()
+
+  def _node(self, name: str, run: StageFn, *, after: Tuple[str, ...] = (), skip: Optional[Callable[[], bool]] = None) -> Stage:
+    return Stage(name, run, after=after, timeout=self.stage_timeouts.get(name), skip=skip)
+
+  async def _run_graph(self, stages: List[Stage], *, name: str, label: str) -> Optional[Finish]:
+    return await StageGraph(stages).run(
+      name=name,
+      label=label,
+      on_trace=self.trace_log.record if self.trace_log else None,
+    )
+
+  async def run(
+    self,
+    request: VideoGenerationRequest,
+    *,
+    state: Optional[Dict[str, Any]] = None,
+    checkpoint: Optional[Checkpoint] = None,
+    notify: Optional[Notify] = None,
+  ) -> VideoGenerationResponse:
+    """Generate (or reuse) the video for ``request``.
+
+    ``context`` feeds both ``script`` and ``reuse``, which run concurrently; a
+    reuse hit ends the run and cancels the script. Otherwise ``render`` →
+    ``store`` → ``save`` follow the script while ``demand`` is logged alongside.
+    """
+    state = state if state is not None else {}
+    supabase_service = self.supabase_service
+
+    async def reached(stage: str) -> None:
+      if checkpoint:
+        await checkpoint(stage, state)
+
+    async def emit(event: str, **data: Any) -> None:
+      if notify:
+        await notify(event, data)
+
+    async def context(_: Dict[str, Any]) -> Dict[str, Any]:
+      patient_context = await supabase_service.fetch_patient_context(request.doctor_email, request.patient_email)
+      await emit("context")
+      demand = {
+        "diagnosis_code": request.diagnosis_code,
+        "procedure_code": request.procedure_code,
+        "recovery_milestone": request.recovery_milestone,
+        "doctor_specialty": patient_context.doctor.get("specialty"),
+      }
+      return {
+        "prompt_payload": context_to_prompt_payload(patient_context, request),
+        "demand": demand,
+        "case_key": LLMService.compute_case_key(**demand),
+        "doctor_specialty": demand["doctor_specialty"],
+      }
+
+    async def script(results: Dict[str, Any]) -> None:
+      case = results["context"]
+      llm_service = self.llm_service_factory()
+      async with self._stage("llm"):
+        generated = await llm_service.generate_script(
+          case["prompt_payload"],
+          diagnosis_code=request.diagnosis_code,
+          cache=supabase_service.cache,
+        )
+      # Recorded together so a handed-off run never resumes with a case but no script.
+      state.update(script=generated, case_key=case["case_key"], doctor_specialty=case["doctor_specialty"])
+      if "demand" in case:
+        state["demand"] = case["demand"]
+      await reached("scripted")
+      await emit("script")
+
+    async def reuse(results: Dict[str, Any]) -> Optional[Finish]:
+      # A resumed run skipped ``context``; its case is in ``state``.
+      case = results["context"] or state
+      case_key = case["case_key"]
+      reusable = await supabase_service.find_reusable_video(case_key)
+      if reusable and not await is_servable(reusable["file_url"], self.video_cache):
+        # Local copy was evicted by the video cache quota; generate a fresh one.
+        reusable = None
+      if reusable:
+        await self._log_demand(case, reused=True)
+        return Finish(VideoGenerationResponse(
+          video_url=reusable["file_url"],
+          case_key=case_key,
+          reused=True,
+          metadata_id=reusable.get("id"),
+        ))
+      related = await self._find_related(request, case)
+      if related:
+        await self._log_demand(case, reused=True)
+        return Finish(VideoGenerationResponse(
+          video_url=related["file_url"],
+          case_key=related["case_key"],
+          reused=True,
+          metadata_id=related.get("metadata_id"),
+          matched_diagnosis_code=related["diagnosis_code"],
+        ))
+      return None
+
+    async def demand(_: Dict[str, Any]) -> None:
+      await self._log_demand(state, reused=False)
+
+    async def render(_: Dict[str, Any]) -> None:
+      async with self._stage("render"):
+        await self._render(
+          state,
+          reached=reached,
+          emit=emit,
+          metadata={
+            "patient_email": request.patient_email,
+            "doctor_email": request.doctor_email,
+            "diagnosis_code": request.diagnosis_code,
+            "procedure_code": request.procedure_code,
+            "recovery_milestone": request.recovery_milestone,
+          },
+        )
+
+    async def store(_: Dict[str, Any]) -> None:
+      await emit("upload")
+      await self._store(state, case_key=state["case_key"], reached=reached)
+
+    async def save(_: Dict[str, Any]) -> None:
+      # Jobs checkpointed before the specialty was recorded stay out of the reuse index.
+      case = {}
+      if "doctor_specialty" in state:
+        case = {
+          "diagnosis_code": request.diagnosis_code,
+          "procedure_code": request.procedure_code,
+          "recovery_milestone": request.recovery_milestone,
+          "doctor_specialty": state["doctor_specialty"],
+        }
+      metadata = await supabase_service.save_video_metadata(
+        doctor_email=request.doctor_email,
+        patient_email=request.patient_email,
+        file_url=state["public_url"],
+        file_name=f"{state['case_key']}.mp4",
+        case_key=state["case_key"],
+        **case,
+      )
+      state["metadata_id"] = metadata.get("id")
+      await reached("saved")
+
+    scripted = lambda: "script" in state
+    finish = await self._run_graph(
+      [
+        self._node("context", context, skip=scripted),
+        self._node("script", script, after=("context",), skip=scripted),
+        self._node("reuse", reuse, after=("context",), skip=lambda: request.force_regenerate or "video_id" in state),
+        self._node("demand", demand, after=("script", "reuse")),
+        self._node("render", render, after=("script", "reuse"), skip=lambda: "video_url" in state),
+        self._node("store", store, after=("render",), skip=lambda: "public_url" in state),
+        self._node("save", save, after=("store",), skip=lambda: "metadata_id" in state),
+      ],
+      name="generate",
+      label=f"{request.diagnosis_code}/{request.procedure_code}",
+    )
+    if finish is not None:
+      return finish.value
+    return VideoGenerationResponse(
+      video_url=state["public_url"],
+      case_key=state["case_key"],
+      reused=False,
+      metadata_id=state["metadata_id"],
+    )
+
+  async def warm(
+    self,
+    target: Dict[str, Any],
+    *,
+    state: Optional[Dict[str, Any]] = None,
+    checkpoint: Optional[Checkpoint] = None,
+    notify: Optional[Notify] = None,
+  ) -> VideoGenerationResponse:
+    """Pre-generate the patient-agnostic video for one predicted case (see ``app.services.warming``)."""
+    state = state if state is not None else {}
+    supabase_service = self.supabase_service
+    case_key = target["case_key"]
+
+    async def reached(stage: str) -> None:
+      if checkpoint:
+        await checkpoint(stage, state)
+
+    async def emit(event: str, **data: Any) -> None:
+      if notify:
+        await notify(event, data)
+
+    async def reuse(_: Dict[str, Any]) -> Optional[Finish]:
+      existing = await supabase_service.find_reusable_video(case_key)
+      if existing:
+        # Demand was met by a regular render since the warm job was queued.
+        return Finish(VideoGenerationResponse(video_url=existing["file_url"], case_key=case_key, reused=True))
+      return None
+
+    async def script(_: Dict[str, Any]) -> None:
+      prompt_payload = {
+        "patient": {},
+        "doctor": {"specialty": target.get("doctor_specialty")},
+        "diagnoses": [target["diagnosis_code"]],
+        "diagnosis_entries": [],
+        "medications": [],
+        "notes": None,
+        "recovery_milestone": target.get("recovery_milestone"),
+      }
+      llm_service = self.llm_service_factory()
+      async with self._stage("llm"):
+        state["script"] = await llm_service.generate_script(
+          prompt_payload,
+          diagnosis_code=target["diagnosis_code"],
+          cache=supabase_service.cache,
+        )
+      await reached("scripted")
+      await emit("script")
+
+    async def render(_: Dict[str, Any]) -> None:
+      async with self._stage("render"):
+        await self._render(
+          state,
+          reached=reached,
+          emit=emit,
+          metadata={key: target.get(key) for key in ("diagnosis_code", "procedure_code", "recovery_milestone")},
+        )
+
+    async def store(_: Dict[str, Any]) -> None:
+      await emit("upload")
+      await self._store(state, case_key=case_key, reached=reached)
+
+    async def save(_: Dict[str, Any]) -> None:
+      await supabase_service.save_warmed_video(
+        case_key=case_key,
+        file_url=state["public_url"],
+        diagnosis_code=target["diagnosis_code"],
+        procedure_code=target["procedure_code"],
+        recovery_milestone=target.get("recovery_milestone"),
+        doctor_specialty=target.get("doctor_specialty"),
+        predicted_daily_demand=target.get("predicted_daily_demand") or 0.0,
+      )
+      state["saved"] = True
+      await reached("saved")
+
+    scripted = lambda: "script" in state
+    finish = await self._run_graph(
+      [
+        self._node("reuse", reuse, skip=scripted),
+        self._node("script", script, skip=scripted),
+        self._node("render", render, after=("script", "reuse"), skip=lambda: "video_url" in state),
+        self._node("store", store, after=("render",), skip=lambda: "public_url" in state),
+        self._node("save", save, after=("store",), skip=lambda: "saved" in state),
+      ],
+      name="warm",
+      label=target["diagnosis_code"],
+    )
+    if finish is not None:
+      return finish.value
+    return VideoGenerationResponse(video_url=state["public_url"], case_key=case_key, reused=False)
+
+  async def _find_related(self, request: VideoGenerationRequest, case: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Closest servable video for a related diagnosis code, when hierarchical reuse applies."""
+    hierarchy = self.reuse_hierarchy
+    if hierarchy is None or "doctor_specialty" not in case or not is_icd10(request.diagnosis_code):
+      return None
+    if (request.reuse_mode or hierarchy.default_mode) != "hierarchical":
+      return None
+    min_prefix = hierarchy.min_prefix(case["doctor_specialty"])
+    if min_prefix is None:
+      return None
+    candidates = await self.supabase_service.find_related_videos(
+      case_key=case["case_key"],
+      diagnosis_code=request.diagnosis_code,
+      procedure_code=request.procedure_code,
+      recovery_milestone=request.recovery_milestone,
+      doctor_specialty=case["doctor_specialty"],
+      min_prefix=min_prefix,
+    )
+    for candidate in hierarchy.closest(request.diagnosis_code, candidates, min_prefix=min_prefix):
+      if await is_servable(candidate["file_url"], self.video_cache):
+        return candidate
+    return None
+
+  async def _log_demand(self, case: Dict[str, Any], *, reused: bool) -> None:
+    # Popped so a resumed job does not count the same request twice.
+    demand = case.pop("demand", None)
+    if demand:
+      await self.supabase_service.record_generation_request(case_key=case["case_key"], reused=reused, **demand)
+
+  async def _store(
+    self,
+    state: Dict[str, Any],
+    *,
+    case_key: str,
+    reached: Callable[[str], Awaitable[None]],
+  ) -> None:
+    """Copy the rendered video into storage and record its public URL."""
+    supabase_service = self.supabase_service
+    storage_service = self.storage_service
+    if storage_service is None:
+      supabase_client = supabase_service.client if supabase_service.use_supabase else None
+      storage_service = StorageService(
+        storage_dir=supabase_service.storage_bucket,
+        storage_bucket=supabase_service.storage_bucket,
+        supabase_client=supabase_client,
+        video_cache=self.video_cache,
+      )
+    # Handle mock videos (skip download/upload for placeholder URLs)
+    if state["mock"]:
+      # For mock videos, use a placeholder video file
+      # In production, this would be replaced with actual video from Sora
+      if not storage_service.use_supabase:
+        if not await self.video_cache.contains("demo_video.mp4"):
+          # Create an empty placeholder file (or copy from public folder)
+          placeholder = await self.video_cache.temp_path("demo_video.mp4")
+          await asyncio.to_thread(placeholder.write_bytes, b"")
+          await self.video_cache.put("demo_video.mp4", placeholder)
+      # For Supabase, we'd need to upload the demo video, but for now use a placeholder URL
+      state["public_url"] = "/storage/videos/demo_video.mp4"
+    else:
+      # Real video: download and upload to storage
+      try:
+        async with self._stage("download"):
+          state["public_url"] = await storage_service.upload_from_url(state["video_url"], case_key=case_key)
+      except Exception as e:
+        status_code = getattr(getattr(e, "response", None), "status_code", None)
+        if status_code in (403, 404, 410):
+          # Signed download URLs expire; polling the render again returns a fresh one.
+          state.pop("video_url", None)
+          await reached("submitted")
+        raise
+    await reached("stored")
+
+  async def _render(
+    self,
+    state: Dict[str, Any],
+    *,
+    reached: Callable[[str], Awaitable[None]],
+    emit: Callable[..., Awaitable[None]],
+    metadata: Dict[str, Any],
+  ) -> None:
+    """Submit the render unless a ``video_id`` is already recorded, then poll it to completion."""
+    video_service = self.video_service_factory()
+    if "video_id" not in state:
+      state["video_id"] = await video_service.submit_video(
+        script_payload=state["script"],
+        metadata=metadata,
+      )
+      await reached("submitted")
+      await emit("render", provider_status="submitted")
+
+    async def on_status(provider_status: str) -> None:
+      await emit("render", provider_status=provider_status)
+
+    try:
+      video_payload = await video_service.wait_for_video(state["video_id"], on_status=on_status)
+    except VideoRenderFailed:
+      # A failed render is final for this video_id; a retry has to submit again.
+      state.pop("video_id", None)
+      await reached("scripted")
+      raise
+
+    output_url = video_payload.get("video_url")
+    if not output_url:
+      raise VideoProviderError("Video provider did not return a video URL.")
+    state["video_url"] = output_url
+    state["mock"] = bool(video_payload.get("mock"))
+    await reached("rendered")
@@ -0,0 +1,454 @@
+"""On-demand profiling for a running process.
+
+- ``LoopLagMonitor`` measures how late a heartbeat task wakes up. A watchdog
+  thread captures the event loop thread's stack while it is blocked, so a
+  stall over the threshold is recorded together with the code that caused it
+  (a synchronous supabase-py call, a large ``json.dumps``, ...).
+- ``Profiler.capture`` profiles a time window or a single request. The
+  ``speedscope`` and ``collapsed`` formats come from a sampler that reads the
+  loop thread's stack every few milliseconds, so they show wall time on the
+  loop, idle ``select`` included. ``pstats`` runs ``cProfile`` on the loop
+  thread instead; its output loads with ``pstats.Stats`` and snakeviz.
+- ``Profiler`` also takes ``tracemalloc`` snapshots, diffs them and exports
+  them in ``tracemalloc.Snapshot.load`` format.
+
+Everything is kept in memory; only the most recent captures and snapshots are
+retained.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import cProfile
+import json
+import marshal
+import os
+import sys
+import sysconfig
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+
+PROFILE_FORMATS = {
+  "speedscope": ("application/json", "speedscope.json"),
+  "collapsed": ("text/plain; charset=utf-8", "collapsed.txt"),
+  "pstats": ("application/octet-stream", "pstats"),
+}
+
+_MAX_ARTIFACTS = 20
+_MAX_SNAPSHOTS = 5
+# Heartbeat lags kept for percentiles: a minute at the default 50 ms interval.
+_LAG_WINDOW = 1200
+
+Frame = Tuple[str, str, int]
+
+
+class ProfilerBusy(RuntimeError):
+  """Another ``pstats`` capture is running; ``cProfile`` can only profile one at a time."""
+
+
+_STDLIB = sysconfig.get_paths()["stdlib"] + os.sep
+
+
+def _short_path(filename: str) -> str:
+  marker = f"site-packages{os.sep}"
+  if marker in filename:
+    return filename.split(marker, 1)[1]
+  for root in (os.getcwd() + os.sep, _STDLIB):
+    if filename.startswith(root):
+      return filename[len(root):]
+  return filename
+
+
+def _stack(frame) -> List[Frame]:
+  """Outermost-first (function, file, first line) of a frame and its callers."""
+  stack = []
+  while frame is not None:
+    code = frame.f_code
+    stack.append((code.co_name, _short_path(code.co_filename), code.co_firstlineno))
+    frame = frame.f_back
+  stack.reverse()
+  return stack
+
+
+def _format_stack(frame, limit: int = 30) -> List[str]:
+  """Innermost-first ``file:line in function`` lines: where the thread is right now, then its callers."""
+  lines = []
+  while frame is not None and len(lines) < limit:
+    lines.append(f"{_short_path(frame.f_code.co_filename)}:{frame.f_lineno} in {frame.f_code.co_name}")
+    frame = frame.f_back
+  return lines
+
+
+class LoopLagMonitor:
+  """Records event-loop stalls longer than ``threshold`` seconds with the blocking stack."""
+
+  def __init__(self, *, threshold: float = 0.1, interval: float = 0.05, max_stalls: int = 100) -> None:
+    self.threshold = threshold
+    self.interval = interval
+    self.stalls: Deque[Dict[str, Any]] = deque(maxlen=max_stalls)
+    self.stall_count = 0
+    self.stalled_seconds = 0.0
+    self.max_lag = 0.0
+    self._lags: Deque[float] = deque(maxlen=_LAG_WINDOW)
+    self._beat = time.monotonic()
+    self._blocked_stack: Optional[List[str]] = None
+    self._lock = threading.Lock()
+    self._stop = threading.Event()
+    self._loop_thread: Optional[int] = None
+    self._task: Optional[asyncio.Task] = None
+    self._watchdog: Optional[threading.Thread] = None
+
+  @property
+  def running(self) -> bool:
+    return self._task is not None
+
+  def start(self) -> None:
+    """Start monitoring the running loop; call from a coroutine on that loop."""
+    if self._task is not None:
+      return
+    self._loop_thread = threading.get_ident()
+    self._beat = time.monotonic()
+    self._stop.clear()
+    self._task = asyncio.create_task(self._heartbeat())
+    self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+    self._watchdog.start()
+
+  async def stop(self) -> None:
+    if self._task is None:
+      return
+    self._stop.set()
+    self._task.cancel()
+    try:
+      await self._task
+    except asyncio.CancelledError:
+      pass
+    self._task = None
+    if self._watchdog is not None:
+      self._watchdog.join(timeout=1.0)
+      self._watchdog = None
+
+  async def _heartbeat(self) -> None:
+    while True:
+      started = time.monotonic()
+      await asyncio.sleep(self.interval)
+      now = time.monotonic()
+      lag = max(0.0, now - started - self.interval)
+      with self._lock:
+        self._beat = now
+        stack, self._blocked_stack = self._blocked_stack, None
+        self._lags.append(lag)
+        self.max_lag = max(self.max_lag, lag)
+        if lag < self.threshold:
+          continue
+        self.stall_count += 1
+        self.stalled_seconds += lag
+        self.stalls.append({
+          "at": time.time() - lag,
+          "lag_ms": round(lag * 1000, 1),
+          # None when the stall ended before the watchdog looked.
+          "stack": stack,
+        })
+      print(f"[WARN] Event loop blocked for {lag * 1000:.0f} ms" + (f" in {stack[0]}" if stack else ""))
+
+  def _watch(self) -> None:
+    while not self._stop.wait(self.threshold / 2):
+      with self._lock:
+        overdue = time.monotonic() - self._beat > self.interval + self.threshold
+        if not overdue or self._blocked_stack is not None:
+          continue
+      frame = sys._current_frames().get(self._loop_thread)
+      if frame is None:
+        continue
+      stack = _format_stack(frame)
+      with self._lock:
+        self._blocked_stack = stack
+
+  def snapshot(self) -> Dict[str, Any]:
+    with self._lock:
+      lags = sorted(self._lags)
+      stalls = list(self.stalls)
+
+    def percentile(q: float) -> Optional[float]:
+      return round(lags[min(len(lags) - 1, int(q * len(lags)))] * 1000, 1) if lags else None
+
+    return {
+      "running": self.running,
+      "threshold_ms": round(self.threshold * 1000),
+      "interval_ms": round(self.interval * 1000),
+      "lag_ms": {"p50": percentile(0.5), "p99": percentile(0.99), "max": round(self.max_lag * 1000, 1)},
+      "stalls": self.stall_count,
+      "stalled_seconds": round(self.stalled_seconds, 3),
+      "recent_stalls": stalls[::-1],
+    }
+
+
+class StackSampler:
+  """Counts the stacks of one thread, sampled every ``interval`` seconds from a helper thread."""
+
+  def __init__(self, thread_id: int, *, interval: float = 0.005) -> None:
+    self.thread_id = thread_id
+    self.interval = interval
+    self.samples: Counter = Counter()
+    self.started = 0.0
+    self.elapsed = 0.0
+    self._stop = threading.Event()
+    self._thread: Optional[threading.Thread] = None
+
+  def start(self) -> None:
+    self.started = time.monotonic()
+    self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+    self._thread.start()
+
+  def stop(self) -> None:
+    self._stop.set()
+    if self._thread is not None:
+      self._thread.join()
+    self.elapsed = time.monotonic() - self.started
+
+  def _run(self) -> None:
+    while not self._stop.wait(self.interval):
+      frame = sys._current_frames().get(self.thread_id)
+      if frame is not None:
+        self.samples[tuple(_stack(frame))] += 1
+
+  def collapsed(self) -> str:
+    """Brendan Gregg's folded format, as read by flamegraph.pl and speedscope."""
+    lines = []
+    for stack, count in self.samples.most_common():
+      frames = ";".join(f"{name} ({path}:{line})".replace(";", ",") for name, path, line in stack)
+      lines.append(f"{frames} {count}")
+    return "\n".join(lines) + "\n"
+
+  def speedscope(self, name: str) -> Dict[str, Any]:
+    frames: Dict[Frame, int] = {}
+    samples, weights = [], []
+    total = sum(self.samples.values())
+    weight = self.elapsed / total if total else self.interval
+    for stack, count in self.samples.items():
+      samples.append([frames.setdefault(frame, len(frames)) for frame in stack])
+      weights.append(round(count * weight, 6))
+    return {
+      "$schema": "https://www.speedscope.app/file-format-schema.json",
+      "name": name,
+      "exporter": "amma-backend",
+      "shared": {"frames": [{"name": fn, "file": path, "line": line} for fn, path, line in frames]},
+      "profiles": [
+        {
+          "type": "sampled",
+          "name": name,
+          "unit": "seconds",
+          "startValue": 0,
+          "endValue": round(sum(weights), 6),
+          "samples": samples,
+          "weights": weights,
+        }
+      ],
+    }
+
+
+@dataclass
+class Artifact:
+  id: str
+  name: str
+  format: str
+  created_at: float
+  content: bytes = field(repr=False)
+
+  @property
+  def media_type(self) -> str:
+    return PROFILE_FORMATS[self.format][0]
+
+  @property
+  def filename(self) -> str:
+    return f"{self.name}-{self.id}.{PROFILE_FORMATS[self.format][1]}"
+
+  def describe(self) -> Dict[str, Any]:
+    return {"id": self.id, "name": self.name, "format": self.format, "created_at": self.created_at, "bytes": len(self.content)}
+
+
+class Profiler:
+  """Process-wide CPU captures and tracemalloc snapshots, plus the loop lag monitor."""
+
+  def __init__(self, *, monitor: Optional[LoopLagMonitor] = None, sample_interval: float = 0.005) -> None:
+    self.monitor = monitor or LoopLagMonitor()
+    self.sample_interval = sample_interval
+    self.artifacts: "OrderedDict[str, Artifact]" = OrderedDict()
+    self.snapshots: "OrderedDict[str, Tuple[float, tracemalloc.Snapshot]]" = OrderedDict()
+    self._cprofile_active = False
+
+  @asynccontextmanager
+  async def capture(self, fmt: str, *, name: str, capture_id: Optional[str] = None) -> AsyncIterator[str]:
+    """Profile the enclosed block on this event loop; yields the id its artifact is stored under."""
+    if fmt not in PROFILE_FORMATS:
+      raise ValueError(f"Unknown profile format: {fmt}")
+    capture_id = capture_id or uuid.uuid4().hex[:12]
+    if fmt == "pstats":
+      if self._cprofile_active:
+        raise ProfilerBusy("A pstats capture is already running")
+      self._cprofile_active = True
+      profile = cProfile.Profile()
+      profile.enable()
+      try:
+        yield capture_id
+      finally:
+        profile.disable()
+        self._cprofile_active = False
+        profile.create_stats()
+        self._store(Artifact(capture_id, name, fmt, time.time(), marshal.dumps(profile.stats)))
+      return
+
+    sampler = StackSampler(threading.get_ident(), interval=self.sample_interval)
+    sampler.start()
+    try:
+      yield capture_id
+    finally:
+      # Joining the sampler thread takes at most one interval.
+      sampler.stop()
+      if fmt == "collapsed":
+        content = sampler.collapsed().encode("utf-8")
+      else:
+        content = json.dumps(sampler.speedscope(name), separators=(",", ":")).encode("utf-8")
+      self._store(Artifact(capture_id, name, fmt, time.time(), content))
+
+  async def profile_window(self, seconds: float, fmt: str) -> Artifact:
+    async with self.capture(fmt, name=f"window-{seconds:g}s") as capture_id:
+      await asyncio.sleep(seconds)
+    return self.artifacts[capture_id]
+
+  def _store(self, artifact: Artifact) -> None:
+    self.artifacts[artifact.id] = artifact
+    while len(self.artifacts) > _MAX_ARTIFACTS:
+      self.artifacts.popitem(last=False)
+
+  def start_tracing(self, frames: int = 25) -> Dict[str, Any]:
+    if not tracemalloc.is_tracing():
+      tracemalloc.start(frames)
+    return self.tracing_status()
+
+  def stop_tracing(self) -> Dict[str, Any]:
+    tracemalloc.stop()
+    self.snapshots.clear()
+    return self.tracing_status()
+
+  def tracing_status(self) -> Dict[str, Any]:
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+      "tracing": tracemalloc.is_tracing(),
+      "frames": tracemalloc.get_traceback_limit(),
+      "traced_bytes": current,
+      "peak_bytes": peak,
+      "snapshots": [{"id": key, "taken_at": taken_at} for key, (taken_at, _) in self.snapshots.items()],
+    }
+
+  async def take_snapshot(self, *, top: int = 20) -> Dict[str, Any]:
+    if not tracemalloc.is_tracing():
+      raise RuntimeError("tracemalloc is not tracing; start it first")
+
+    def take() -> Tuple[tracemalloc.Snapshot, List[Dict[str, Any]]]:
+      snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+      ))
+      return snapshot, [_stat(stat) for stat in snapshot.statistics("lineno")[:top]]
+
+    # Walking every trace takes a while on a large heap; keep it off the event loop.
+    snapshot, stats = await asyncio.to_thread(take)
+    snapshot_id = uuid.uuid4().hex[:12]
+    self.snapshots[snapshot_id] = (time.time(), snapshot)
+    while len(self.snapshots) > _MAX_SNAPSHOTS:
+      self.snapshots.popitem(last=False)
+    return {"id": snapshot_id, **self.tracing_status(), "top": stats}
+
+  def _snapshot(self, snapshot_id: str) -> tracemalloc.Snapshot:
+    if snapshot_id not in self.snapshots:
+      raise KeyError(snapshot_id)
+    return self.snapshots[snapshot_id][1]
+
+  async def diff_snapshots(self, base_id: str, snapshot_id: str, *, group_by: str = "lineno", top: int = 20) -> Dict[str, Any]:
+    base, snapshot = self._snapshot(base_id), self._snapshot(snapshot_id)
+    stats = await asyncio.to_thread(snapshot.compare_to, base, group_by)
+    return {
+      "base": base_id,
+      "snapshot": snapshot_id,
+      "size_diff_bytes": sum(stat.size_diff for stat in stats),
+      "top": [_stat(stat) for stat in stats[:top]],
+    }
+
+  async def dump_snapshot(self, snapshot_id: str) -> bytes:
+    snapshot = self._snapshot(snapshot_id)
+
+    def dump() -> bytes:
+      with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "snapshot")
+        snapshot.dump(path)
+        with open(path, "rb") as f:
+          return f.read()
+
+    return await asyncio.to_thread(dump)
+
+
+def _stat(stat) -> Dict[str, Any]:
+  frame = stat.traceback[0]
+  entry = {"location": f"{_short_path(frame.filename)}:{frame.lineno}", "size_bytes": stat.size, "count": stat.count}
+  if hasattr(stat, "size_diff"):
+    entry.update(size_diff_bytes=stat.size_diff, count_diff=stat.count_diff)
+  return entry
+
+
+class ProfileMiddleware:
+  """Profiles single requests sent with ``X-Profile: <format>`` and a valid ``X-Admin-Token``.
+
+  The capture spans the whole ASGI call, response body included; other
+  requests running on the loop at the same time show up in it too. The
+  response carries ``X-Profile-Id`` for ``GET /admin/profiles/{id}``.
+  """
+
+  def __init__(self, app, *, profiler: Callable[[], Profiler], authorize: Callable[[Optional[str]], bool]) -> None:
+    self.app = app
+    self.profiler = profiler
+    self.authorize = authorize
+
+  async def __call__(self, scope, receive, send) -> None:
+    if scope["type"] != "http":
+      await self.app(scope, receive, send)
+      return
+    headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope.get("headers", [])}
+    fmt = headers.get("x-profile")
+    if not fmt or not self.authorize(headers.get("x-admin-token")):
+      await self.app(scope, receive, send)
+      return
+    if fmt not in PROFILE_FORMATS:
+      await _plain_response(send, 400, f"X-Profile must be one of: {', '.join(PROFILE_FORMATS)}")
+      return
+
+    capture_id = uuid.uuid4().hex[:12]
+
+    async def send_with_id(message) -> None:
+      if message["type"] == "http.response.start":
+        message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", capture_id.encode("ascii"))]}
+      await send(message)
+
+    try:
+      async with self.profiler().capture(fmt, name=f"{scope['method']} {scope['path']}", capture_id=capture_id):
+        await self.app(scope, receive, send_with_id)
+    except ProfilerBusy as e:
+      await _plain_response(send, 409, str(e))
+
+
+async def _plain_response(send, status_code: int, text: str) -> None:
+  body = text.encode("utf-8")
+  await send({
+    "type": "http.response.start",
+    "status": status_code,
+    "headers": [(b"content-type", b"text/plain; charset=utf-8"), (b"content-length", str(len(body)).encode("ascii"))],
+  })
+  await send({"type": "http.response.body", "body": body})
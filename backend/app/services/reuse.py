@@ -0,0 +1,116 @@
+"""Hierarchical ICD-10 reuse.
+
+``case_key`` reuse only matches the exact diagnosis code, so E11.9 and E11.65
+never share a video. In hierarchical mode a request that misses its exact case
+may take a video rendered for a related code instead: same procedure,
+milestone and specialty, and a diagnosis code that shares at least
+``min_prefix`` leading characters once dots are dropped (E11.65 → E11.6 →
+E11 → E). The closest code wins, then the newest video.
+
+``min_prefix`` is the match depth: 4 stays within the subcategory, 3 within
+the category (the default), 1 within the chapter. Two shared characters
+(``E1``) is not an ICD-10 level and counts as the chapter. Specialties can
+require a longer prefix, or ``exact`` to never reuse across codes.
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, List, Mapping, Optional
+
+
+REUSE_MODES = ("exact", "hierarchical")
+
+_NON_CODE = re.compile(r"[^0-9A-Z]")
+# Letter, digit, alphanumeric (then up to four more); SNOMED ids are numeric and have no prefix hierarchy.
+_ICD10 = re.compile(r"^[A-Z][0-9][0-9A-Z][0-9A-Z]{0,4}$")
+# ICD-10 categories are three characters; a shorter shared prefix only shares the chapter.
+_CATEGORY_LENGTH = 3
+
+
+def normalize_code(code: Optional[str]) -> str:
+  """``"e11.65 "`` → ``"E1165"``."""
+  return _NON_CODE.sub("", (code or "").upper())
+
+
+def is_icd10(code: Optional[str]) -> bool:
+  return bool(_ICD10.match(normalize_code(code)))
+
+
+def case_parts(
+  *,
+  diagnosis_code: Optional[str],
+  procedure_code: Optional[str],
+  recovery_milestone: Optional[str] = None,
+  doctor_specialty: Optional[str] = None,
+) -> Dict[str, str]:
+  """Normalized columns of ``video_reuse_index``, matching how ``compute_case_key`` folds them."""
+  return {
+    "diagnosis_code": normalize_code(diagnosis_code),
+    "procedure_code": (procedure_code or "").strip().lower(),
+    "recovery_milestone": (recovery_milestone or "").strip().lower(),
+    "doctor_specialty": (doctor_specialty or "").strip().lower() or "general",
+  }
+
+
+def match_depth(code: str, other: str) -> int:
+  """Length of the shared ICD-10 prefix of two normalized codes."""
+  shared = 0
+  for left, right in zip(code, other):
+    if left != right:
+      break
+    shared += 1
+  return 1 if 0 < shared < _CATEGORY_LENGTH else shared
+
+
+def prefix_range(prefix: str) -> tuple[str, str]:
+  """``[low, high)`` bounds of every string starting with ``prefix``, for an index range scan."""
+  return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class ReuseHierarchy:
+  """Default reuse mode and per-specialty match depth; requests may override the mode."""
+
+  def __init__(
+    self,
+    *,
+    default_mode: str = "exact",
+    min_prefix: int = 3,
+    specialty_prefix: Optional[Mapping[str, Optional[int]]] = None,
+  ) -> None:
+    if default_mode not in REUSE_MODES:
+      raise ValueError(f"Unknown reuse mode: {default_mode}")
+    self.default_mode = default_mode
+    self.default_min_prefix = max(1, min_prefix)
+    self.specialty_prefix = {key.strip().lower(): value for key, value in (specialty_prefix or {}).items()}
+
+  def min_prefix(self, doctor_specialty: Optional[str]) -> Optional[int]:
+    """Shared prefix a related video needs for this specialty; ``None`` means exact matches only."""
+    specialty = (doctor_specialty or "").strip().lower() or "general"
+    if specialty not in self.specialty_prefix:
+      return self.default_min_prefix
+    value = self.specialty_prefix[specialty]
+    return None if value is None else max(1, value)
+
+  def closest(self, diagnosis_code: str, candidates: List[Dict[str, Any]], *, min_prefix: int) -> List[Dict[str, Any]]:
+    """Acceptable candidates, closest code first and newest first within a level."""
+    code = normalize_code(diagnosis_code)
+    ranked = []
+    for row in candidates:
+      depth = match_depth(code, row["diagnosis_code"])
+      if depth >= min_prefix:
+        ranked.append((depth, str(row.get("created_at") or ""), row))
+    ranked.sort(key=lambda item: (item[0], item[1]), reverse=True)
+    return [row for _, _, row in ranked]
+
+
+def parse_specialty_prefixes(spec: str) -> Dict[str, Optional[int]]:
+  """Parse ``"oncology=exact,endocrinology=1"`` into per-specialty match depths."""
+  depths: Dict[str, Optional[int]] = {}
+  for part in (spec or "").split(","):
+    if "=" not in part:
+      continue
+    specialty, value = part.rsplit("=", 1)
+    value = value.strip().lower()
+    depths[specialty.strip().lower()] = None if value == "exact" else int(value)
+  return depths
@@ -0,0 +1,130 @@
+"""Priority classes and per-tenant fairness for video generation.
+
+Every generation runs under a ``Ticket``: its priority class and its tenant
+(the requesting doctor, or their email domain as a stand-in for the clinic).
+Both the admission stage queues and ``JobQueue.claim`` pick the next waiter
+with ``FairPolicy``:
+
+1. lowest class level: the class rank, raised one level for every
+   ``aging_seconds`` spent waiting so background work always progresses;
+2. then the tenant holding the fewest slots relative to its weight, so one
+   clinic's bulk batch cannot crowd out everyone else;
+3. then the longest waiting.
+"""
+
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, Iterator, Mapping, Optional, Sequence, TypeVar
+
+
+PRIORITY_CLASSES = ("interactive", "recovery", "warming")
+INTERACTIVE = PRIORITY_CLASSES.index("interactive")
+
+
+def priority_rank(name: str) -> int:
+  try:
+    return PRIORITY_CLASSES.index(name)
+  except ValueError:
+    raise ValueError(f"Unknown priority class: {name!r}") from None
+
+
+def tenant_for(doctor_email: Optional[str], mode: str = "doctor") -> str:
+  """Fairness key for a request: the doctor, or with ``mode="domain"`` their clinic's email domain."""
+  email = (doctor_email or "").strip().lower()
+  if not email:
+    return "anonymous"
+  if mode == "domain" and "@" in email:
+    return email.rsplit("@", 1)[1]
+  return email
+
+
+@dataclass(frozen=True)
+class Ticket:
+  priority: str = "interactive"
+  tenant: str = "anonymous"
+
+  @property
+  def rank(self) -> int:
+    return priority_rank(self.priority)
+
+
+_current_ticket: ContextVar[Ticket] = ContextVar("generation_ticket", default=Ticket())
+
+
+def current_ticket() -> Ticket:
+  return _current_ticket.get()
+
+
+@contextmanager
+def scheduled_as(ticket: Ticket) -> Iterator[Ticket]:
+  """Run the enclosed generation (and every stage slot it takes) under ``ticket``."""
+  token = _current_ticket.set(ticket)
+  try:
+    yield ticket
+  finally:
+    _current_ticket.reset(token)
+
+
+@dataclass
+class Candidate:
+  """Something waiting to be scheduled; ``item`` is what the caller gets back."""
+
+  rank: int
+  tenant: str
+  since: float
+  item: object = None
+
+
+C = TypeVar("C", bound=Candidate)
+
+
+class FairPolicy:
+  def __init__(
+    self,
+    *,
+    aging_seconds: float = 300.0,
+    weights: Optional[Mapping[str, float]] = None,
+    tenant_mode: str = "doctor",
+  ) -> None:
+    if tenant_mode not in ("doctor", "domain"):
+      raise ValueError(f"Unknown tenant mode: {tenant_mode}")
+    self.aging_seconds = aging_seconds
+    self.weights = dict(weights or {})
+    self.tenant_mode = tenant_mode
+
+  def tenant(self, doctor_email: Optional[str]) -> str:
+    return tenant_for(doctor_email, self.tenant_mode)
+
+  def weight(self, tenant: str) -> float:
+    return max(self.weights.get(tenant, 1.0), 1e-6)
+
+  def level(self, candidate: Candidate, now: float) -> int:
+    if self.aging_seconds <= 0:
+      return candidate.rank
+    return max(0, candidate.rank - int((now - candidate.since) // self.aging_seconds))
+
+  def pick(self, candidates: Sequence[C], held: Mapping[str, int], *, now: Optional[float] = None) -> Optional[C]:
+    """Return the candidate to run next given how many slots each tenant already holds."""
+    if not candidates:
+      return None
+    now = time.time() if now is None else now
+    return min(
+      candidates,
+      key=lambda c: (self.level(c, now), held.get(c.tenant, 0) / self.weight(c.tenant), c.since),
+    )
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+  """Parse ``"clinic-a.org=3,dr.who@x.org=0.5"`` into tenant weights."""
+  weights: Dict[str, float] = {}
+  for part in (spec or "").split(","):
+    if "=" not in part:
+      continue
+    tenant, value = part.rsplit("=", 1)
+    weights[tenant.strip().lower()] = float(value)
+  return weights
+
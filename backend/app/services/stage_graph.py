@@ -0,0 +1,235 @@
+"""Run a small dependency graph of async stages with as much overlap as it allows.
+
+Each ``Stage`` names the stages it runs ``after`` and starts as soon as they
+have finished, so independent branches run concurrently. Stages receive the
+results of the stages before them.
+
+- ``skip`` lets a resumed run pass over work it already recorded.
+- ``timeout`` bounds one stage and raises ``StageTimeout``. The request
+  deadline (``app.services.deadline``) bounds every stage as well and
+  raises ``DeadlineExceeded``.
+- A stage that returns ``Finish(value)`` ends the run with that value. Every
+  stage still running or waiting is cancelled, since nothing needs it any
+  more.
+- Any other error cancels the rest and propagates.
+
+Every run produces a ``Trace``: when each stage started and ended relative to
+the run, and how it ended.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from app.services.deadline import DeadlineExceeded, current_deadline, expired
+
+
+StageFn = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class StageTimeout(TimeoutError):
+  """A stage ran longer than its ``timeout``."""
+
+  def __init__(self, stage: str, timeout: float) -> None:
+    super().__init__(f"Stage {stage} did not finish within {timeout:g}s")
+    self.stage = stage
+    self.timeout = timeout
+
+
+@dataclass
+class Stage:
+  name: str
+  run: StageFn
+  after: Tuple[str, ...] = ()
+  timeout: Optional[float] = None
+  skip: Optional[Callable[[], bool]] = None
+
+
+@dataclass
+class Finish:
+  """Returned by a stage to end the run early with ``value``."""
+
+  value: Any
+
+
+@dataclass
+class Span:
+  stage: str
+  # pending | ok | finish | skipped | cancelled | timeout | deadline | failed
+  status: str = "pending"
+  start_ms: Optional[float] = None
+  end_ms: Optional[float] = None
+  error: Optional[str] = None
+
+
+@dataclass
+class Trace:
+  name: str
+  label: Optional[str]
+  started_at: float
+  duration_ms: float = 0.0
+  # completed | finished (a stage ended it early) | failed | cancelled
+  outcome: str = "completed"
+  spans: List[Span] = field(default_factory=list)
+
+  def describe(self) -> Dict[str, Any]:
+    return asdict(self)
+
+  def summary(self) -> str:
+    """``context 0-14ms, script 14-920ms cancelled, reuse 14-19ms finish``."""
+    parts = []
+    for span in self.spans:
+      if span.start_ms is None:
+        parts.append(f"{span.stage} {span.status}")
+        continue
+      part = f"{span.stage} {span.start_ms:.0f}-{span.end_ms:.0f}ms"
+      parts.append(part if span.status == "ok" else f"{part} {span.status}")
+    return ", ".join(parts)
+
+
+class TraceLog:
+  """The most recent traces, newest last."""
+
+  def __init__(self, size: int = 100) -> None:
+    self._traces: Deque[Trace] = deque(maxlen=max(1, size))
+
+  def record(self, trace: Trace) -> None:
+    self._traces.append(trace)
+    label = f" {trace.label}" if trace.label else ""
+    print(f"[INFO] Pipeline {trace.name}{label} {trace.outcome} in {trace.duration_ms:.0f} ms: {trace.summary()}")
+
+  def recent(self, limit: Optional[int] = None) -> List[Trace]:
+    traces = list(self._traces)
+    return traces[-limit:] if limit else traces
+
+
+def parse_stage_timeouts(spec: str) -> Dict[str, float]:
+  """Parse ``"script=120,render=1800"`` into seconds per stage."""
+  timeouts: Dict[str, float] = {}
+  for part in (spec or "").split(","):
+    if "=" not in part:
+      continue
+    stage, value = part.rsplit("=", 1)
+    timeouts[stage.strip().lower()] = float(value)
+  return timeouts
+
+
+class StageGraph:
+  def __init__(self, stages: Iterable[Stage]) -> None:
+    self.stages = list(stages)
+    names = [stage.name for stage in self.stages]
+    if len(set(names)) != len(names):
+      raise ValueError(f"Duplicate stage names: {names}")
+    # Dependencies must be declared first, which also rules out cycles.
+    seen = set()
+    for stage in self.stages:
+      missing = [dep for dep in stage.after if dep not in seen]
+      if missing:
+        raise ValueError(f"Stage {stage.name} runs after undeclared stage(s) {missing}")
+      seen.add(stage.name)
+
+  async def run(
+    self,
+    *,
+    name: str = "run",
+    label: Optional[str] = None,
+    on_trace: Optional[Callable[[Trace], None]] = None,
+  ) -> Optional[Finish]:
+    """Run every stage; return the ``Finish`` that ended the run early, else ``None``."""
+    trace = Trace(name=name, label=label, started_at=time.time())
+    spans = {stage.name: Span(stage.name) for stage in self.stages}
+    trace.spans = list(spans.values())
+    started = time.perf_counter()
+    elapsed = lambda: (time.perf_counter() - started) * 1000
+
+    results: Dict[str, Any] = {}
+    launched = set()
+    running: Dict[asyncio.Task, Stage] = {}
+    try:
+      while True:
+        # Declaration order puts dependencies first, so one pass also launches what a skip unblocks.
+        for stage in self.stages:
+          if stage.name in launched or not all(dep in results for dep in stage.after):
+            continue
+          launched.add(stage.name)
+          if stage.skip is not None and stage.skip():
+            spans[stage.name].status = "skipped"
+            results[stage.name] = None
+            continue
+          spans[stage.name].start_ms = elapsed()
+          running[asyncio.create_task(self._call(stage, results))] = stage
+        if not running:
+          return None
+
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+          stage = running.pop(task)
+          span = spans[stage.name]
+          span.end_ms = elapsed()
+          try:
+            value = task.result()
+          except StageTimeout as e:
+            span.status, span.error = "timeout", str(e)
+            raise
+          except DeadlineExceeded as e:
+            span.status, span.error = "deadline", str(e)
+            raise
+          except Exception as e:
+            span.status, span.error = "failed", f"{type(e).__name__}: {e}"
+            raise
+          if isinstance(value, Finish):
+            span.status = "finish"
+            trace.outcome = "finished"
+            return value
+          span.status = "ok"
+          results[stage.name] = value
+    except asyncio.CancelledError:
+      trace.outcome = "cancelled"
+      raise
+    except Exception:
+      trace.outcome = "failed"
+      raise
+    finally:
+      for task, stage in running.items():
+        span = spans[stage.name]
+        span.end_ms = elapsed()
+        if not task.done():
+          task.cancel()
+          span.status = "cancelled"
+        else:
+          # Finished alongside the stage that ended the run.
+          span.status = "failed" if task.cancelled() or task.exception() else "ok"
+      if running:
+        await asyncio.gather(*running, return_exceptions=True)
+      for span in trace.spans:
+        if span.status == "pending":
+          span.status = "cancelled"
+      trace.duration_ms = elapsed()
+      if on_trace is not None:
+        on_trace(trace)
+
+  @staticmethod
+  async def _call(stage: Stage, results: Dict[str, Any]) -> Any:
+    deadline = current_deadline()
+    if stage.timeout is not None:
+      stage_deadline = asyncio.get_running_loop().time() + stage.timeout
+      if deadline is None or stage_deadline < deadline:
+        deadline = stage_deadline
+    if deadline is None:
+      return await stage.run(results)
+    try:
+      async with asyncio.timeout_at(deadline) as scope:
+        return await stage.run(results)
+    except DeadlineExceeded:
+      raise
+    except Exception as e:
+      if expired():
+        # Includes calls whose own timeout was clipped to the deadline and fired first.
+        raise DeadlineExceeded(f"stage {stage.name}") from e
+      if isinstance(e, TimeoutError) and scope.expired():
+        raise StageTimeout(stage.name, stage.timeout) from None
+      raise
@@ -1,10 +1,19 @@
 import asyncio
+import hashlib
 import os
+import shutil
+import time
 import uuid
 from pathlib import Path
 from typing import Optional
 
-import httpx
+from app.services.container import http_session
+from app.services.deadline import bounded
+from app.services.video_cache import VideoCache
+
+
+# A partial file nobody has written to for this long belongs to a download whose process died.
+_ORPHANED_PARTIAL_AGE = 300
 
 
 class StorageService:
@@ -15,38 +24,53 @@ class StorageService:
     storage_dir: str = "storage",
     storage_bucket: str = "patient-files",
     supabase_client=None,
+    video_cache: Optional[VideoCache] = None,
+    http_client=None,
   ) -> None:
     self.storage_dir = Path(storage_dir)
     self.storage_bucket = storage_bucket
     self._supabase = supabase_client
     self.use_supabase = supabase_client is not None
+    self.video_cache = video_cache
+    self._http = http_client
+    self.videos_dir = video_cache.directory if video_cache else self.storage_dir / "videos"
+    # Interrupted downloads are kept here and resumed with a Range request.
+    self.partial_dir = (video_cache.directory.parent if video_cache else self.storage_dir) / "partial"
     
     if not self.use_supabase:
       # Local storage setup
-      self.videos_dir = self.storage_dir / "videos"
       self.videos_dir.mkdir(parents=True, exist_ok=True)
 
   async def upload_from_url(self, source_url: str, *, case_key: str) -> str:
     """Download a video from URL and upload to storage (Supabase or local)."""
     filename = f"{case_key}-{uuid.uuid4().hex}.mp4"
     
-    # Download the video first
-    async with httpx.AsyncClient(timeout=120) as client:
-      response = await client.get(source_url)
-      response.raise_for_status()
-      video_data = response.content
+    # Download the video first, straight to disk
+    downloaded = await self._download(source_url)
+    try:
+      return await self._store(downloaded, filename)
+    finally:
+      # Consumed by the cache on success; an upload that failed midway leaves it behind.
+      await asyncio.to_thread(downloaded.unlink, missing_ok=True)
 
+  async def _store(self, downloaded: Path, filename: str) -> str:
     if self.use_supabase:
-      # Upload to Supabase Storage
-      file_path = f"videos/{filename}"
+      # Upload to Supabase Storage, under the prefix the video cache reads through from
+      file_path = f"{self.video_cache.object_prefix if self.video_cache else 'videos/'}{filename}"
       try:
-        # Upload file to Supabase Storage bucket
+        # Upload file to Supabase Storage bucket; a path argument is streamed from disk
         upload_res = self._supabase.storage.from_(self.storage_bucket).upload(
           file_path,
-          video_data,
+          str(downloaded),
           file_options={"content-type": "video/mp4", "upsert": "false"}
         )
-        
+
+        if self.video_cache:
+          # Served through /storage/videos so playback hits the local cache; the bucket copy is the origin.
+          await self.video_cache.put(filename, downloaded)
+          print(f"[INFO] Video uploaded to Supabase Storage: {file_path}")
+          return f"/storage/videos/{filename}"
+
         # Get public URL
         url_data = self._supabase.storage.from_(self.storage_bucket).get_public_url(file_path)
         public_url = url_data if isinstance(url_data, str) else url_data.get("publicUrl", url_data)
@@ -54,13 +78,71 @@ class StorageService:
         return public_url
       except Exception as e:
         print(f"[ERROR] Supabase upload failed: {e}, falling back to local storage")
-        # Fall back to local storage on error
-        self.use_supabase = False
-        self.videos_dir = self.storage_dir / "videos"
-        self.videos_dir.mkdir(parents=True, exist_ok=True)
+        # Fall back to local storage for this upload only; the service is shared across requests.
+        await asyncio.to_thread(self.videos_dir.mkdir, parents=True, exist_ok=True)
     
-    # Local storage fallback
-    file_path = self.videos_dir / filename
-    await asyncio.to_thread(file_path.write_bytes, video_data)
+    # Local storage fallback; the cache keeps storage/videos under its byte quota.
+    if self.video_cache:
+      await self.video_cache.put(filename, downloaded)
+      return f"/storage/videos/{filename}"
+    await asyncio.to_thread(shutil.move, downloaded, self.videos_dir / filename)
     return f"/storage/videos/{filename}"
 
+  async def _download(self, source_url: str) -> Path:
+    """Stream ``source_url`` into a partial file, resuming from a previous attempt if one exists.
+
+    Returns the completed file; the caller moves it into storage.
+    """
+    key = hashlib.sha1(source_url.encode("utf-8")).hexdigest()
+    partial_path = await asyncio.to_thread(self._claim_partial, key)
+    offset = partial_path.stat().st_size if partial_path.exists() else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+    try:
+      async with http_session(self._http) as client:
+        async with client.stream("GET", source_url, headers=headers, timeout=bounded(120, "the video download")) as response:
+          if response.status_code == 416:
+            # Nothing left to fetch: the previous attempt had already finished.
+            pass
+          else:
+            response.raise_for_status()
+            resumed = response.status_code == 206
+            if offset:
+              print(f"[INFO] {'Resuming' if resumed else 'Restarting'} download at byte {offset if resumed else 0}")
+            with open(partial_path, "ab" if resumed else "wb") as handle:
+              async for chunk in response.aiter_bytes(1024 * 1024):
+                await asyncio.to_thread(handle.write, chunk)
+    except BaseException:
+      # Hand what we have to the next attempt.
+      if partial_path.exists():
+        await asyncio.to_thread(os.replace, partial_path, self.partial_dir / f"{key}.part")
+      raise
+
+    return partial_path
+
+  def _claim_partial(self, key: str) -> Path:
+    """Take over the resumable partial file of a URL under a name unique to this download.
+
+    ``{key}.part`` holds an interrupted download until the next attempt
+    renames it away. The rename is atomic, so two concurrent downloads of one
+    URL never write to the same file: one resumes, the other starts over.
+    Files of downloads whose process died are picked up once they go stale.
+    """
+    self.partial_dir.mkdir(parents=True, exist_ok=True)
+    claimed = self.partial_dir / f"{key}.{uuid.uuid4().hex}.part"
+    stale_before = time.time() - _ORPHANED_PARTIAL_AGE
+    orphans = []
+    for path in self.partial_dir.glob(f"{key}.*.part"):
+      try:
+        stat = path.stat()
+      except FileNotFoundError:
+        continue
+      if stat.st_mtime < stale_before:
+        orphans.append((stat.st_size, path))
+    for candidate in [self.partial_dir / f"{key}.part"] + [path for _, path in sorted(orphans, reverse=True)]:
+      try:
+        os.replace(candidate, claimed)
+        return claimed
+      except FileNotFoundError:
+        continue
+    return claimed
@@ -1,9 +1,58 @@
 import asyncio
+import html
 import json
+import re
 from dataclasses import dataclass
-from typing import Any, Dict, Optional
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
 
-from app.services.database import LocalDatabase
+from app.services.cache import CacheBackend, MemoryCache
+from app.services.database import LocalDatabase, LocalDatabasePool
+from app.services.notes_digest import build_notes_digest, digest_signature, relevance_terms
+from app.services.reuse import case_parts, is_icd10, prefix_range
+
+
+# Snapshot columns read per request; the raw diagnoses/medications JSON is served from the projection tables.
+_EPIC_SNAPSHOT_COLUMNS = (
+  "id, doctor_email, patient_email, epic_patient_id, epic_mrn, patient_name, "
+  "patient_dob, clinical_notes, last_synced, created_at"
+)
+
+
+# Fallback for services built outside a request (scripts, warm-up); the app injects CACHE_URL's backend.
+_process_cache = MemoryCache()
+
+# Digests are keyed by their input signature and never go stale; the TTL only reclaims orphans.
+NOTES_DIGEST_TTL = 24 * 3600
+# Bounds how long a video inserted outside this service (e.g. by the frontend) stays invisible to reuse.
+REUSE_LOOKUP_TTL = 60
+# Misses are only invalidated by this process's own saves; elsewhere a stale miss means a duplicate render.
+REUSE_MISS_TTL = 2
+
+# Upper bound on related videos scanned per hierarchical lookup; one category of one case rarely has more.
+RELATED_LOOKUP_LIMIT = 200
+
+# Video library projection; never ships extracted_text.
+_VIDEO_LIBRARY_COLUMNS = "id, doctor_email, file_url, file_name, case_key, created_at"
+
+# Snippet highlight markers: control characters that cannot collide with escaped note text.
+_MARK_START, _MARK_END = "\x02", "\x03"
+_SEARCH_TERM = re.compile(r"\w+", re.UNICODE)
+
+
+def _fts_match_expression(patient_email: str, query: str) -> Optional[str]:
+  """Build an FTS5 MATCH expression scoped to one patient; user input is quoted term by term."""
+  terms = _SEARCH_TERM.findall(query)
+  if not terms:
+    return None
+  owner = "p" + patient_email.encode("utf-8").hex().upper()
+  return f"search_owner:{owner} AND " + " AND ".join(f'"{term}"' for term in terms)
+
+
+def _highlight(snippet: Optional[str]) -> str:
+  """HTML-escape a snippet and turn the highlight markers into <mark> tags."""
+  escaped = html.escape(snippet or "")
+  return escaped.replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
 
 
 @dataclass
@@ -26,13 +75,32 @@ class SupabaseService:
     reuse_case_enabled: bool = True,
     supabase_url: str | None = None,
     supabase_key: str | None = None,
+    notes_token_budget: int = 1500,
+    notes_max_files: int = 5,
+    cache: Optional[CacheBackend] = None,
+    supabase_client=None,
+    database_pool: Optional[LocalDatabasePool] = None,
   ) -> None:
     self.storage_bucket = storage_bucket
+    self.cache = cache if cache is not None else _process_cache
     self.reuse_case_enabled = reuse_case_enabled
+    self.notes_token_budget = notes_token_budget
+    self.notes_max_files = notes_max_files
     self._connected = False
-    
+    self._pool = None
+
+    # Shared clients from the app's ServiceContainer skip the per-request setup below.
+    if supabase_client is not None:
+      self._supabase = supabase_client
+      self.use_supabase = True
+      self._db = None
+    elif database_pool is not None:
+      self._pool = database_pool
+      self.use_supabase = False
+      self._supabase = None
+      self._db = None
     # Use Supabase if credentials provided, otherwise use local SQLite
-    if supabase_url and supabase_key:
+    elif supabase_url and supabase_key:
       try:
         from supabase import create_client, Client
         self._supabase: Client = create_client(supabase_url, supabase_key)
@@ -65,17 +133,74 @@ class SupabaseService:
   async def _ensure_connected(self):
     """Ensure database connection is established."""
     if not self._connected:
-      if not self.use_supabase and self._db:
+      if self._pool is not None:
+        db = await self._pool.acquire()
+        if self._db is None:
+          self._db = db
+        else:
+          # A concurrent call connected first; keep one connection per service.
+          await self._pool.release(db)
+      elif not self.use_supabase and self._db:
         await self._db.connect()
       self._connected = True
 
   async def close(self) -> None:
-    """Close database connection."""
+    """Close database connection, or hand it back to the pool it came from."""
     if self._connected:
-      if not self.use_supabase and self._db:
+      if self._pool is not None:
+        db, self._db = self._db, None
+        await self._pool.release(db)
+      elif not self.use_supabase and self._db:
         await self._db.close()
       self._connected = False
 
+  async def bulk_upsert(
+    self,
+    table: str,
+    rows: List[Dict[str, Any]],
+    *,
+    conflict_columns: List[str],
+    batch_size: int = 500,
+  ) -> List[int]:
+    """Upsert rows in batches and return their ids (local: one transaction, Supabase: one call per batch)."""
+    await self._ensure_connected()
+
+    if not self.use_supabase:
+      return await self._db.upsert_many(table, rows, conflict_columns)
+
+    ids: List[int] = []
+    on_conflict = ",".join(conflict_columns)
+    for start in range(0, len(rows), batch_size):
+      batch = rows[start:start + batch_size]
+      res = await asyncio.to_thread(
+        self._supabase.table(table).upsert(batch, on_conflict=on_conflict).execute
+      )
+      ids.extend(row.get("id") for row in res.data or [])
+    return ids
+
+  async def fetch_epic_resources(self, doctor_email: str, epic_patient_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Stored diagnoses/medications JSON of a doctor's Epic snapshots, keyed by ``epic_patient_id``."""
+    await self._ensure_connected()
+    if not epic_patient_ids:
+      return {}
+
+    if self.use_supabase:
+      res = (
+        self._supabase.table("epic_patient_data")
+        .select("epic_patient_id, diagnoses, medications")
+        .eq("doctor_email", doctor_email)
+        .in_("epic_patient_id", epic_patient_ids)
+        .execute()
+      )
+      rows = res.data or []
+    else:
+      rows = await self._db.query(
+        "SELECT epic_patient_id, diagnoses, medications FROM epic_patient_data"
+        f" WHERE doctor_email = ? AND epic_patient_id IN ({', '.join('?' for _ in epic_patient_ids)})",
+        (doctor_email, *epic_patient_ids),
+      )
+    return {row["epic_patient_id"]: row for row in rows}
+
   async def fetch_patient_context(self, doctor_email: str, patient_email: str) -> PatientContext:
     await self._ensure_connected()
 
@@ -96,7 +221,11 @@ class SupabaseService:
 
       epic_res = (
         self._supabase.table("epic_patient_data")
-        .select("*")
+        .select(
+          f"{_EPIC_SNAPSHOT_COLUMNS}, "
+          "epic_diagnoses(position, code, display, clinical_status), "
+          "epic_medications(position, code, name, status)"
+        )
         .eq("patient_email", patient_email)
         .order("created_at", desc=True)
         .limit(1)
@@ -104,30 +233,10 @@ class SupabaseService:
       )
       epic_snapshot = None
       if epic_res.data:
-        epic_data = epic_res.data[0]
-        # Parse JSON fields
-        if epic_data.get("diagnoses"):
-          try:
-            epic_data["diagnoses"] = json.loads(epic_data["diagnoses"]) if isinstance(epic_data["diagnoses"], str) else epic_data["diagnoses"]
-          except (json.JSONDecodeError, TypeError):
-            epic_data["diagnoses"] = []
-        if epic_data.get("medications"):
-          try:
-            epic_data["medications"] = json.loads(epic_data["medications"]) if isinstance(epic_data["medications"], str) else epic_data["medications"]
-          except (json.JSONDecodeError, TypeError):
-            epic_data["medications"] = []
-        epic_snapshot = epic_data
-
-      files_res = (
-        self._supabase.table("patient_files")
-        .select("*")
-        .eq("patient_email", patient_email)
-        .eq("file_type", "file")
-        .order("created_at", desc=True)
-        .limit(5)
-        .execute()
-      )
-      recent_files = files_res.data or []
+        epic_snapshot = epic_res.data[0]
+        # Diagnoses and medications come pre-normalized from the projection tables.
+        epic_snapshot["diagnoses"] = sorted(epic_snapshot.pop("epic_diagnoses") or [], key=lambda d: d["position"])
+        epic_snapshot["medications"] = sorted(epic_snapshot.pop("epic_medications") or [], key=lambda m: m["position"])
     else:
       # Local SQLite queries
       patient = await self._db.fetch_one("users", {"email": patient_email})
@@ -141,38 +250,31 @@ class SupabaseService:
       print(f"[INFO] Loaded patient record: {patient_email} -> {patient}")
       print(f"[INFO] Loaded doctor record: {doctor_email} -> {doctor}")
 
-      epic_rows = await self._db.fetch_all(
-        "epic_patient_data",
-        {"patient_email": patient_email},
-        order_by="created_at",
-        limit=1
+      epic_rows = await self._db.query(
+        f"SELECT {_EPIC_SNAPSHOT_COLUMNS} FROM epic_patient_data"
+        " WHERE patient_email = ? ORDER BY created_at DESC LIMIT 1",
+        (patient_email,),
       )
       epic_snapshot = None
       if epic_rows:
-        epic_data = epic_rows[0]
-        # Parse JSON fields
-        if epic_data.get("diagnoses"):
-          try:
-            epic_data["diagnoses"] = json.loads(epic_data["diagnoses"])
-          except (json.JSONDecodeError, TypeError):
-            epic_data["diagnoses"] = []
-        if epic_data.get("medications"):
-          try:
-            epic_data["medications"] = json.loads(epic_data["medications"])
-          except (json.JSONDecodeError, TypeError):
-            epic_data["medications"] = []
-        epic_snapshot = epic_data
-
-      recent_files = await self._db.fetch_all(
-        "patient_files",
-        {"patient_email": patient_email, "file_type": "file"},
-        order_by="created_at",
-        limit=5
-      )
-
-    notes = "\n".join(
-      filter(None, [file.get("extracted_text", "").strip() for file in recent_files])
-    ) or None
+        epic_snapshot = epic_rows[0]
+        # Diagnoses and medications come pre-normalized from the projection tables.
+        epic_snapshot["diagnoses"] = await self._db.query(
+          "SELECT code, display, clinical_status FROM epic_diagnoses"
+          " WHERE epic_patient_data_id = ? ORDER BY position",
+          (epic_snapshot["id"],),
+        )
+        epic_snapshot["medications"] = await self._db.query(
+          "SELECT code, name, status FROM epic_medications"
+          " WHERE epic_patient_data_id = ? ORDER BY position",
+          (epic_snapshot["id"],),
+        )
+
+    terms = relevance_terms(
+      [d.get("display") for d in (epic_snapshot or {}).get("diagnoses", [])]
+      + [m.get("name") for m in (epic_snapshot or {}).get("medications", [])]
+    )
+    notes = await self._recent_notes_digest(patient_email, terms)
 
     return PatientContext(
       patient=patient,
@@ -181,30 +283,188 @@ class SupabaseService:
       recent_notes=notes,
     )
 
-  async def find_reusable_video(self, case_key: str) -> Optional[Dict[str, Any]]:
-    if not self.reuse_case_enabled:
+  async def _recent_notes_digest(self, patient_email: str, terms: List[str]) -> Optional[str]:
+    """Return the token-budgeted digest of the newest files, recomputed only when they change."""
+    if self.use_supabase:
+      files_res = (
+        self._supabase.table("patient_files")
+        .select("id, created_at, text_revision")
+        .eq("patient_email", patient_email)
+        .eq("file_type", "file")
+        .order("created_at", desc=True)
+        .limit(self.notes_max_files)
+        .execute()
+      )
+      files = files_res.data or []
+    else:
+      files = await self._db.query(
+        "SELECT id, created_at, text_revision FROM patient_files WHERE patient_email = ? AND file_type = ?"
+        " ORDER BY created_at DESC LIMIT ?",
+        (patient_email, "file", self.notes_max_files),
+      )
+    if not files:
       return None
+
+    signature = digest_signature(files, token_budget=self.notes_token_budget, terms=terms)
+    ids = [file["id"] for file in files]
+
+    async def compute() -> Optional[str]:
+      if self.use_supabase:
+        texts_res = self._supabase.table("patient_files").select("id, extracted_text").in_("id", ids).execute()
+        rows = texts_res.data or []
+      else:
+        placeholders = ", ".join(["?" for _ in ids])
+        rows = await self._db.query(
+          f"SELECT id, extracted_text FROM patient_files WHERE id IN ({placeholders})",
+          tuple(ids),
+        )
+      texts = {row["id"]: row.get("extracted_text") for row in rows}
+      return build_notes_digest(
+        [texts.get(file_id) for file_id in ids],
+        token_budget=self.notes_token_budget,
+        terms=terms,
+      )
+
+    return await self.cache.get_or_compute(
+      "notes_digest",
+      f"{patient_email}:{signature}",
+      compute,
+      ttl=NOTES_DIGEST_TTL,
+    )
+
+  async def search_patient_files(
+    self,
+    patient_email: str,
+    query: str,
+    *,
+    limit: int = 20,
+    offset: int = 0,
+  ) -> List[Dict[str, Any]]:
+    """Full-text search over a patient's files, best match first, with highlighted snippets."""
     await self._ensure_connected()
 
     if self.use_supabase:
-      res = (
+      res = self._supabase.rpc(
+        "search_patient_files",
+        {"p_patient_email": patient_email, "p_query": query, "p_limit": limit, "p_offset": offset},
+      ).execute()
+      rows = res.data or []
+    else:
+      match = _fts_match_expression(patient_email, query)
+      if not match:
+        return []
+      rows = await self._db.query(
+        f"""
+        SELECT f.id, f.file_name, f.file_url, f.created_at,
+               -bm25(patient_files_fts, 0.0, 2.0, 1.0) AS rank,
+               snippet(patient_files_fts, 2, '{_MARK_START}', '{_MARK_END}', '…', 24) AS snippet
+        FROM patient_files_fts
+        JOIN patient_files f ON f.id = patient_files_fts.rowid
+        WHERE patient_files_fts MATCH ? AND f.file_type = 'file'
+        ORDER BY bm25(patient_files_fts, 0.0, 2.0, 1.0)
+        LIMIT ? OFFSET ?
+        """,
+        (match, limit, offset),
+      )
+
+    for row in rows:
+      row["snippet"] = _highlight(row.get("snippet"))
+    return rows
+
+  async def list_patient_videos(
+    self,
+    patient_email: str,
+    *,
+    limit: int = 20,
+    before: Optional[Tuple[str, int]] = None,
+  ) -> List[Dict[str, Any]]:
+    """Return one keyset page of a patient's videos, newest first, ordered by (created_at, id)."""
+    await self._ensure_connected()
+
+    if self.use_supabase:
+      builder = (
         self._supabase.table("patient_files")
-        .select("*")
+        .select(_VIDEO_LIBRARY_COLUMNS)
+        .eq("patient_email", patient_email)
         .eq("file_type", "video")
-        .eq("case_key", case_key)
-        .order("created_at", desc=True)
-        .limit(1)
+      )
+      if before:
+        created_at, video_id = before
+        builder = builder.or_(
+          f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{int(video_id)})'
+        )
+      res = builder.order("created_at", desc=True).order("id", desc=True).limit(limit).execute()
+      return res.data or []
+
+    query = f"SELECT {_VIDEO_LIBRARY_COLUMNS} FROM patient_files WHERE patient_email = ? AND file_type = ?"
+    params: List[Any] = [patient_email, "video"]
+    if before:
+      query += " AND (created_at, id) < (?, ?)"
+      params.extend(before)
+    query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+    params.append(limit)
+    return await self._db.query(query, tuple(params))
+
+  async def find_patients_by_diagnosis(self, code: str, *, limit: int = 500) -> List[str]:
+    """Return emails of patients whose Epic snapshot carries the given diagnosis code."""
+    await self._ensure_connected()
+
+    if self.use_supabase:
+      res = (
+        self._supabase.table("epic_diagnoses")
+        .select("patient_email")
+        .eq("code", code)
+        .not_.is_("patient_email", "null")
+        .limit(limit)
         .execute()
       )
+      return list(dict.fromkeys(row["patient_email"] for row in res.data or []))
+
+    rows = await self._db.query(
+      "SELECT DISTINCT patient_email FROM epic_diagnoses WHERE code = ? AND patient_email IS NOT NULL LIMIT ?",
+      (code, limit),
+    )
+    return [row["patient_email"] for row in rows]
+
+  async def find_reusable_video(self, case_key: str) -> Optional[Dict[str, Any]]:
+    if not self.reuse_case_enabled:
+      return None
+    await self._ensure_connected()
+
+    async def lookup() -> Optional[Dict[str, Any]]:
+      if self.use_supabase:
+        res = (
+          self._supabase.table("patient_files")
+          .select("*")
+          .eq("file_type", "video")
+          .eq("case_key", case_key)
+          .order("created_at", desc=True)
+          .limit(1)
+          .execute()
+        )
+        return res.data[0] if res.data else None
+      else:
+        results = await self._db.fetch_all(
+          "patient_files",
+          {"file_type": "video", "case_key": case_key},
+          order_by="created_at",
+          limit=1
+        )
+        return results[0] if results else None
+
+    async def lookup_with_warmed() -> Optional[Dict[str, Any]]:
+      found = await lookup()
+      return found if found is not None else await self._find_warmed_video(case_key)
+
+    return await self.cache.get_or_compute(
+      "reuse", case_key, lookup_with_warmed, ttl=REUSE_LOOKUP_TTL, miss_ttl=REUSE_MISS_TTL
+    )
+
+  async def _find_warmed_video(self, case_key: str) -> Optional[Dict[str, Any]]:
+    if self.use_supabase:
+      res = self._supabase.table("warmed_videos").select("case_key, file_url").eq("case_key", case_key).limit(1).execute()
       return res.data[0] if res.data else None
-    else:
-      results = await self._db.fetch_all(
-        "patient_files",
-        {"file_type": "video", "case_key": case_key},
-        order_by="created_at",
-        limit=1
-      )
-      return results[0] if results else None
+    return await self._db.fetch_one("warmed_videos", {"case_key": case_key})
 
   async def save_video_metadata(
     self,
@@ -214,7 +474,12 @@ class SupabaseService:
     file_url: str,
     file_name: str,
     case_key: str,
+    diagnosis_code: Optional[str] = None,
+    procedure_code: Optional[str] = None,
+    recovery_milestone: Optional[str] = None,
+    doctor_specialty: Optional[str] = None,
   ) -> Dict[str, Any]:
+    """Add a video to the patient's library; with its case given it also joins the reuse index."""
     await self._ensure_connected()
 
     data = {
@@ -228,7 +493,313 @@ class SupabaseService:
 
     if self.use_supabase:
       res = self._supabase.table("patient_files").insert(data).execute()
-      return res.data[0] if res.data else data
+      saved = res.data[0] if res.data else data
     else:
-      return await self._db.insert("patient_files", data)
+      saved = await self._db.insert("patient_files", data)
+    await self.cache.delete("reuse", case_key)
+    if diagnosis_code and procedure_code:
+      await self._index_reusable_video(
+        case_key=case_key,
+        file_url=file_url,
+        metadata_id=saved.get("id"),
+        parts=case_parts(
+          diagnosis_code=diagnosis_code,
+          procedure_code=procedure_code,
+          recovery_milestone=recovery_milestone,
+          doctor_specialty=doctor_specialty,
+        ),
+      )
+    return saved
+
+  async def save_warmed_video(
+    self,
+    *,
+    case_key: str,
+    file_url: str,
+    diagnosis_code: str,
+    procedure_code: str,
+    recovery_milestone: Optional[str],
+    doctor_specialty: Optional[str],
+    predicted_daily_demand: float,
+  ) -> Dict[str, Any]:
+    """Record a pre-generated video that is not tied to any patient's library."""
+    await self._ensure_connected()
+
+    data = {
+      "case_key": case_key,
+      "file_url": file_url,
+      "diagnosis_code": diagnosis_code,
+      "procedure_code": procedure_code,
+      "recovery_milestone": recovery_milestone,
+      "doctor_specialty": doctor_specialty,
+      "predicted_daily_demand": predicted_daily_demand,
+    }
+    if self.use_supabase:
+      res = self._supabase.table("warmed_videos").upsert(data, on_conflict="case_key").execute()
+      saved = res.data[0] if res.data else data
+    else:
+      await self._db.upsert_many("warmed_videos", [data], ["case_key"])
+      saved = data
+    await self.cache.delete("reuse", case_key)
+    await self._index_reusable_video(
+      case_key=case_key,
+      file_url=file_url,
+      metadata_id=None,
+      parts=case_parts(
+        diagnosis_code=diagnosis_code,
+        procedure_code=procedure_code,
+        recovery_milestone=recovery_milestone,
+        doctor_specialty=doctor_specialty,
+      ),
+    )
+    return saved
 
+  async def _index_reusable_video(
+    self,
+    *,
+    case_key: str,
+    file_url: str,
+    metadata_id: Optional[int],
+    parts: Dict[str, str],
+  ) -> None:
+    """Point the case's ``video_reuse_index`` row at its newest video; never fails the save."""
+    if not is_icd10(parts["diagnosis_code"]):
+      return
+    now = datetime.now(timezone.utc)
+    data = {
+      "case_key": case_key,
+      "file_url": file_url,
+      "metadata_id": metadata_id,
+      **parts,
+      "created_at": now.isoformat() if self.use_supabase else now.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    try:
+      if self.use_supabase:
+        self._supabase.table("video_reuse_index").upsert(data, on_conflict="case_key").execute()
+      else:
+        await self._db.upsert_many("video_reuse_index", [data], ["case_key"])
+    except Exception as e:
+      print(f"[WARN] Failed to index video for reuse: {e}")
+
+  async def find_related_videos(
+    self,
+    *,
+    case_key: str,
+    diagnosis_code: str,
+    procedure_code: str,
+    recovery_milestone: Optional[str],
+    doctor_specialty: Optional[str],
+    min_prefix: int,
+  ) -> List[Dict[str, Any]]:
+    """Videos of the same procedure, milestone and specialty whose code shares ``min_prefix`` characters.
+
+    Unordered; ``ReuseHierarchy.closest`` ranks them. The case itself is left out.
+    """
+    if not self.reuse_case_enabled:
+      return []
+    parts = case_parts(
+      diagnosis_code=diagnosis_code,
+      procedure_code=procedure_code,
+      recovery_milestone=recovery_milestone,
+      doctor_specialty=doctor_specialty,
+    )
+    prefix = parts["diagnosis_code"][:min_prefix]
+    if len(prefix) < min_prefix:
+      return []
+    low, high = prefix_range(prefix)
+    await self._ensure_connected()
+
+    async def lookup() -> List[Dict[str, Any]]:
+      if self.use_supabase:
+        res = (
+          self._supabase.table("video_reuse_index")
+          .select("case_key, file_url, metadata_id, diagnosis_code, created_at")
+          .eq("procedure_code", parts["procedure_code"])
+          .eq("recovery_milestone", parts["recovery_milestone"])
+          .eq("doctor_specialty", parts["doctor_specialty"])
+          .gte("diagnosis_code", low)
+          .lt("diagnosis_code", high)
+          .limit(RELATED_LOOKUP_LIMIT)
+          .execute()
+        )
+        rows = res.data or []
+      else:
+        rows = await self._db.query(
+          "SELECT case_key, file_url, metadata_id, diagnosis_code, created_at FROM video_reuse_index"
+          " WHERE procedure_code = ? AND recovery_milestone = ? AND doctor_specialty = ?"
+          " AND diagnosis_code >= ? AND diagnosis_code < ? LIMIT ?",
+          (
+            parts["procedure_code"],
+            parts["recovery_milestone"],
+            parts["doctor_specialty"],
+            low,
+            high,
+            RELATED_LOOKUP_LIMIT,
+          ),
+        )
+      return [row for row in rows if row["case_key"] != case_key]
+
+    return await self.cache.get_or_compute(
+      "reuse_related", f"{case_key}:{min_prefix}", lookup, ttl=REUSE_LOOKUP_TTL, miss_ttl=REUSE_MISS_TTL
+    )
+
+  async def record_generation_request(
+    self,
+    *,
+    case_key: str,
+    diagnosis_code: str,
+    procedure_code: str,
+    recovery_milestone: Optional[str],
+    doctor_specialty: Optional[str],
+    reused: bool,
+  ) -> None:
+    """Append to the request log that drives cache warming; never fails the request."""
+    data = {
+      "case_key": case_key,
+      "diagnosis_code": diagnosis_code,
+      "procedure_code": procedure_code,
+      "recovery_milestone": recovery_milestone,
+      "doctor_specialty": doctor_specialty,
+      "reused": reused,
+    }
+    try:
+      await self._ensure_connected()
+      if self.use_supabase:
+        await asyncio.to_thread(self._supabase.table("generation_requests").insert(data).execute)
+      else:
+        await self._db.insert("generation_requests", data)
+    except Exception as e:
+      print(f"[WARN] Failed to log generation request: {e}")
+
+  async def fetch_generation_requests(self, since: datetime) -> List[Dict[str, Any]]:
+    """Return logged generation requests newer than ``since`` (UTC)."""
+    await self._ensure_connected()
+    columns = "case_key, diagnosis_code, procedure_code, recovery_milestone, doctor_specialty, reused, created_at"
+
+    if self.use_supabase:
+      res = (
+        self._supabase.table("generation_requests")
+        .select(columns)
+        .gte("created_at", since.isoformat())
+        .execute()
+      )
+      return res.data or []
+
+    return await self._db.query(
+      f"SELECT {columns} FROM generation_requests WHERE created_at >= ?",
+      (since.strftime("%Y-%m-%d %H:%M:%S"),),
+    )
+
+  async def fetch_warmed_videos(self) -> List[Dict[str, Any]]:
+    await self._ensure_connected()
+    if self.use_supabase:
+      res = self._supabase.table("warmed_videos").select("*").execute()
+      return res.data or []
+    return await self._db.query("SELECT * FROM warmed_videos")
+
+  async def available_case_keys(self, case_keys: List[str]) -> Set[str]:
+    """Return the subset of ``case_keys`` that already have a reusable video."""
+    await self._ensure_connected()
+    found: Set[str] = set()
+    for start in range(0, len(case_keys), 500):
+      chunk = case_keys[start:start + 500]
+      if self.use_supabase:
+        for table, extra in (("patient_files", {"file_type": "video"}), ("warmed_videos", {})):
+          builder = self._supabase.table(table).select("case_key").in_("case_key", chunk)
+          for column, value in extra.items():
+            builder = builder.eq(column, value)
+          found.update(row["case_key"] for row in builder.execute().data or [])
+        continue
+      placeholders = ", ".join("?" for _ in chunk)
+      rows = await self._db.query(
+        f"SELECT case_key FROM patient_files WHERE file_type = 'video' AND case_key IN ({placeholders})"
+        f" UNION SELECT case_key FROM warmed_videos WHERE case_key IN ({placeholders})",
+        (*chunk, *chunk),
+      )
+      found.update(row["case_key"] for row in rows)
+    return found
+
+  async def claim_idempotency_key(
+    self,
+    key: str,
+    request_hash: str,
+    *,
+    now: float,
+    lease_until: float,
+    expires_at: float,
+  ) -> bool:
+    """Insert an in-progress key, or take over an expired one or a stale one for the same request."""
+    await self._ensure_connected()
+    if self.use_supabase:
+      res = await asyncio.to_thread(
+        self._supabase.rpc(
+          "claim_idempotency_key",
+          {
+            "p_key": key,
+            "p_request_hash": request_hash,
+            "p_now": now,
+            "p_lease_until": lease_until,
+            "p_expires_at": expires_at,
+          },
+        ).execute
+      )
+      return bool(res.data)
+
+    changed = await self._db.execute(
+      """
+      INSERT INTO idempotency_keys AS k (key, request_hash, status, lease_expires_at, expires_at, created_at)
+      VALUES (?, ?, 'in_progress', ?, ?, ?)
+      ON CONFLICT (key) DO UPDATE SET
+        request_hash = excluded.request_hash, status = 'in_progress', status_code = NULL, response = NULL,
+        job_id = NULL, lease_expires_at = excluded.lease_expires_at, expires_at = excluded.expires_at,
+        created_at = excluded.created_at
+      WHERE k.expires_at < ?
+        OR (k.status = 'in_progress' AND k.lease_expires_at < ? AND k.request_hash = excluded.request_hash)
+      """,
+      (key, request_hash, lease_until, expires_at, now, now, now),
+    )
+    return changed > 0
+
+  async def get_idempotency_key(self, key: str) -> Optional[Dict[str, Any]]:
+    await self._ensure_connected()
+    if self.use_supabase:
+      res = await asyncio.to_thread(
+        self._supabase.table("idempotency_keys").select("*").eq("key", key).limit(1).execute
+      )
+      return res.data[0] if res.data else None
+    row = await self._db.fetch_one("idempotency_keys", {"key": key})
+    if row and row.get("response"):
+      row["response"] = json.loads(row["response"])
+    return row
+
+  async def update_idempotency_key(self, key: str, data: Dict[str, Any], *, status: str = "in_progress") -> None:
+    """Update a key still in ``status``, so a key that was reclaimed meanwhile is left alone."""
+    await self._ensure_connected()
+    if self.use_supabase:
+      await asyncio.to_thread(
+        self._supabase.table("idempotency_keys").update(data).eq("key", key).eq("status", status).execute
+      )
+      return
+    if "response" in data:
+      data = {**data, "response": json.dumps(data["response"])}
+    assignments = ", ".join(f"{column} = ?" for column in data)
+    await self._db.execute(
+      f"UPDATE idempotency_keys SET {assignments} WHERE key = ? AND status = ?",
+      (*data.values(), key, status),
+    )
+
+  async def delete_idempotency_key(self, key: str, *, status: str) -> None:
+    await self._ensure_connected()
+    if self.use_supabase:
+      await asyncio.to_thread(
+        self._supabase.table("idempotency_keys").delete().eq("key", key).eq("status", status).execute
+      )
+      return
+    await self._db.execute("DELETE FROM idempotency_keys WHERE key = ? AND status = ?", (key, status))
+
+  async def purge_idempotency_keys(self, now: float) -> None:
+    await self._ensure_connected()
+    if self.use_supabase:
+      await asyncio.to_thread(self._supabase.table("idempotency_keys").delete().lt("expires_at", now).execute)
+      return
+    await self._db.execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (now,))
@@ -0,0 +1,308 @@
+"""Bounded on-disk video cache with LRU/LFU eviction.
+
+In local mode the cache directory is the video store itself; with Supabase
+it holds read-through copies of objects in the storage bucket. Entries that
+are being served are pinned and never evicted until their response finishes.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import errno
+import os
+import re
+import shutil
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+
+_SAFE_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,254}$")
+
+# Persist access times to the file mtime at most this often per entry.
+_TOUCH_INTERVAL = 60.0
+# Lifetime of the signed URL a read-through miss streams the object from.
+_SIGNED_URL_TTL = 300
+
+
+@dataclass
+class _Entry:
+  size: int
+  last_access: float
+  hits: int = 0
+  touched_at: float = 0.0
+
+
+class VideoCache:
+  """Quota-bounded video directory shared by uploads and serving."""
+
+  def __init__(
+    self,
+    directory: str | Path,
+    *,
+    max_bytes: int,
+    policy: str = "lru",
+    supabase_client=None,
+    storage_bucket: str = "patient-files",
+    object_prefix: str = "videos/",
+    http_client=None,
+  ) -> None:
+    if policy not in ("lru", "lfu"):
+      raise ValueError(f"Unknown video cache policy: {policy}")
+    self.directory = Path(directory)
+    self.max_bytes = max_bytes
+    self.policy = policy
+    self.storage_bucket = storage_bucket
+    self.object_prefix = object_prefix
+    self._supabase = supabase_client
+    self._http = http_client
+    self._entries: Dict[str, _Entry] = {}
+    self._pins: Dict[str, int] = {}
+    self._inflight: Dict[str, asyncio.Future] = {}
+    self._lock = asyncio.Lock()
+    self._used = 0
+    self._loaded = False
+
+  @property
+  def use_read_through(self) -> bool:
+    return self._supabase is not None
+
+  @property
+  def used_bytes(self) -> int:
+    return self._used
+
+  def path_for(self, name: str) -> Path:
+    if not _SAFE_NAME.match(name) or name.endswith(".part"):
+      raise ValueError(f"Invalid video file name: {name!r}")
+    return self.directory / name
+
+  async def _ensure_loaded(self) -> None:
+    if self._loaded:
+      return
+    entries = await asyncio.to_thread(self._scan)
+    async with self._lock:
+      if self._loaded:
+        return
+      self._entries = entries
+      self._used = sum(entry.size for entry in entries.values())
+      self._loaded = True
+      victims = self._select_victims()
+    await self._unlink(victims)
+
+  def _scan(self) -> Dict[str, _Entry]:
+    self.directory.mkdir(parents=True, exist_ok=True)
+    entries: Dict[str, _Entry] = {}
+    for path in self.directory.iterdir():
+      if not path.is_file():
+        continue
+      if path.name.endswith(".part"):
+        # Leftover from an interrupted write.
+        path.unlink(missing_ok=True)
+        continue
+      stat = path.stat()
+      last_access = max(stat.st_mtime, stat.st_atime)
+      entries[path.name] = _Entry(size=stat.st_size, last_access=last_access, touched_at=stat.st_mtime)
+    return entries
+
+  def _select_victims(self, keep: Optional[str] = None) -> Dict[str, int]:
+    """Drop entries from the index until under quota; caller holds the lock."""
+    if self._used <= self.max_bytes:
+      return {}
+    if self.policy == "lfu":
+      rank = lambda item: (item[1].hits, item[1].last_access)
+    else:
+      rank = lambda item: item[1].last_access
+    victims: Dict[str, int] = {}
+    for name, entry in sorted(self._entries.items(), key=rank):
+      if self._used <= self.max_bytes:
+        break
+      if name == keep or self._pins.get(name):
+        continue
+      victims[name] = entry.size
+      self._used -= entry.size
+      del self._entries[name]
+    return victims
+
+  async def _unlink(self, victims: Dict[str, int]) -> None:
+    if not victims:
+      return
+    def remove() -> None:
+      for name in victims:
+        (self.directory / name).unlink(missing_ok=True)
+    await asyncio.to_thread(remove)
+    print(f"[INFO] Video cache evicted {len(victims)} file(s), {sum(victims.values())} bytes")
+
+  async def temp_path(self, name: str) -> Path:
+    """A unique ``.part`` file in the cache directory to stream a video into before ``put``."""
+    # Loading first: the startup scan deletes leftover .part files.
+    await self._ensure_loaded()
+    return self.path_for(name).with_name(f"{name}.{uuid.uuid4().hex}.part")
+
+  async def put(self, name: str, source: Path) -> Path:
+    """Move a fully written file into the cache atomically and account for it, evicting others if over quota.
+
+    ``source`` is consumed. A file on another filesystem than ``temp_path`` is copied in first.
+    """
+    await self._ensure_loaded()
+    path = self.path_for(name)
+
+    def install() -> int:
+      try:
+        os.replace(source, path)
+      except OSError as e:
+        if e.errno != errno.EXDEV:
+          raise
+        tmp = path.with_name(f"{name}.{uuid.uuid4().hex}.part")
+        try:
+          shutil.copyfile(source, tmp)
+          os.replace(tmp, path)
+        finally:
+          tmp.unlink(missing_ok=True)
+        Path(source).unlink(missing_ok=True)
+      return path.stat().st_size
+
+    size = await asyncio.to_thread(install)
+    now = time.time()
+    async with self._lock:
+      previous = self._entries.get(name)
+      if previous:
+        self._used -= previous.size
+      self._entries[name] = _Entry(size=size, last_access=now, touched_at=now)
+      self._used += size
+      victims = self._select_victims(keep=name)
+    await self._unlink(victims)
+    return path
+
+  async def contains(self, name: str) -> bool:
+    await self._ensure_loaded()
+    return name in self._entries
+
+  async def acquire(self, name: str) -> Optional[Path]:
+    """Pin a cached video for serving, reading it through from Supabase Storage on a miss.
+
+    Returns ``None`` when the video exists neither locally nor in the bucket.
+    Every successful call must be paired with ``release``.
+    """
+    await self._ensure_loaded()
+    path = self.path_for(name)
+
+    while True:
+      async with self._lock:
+        entry = self._entries.get(name)
+        if entry is not None:
+          self._pins[name] = self._pins.get(name, 0) + 1
+          now = time.time()
+          entry.last_access = now
+          entry.hits += 1
+          touch = now - entry.touched_at >= _TOUCH_INTERVAL
+          if touch:
+            entry.touched_at = now
+          break
+        if self._supabase is None:
+          return None
+        pending = self._inflight.get(name)
+        if pending is None:
+          pending = asyncio.get_running_loop().create_future()
+          self._inflight[name] = pending
+          owner = True
+        else:
+          owner = False
+
+      if owner:
+        try:
+          downloaded = await self._download(name)
+          if downloaded is not None:
+            await self.put(name, downloaded)
+          pending.set_result(downloaded is not None)
+        except Exception as e:
+          pending.set_exception(e)
+        finally:
+          self._inflight.pop(name, None)
+          if not pending.done():
+            # The owner was cancelled mid-download; waiters retry and one of them takes over.
+            pending.cancel()
+      try:
+        found = await asyncio.shield(pending)
+      except asyncio.CancelledError:
+        if not pending.cancelled() or asyncio.current_task().cancelling():
+          raise
+        continue
+      if not found:
+        return None
+      # Loop back to pin the freshly cached entry (it may already have been evicted again).
+
+    if touch:
+      await asyncio.to_thread(_touch, path)
+    return path
+
+  async def release(self, name: str) -> None:
+    async with self._lock:
+      remaining = self._pins.get(name, 0) - 1
+      if remaining > 0:
+        self._pins[name] = remaining
+      else:
+        self._pins.pop(name, None)
+      victims = self._select_victims()
+    await self._unlink(victims)
+
+  async def _download(self, name: str) -> Optional[Path]:
+    """Stream an object from the bucket into a temp file; ``None`` when it does not exist."""
+    from app.services.container import http_session
+
+    bucket = self._supabase.storage.from_(self.storage_bucket)
+    try:
+      signed = await asyncio.to_thread(bucket.create_signed_url, f"{self.object_prefix}{name}", _SIGNED_URL_TTL)
+    except Exception as e:
+      if "not found" in str(e).lower() or "404" in str(e):
+        return None
+      raise
+    url = signed.get("signedURL") or signed.get("signedUrl")
+
+    tmp = await self.temp_path(name)
+    complete = False
+    try:
+      async with http_session(self._http) as client:
+        async with client.stream("GET", url) as response:
+          if response.status_code == 404:
+            return None
+          response.raise_for_status()
+          with open(tmp, "wb") as handle:
+            async for chunk in response.aiter_bytes(1024 * 1024):
+              await asyncio.to_thread(handle.write, chunk)
+      complete = True
+      return tmp
+    finally:
+      if not complete:
+        tmp.unlink(missing_ok=True)
+
+  async def response(self, name: str, **kwargs) -> Optional[FileResponse]:
+    """Return a range-capable response that keeps the video pinned until it is fully sent."""
+    path = await self.acquire(name)
+    if path is None:
+      return None
+    return _LeasedFileResponse(path, cache=self, name=name, **kwargs)
+
+
+def _touch(path: Path) -> None:
+  try:
+    os.utime(path)
+  except FileNotFoundError:
+    pass
+
+
+class _LeasedFileResponse(FileResponse):
+  def __init__(self, path: Path, *, cache: VideoCache, name: str, **kwargs) -> None:
+    super().__init__(path, **kwargs)
+    self._cache = cache
+    self._name = name
+
+  async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+    try:
+      await super().__call__(scope, receive, send)
+    finally:
+      await self._cache.release(self._name)
@@ -2,9 +2,14 @@ from __future__ import annotations
 
 import asyncio
 import json
-from typing import Any, Dict, Tuple
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
 
-import httpx
+from app.services.container import http_session
+from app.services.deadline import DeadlineExceeded, bounded, remaining
+
+
+class VideoRenderFailed(RuntimeError):
+  """HeyGen reported the render as failed; polling the same ``video_id`` again will not help."""
 
 
 class VideoGeneratorService:
@@ -20,6 +25,7 @@ class VideoGeneratorService:
     background: str | None = None,
     poll_interval: int = 5,
     poll_timeout: int = 300,
+    http_client=None,
   ) -> None:
     if not api_key:
       raise ValueError("HEYGEN_API_KEY is required")
@@ -35,9 +41,23 @@ class VideoGeneratorService:
     self._background = background
     self._poll_interval = poll_interval
     self._poll_timeout = poll_timeout
+    self._http = http_client
 
   async def create_video(self, script_payload: Dict[str, Any], metadata: Dict[str, Any]) -> Dict[str, Any]:
     """Generate a HeyGen avatar video driven entirely by a text script."""
+    video_id = await self.submit_video(script_payload, metadata)
+    status_payload = await self.wait_for_video(video_id)
+    video_url = status_payload["video_url"]
+
+    return {
+      "id": video_id,
+      "status": status_payload["status"],
+      "video_url": video_url,
+      "thumbnail_url": status_payload.get("thumbnail_url"),
+    }
+
+  async def submit_video(self, script_payload: Dict[str, Any], metadata: Dict[str, Any]) -> str:
+    """Submit a render to HeyGen and return its ``video_id`` without waiting for it."""
     script_text = self._build_script(script_payload)
     if not script_text:
       raise ValueError("Unable to build script text for HeyGen video.")
@@ -91,11 +111,12 @@ class VideoGeneratorService:
       "X-API-KEY": self._api_key,
     }
 
-    async with httpx.AsyncClient(timeout=120) as client:
+    async with http_session(self._http) as client:
       response = await client.post(
         "https://api.heygen.com/v2/video/generate",
         headers=headers,
         json=payload,
+        timeout=bounded(120, "the HeyGen submit"),
       )
       if response.status_code >= 400:
         try:
@@ -105,20 +126,18 @@ class VideoGeneratorService:
         print(f"[ERROR] HeyGen video request failed: {error_json}")
       response.raise_for_status()
       data = response.json()
-      video_id = data["data"]["video_id"]
+      return data["data"]["video_id"]
 
-    status_payload = await self._wait_for_video(video_id)
-    video_url = status_payload["video_url"]
-
-    return {
-      "id": video_id,
-      "status": status_payload["status"],
-      "video_url": video_url,
-      "thumbnail_url": status_payload.get("thumbnail_url"),
-    }
+  async def wait_for_video(
+    self,
+    video_id: str,
+    *,
+    on_status: Optional[Callable[[str], Awaitable[None]]] = None,
+  ) -> Dict[str, Any]:
+    """Poll HeyGen until the avatar video is ready; safe to call again for an already submitted video.
 
-  async def _wait_for_video(self, video_id: str) -> Dict[str, Any]:
-    """Poll HeyGen until the avatar video is ready."""
+    ``on_status`` is called whenever HeyGen reports a new status (``pending``, ``processing``, ...).
+    """
     status_url = f"https://api.heygen.com/v1/video_status.get?video_id={video_id}"
     headers = {
       "Accept": "application/json",
@@ -126,27 +145,45 @@ class VideoGeneratorService:
     }
 
     elapsed = 0
+    last_status = None
     while elapsed <= self._poll_timeout:
-      async with httpx.AsyncClient(timeout=60) as client:
-        response = await client.get(status_url, headers=headers)
+      async with http_session(self._http) as client:
+        response = await client.get(status_url, headers=headers, timeout=bounded(60, "HeyGen polling"))
         response.raise_for_status()
         payload = response.json()["data"]
 
       status = payload["status"]
+      if on_status is not None and status != last_status:
+        await on_status(status)
+      last_status = status
       if status == "completed":
         return payload
       if status == "failed":
         error_msg = payload.get("error") or "Unknown HeyGen error"
-        raise RuntimeError(f"HeyGen video generation failed: {error_msg}")
+        raise VideoRenderFailed(f"HeyGen video generation failed: {error_msg}")
 
+      left = remaining("HeyGen polling")
+      if left is not None and left <= self._poll_interval:
+        # The render keeps going on HeyGen; the caller decides whether to pick it up later.
+        await asyncio.sleep(left)
+        raise DeadlineExceeded(f"HeyGen polling for video {video_id}")
       await asyncio.sleep(self._poll_interval)
       elapsed += self._poll_interval
 
     raise TimeoutError(f"Timed out waiting for HeyGen video {video_id} after {self._poll_timeout} seconds.")
 
   def _build_script(self, script_payload: Dict[str, Any]) -> str:
-    """Convert the LLM output into a single script string for HeyGen."""
+    """Stitch the storyboard scene narrations (or legacy free-form sections) into one script string."""
+    from app.services.llm import SCENE_ORDER
+
     sections = []
+    for scene in SCENE_ORDER:
+      value = script_payload.get(scene)
+      narration = value.get("narration") if isinstance(value, dict) else value
+      if isinstance(narration, str) and narration.strip():
+        sections.append(narration.strip())
+    if sections:
+      return "\n\n".join(sections)
 
     for key in ["intro", "overview", "content", "details", "treatment", "plan", "reminders", "next_steps"]:
       value = script_payload.get(key)
@@ -0,0 +1,223 @@
+"""Popularity-driven cache warming.
+
+Demand per case (diagnosis, procedure, milestone, specialty) is forecast from
+the generation request log as an exponentially decayed request count, so a
+case requested often last week outranks one requested often last quarter.
+Cases predicted to be requested at least ``min_daily_demand`` times a day that
+have no reusable video yet are rendered ahead of time as patient-agnostic
+videos, only while the job queue is idle and within a daily render budget.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from app.services.jobs import JobQueue
+from app.services.supabase import SupabaseService
+
+
+_DAY = 24 * 3600
+
+
+@dataclass
+class CaseDemand:
+  case_key: str
+  diagnosis_code: str
+  procedure_code: str
+  recovery_milestone: Optional[str]
+  doctor_specialty: Optional[str]
+  requests: int
+  predicted_daily_demand: float
+  available: bool = False
+
+
+def _parse_timestamp(value: Any) -> datetime:
+  if isinstance(value, datetime):
+    parsed = value
+  else:
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+  return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def forecast_demand(rows: Iterable[Dict[str, Any]], *, now: datetime, half_life_days: float) -> List[CaseDemand]:
+  """Predict requests/day per case; each request counts ``0.5 ** (age / half_life)``.
+
+  For a steady rate ``r`` the decayed sum converges to ``r * half_life / ln 2``,
+  which is inverted here to get the rate back.
+  """
+  cases: Dict[str, CaseDemand] = {}
+  weights: Dict[str, float] = {}
+  for row in rows:
+    case_key = row["case_key"]
+    age_days = max(0.0, (now - _parse_timestamp(row["created_at"])).total_seconds() / _DAY)
+    if case_key not in cases:
+      cases[case_key] = CaseDemand(
+        case_key=case_key,
+        diagnosis_code=row["diagnosis_code"],
+        procedure_code=row["procedure_code"],
+        recovery_milestone=row.get("recovery_milestone"),
+        doctor_specialty=row.get("doctor_specialty"),
+        requests=0,
+        predicted_daily_demand=0.0,
+      )
+      weights[case_key] = 0.0
+    cases[case_key].requests += 1
+    weights[case_key] += 0.5 ** (age_days / half_life_days)
+
+  for case_key, case in cases.items():
+    case.predicted_daily_demand = round(weights[case_key] * math.log(2) / half_life_days, 4)
+  return sorted(cases.values(), key=lambda case: case.predicted_daily_demand, reverse=True)
+
+
+async def build_report(
+  supabase_service: SupabaseService,
+  *,
+  lookback_days: int,
+  half_life_days: float,
+  min_daily_demand: float,
+  render_cost: float,
+  limit: int,
+  exclude: Optional[Set[str]] = None,
+) -> Dict[str, Any]:
+  """Forecast demand, pick warming candidates and measure what earlier warming saved."""
+  now = datetime.now(timezone.utc)
+  rows = await supabase_service.fetch_generation_requests(now - timedelta(days=lookback_days))
+  demand = forecast_demand(rows, now=now, half_life_days=half_life_days)
+  available = await supabase_service.available_case_keys([case.case_key for case in demand])
+  for case in demand:
+    case.available = case.case_key in available
+
+  exclude = exclude or set()
+  candidates = [
+    case for case in demand
+    if not case.available and case.case_key not in exclude and case.predicted_daily_demand >= min_daily_demand
+  ][:max(0, limit)]
+
+  total = sum(case.predicted_daily_demand for case in demand)
+  covered = sum(case.predicted_daily_demand for case in demand if case.available)
+  covered_after = covered + sum(case.predicted_daily_demand for case in candidates)
+
+  # A reuse hit on a warmed case after it was warmed is a render that did not happen.
+  warmed = {row["case_key"]: _parse_timestamp(row["created_at"]) for row in await supabase_service.fetch_warmed_videos()}
+  warmed_hits = sum(
+    1 for row in rows
+    if row.get("reused") and row["case_key"] in warmed and _parse_timestamp(row["created_at"]) >= warmed[row["case_key"]]
+  )
+  warmed_in_window = sum(1 for created_at in warmed.values() if now - created_at <= timedelta(days=lookback_days))
+
+  return {
+    "window_days": lookback_days,
+    "requests": len(rows),
+    "observed_hit_rate": round(sum(1 for row in rows if row.get("reused")) / len(rows), 4) if rows else 0.0,
+    "predicted_daily_requests": round(total, 4),
+    "expected_hit_rate": round(covered / total, 4) if total else 0.0,
+    "expected_hit_rate_after_warming": round(covered_after / total, 4) if total else 0.0,
+    "candidates": [asdict(case) for case in candidates],
+    "savings": {
+      "warmed_videos": len(warmed),
+      "warmed_in_window": warmed_in_window,
+      "reuse_hits": warmed_hits,
+      "render_cost": render_cost,
+      "saved": round(warmed_hits * render_cost, 2),
+      "spent": round(warmed_in_window * render_cost, 2),
+      "net": round((warmed_hits - warmed_in_window) * render_cost, 2),
+    },
+  }
+
+
+class CacheWarmer:
+  """Periodically enqueues warm renders for the top predicted cases while the queue is idle."""
+
+  def __init__(
+    self,
+    queue: JobQueue,
+    service_factory: Callable[[], SupabaseService],
+    *,
+    interval: float = 900.0,
+    daily_budget: int = 10,
+    batch_size: int = 1,
+    min_daily_demand: float = 1.0,
+    half_life_days: float = 7.0,
+    lookback_days: int = 30,
+    render_cost: float = 1.0,
+  ) -> None:
+    self.queue = queue
+    self.service_factory = service_factory
+    self.interval = interval
+    self.daily_budget = daily_budget
+    self.batch_size = batch_size
+    self.min_daily_demand = min_daily_demand
+    self.half_life_days = half_life_days
+    self.lookback_days = lookback_days
+    self.render_cost = render_cost
+    self._task: Optional[asyncio.Task] = None
+
+  def start(self) -> None:
+    if self._task is None:
+      self._task = asyncio.create_task(self._loop())
+
+  async def stop(self) -> None:
+    if self._task is not None:
+      self._task.cancel()
+      try:
+        await self._task
+      except asyncio.CancelledError:
+        pass
+      self._task = None
+
+  async def _loop(self) -> None:
+    while True:
+      await asyncio.sleep(self.interval)
+      try:
+        await self.run_once()
+      except Exception as e:
+        print(f"[WARN] Cache warming pass failed: {e}")
+
+  async def _budget(self) -> tuple[int, Set[str]]:
+    """Warm jobs still allowed in the trailing 24h, and case keys already queued or running."""
+    recent = await self.queue.requests_since(time.time() - _DAY, key="warming")
+    in_flight = {item["value"]["case_key"] for item in recent if item["status"] in ("queued", "running")}
+    return max(0, self.daily_budget - len(recent)), in_flight
+
+  async def report(self) -> Dict[str, Any]:
+    remaining, in_flight = await self._budget()
+    service = self.service_factory()
+    try:
+      report = await build_report(
+        service,
+        lookback_days=self.lookback_days,
+        half_life_days=self.half_life_days,
+        min_daily_demand=self.min_daily_demand,
+        render_cost=self.render_cost,
+        limit=remaining,
+        exclude=in_flight,
+      )
+    finally:
+      await service.close()
+    report["budget_remaining"] = remaining
+    report["in_flight"] = sorted(in_flight)
+    return report
+
+  async def run_once(self, *, force: bool = False) -> List[str]:
+    """Enqueue up to ``batch_size`` warm jobs; ``force`` skips the idle-queue check."""
+    if not force and await self.queue.pending_count() > 0:
+      return []
+    report = await self.report()
+    job_ids = []
+    for case in report["candidates"][:self.batch_size]:
+      target = {key: case[key] for key in (
+        "case_key", "diagnosis_code", "procedure_code", "recovery_milestone", "doctor_specialty", "predicted_daily_demand",
+      )}
+      job = await self.queue.enqueue({"warming": target}, priority="warming", tenant="warming")
+      job_ids.append(job.id)
+    if job_ids:
+      print(
+        f"[INFO] Queued {len(job_ids)} warm render(s); expected hit rate "
+        f"{report['expected_hit_rate']:.0%} -> {report['expected_hit_rate_after_warming']:.0%}"
+      )
+    return job_ids
@@ -0,0 +1,43 @@
+"""Optional startup warm-up run from the app lifespan before readiness is reported."""
+
+import asyncio
+import importlib
+import time
+
+from app.dependencies import build_supabase_service, get_service_container, get_settings
+from app.services import recovery_plan
+
+
+# Provider SDKs are imported lazily by their services; warm-up pays that cost up front.
+PROVIDER_MODULES = ("httpx", "openai")
+
+
+async def warm_up() -> None:
+  """Load settings and provider SDKs, open the database once and prime static caches."""
+  started = time.perf_counter()
+  settings = get_settings()
+
+  modules = list(PROVIDER_MODULES)
+  if settings.supabase_url:
+    modules.append("supabase")
+  for name in modules:
+    try:
+      await asyncio.to_thread(importlib.import_module, name)
+    except ImportError as e:
+      print(f"[WARN] Warm-up could not import {name}: {e}")
+
+  # Build the shared clients the first request would otherwise construct.
+  container = get_service_container()
+  _ = container.openai, container.http
+
+  # Connecting applies any pending schema migrations so the first request doesn't.
+  service = build_supabase_service()
+  try:
+    await service._ensure_connected()
+  finally:
+    await service.close()
+
+  for day in recovery_plan.PLAN_DEFINITIONS:
+    recovery_plan.get_plan_for_day(day)
+
+  print(f"[INFO] Warm-up finished in {(time.perf_counter() - started) * 1000:.0f} ms")
@@ -0,0 +1,101 @@
+"""Benchmark streaming FHIR Bundle parsing on a synthetic multi-hundred-MB bundle.
+
+The bundle is generated on the fly and fed in fixed-size chunks, so peak
+RSS reflects the parser (plus one flush of normalized rows) rather than the input.
+
+  python benchmarks/fhir_bundle.py --megabytes 300
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+import resource
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.fhir import FLUSH_RESOURCES, BundleAccumulator, bucket_rows, iter_bundle_entries
+
+
+def _patient_entries(index: int, conditions: int, medications: int):
+  patient_id = f"pat-{index}"
+  yield {
+    "fullUrl": f"urn:uuid:{patient_id}",
+    "resource": {
+      "resourceType": "Patient",
+      "id": patient_id,
+      "name": [{"given": ["Synthetic"], "family": f"Patient {index}"}],
+      "birthDate": "1980-01-01",
+      "identifier": [{"type": {"coding": [{"code": "MR"}]}, "value": f"MRN{index:08d}"}],
+      "telecom": [{"system": "email", "value": f"patient{index}@bench.amma.health"}],
+    },
+  }
+  for c in range(conditions):
+    yield {
+      "resource": {
+        "resourceType": "Condition",
+        "id": f"cond-{index}-{c}",
+        "subject": {"reference": f"Patient/{patient_id}"},
+        "code": {"coding": [{"system": "http://hl7.org/fhir/sid/icd-10-cm", "code": "E11.9", "display": "Type 2 diabetes mellitus without complications"}]},
+        "clinicalStatus": {"coding": [{"code": "active"}]},
+        "note": [{"text": "Synthetic note é " * 40}],
+      }
+    }
+  for m in range(medications):
+    yield {
+      "resource": {
+        "resourceType": "MedicationStatement",
+        "id": f"med-{index}-{m}",
+        "status": "active",
+        "subject": {"reference": f"urn:uuid:{patient_id}"},
+        "medicationCodeableConcept": {"coding": [{"code": "860975", "display": "Metformin 500 MG"}]},
+        "dosage": [{"text": "500mg twice daily", "route": {"coding": [{"display": "Oral"}]}}],
+      }
+    }
+
+
+async def synthetic_bundle(target_bytes: int, chunk_size: int):
+  """Yield a Bundle as byte chunks until roughly ``target_bytes`` have been produced."""
+  pending = b'{"resourceType": "Bundle", "type": "searchset", "meta": {"tag": [{"code": "entry"}]}, "entry": ['
+  produced = 0
+  index = 0
+  first = True
+  while produced < target_bytes:
+    for entry in _patient_entries(index, conditions=5, medications=5):
+      pending += (b"" if first else b",") + json.dumps(entry).encode("utf-8")
+      first = False
+    index += 1
+    while len(pending) >= chunk_size:
+      produced += chunk_size
+      yield pending[:chunk_size]
+      pending = pending[chunk_size:]
+  pending += b'], "total": ' + str(index).encode() + b"}"
+  yield pending
+
+
+async def bench(megabytes: int, chunk_size: int) -> None:
+  accumulator = BundleAccumulator()
+  patients = 0
+  started = time.perf_counter()
+  async for entry in iter_bundle_entries(synthetic_bundle(megabytes * 1024 * 1024, chunk_size)):
+    accumulator.add(entry)
+    # Build the rows each flush would upsert, without a database.
+    if accumulator.pending >= FLUSH_RESOURCES:
+      patients += len(bucket_rows(accumulator.drain(), doctor_email="bench.doctor@amma.health"))
+  patients += len(bucket_rows(accumulator.drain(final=True), doctor_email="bench.doctor@amma.health"))
+  elapsed = time.perf_counter() - started
+  peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+  print(f"parsed {megabytes} MB in {elapsed:.1f}s ({megabytes / elapsed:.1f} MB/s)")
+  print(f"entries {accumulator.entries}, patients {patients}, conditions {accumulator.conditions}, medications {accumulator.medications}")
+  print(f"peak RSS {peak_rss_mb:.1f} MB (includes interpreter and one flush of rows)")
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--megabytes", type=int, default=300)
+  parser.add_argument("--chunk-size", type=int, default=64 * 1024)
+  args = parser.parse_args()
+  asyncio.run(bench(args.megabytes, args.chunk_size))
@@ -0,0 +1,66 @@
+"""Benchmark epic_patient_data ingest: per-row ``insert`` vs batched ``upsert_many``.
+
+  python benchmarks/ingest.py --rows 100000
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.database import LocalDatabase
+
+
+def make_rows(count: int, doctor: str = "bench.doctor@amma.health"):
+  diagnoses = json.dumps([{"display": "Essential (primary) hypertension", "code": "I10", "clinicalStatus": "active"}])
+  medications = json.dumps([{"name": "Lisinopril", "status": "active", "dosage": "10mg"}])
+  return [
+    {
+      "doctor_email": doctor,
+      "patient_email": f"patient{i}@bench.amma.health",
+      "epic_patient_id": f"EPIC-{i:08d}",
+      "epic_mrn": f"MRN{i:08d}",
+      "patient_name": f"Bench Patient {i}",
+      "patient_dob": "1980-01-01",
+      "clinical_notes": "Routine follow-up.",
+      "diagnoses": diagnoses,
+      "medications": medications,
+    }
+    for i in range(count)
+  ]
+
+
+async def bench(rows: int, legacy_rows: int, batch_size: int) -> None:
+  with tempfile.TemporaryDirectory() as tmp:
+    db = await LocalDatabase(str(Path(tmp) / "bench.db")).connect()
+    try:
+      legacy = make_rows(legacy_rows, doctor="legacy.doctor@amma.health")
+      started = time.perf_counter()
+      for row in legacy:
+        await db.insert("epic_patient_data", row)
+      legacy_elapsed = time.perf_counter() - started
+      print(f"insert (per row):  {legacy_rows:>7} rows in {legacy_elapsed:7.2f}s  ({legacy_rows / legacy_elapsed:9.0f} rows/s)")
+
+      data = make_rows(rows)
+      for label in ("upsert_many (new)", "upsert_many (update)"):
+        started = time.perf_counter()
+        for start in range(0, rows, batch_size):
+          await db.upsert_many("epic_patient_data", data[start:start + batch_size], ["doctor_email", "epic_patient_id"])
+        elapsed = time.perf_counter() - started
+        print(f"{label:<19}{rows:>7} rows in {elapsed:7.2f}s  ({rows / elapsed:9.0f} rows/s)")
+    finally:
+      await db.close()
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--rows", type=int, default=100_000)
+  parser.add_argument("--legacy-rows", type=int, default=2_000, help="rows for the slow per-row baseline")
+  parser.add_argument("--batch-size", type=int, default=5_000)
+  args = parser.parse_args()
+  asyncio.run(bench(args.rows, args.legacy_rows, args.batch_size))
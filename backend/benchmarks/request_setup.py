@@ -0,0 +1,99 @@
+"""Benchmark per-request setup: the clients a request builds before doing any work.
+
+Times what ``POST /videos/generate`` obtains per request (LLM service, HeyGen
+service, a connected database service, storage) and the latency of a
+database-backed ``GET``, inside a running app.
+
+  python benchmarks/request_setup.py --requests 300
+  DATABASE_PATH=/tmp/bench.db python benchmarks/request_setup.py
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+DUMMY_ENV = {
+  "OPENAI_API_KEY": "sk-benchmark",
+  "HEYGEN_API_KEY": "benchmark",
+  "HEYGEN_AVATAR_ID": "benchmark",
+  "HEYGEN_VOICE_ID": "benchmark",
+  "JOB_WORKER_CONCURRENCY": "0",
+}
+
+
+async def setup_once() -> dict:
+  from app.dependencies import build_supabase_service, get_llm_service, get_storage_service, get_video_service
+
+  timings = {}
+  started = time.perf_counter()
+  get_llm_service()
+  timings["llm"] = time.perf_counter() - started
+
+  started = time.perf_counter()
+  get_video_service()
+  timings["video"] = time.perf_counter() - started
+
+  started = time.perf_counter()
+  service = build_supabase_service()
+  await service._ensure_connected()
+  await service.close()
+  timings["database"] = time.perf_counter() - started
+
+  started = time.perf_counter()
+  get_storage_service()
+  timings["storage"] = time.perf_counter() - started
+  return timings
+
+
+def report(name: str, values_ms: list) -> None:
+  p95 = sorted(values_ms)[int(0.95 * (len(values_ms) - 1))]
+  print(f"{name:>12}: mean {statistics.mean(values_ms):8.3f} ms  p50 {statistics.median(values_ms):8.3f}  p95 {p95:8.3f}")
+
+
+async def run(requests: int, email: str) -> None:
+  import httpx
+
+  from app.main import app
+
+  async with app.router.lifespan_context(app):
+    for _ in range(5):
+      await setup_once()
+    rows = [await setup_once() for _ in range(requests)]
+    for name in rows[0]:
+      report(name, [row[name] * 1000 for row in rows])
+    report("total", [sum(row.values()) * 1000 for row in rows])
+
+    url = f"/patients/{email}/videos"
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+      for _ in range(5):
+        await client.get(url)
+      latencies = []
+      for _ in range(requests):
+        started = time.perf_counter()
+        response = await client.get(url)
+        latencies.append((time.perf_counter() - started) * 1000)
+    report(f"GET {response.status_code}", latencies)
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--requests", type=int, default=200)
+  parser.add_argument("--email", default="anish.polakala@gmail.com", help="Patient whose videos the GET lists.")
+  args = parser.parse_args()
+
+  for key, value in DUMMY_ENV.items():
+    os.environ.setdefault(key, value)
+  os.chdir(BACKEND_DIR)
+  asyncio.run(run(args.requests, args.email))
+
+
+if __name__ == "__main__":
+  main()
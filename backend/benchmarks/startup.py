@@ -0,0 +1,71 @@
+"""Benchmark cold start: `import app.main` time and time to first request.
+
+Each run starts a fresh interpreter so nothing is cached in-process.
+
+  python benchmarks/startup.py --runs 5
+  WARMUP_ON_STARTUP=true python benchmarks/startup.py
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+CHILD = r"""
+import json, time
+t0 = time.perf_counter()
+import app.main
+t1 = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(app.main.app) as client:
+  t2 = time.perf_counter()
+  response = client.get("/health/ready")
+  t3 = time.perf_counter()
+print(json.dumps({
+  "import_ms": (t1 - t0) * 1000,
+  "startup_ms": (t2 - t1) * 1000,
+  "first_request_ms": (t3 - t0) * 1000,
+  "status": response.status_code,
+}))
+"""
+
+DUMMY_ENV = {
+  "OPENAI_API_KEY": "sk-benchmark",
+  "HEYGEN_API_KEY": "benchmark",
+  "HEYGEN_AVATAR_ID": "benchmark",
+  "HEYGEN_VOICE_ID": "benchmark",
+}
+
+
+def run_once() -> dict:
+  env = {**DUMMY_ENV, **os.environ}
+  out = subprocess.run(
+    [sys.executable, "-c", CHILD],
+    cwd=BACKEND_DIR,
+    env=env,
+    capture_output=True,
+    text=True,
+    check=True,
+  )
+  return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--runs", type=int, default=5)
+  args = parser.parse_args()
+
+  results = [run_once() for _ in range(args.runs)]
+  for key in ("import_ms", "startup_ms", "first_request_ms"):
+    values = [r[key] for r in results]
+    print(f"{key:>18}: median {statistics.median(values):8.1f}  min {min(values):8.1f}  max {max(values):8.1f}")
+
+
+if __name__ == "__main__":
+  main()
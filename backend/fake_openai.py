@@ -0,0 +1,145 @@
+"""Local stand-in for the OpenAI chat completions, Files and Batch endpoints.
+
+Answers every chat request with a canned storyboard, so batch mode can be
+exercised end to end without an API key or a 24h wait:
+
+  python fake_openai.py --port 8100 --batch-delay 5
+  OPENAI_BASE_URL=http://127.0.0.1:8100/v1 LLM_BATCH_ENABLED=true uvicorn app.main:app
+
+Batches complete ``--batch-delay`` seconds after creation. Requests whose
+prompt contains ``FAIL`` get a 400 in the error file.
+"""
+
+import argparse
+import json
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import default
+from typing import Any, Dict
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+from app.services.llm import PERSONALIZED_SCENES, SCENE_ORDER, STYLE_KEYS
+
+
+app = FastAPI(title="Fake OpenAI")
+app.state.batch_delay = 5.0
+_files: Dict[str, Dict[str, Any]] = {}
+_batches: Dict[str, Dict[str, Any]] = {}
+
+
+def _completion(body: Dict[str, Any]) -> Dict[str, Any]:
+  prompt = body["messages"][-1]["content"]
+  script: Dict[str, Any] = {scene: {"narration": f"{scene} narration", "visuals": f"{scene} visuals"} for scene in SCENE_ORDER}
+  script.update({key: "calm" for key in STYLE_KEYS})
+  script["title"] = "Understanding your condition"
+  if "Write only these personalized scenes" in prompt:
+    script = {key: value for key, value in script.items() if key in PERSONALIZED_SCENES or key == "title"}
+  return {
+    "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+    "object": "chat.completion",
+    "created": int(time.time()),
+    "model": body.get("model", "gpt-4o"),
+    "choices": [
+      {"index": 0, "message": {"role": "assistant", "content": json.dumps(script)}, "finish_reason": "stop"}
+    ],
+    "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": 200, "total_tokens": len(prompt) // 4 + 200},
+  }
+
+
+def _store_file(content: bytes, filename: str, purpose: str) -> Dict[str, Any]:
+  file_id = f"file-{uuid.uuid4().hex[:12]}"
+  _files[file_id] = {
+    "id": file_id,
+    "object": "file",
+    "bytes": len(content),
+    "created_at": int(time.time()),
+    "filename": filename,
+    "purpose": purpose,
+    "status": "processed",
+    "content": content,
+  }
+  return {key: value for key, value in _files[file_id].items() if key != "content"}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(body: Dict[str, Any]) -> Dict[str, Any]:
+  return _completion(body)
+
+
+@app.post("/v1/files")
+async def upload_file(request: Request) -> Dict[str, Any]:
+  raw = await request.body()
+  header = f"Content-Type: {request.headers['content-type']}\r\n\r\n".encode()
+  message = BytesParser(policy=default).parsebytes(header + raw)
+  fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+  if "file" not in fields:
+    raise HTTPException(status_code=400, detail="file is required")
+  purpose = fields["purpose"].get_content().strip() if "purpose" in fields else "batch"
+  return _store_file(fields["file"].get_payload(decode=True), fields["file"].get_filename() or "upload", purpose)
+
+
+@app.get("/v1/files/{file_id}/content")
+async def file_content(file_id: str) -> PlainTextResponse:
+  if file_id not in _files:
+    raise HTTPException(status_code=404, detail="No such file")
+  return PlainTextResponse(_files[file_id]["content"].decode("utf-8"))
+
+
+@app.post("/v1/batches")
+async def create_batch(body: Dict[str, Any]) -> Dict[str, Any]:
+  if body.get("input_file_id") not in _files:
+    raise HTTPException(status_code=400, detail="Unknown input_file_id")
+  batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+  _batches[batch_id] = {
+    "id": batch_id,
+    "object": "batch",
+    "endpoint": body["endpoint"],
+    "input_file_id": body["input_file_id"],
+    "completion_window": body["completion_window"],
+    "status": "in_progress",
+    "output_file_id": None,
+    "error_file_id": None,
+    "created_at": int(time.time()),
+    "request_counts": {"total": 0, "completed": 0, "failed": 0},
+  }
+  return _batches[batch_id]
+
+
+@app.get("/v1/batches/{batch_id}")
+async def retrieve_batch(batch_id: str) -> Dict[str, Any]:
+  batch = _batches.get(batch_id)
+  if batch is None:
+    raise HTTPException(status_code=404, detail="No such batch")
+  if batch["status"] == "in_progress" and time.time() - batch["created_at"] >= app.state.batch_delay:
+    outputs, errors = [], []
+    for line in _files[batch["input_file_id"]]["content"].decode("utf-8").splitlines():
+      item = json.loads(line)
+      result = {"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": item["custom_id"]}
+      if "FAIL" in item["body"]["messages"][-1]["content"]:
+        result["response"] = {"status_code": 400, "body": {"error": {"message": "Rejected by fake server"}}}
+        errors.append(result)
+      else:
+        result["response"] = {"status_code": 200, "body": _completion(item["body"])}
+        outputs.append(result)
+    if outputs:
+      batch["output_file_id"] = _store_file("\n".join(map(json.dumps, outputs)).encode(), "output.jsonl", "batch_output")["id"]
+    if errors:
+      batch["error_file_id"] = _store_file("\n".join(map(json.dumps, errors)).encode(), "errors.jsonl", "batch_output")["id"]
+    batch["status"] = "completed"
+    batch["request_counts"] = {"total": len(outputs) + len(errors), "completed": len(outputs), "failed": len(errors)}
+  return batch
+
+
+if __name__ == "__main__":
+  import uvicorn
+
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8100)
+  parser.add_argument("--batch-delay", type=float, default=5.0, help="seconds until a batch completes")
+  args = parser.parse_args()
+  app.state.batch_delay = args.batch_delay
+  uvicorn.run(app, host=args.host, port=args.port)
@@ -2,6 +2,8 @@
 
 import asyncio
 import json
+from datetime import datetime, timezone
+
 from app.services.database import LocalDatabase
 
 
@@ -39,12 +41,8 @@ async def init_sample_data():
       }
     ]
 
-    for doctor in doctors:
-      try:
-        await db.insert("users", doctor)
-        print(f"✅ Added doctor: {doctor['email']}")
-      except Exception as e:
-        print(f"⚠️  Doctor {doctor['email']} may already exist: {e}")
+    await db.upsert_many("users", doctors, ["email"])
+    print(f"✅ Upserted {len(doctors)} doctors")
 
     # Insert multiple patients with diverse conditions
     patients = [
@@ -86,12 +84,10 @@ async def init_sample_data():
       }
     ]
 
-    for patient in patients:
-      try:
-        await db.insert("users", patient)
-        print(f"✅ Added patient: {patient['email']}")
-      except Exception as e:
-        print(f"⚠️  Patient {patient['email']} may already exist: {e}")
+    await db.upsert_many("users", patients, ["email"])
+    print(f"✅ Upserted {len(patients)} patients")
+
+    synced_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
 
     # Insert comprehensive Epic patient data with realistic medical information
     epic_data = [
@@ -198,11 +194,9 @@ async def init_sample_data():
     ]
 
     for data in epic_data:
-      try:
-        await db.insert("epic_patient_data", data)
-        print(f"✅ Added Epic data for: {data['patient_name']}")
-      except Exception as e:
-        print(f"⚠️  Epic data for {data['patient_name']} may already exist: {e}")
+      data["last_synced"] = synced_at
+    await db.upsert_many("epic_patient_data", epic_data, ["doctor_email", "epic_patient_id"])
+    print(f"✅ Upserted Epic data for {len(epic_data)} patients")
 
     print("\n" + "="*60)
     print("✅ Database initialization completed successfully!")
@@ -0,0 +1,127 @@
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pytest
+
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from app.dependencies import get_settings  # noqa: E402
+from app.services.cache import _RELEASE_LEASE_SCRIPT  # noqa: E402
+
+
+@pytest.fixture
+def run():
+  """Run a coroutine to completion on a fresh event loop."""
+  return asyncio.run
+
+
+@pytest.fixture
+def settings(monkeypatch):
+  """``get_settings()`` with placeholder API credentials and every other setting at its default."""
+  for name in ("OPENAI_API_KEY", "HEYGEN_API_KEY", "HEYGEN_AVATAR_ID", "HEYGEN_VOICE_ID"):
+    monkeypatch.setenv(name, "test")
+  get_settings.cache_clear()
+  yield get_settings()
+  get_settings.cache_clear()
+
+
+class FakeRespServer:
+  """In-process Redis-protocol server covering the commands ``RedisCache`` sends.
+
+  It runs on its own thread and event loop, so it outlives each test's
+  ``asyncio.run``. Set ``reply_delay`` to hold replies back, e.g. to cancel a
+  client between writing a command and reading its reply.
+  """
+
+  def __init__(self) -> None:
+    self.data: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+    self.reply_delay = 0.0
+    self.port = 0
+    self._loop = asyncio.new_event_loop()
+    self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+  def start(self) -> "FakeRespServer":
+    self._thread.start()
+    self._server = asyncio.run_coroutine_threadsafe(
+      asyncio.start_server(self._serve, "127.0.0.1", 0), self._loop
+    ).result()
+    self.port = self._server.sockets[0].getsockname()[1]
+    return self
+
+  def stop(self) -> None:
+    asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+    self._loop.call_soon_threadsafe(self._loop.stop)
+    self._thread.join()
+    self._loop.close()
+
+  async def _shutdown(self) -> None:
+    self._server.close()
+    handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in handlers:
+      task.cancel()
+    await asyncio.gather(*handlers, return_exceptions=True)
+
+  def _get(self, key: bytes) -> Optional[bytes]:
+    value, expires_at = self.data.get(key, (None, None))
+    if expires_at is not None and expires_at <= time.monotonic():
+      del self.data[key]
+      return None
+    return value
+
+  def _command(self, name: bytes, args: List[bytes]) -> bytes:
+    if name in (b"AUTH", b"SELECT"):
+      return b"+OK\r\n"
+    if name == b"GET":
+      value = self._get(args[0])
+      return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+    if name == b"SET":
+      key, value, options = args[0], args[1], [arg.upper() for arg in args[2:]]
+      if b"NX" in options and self._get(key) is not None:
+        return b"$-1\r\n"
+      ttl = int(options[options.index(b"PX") + 1]) / 1000 if b"PX" in options else None
+      self.data[key] = (value, time.monotonic() + ttl if ttl else None)
+      return b"+OK\r\n"
+    if name == b"DEL":
+      return b":%d\r\n" % sum(self.data.pop(key, None) is not None for key in args)
+    if name == b"INCR":
+      value = int(self._get(args[0]) or 0) + 1
+      self.data[args[0]] = (str(value).encode(), None)
+      return b":%d\r\n" % value
+    if name == b"EVAL" and args[0].decode() == _RELEASE_LEASE_SCRIPT:
+      if self._get(args[2]) == args[3]:
+        del self.data[args[2]]
+        return b":1\r\n"
+      return b":0\r\n"
+    return b"-ERR unsupported command '%s'\r\n" % name
+
+  async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+      while True:
+        header = await reader.readline()
+        if not header:
+          break
+        args = []
+        for _ in range(int(header[1:])):
+          length = int((await reader.readline())[1:])
+          args.append((await reader.readexactly(length + 2))[:-2])
+        if self.reply_delay:
+          await asyncio.sleep(self.reply_delay)
+        writer.write(self._command(args[0].upper(), args[1:]))
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+      pass
+    finally:
+      writer.close()
+
+
+@pytest.fixture(scope="session")
+def resp_server():
+  server = FakeRespServer().start()
+  yield server
+  server.stop()
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from app.services.admission import Overloaded, StageLimiter
+from app.services.scheduler import Ticket, scheduled_as
+
+
+async def _hold(limiter, release, ticket=Ticket()):
+  with scheduled_as(ticket):
+    async with limiter.slot():
+      await release.wait()
+
+
+def test_a_full_wait_queue_rejects_at_once_with_429(run):
+  async def scenario():
+    limiter = StageLimiter("render", 1, queue_size=1, queue_timeout=30)
+    release = asyncio.Event()
+    holder = asyncio.create_task(_hold(limiter, release))
+    waiter = asyncio.create_task(_hold(limiter, release))
+    await asyncio.sleep(0.01)
+    assert (limiter.active, limiter.waiting) == (1, 1)
+
+    with pytest.raises(Overloaded) as rejected:
+      async with limiter.slot():
+        pass
+    assert rejected.value.status_code == 429 and rejected.value.retry_after >= 1
+    assert limiter.rejected == 1
+
+    # The queued caller gets the slot as soon as the holder lets go.
+    release.set()
+    await asyncio.gather(holder, waiter)
+    assert (limiter.active, limiter.waiting, limiter.admitted) == (0, 0, 2)
+
+  run(scenario())
+
+
+def test_waiting_past_the_queue_timeout_gives_up_with_503(run):
+  async def scenario():
+    limiter = StageLimiter("llm", 1, queue_size=5, queue_timeout=0.05)
+    release = asyncio.Event()
+    holder = asyncio.create_task(_hold(limiter, release))
+    await asyncio.sleep(0.01)
+    with pytest.raises(Overloaded) as timed_out:
+      async with limiter.slot():
+        pass
+    assert timed_out.value.status_code == 503
+    assert (limiter.timed_out, limiter.waiting) == (1, 0)
+    release.set()
+    await holder
+
+  run(scenario())
+
+
+def test_a_cancelled_waiter_leaves_the_queue(run):
+  async def scenario():
+    limiter = StageLimiter("download", 1, queue_size=1, queue_timeout=30)
+    release = asyncio.Event()
+    holder = asyncio.create_task(_hold(limiter, release))
+    waiter = asyncio.create_task(_hold(limiter, release))
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    assert limiter.waiting == 0
+    release.set()
+    await holder
+    assert limiter.active == 0
+
+  run(scenario())
+
+
+def test_interactive_reserve_keeps_a_slot_free_of_background_work(run):
+  async def scenario():
+    limiter = StageLimiter("pipeline", 2, queue_size=5, queue_timeout=30, interactive_reserve=1)
+    release = asyncio.Event()
+    background = Ticket("warming", "clinic-a")
+    first = asyncio.create_task(_hold(limiter, release, background))
+    second = asyncio.create_task(_hold(limiter, release, background))
+    await asyncio.sleep(0.01)
+    assert (limiter.active, limiter.waiting) == (1, 1)
+
+    with scheduled_as(Ticket("interactive", "clinic-b")):
+      async with limiter.slot():
+        assert limiter.active == 2
+    release.set()
+    await asyncio.gather(first, second)
+    assert limiter.snapshot()["admitted"] == 3
+
+  run(scenario())
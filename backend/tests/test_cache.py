@@ -0,0 +1,208 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from app.services.cache import MemoryCache, RedisCache, SQLiteCache, _RespConnection, create_cache
+
+
+# Set REDIS_URL to run the Redis cases against a real server; by default they use the in-process fake.
+REDIS_URL = os.getenv("REDIS_URL")
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def make_cache(request, tmp_path):
+  """Factory for the backend under test; call it inside the event loop that uses the cache."""
+  if request.param == "memory":
+    return lambda: MemoryCache()
+  if request.param == "sqlite":
+    return lambda: SQLiteCache(str(tmp_path / "cache.db"))
+  url = REDIS_URL or f"redis://127.0.0.1:{request.getfixturevalue('resp_server').port}/15"
+  # A fresh prefix per test keeps runs independent without flushing the database.
+  prefix = f"amma-test-{uuid.uuid4().hex}:"
+  return lambda: create_cache(f"{url}?prefix={prefix}")
+
+
+def _text(reply):
+  return reply.decode("utf-8") if isinstance(reply, bytes) else reply
+
+
+async def _using(make_cache, scenario):
+  cache = make_cache()
+  try:
+    await scenario(cache)
+  finally:
+    await cache.close()
+
+
+def _counting(value, delay=0.05):
+  calls = []
+
+  async def compute():
+    calls.append(1)
+    await asyncio.sleep(delay)
+    return value
+
+  return compute, calls
+
+
+def test_get_or_compute_runs_compute_once_for_concurrent_callers(make_cache, run):
+  async def scenario(cache):
+    compute, calls = _counting({"scenes": ["intro", "closing"]})
+    results = await asyncio.gather(*(cache.get_or_compute("ns", "key", compute) for _ in range(20)))
+    assert results == [{"scenes": ["intro", "closing"]}] * 20
+    assert len(calls) == 1
+    assert await cache.get("ns", "key") == (True, {"scenes": ["intro", "closing"]})
+
+  run(_using(make_cache, scenario))
+
+
+def test_get_or_compute_caches_none(make_cache, run):
+  async def scenario(cache):
+    compute, calls = _counting(None, delay=0)
+    assert await cache.get_or_compute("ns", "empty", compute) is None
+    assert await cache.get_or_compute("ns", "empty", compute) is None
+    assert len(calls) == 1
+
+  run(_using(make_cache, scenario))
+
+
+def test_get_or_compute_does_not_cache_failures(make_cache, run):
+  async def scenario(cache):
+    async def failing():
+      raise RuntimeError("LLM unavailable")
+
+    with pytest.raises(RuntimeError):
+      await cache.get_or_compute("ns", "key", failing)
+    compute, calls = _counting("ok", delay=0)
+    assert await cache.get_or_compute("ns", "key", compute) == "ok"
+    assert len(calls) == 1
+
+  run(_using(make_cache, scenario))
+
+
+def test_get_or_compute_recomputes_after_invalidate_and_ttl(make_cache, run):
+  async def scenario(cache):
+    compute, calls = _counting("v", delay=0)
+    await cache.get_or_compute("ns", "key", compute)
+    await cache.get_or_compute("other", "key", compute)
+    await cache.invalidate("ns")
+    assert (await cache.get("ns", "key"))[0] is False
+    assert (await cache.get("other", "key"))[0] is True
+    await cache.get_or_compute("ns", "key", compute)
+    assert len(calls) == 3
+
+    await cache.get_or_compute("ns", "short", compute, ttl=0.2)
+    await asyncio.sleep(0.3)
+    await cache.get_or_compute("ns", "short", compute, ttl=0.2)
+    assert len(calls) == 5
+
+  run(_using(make_cache, scenario))
+
+
+def test_shared_backends_compute_once_across_instances(make_cache, run):
+  async def scenario(first):
+    if isinstance(first, MemoryCache):
+      pytest.skip("the memory backend is per process")
+    second = make_cache()
+    try:
+      compute, calls = _counting("shared", delay=0.2)
+      results = await asyncio.gather(
+        first.get_or_compute("ns", "key", compute),
+        second.get_or_compute("ns", "key", compute),
+      )
+      assert results == ["shared", "shared"]
+      assert len(calls) == 1
+    finally:
+      await second.close()
+
+  run(_using(make_cache, scenario))
+
+
+def test_redis_lease_release_keeps_a_lease_taken_over_by_another_worker(make_cache, run):
+  async def scenario(cache):
+    if not isinstance(cache, RedisCache):
+      pytest.skip("Redis leases only")
+    token = await cache._acquire_lease("ns", "key")
+    assert token
+    # Our lease expired and another worker now holds it.
+    lease_key = f"{cache.prefix}lease:ns:key"
+    await cache._conn.execute("SET", lease_key, "other-worker")
+    await cache._release_lease("ns", "key", token)
+    assert _text(await cache._conn.execute("GET", lease_key)) == "other-worker"
+
+    await cache._release_lease("ns", "key", "other-worker")
+    assert await cache._conn.execute("GET", lease_key) is None
+
+  run(_using(make_cache, scenario))
+
+
+def test_redis_lease_release_is_atomic(make_cache, run):
+  async def scenario(cache):
+    if not isinstance(cache, RedisCache):
+      pytest.skip("Redis leases only")
+    token = await cache._acquire_lease("ns", "key")
+    lease_key = f"{cache.prefix}lease:ns:key"
+    execute = cache._conn.execute
+
+    async def takeover_between_commands(*args):
+      reply = await execute(*args)
+      if args[:2] == ("GET", lease_key):
+        # The lease expires and another worker claims it right after our read.
+        await execute("SET", lease_key, "other-worker")
+      return reply
+
+    cache._conn.execute = takeover_between_commands
+    try:
+      await cache._release_lease("ns", "key", token)
+    finally:
+      cache._conn.execute = execute
+    held = await cache._conn.execute("GET", lease_key)
+    assert held is None or _text(held) == "other-worker"
+
+  run(_using(make_cache, scenario))
+
+
+def test_resp_connection_is_dropped_when_cancelled_before_the_reply(resp_server, run):
+  async def scenario():
+    conn = _RespConnection("127.0.0.1", resp_server.port, password=None, db=0)
+    try:
+      await conn.execute("SET", "notes:a", "A's notes")
+      resp_server.reply_delay = 0.2
+      pending = asyncio.create_task(conn.execute("GET", "notes:a"))
+      await asyncio.sleep(0.05)
+      pending.cancel()
+      with pytest.raises(asyncio.CancelledError):
+        await pending
+      resp_server.reply_delay = 0
+      # A reused socket would hand this command the cancelled GET's reply.
+      assert await conn.execute("GET", "notes:b") is None
+    finally:
+      resp_server.reply_delay = 0
+      await conn.close()
+
+  run(scenario())
+
+
+def test_get_or_compute_keeps_misses_for_miss_ttl(make_cache, run):
+  async def scenario(cache):
+    compute, calls = _counting(None, delay=0)
+    await cache.get_or_compute("ns", "never", compute, ttl=60, miss_ttl=0)
+    await cache.get_or_compute("ns", "never", compute, ttl=60, miss_ttl=0)
+    assert len(calls) == 2
+
+    await cache.get_or_compute("ns", "briefly", compute, ttl=60, miss_ttl=0.2)
+    await cache.get_or_compute("ns", "briefly", compute, ttl=60, miss_ttl=0.2)
+    assert len(calls) == 3
+    await asyncio.sleep(0.3)
+    await cache.get_or_compute("ns", "briefly", compute, ttl=60, miss_ttl=0.2)
+    assert len(calls) == 4
+
+    found, found_calls = _counting({"file_url": "/v.mp4"}, delay=0)
+    await cache.get_or_compute("ns", "hit", found, ttl=60, miss_ttl=0)
+    await asyncio.sleep(0.3)
+    await cache.get_or_compute("ns", "hit", found, ttl=60, miss_ttl=0)
+    assert len(found_calls) == 1
+
+  run(_using(make_cache, scenario))
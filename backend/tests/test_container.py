@@ -0,0 +1,81 @@
+import asyncio
+
+from app.services.cache import MemoryCache
+from app.services.container import ServiceContainer
+from app.services.database import LocalDatabasePool
+from app.services.supabase import SupabaseService
+
+
+def test_services_borrow_pooled_connections(tmp_path, run):
+  async def scenario():
+    pool = LocalDatabasePool(str(tmp_path / "amma.db"), max_idle=1)
+    try:
+      first = SupabaseService(database_pool=pool, cache=MemoryCache())
+      await first._ensure_connected()
+      connection = first._db
+      await first.close()
+
+      second = SupabaseService(database_pool=pool, cache=MemoryCache())
+      await second._ensure_connected()
+      assert second._db is connection
+      # Work left uncommitted by one request is rolled back before the next borrows the connection.
+      await second._db._conn.execute("BEGIN")
+      await second._db._conn.execute(
+        "INSERT INTO users (email, first_name, last_name, user_type) VALUES ('a@b.c', 'A', 'B', 'patient')"
+      )
+      third = SupabaseService(database_pool=pool, cache=MemoryCache())
+      await third._ensure_connected()
+      assert third._db is not connection
+      await second.close()
+      await third.close()
+
+      # Only max_idle connections are kept; the extra one was closed on release.
+      assert pool._idle == [connection]
+      again = await pool.acquire()
+      assert await again.query("SELECT COUNT(*) AS n FROM users") == [{"n": 0}]
+      await pool.release(again)
+    finally:
+      await pool.close()
+
+  run(scenario())
+
+
+def test_container_builds_each_client_once_and_again_after_close(tmp_path, run):
+  async def scenario():
+    container = ServiceContainer(
+      openai_api_key="test",
+      database_path=str(tmp_path / "amma.db"),
+      storage_bucket=str(tmp_path / "storage"),
+    )
+    try:
+      await container.start()
+      assert container.supabase is None and len(container.database._idle) == 1
+      openai, http = container.openai, container.http
+      assert container.openai is openai and container.http is http
+      assert container.storage is container.storage
+      assert container.storage._http is http
+
+      await container.close()
+      assert http.is_closed and container.database._idle == []
+      assert container.http is not http and not container.http.is_closed
+      assert container.openai is not openai
+    finally:
+      await container.close()
+
+  run(scenario())
+
+
+def test_concurrent_first_acquires_migrate_once(tmp_path, run):
+  async def scenario():
+    pool = LocalDatabasePool(str(tmp_path / "amma.db"), max_idle=4)
+    try:
+      connections = await asyncio.gather(*(pool.acquire() for _ in range(4)))
+      assert len({id(db) for db in connections}) == 4
+      rows = await connections[0].query("SELECT COUNT(*) AS n FROM schema_migrations")
+      assert rows[0]["n"] > 0
+      for db in connections:
+        await pool.release(db)
+    finally:
+      await pool.close()
+
+  run(scenario())
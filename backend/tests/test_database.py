@@ -0,0 +1,103 @@
+import sqlite3
+
+import pytest
+
+from app.services.database import LocalDatabase
+
+
+SCHEMA = (
+  "CREATE TABLE items (id INTEGER PRIMARY KEY, code INTEGER, region TEXT, name TEXT, UNIQUE(code, region))",
+)
+
+
+def _with_db(path, scenario):
+  async def main():
+    db = await LocalDatabase(str(path)).connect(migrate=False)
+    try:
+      for statement in SCHEMA:
+        await db._conn.execute(statement)
+      await scenario(db)
+    finally:
+      await db.close()
+  return main()
+
+
+async def _names(db, ids):
+  rows = await db.query(f"SELECT id, name FROM items WHERE id IN ({', '.join('?' for _ in ids)})", tuple(ids))
+  names = {row["id"]: row["name"] for row in rows}
+  return [names[i] for i in ids]
+
+
+def test_insert_many_returns_ids_in_input_order(tmp_path, run):
+  async def scenario(db):
+    # Explicit, non-contiguous ids mixed with assigned ones.
+    await db.insert_many("items", [{"id": 50, "code": 0, "region": "x", "name": "first"}])
+    ids = await db.insert_many("items", [
+      {"id": 7, "code": 1, "region": "a", "name": "seven"},
+      {"id": None, "code": 2, "region": "a", "name": "auto"},
+      {"id": 3, "code": 3, "region": "a", "name": "three"},
+    ])
+    assert ids[0] == 7 and ids[2] == 3 and ids[1] == 51
+    assert await _names(db, ids) == ["seven", "auto", "three"]
+
+  run(_with_db(tmp_path / "t.db", scenario))
+
+
+def test_insert_many_chunks_over_the_parameter_limit(tmp_path, run, monkeypatch):
+  monkeypatch.setattr("app.services.database._MAX_SQL_PARAMS", 9)
+
+  async def scenario(db):
+    rows = [{"code": i, "region": "r", "name": f"n{i}"} for i in range(10)]
+    ids = await db.insert_many("items", rows)
+    assert await _names(db, ids) == [f"n{i}" for i in range(10)]
+
+  run(_with_db(tmp_path / "t.db", scenario))
+
+
+def test_upsert_many_maps_coerced_and_null_keys(tmp_path, run):
+  async def scenario(db):
+    first = await db.upsert_many("items", [{"code": 1, "region": "a", "name": "old"}], ["code", "region"])
+    ids = await db.upsert_many(
+      "items",
+      [
+        # "1" is stored as 1 under INTEGER affinity and hits the existing row.
+        {"code": "1", "region": "a", "name": "updated"},
+        # NULL never conflicts, so each of these is a new row.
+        {"code": None, "region": "a", "name": "null-1"},
+        {"code": None, "region": "a", "name": "null-2"},
+        {"code": 2, "region": "b", "name": "new"},
+      ],
+      ["code", "region"],
+    )
+    assert ids[0] == first[0]
+    assert len(set(ids)) == 4
+    assert await _names(db, ids) == ["updated", "null-1", "null-2", "new"]
+
+  run(_with_db(tmp_path / "t.db", scenario))
+
+
+def test_upsert_many_without_update_columns_keeps_rows_and_returns_ids(tmp_path, run):
+  async def scenario(db):
+    first = await db.insert_many("items", [{"code": 5, "region": "z", "name": "keep"}])
+    ids = await db.upsert_many(
+      "items",
+      [{"code": 5, "region": "z"}, {"code": 6, "region": "z"}, {"code": 5, "region": "z"}],
+      ["code", "region"],
+    )
+    assert ids[0] == ids[2] == first[0]
+    assert await _names(db, ids[:1]) == ["keep"]
+
+  run(_with_db(tmp_path / "t.db", scenario))
+
+
+def test_failed_batch_rolls_back(tmp_path, run):
+  async def scenario(db):
+    await db.insert_many("items", [{"id": 1, "code": 1, "region": "a", "name": "one"}])
+    with pytest.raises(sqlite3.IntegrityError):
+      await db.insert_many("items", [
+        {"id": 2, "code": 2, "region": "a", "name": "two"},
+        {"id": 1, "code": 3, "region": "a", "name": "duplicate id"},
+      ])
+    assert await db.query("SELECT id FROM items ORDER BY id") == [{"id": 1}]
+
+  run(_with_db(tmp_path / "t.db", scenario))
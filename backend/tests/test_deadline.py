@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.models.requests import VideoGenerationRequest
+from app.routers import videos
+from app.services.admission import AdmissionController, StageLimiter
+from app.services.deadline import DeadlineExceeded, current_deadline, deadline_after, remaining
+from app.services.drain import DrainCoordinator
+from app.services.jobs import JobQueue
+from app.services.scheduler import FairPolicy
+from app.services.stage_graph import Stage, StageGraph, TraceLog
+
+
+REQUEST = VideoGenerationRequest(
+  doctor_email="dr.rao@amma.health",
+  patient_email="anika@example.com",
+  diagnosis_code="I10",
+  procedure_code="99213",
+)
+
+
+async def _sleep_stage(results):
+  await asyncio.sleep(10)
+
+
+async def _context_stage(results):
+  return {"patient": "anika@example.com"}
+
+
+def test_nested_deadlines_can_only_be_earlier(run):
+  async def scenario():
+    assert current_deadline() is None and remaining() is None
+    with deadline_after(0.05) as outer:
+      with deadline_after(30) as inner:
+        assert inner == outer
+      with deadline_after(0.01) as earlier:
+        assert earlier < outer
+      await asyncio.sleep(0.06)
+      with pytest.raises(DeadlineExceeded, match="during the render poll"):
+        remaining("the render poll")
+    assert current_deadline() is None
+
+  run(scenario())
+
+
+def test_the_deadline_cancels_a_running_stage(run):
+  traces = TraceLog()
+  graph = StageGraph([
+    Stage("context", _context_stage),
+    Stage("render", _sleep_stage, after=("context",), timeout=30),
+    Stage("download", _context_stage, after=("render",)),
+  ])
+
+  async def scenario():
+    with deadline_after(0.05):
+      with pytest.raises(DeadlineExceeded, match="during stage render"):
+        await asyncio.wait_for(graph.run(on_trace=traces.record), 2)
+
+  run(scenario())
+  trace = traces.recent()[-1]
+  assert trace.outcome == "failed"
+  # The render's own 30 s timeout is clipped to the deadline, which is what it reports.
+  assert {span.stage: span.status for span in trace.spans} == {
+    "context": "ok", "render": "deadline", "download": "cancelled",
+  }
+
+
+def test_a_queued_caller_gives_up_when_its_deadline_comes_first(run):
+  async def scenario():
+    limiter = StageLimiter("render", 1, queue_size=5, queue_timeout=30)
+    release = asyncio.Event()
+
+    async def hold():
+      async with limiter.slot():
+        await release.wait()
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0.01)
+    with deadline_after(0.05):
+      with pytest.raises(DeadlineExceeded, match="the wait for a render slot"):
+        async with limiter.slot():
+          pass
+    # Not counted as the stage timing out.
+    assert limiter.timed_out == 0 and limiter.waiting == 0
+    release.set()
+    await holder
+
+  run(scenario())
+
+
+class _Client:
+  """The ``receive`` side of a request whose client hangs up when ``gone`` is set."""
+
+  def __init__(self):
+    self.gone = asyncio.Event()
+
+  async def receive(self):
+    await self.gone.wait()
+    return {"type": "http.disconnect"}
+
+
+class _Pipeline:
+  def __init__(self, submit_render):
+    self.submit_render = submit_render
+    self.waiting = asyncio.Event()
+
+  async def run(self, request, *, state, checkpoint):
+    state["script"] = {"title": "Managing blood pressure"}
+    await checkpoint("script", state)
+    if self.submit_render:
+      state["video_id"] = "hg-1"
+      await checkpoint("render", state)
+    self.waiting.set()
+    await asyncio.sleep(30)
+
+
+async def _disconnect_mid_generation(tmp_path, submit_render):
+  queue = JobQueue(str(tmp_path / "jobs.db"))
+  admission = AdmissionController({"pipeline": 1}, queue_size=1, queue_timeout=5)
+  drain = DrainCoordinator()
+  client, pipeline = _Client(), _Pipeline(submit_render)
+  try:
+    generation = asyncio.create_task(videos._generate(
+      REQUEST,
+      pipeline,
+      http_request=client,
+      drain=drain,
+      job_queue=queue,
+      admission=admission,
+      policy=FairPolicy(),
+    ))
+    await asyncio.wait_for(pipeline.waiting.wait(), 2)
+    client.gone.set()
+    with pytest.raises(HTTPException) as closed:
+      await asyncio.wait_for(generation, 2)
+    # Nobody's slot stays held for a client that left.
+    assert admission.stages["pipeline"].active == 0 and drain.in_flight == 0
+    detail = closed.value.detail
+    job = await queue.get(detail["job_id"]) if isinstance(detail, dict) else None
+    return closed.value, job
+  finally:
+    await queue.close()
+
+
+def test_a_submitted_render_is_handed_to_the_job_queue_when_the_client_disconnects(tmp_path, run, settings):
+  error, job = run(_disconnect_mid_generation(tmp_path, submit_render=True))
+  assert error.status_code == videos.CLIENT_CLOSED_REQUEST
+  assert error.headers["Location"] == f"/videos/jobs/{job.id}"
+  assert (job.status, job.stage, job.priority_class) == ("queued", "render", "recovery")
+  assert job.state["video_id"] == "hg-1" and job.request["diagnosis_code"] == "I10"
+
+
+def test_a_run_without_a_submitted_render_is_dropped_when_the_client_disconnects(tmp_path, run, settings):
+  error, job = run(_disconnect_mid_generation(tmp_path, submit_render=False))
+  assert error.status_code == videos.CLIENT_CLOSED_REQUEST
+  assert error.detail == "Client closed the request." and job is None
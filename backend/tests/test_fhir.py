@@ -0,0 +1,203 @@
+import json
+import re
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.dependencies import get_supabase_service
+from app.routers import epic
+from app.services.fhir import BundleAccumulator, ingest_bundle_stream, iter_bundle_entries
+from app.services.supabase import SupabaseService
+
+
+DOCTOR = "dr.rao@amma.health"
+
+
+def _patient(patient_id, full_url=None, **resource):
+  entry = {"resource": {"resourceType": "Patient", "id": patient_id, **resource}}
+  if full_url:
+    entry["fullUrl"] = full_url
+  return entry
+
+
+def _condition(reference, code, display="Condition"):
+  return {"resource": {
+    "resourceType": "Condition",
+    "subject": {"reference": reference},
+    "code": {"coding": [{"code": code, "display": display}]},
+  }}
+
+
+def _medication(reference, name):
+  return {"resource": {
+    "resourceType": "MedicationStatement",
+    "subject": {"reference": reference},
+    "medicationCodeableConcept": {"text": name},
+    "dosage": [{"text": "1 tablet daily"}],
+  }}
+
+
+# Keys named "entry" outside the top level, escaped quotes, brackets inside strings and multi-byte text.
+ENTRIES = [
+  _patient("p1", name=[{"given": ["Añika", "हि"], "family": 'O"Neil'}], telecom=[
+    {"system": "email", "value": " Anika@Example.com "},
+  ]),
+  _condition("Patient/p1", "I10", display='Hypertension ]}[{ "entry": ['),
+  {"resource": {"resourceType": "Observation", "entry": [{"entry": []}], "valueString": "\\\"}"}},
+  _medication("Patient/p1", "Amlodipine \U0001f48a"),
+]
+BUNDLE = json.dumps({
+  "resourceType": "Bundle",
+  "meta": {"tag": [{"code": "entry", "entry": ["not", "these"]}]},
+  "entry": ENTRIES,
+  "link": [{"relation": "self", "url": "https://fhir.example/entry?x=[1]"}],
+}, ensure_ascii=False).encode("utf-8")
+
+
+async def _stream(data, chunk_size):
+  for start in range(0, len(data), chunk_size):
+    yield data[start:start + chunk_size]
+
+
+async def _pieces(*parts):
+  for part in parts:
+    yield part
+
+
+async def _collect(chunks):
+  return [entry async for entry in iter_bundle_entries(chunks)]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, len(BUNDLE)])
+def test_scanner_yields_entries_for_any_chunk_size(chunk_size, run):
+  assert run(_collect(_stream(BUNDLE, chunk_size))) == ENTRIES
+
+
+def test_scanner_yields_entries_for_every_split_point(run):
+  for split in range(1, len(BUNDLE)):
+    assert run(_collect(_pieces(BUNDLE[:split], BUNDLE[split:]))) == ENTRIES, split
+
+
+def test_scanner_rejects_a_truncated_bundle(run):
+  with pytest.raises(ValueError):
+    run(_collect(_stream(BUNDLE[:-40], 16)))
+
+
+@pytest.mark.parametrize("entry, message", [
+  ("just text", "entry must be a JSON object"),
+  ({"resource": "Patient/1"}, "resource must be a JSON object"),
+  ({"resource": {"resourceType": "Patient", "id": "p", "name": {"family": "Rao"}}}, "Patient.name must be a JSON array"),
+  ({"resource": {"resourceType": "Patient", "id": "p", "name": ["Rao"]}}, "Patient.name[0] must be a JSON object"),
+  ({"resource": {"resourceType": "Patient", "id": "p", "name": [{"given": "Anika"}]}}, "Patient.name.given"),
+  ({"resource": {"resourceType": "Condition", "code": {"coding": "I10"}}}, "Condition.code.coding"),
+  ({"resource": {"resourceType": "MedicationRequest", "dosageInstruction": [7]}}, "MedicationRequest.dosage[0]"),
+])
+def test_malformed_entries_raise_value_error(entry, message, run):
+  data = json.dumps({"resourceType": "Bundle", "entry": [entry]}).encode()
+
+  async def ingest():
+    accumulator = BundleAccumulator()
+    async for item in iter_bundle_entries(_stream(data, 5)):
+      accumulator.add(item)
+
+  with pytest.raises(ValueError, match=re.escape(message)):
+    run(ingest())
+
+
+async def _ingest_into(db_path, entries, **kwargs):
+  service = SupabaseService(db_path=str(db_path))
+  try:
+    data = json.dumps({"resourceType": "Bundle", "entry": entries}).encode()
+    summary = await ingest_bundle_stream(_stream(data, 11), supabase_service=service, doctor_email=DOCTOR, **kwargs)
+    rows = await service._db.query(
+      "SELECT id, epic_patient_id, patient_email, patient_name, diagnoses, medications"
+      " FROM epic_patient_data ORDER BY epic_patient_id"
+    )
+    projected = await service._db.query(
+      "SELECT epic_patient_data_id, position, code FROM epic_diagnoses ORDER BY epic_patient_data_id, position"
+    )
+    return summary, rows, projected
+  finally:
+    await service.close()
+
+
+def test_ingest_flushes_in_batches_and_extends_patients_split_across_flushes(tmp_path, run):
+  entries = [
+    # Referenced by fullUrl before the Patient entry arrives.
+    _condition("urn:uuid:aaaa", "E11"),
+    _patient("p1", name=[{"given": ["Anika"], "family": "Rao"}]),
+    _condition("Patient/p1", "I10"),
+    _patient("p2", full_url="urn:uuid:aaaa"),
+    _condition("Patient/p2", "J45"),
+    # p1 comes back after it was flushed.
+    _condition("Patient/p1", "N18"),
+    _medication("Patient/p1", "Metformin"),
+    _condition("urn:uuid:aaaa", "K21"),
+  ]
+  summary, rows, projected = run(_ingest_into(tmp_path / "amma.db", entries, flush_resources=2))
+
+  assert summary["entries"] == 8 and summary["patients"] == 2
+  assert summary["conditions"] == 5 and summary["medications"] == 1
+  assert sorted(summary["epic_patient_data_ids"]) == [row["id"] for row in rows]
+
+  p1, p2 = rows
+  assert p1["epic_patient_id"] == "p1" and p1["patient_name"] == "Anika Rao"
+  assert [d["code"] for d in json.loads(p1["diagnoses"])] == ["I10", "N18"]
+  assert [m["name"] for m in json.loads(p1["medications"])] == ["Metformin"]
+  assert p2["epic_patient_id"] == "p2"
+  assert [d["code"] for d in json.loads(p2["diagnoses"])] == ["E11", "J45", "K21"]
+  assert [(d["epic_patient_data_id"], d["code"]) for d in projected] == [
+    (p1["id"], "I10"), (p1["id"], "N18"), (p2["id"], "E11"), (p2["id"], "J45"), (p2["id"], "K21"),
+  ]
+
+
+def test_ingest_matches_a_single_flush(tmp_path, run):
+  entries = [_patient(f"p{i % 5}") if i % 4 == 0 else _condition(f"Patient/p{i % 5}", f"C{i}") for i in range(40)]
+  _, batched, _ = run(_ingest_into(tmp_path / "batched.db", entries, flush_resources=3))
+  _, single, _ = run(_ingest_into(tmp_path / "single.db", entries))
+
+  def contents(rows):
+    return [(row["epic_patient_id"], json.loads(row["diagnoses"])) for row in rows]
+
+  assert contents(batched) == contents(single)
+
+
+def test_a_malformed_entry_after_the_first_flush_writes_nothing(tmp_path, run):
+  entries = [_patient(f"p{i}") for i in range(6)] + [_condition("Patient/p1", "I10")]
+  entries.append({"resource": {"resourceType": "Condition", "subject": "Patient/p2"}})
+
+  async def ingest():
+    service = SupabaseService(db_path=str(tmp_path / "amma.db"))
+    try:
+      data = json.dumps({"resourceType": "Bundle", "entry": entries}).encode()
+      with pytest.raises(ValueError, match="Condition.subject must be a JSON object"):
+        await ingest_bundle_stream(_stream(data, 7), supabase_service=service, doctor_email=DOCTOR, flush_resources=2)
+      await service._ensure_connected()
+      return await service._db.query("SELECT COUNT(*) AS n FROM epic_patient_data")
+    finally:
+      await service.close()
+
+  assert run(ingest()) == [{"n": 0}]
+
+
+def test_bundle_endpoint_returns_400_for_a_malformed_bundle(tmp_path):
+  async def local_service():
+    service = SupabaseService(db_path=str(tmp_path / "amma.db"))
+    try:
+      yield service
+    finally:
+      await service.close()
+
+  app = FastAPI()
+  app.include_router(epic.router)
+  app.dependency_overrides[get_supabase_service] = local_service
+  client = TestClient(app)
+  bad = {"resourceType": "Bundle", "entry": [{"resource": {"resourceType": "Patient", "id": "p", "name": "Rao"}}]}
+
+  res = client.post("/epic/bundles", params={"doctor_email": DOCTOR}, content=json.dumps(bad))
+  assert res.status_code == 400
+  assert "Patient.name must be a JSON array" in res.json()["detail"]
+
+  res = client.post("/epic/bundles", params={"doctor_email": DOCTOR}, content=b'{"entry": [{"resource": {}')
+  assert res.status_code == 400
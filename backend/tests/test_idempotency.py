@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+from app.services.idempotency import IdempotencyStore
+from app.services.supabase import SupabaseService
+
+
+def _store(tmp_path, **kwargs):
+  return IdempotencyStore(lambda: SupabaseService(db_path=str(tmp_path / "amma.db")), **kwargs)
+
+
+async def _using(store, scenario):
+  try:
+    await scenario(store)
+  finally:
+    await store.close()
+
+
+def test_waiters_get_the_completed_outcome(tmp_path, run):
+  async def scenario(store):
+    assert await store.claim("k", "hash") is None
+    async with store.run("k") as handle:
+      waiter = asyncio.create_task(store.wait("k"))
+      await asyncio.sleep(0)
+      await handle.complete(201, {"video_id": 7})
+    assert (await waiter)["response"] == {"video_id": 7}
+    assert (await store.claim("k", "hash"))["status"] == "completed"
+
+  run(_using(_store(tmp_path), scenario))
+
+
+def test_waiters_are_released_when_freeing_the_key_fails(tmp_path, run, monkeypatch):
+  async def failing_delete(self, key, *, status):
+    raise RuntimeError("database is locked")
+
+  async def scenario(store):
+    assert await store.claim("k", "hash") is None
+    waiter = None
+    with pytest.raises(RuntimeError, match="database is locked"):
+      async with store.run("k"):
+        waiter = asyncio.create_task(store.wait("k"))
+        await asyncio.sleep(0)
+        monkeypatch.setattr(SupabaseService, "delete_idempotency_key", failing_delete)
+        raise ValueError("render failed")
+    # The waiter is woken at once instead of sitting out wait_timeout.
+    assert await asyncio.wait_for(waiter, 1) is None
+
+  run(_using(_store(tmp_path, wait_timeout=30), scenario))
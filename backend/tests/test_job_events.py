@@ -0,0 +1,139 @@
+import asyncio
+import json
+
+import httpx
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.dependencies import get_job_event_hub, get_job_queue
+from app.routers import videos
+from app.services.job_events import JobEventHub
+from app.services.jobs import JobQueue
+
+
+def _app(queue, hub):
+  app = FastAPI()
+  app.include_router(videos.router)
+  app.dependency_overrides[get_job_queue] = lambda: queue
+  app.dependency_overrides[get_job_event_hub] = lambda: hub
+  return app
+
+
+async def _progress(queue, job_id, delay=0.05):
+  """Run a job the way a worker does, pausing so subscribers see each step arrive live."""
+  await asyncio.sleep(delay)
+  await queue.claim("worker")
+  await asyncio.sleep(delay)
+  await queue.publish(job_id, "stage", {"stage": "script"})
+  await asyncio.sleep(delay)
+  await queue.complete(job_id, "worker", {"video_url": "/storage/videos/v.mp4", "case_key": "I10", "reused": False})
+
+
+def _parse_sse(text):
+  events = []
+  for block in text.strip().split("\n\n"):
+    fields = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line and not line.startswith(":"))
+    events.append((fields.get("id"), fields["event"], json.loads(fields["data"])))
+  return events
+
+
+def test_subscribers_get_the_history_then_live_events_until_done(tmp_path, run):
+  async def scenario():
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    hub = JobEventHub(queue, poll_interval=5)
+    try:
+      job = await queue.enqueue({})
+      progress = asyncio.create_task(_progress(queue, job.id))
+      # Publishing in this process wakes the poller, so the long poll interval never shows.
+      received = [event.event async for event in hub.subscribe(job.id)]
+      await progress
+      assert received == ["queued", "started", "stage", "done"]
+      assert hub.subscribers == 0
+    finally:
+      hub.close()
+      await queue.close()
+
+  run(asyncio.wait_for(scenario(), 5))
+
+
+def test_closing_the_hub_ends_streams_and_quiet_streams_get_heartbeats(tmp_path, run):
+  async def scenario():
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    hub = JobEventHub(queue, poll_interval=0.01)
+    try:
+      job = await queue.enqueue({})
+      received = []
+
+      async def listen():
+        async for event in hub.subscribe(job.id, heartbeat=0.02):
+          received.append(event.event if event else None)
+
+      listener = asyncio.create_task(listen())
+      await asyncio.sleep(0.1)
+      hub.close()
+      await listener
+      assert received[0] == "queued" and None in received
+      assert [event async for event in hub.subscribe(job.id)] == []
+    finally:
+      await queue.close()
+
+  run(asyncio.wait_for(scenario(), 5))
+
+
+def test_sse_streams_progress_and_resumes_after_the_last_event_id(tmp_path, run, settings):
+  async def scenario():
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    hub = JobEventHub(queue, poll_interval=0.01)
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=_app(queue, hub)), base_url="http://amma.test")
+    try:
+      job = await queue.enqueue({})
+      progress = asyncio.create_task(_progress(queue, job.id))
+      res = await client.get(f"/videos/jobs/{job.id}/events")
+      await progress
+      assert res.headers["content-type"].startswith("text/event-stream")
+      assert res.text.startswith("retry: 2000\n")
+      events = _parse_sse(res.text)
+      assert [event for _, event, _ in events] == ["status", "queued", "started", "stage", "done"]
+      assert events[0][2]["status"] == "queued" and events[-1][2]["result"]["case_key"] == "I10"
+
+      started_id = events[2][0]
+      resumed = await client.get(f"/videos/jobs/{job.id}/events", headers={"Last-Event-ID": started_id})
+      status, *rest = _parse_sse(resumed.text)
+      assert status[2]["status"] == "succeeded"
+      assert [event for _, event, _ in rest] == ["stage", "done"]
+
+      # A client that already saw the end is told to stop reconnecting.
+      finished = await client.get(f"/videos/jobs/{job.id}/events", params={"after": events[-1][0]})
+      assert finished.status_code == 204
+      assert (await client.get("/videos/jobs/nope/events")).status_code == 404
+    finally:
+      await client.aclose()
+      hub.close()
+      await queue.close()
+
+  run(asyncio.wait_for(scenario(), 10))
+
+
+def test_websocket_pushes_events_and_closes_after_done(tmp_path, settings):
+  queue = JobQueue(str(tmp_path / "jobs.db"))
+  hub = JobEventHub(queue, poll_interval=0.01)
+
+  with TestClient(_app(queue, hub)) as client:
+    job = client.portal.call(queue.enqueue, {})
+    with client.websocket_connect(f"/videos/jobs/{job.id}/ws") as socket:
+      assert socket.receive_json()["data"]["status"] == "queued"
+      assert socket.receive_json()["event"] == "queued"
+      client.portal.call(_progress, queue, job.id, 0)
+      received = [socket.receive_json() for _ in range(3)]
+      assert [message["event"] for message in received] == ["started", "stage", "done"]
+      assert received[1]["data"] == {"stage": "script"} and received[1]["id"] > received[0]["id"]
+      assert socket.receive()["code"] == 1000
+
+    with client.websocket_connect("/videos/jobs/nope/ws") as socket:
+      assert socket.receive()["code"] == 4404
+
+    async def shut_down():
+      hub.close()
+      await queue.close()
+
+    client.portal.call(shut_down)
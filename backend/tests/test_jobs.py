@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from app.services.jobs import Deferred, JobQueue, JobWorker, LeaseLost
+
+
+async def _using(queue, scenario):
+  try:
+    await scenario(queue)
+  finally:
+    await queue.close()
+
+
+async def _event_names(queue, job_id):
+  return [event.event for event in await queue.events(job_id)]
+
+
+def test_claim_checkpoint_and_complete(tmp_path, run):
+  async def scenario(queue):
+    job = await queue.enqueue({"doctor_email": "dr.rao@amma.health"})
+    claimed = await queue.claim("worker-a")
+    assert claimed.id == job.id and claimed.attempts == 1
+    assert await queue.claim("worker-b") is None
+
+    await queue.checkpoint(job.id, "worker-a", "script", {"script": "hello"})
+    await queue.complete(job.id, "worker-a", {"video_url": "v.mp4"})
+    done = await queue.get(job.id)
+    assert (done.status, done.stage, done.result) == ("succeeded", "done", {"video_url": "v.mp4"})
+    assert await _event_names(queue, job.id) == ["queued", "started", "done"]
+    assert await queue.pending_count() == 0
+
+  run(_using(JobQueue(str(tmp_path / "jobs.db")), scenario))
+
+
+def test_an_expired_lease_is_resumed_from_its_checkpoint_by_another_worker(tmp_path, run):
+  async def scenario(queue):
+    job = await queue.enqueue({"doctor_email": "dr.rao@amma.health"})
+    await queue.claim("worker-a")
+    await queue.checkpoint(job.id, "worker-a", "render", {"video_id": "hg-1"})
+    await asyncio.sleep(0.1)
+
+    resumed = await queue.claim("worker-b")
+    assert resumed.id == job.id and resumed.attempts == 2
+    assert (resumed.stage, resumed.state) == ("render", {"video_id": "hg-1"})
+    with pytest.raises(LeaseLost):
+      await queue.checkpoint(job.id, "worker-a", "download", {})
+
+  run(_using(JobQueue(str(tmp_path / "jobs.db"), visibility_timeout=0.05), scenario))
+
+
+def test_failures_retry_until_attempts_run_out(tmp_path, run):
+  async def scenario(queue):
+    job = await queue.enqueue({})
+    await queue.claim("worker-a")
+    await queue.fail(job.id, "worker-a", "HeyGen 500", retry=True)
+    assert (await queue.get(job.id)).status == "queued"
+
+    await queue.claim("worker-a")
+    await queue.fail(job.id, "worker-a", "HeyGen 500 again", retry=True)
+    failed = await queue.get(job.id)
+    assert (failed.status, failed.error) == ("failed", "HeyGen 500 again")
+    assert await _event_names(queue, job.id) == ["queued", "started", "retrying", "started", "failed"]
+
+  run(_using(JobQueue(str(tmp_path / "jobs.db"), max_attempts=2, retry_backoff=0), scenario))
+
+
+def test_stopping_a_worker_hands_its_running_job_back(tmp_path, run):
+  async def handler(job, checkpoint):
+    job.state["video_id"] = "hg-1"
+    await checkpoint("render", job.state)
+    await asyncio.Event().wait()
+
+  async def scenario(queue):
+    job = await queue.enqueue({})
+    worker = JobWorker(queue, handler, concurrency=1, poll_interval=0.01)
+    worker.start()
+    for _ in range(200):
+      if (await queue.get(job.id)).stage == "render":
+        break
+      await asyncio.sleep(0.01)
+    await worker.stop(timeout=0)
+
+    handed_back = await queue.get(job.id)
+    assert (handed_back.status, handed_back.stage, handed_back.state) == ("queued", "render", {"video_id": "hg-1"})
+    # Draining is not the job's fault, so the attempt is not counted.
+    assert handed_back.attempts == 0 and handed_back.lease_owner is None
+    assert (await _event_names(queue, job.id))[-1] == "requeued"
+    assert (await queue.claim("worker-b")).state == {"video_id": "hg-1"}
+
+  run(_using(JobQueue(str(tmp_path / "jobs.db")), scenario))
+
+
+def test_a_deferred_job_is_released_for_later_without_using_an_attempt(tmp_path, run):
+  async def handler(job, checkpoint):
+    raise Deferred("render still processing", delay=60)
+
+  async def scenario(queue):
+    job = await queue.enqueue({})
+    worker = JobWorker(queue, handler)
+    await worker._run(await queue.claim(worker.owner))
+    deferred = await queue.get(job.id)
+    assert (deferred.status, deferred.attempts) == ("queued", 0)
+    assert deferred.available_at > deferred.updated_at + 59
+    assert await queue.claim("worker-b") is None
+
+  run(_using(JobQueue(str(tmp_path / "jobs.db")), scenario))
@@ -0,0 +1,106 @@
+import json
+
+import httpx
+import pytest
+from openai import AsyncOpenAI
+
+import fake_openai
+from app.services.llm_batch import ScriptBatcher, ScriptPending, request_id
+
+
+def _body(prompt, model="gpt-4o"):
+  return {"model": model, "messages": [{"role": "user", "content": prompt}]}
+
+
+@pytest.fixture
+def fake_server():
+  """fake_openai.py's app served in-process; batches complete on their first poll."""
+  fake_openai.app.state.batch_delay = 0
+  yield fake_openai
+  fake_openai.app.state.batch_delay = 5.0
+
+
+async def _using(tmp_path, scenario, **kwargs):
+  http_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=fake_openai.app))
+  client = AsyncOpenAI(api_key="test", base_url="http://fake-openai/v1", http_client=http_client)
+  batcher = ScriptBatcher(client, str(tmp_path / "jobs.db"), **kwargs)
+  try:
+    await scenario(batcher)
+  finally:
+    await batcher.close()
+    await client.close()
+
+
+async def _pending(batcher, body):
+  with pytest.raises(ScriptPending):
+    await batcher.result(body)
+
+
+def test_submit_poll_and_answer(tmp_path, run, fake_server):
+  async def scenario(batcher):
+    body = _body("Explain type 2 diabetes")
+    await _pending(batcher, body)
+    # Identical prompts share one request.
+    await _pending(batcher, dict(body))
+    assert await batcher.flush() is None
+
+    batch_id = await batcher.flush(force=True)
+    assert batch_id in fake_server._batches
+    assert await batcher.flush(force=True) is None
+    await _pending(batcher, body)
+
+    await batcher.poll()
+    completion = await batcher.result(body)
+    assert json.loads(completion["choices"][0]["message"]["content"])["title"] == "Understanding your condition"
+
+  run(_using(tmp_path, scenario))
+
+
+def test_flush_submits_one_batch_per_model(tmp_path, run, fake_server):
+  async def scenario(batcher):
+    bodies = [_body("a"), _body("b", model="gpt-4o-mini"), _body("c"), _body("d", model="gpt-4o-mini")]
+    for body in bodies:
+      await _pending(batcher, body)
+
+    batch_ids = [await batcher.flush(force=True), await batcher.flush(force=True)]
+    assert await batcher.flush(force=True) is None
+
+    submitted = {}
+    for batch_id in batch_ids:
+      batch = fake_server._batches[batch_id]
+      lines = fake_server._files[batch["input_file_id"]]["content"].decode().splitlines()
+      items = [json.loads(line) for line in lines]
+      submitted[batch_id] = {(item["body"]["model"], item["custom_id"]) for item in items}
+    assert sorted(submitted.values(), key=len) == [
+      {("gpt-4o", request_id(bodies[0])), ("gpt-4o", request_id(bodies[2]))},
+      {("gpt-4o-mini", request_id(bodies[1])), ("gpt-4o-mini", request_id(bodies[3]))},
+    ]
+
+    await batcher.poll()
+    for body in bodies:
+      assert (await batcher.result(body))["object"] == "chat.completion"
+
+  run(_using(tmp_path, scenario))
+
+
+def test_flush_waits_for_max_requests_or_max_wait(tmp_path, run, fake_server):
+  async def scenario(batcher):
+    await _pending(batcher, _body("one"))
+    assert await batcher.flush() is None
+    await _pending(batcher, _body("two"))
+    assert await batcher.flush() is not None
+
+  run(_using(tmp_path, scenario, max_requests=2))
+
+
+def test_failed_request_raises_once_then_queues_again(tmp_path, run, fake_server):
+  async def scenario(batcher):
+    body = _body("FAIL this one")
+    await _pending(batcher, body)
+    await batcher.flush(force=True)
+    await batcher.poll()
+    with pytest.raises(RuntimeError, match="Rejected by fake server"):
+      await batcher.result(body)
+    await _pending(batcher, body)
+
+  run(_using(tmp_path, scenario))
@@ -0,0 +1,114 @@
+import json
+
+import httpx
+import pytest
+from openai import AsyncOpenAI
+
+from app.services.llm import LLMService, check_script
+from app.services.llm_routing import ModelRouter, classify, parse_prices, parse_routes
+
+
+GOOD = {
+  "title": "Your recovery, day 3",
+  "intro": {"narration": "Hi Anika, today is day 3 of your knee recovery.", "visuals": "..."},
+  "closing": {"narration": "Keep up the stretching exercises.", "visuals": "..."},
+}
+# No closing narration, so it fails validation.
+SHORT = {"title": "Day 3", "intro": {"narration": "Hi Anika."}}
+
+
+def _openai(answers, seen):
+  """A client whose chat completions answer per model from ``answers`` (a dict, or an int status to fail with)."""
+
+  def handler(request):
+    body = json.loads(request.content)
+    seen.append(body["model"])
+    answer = answers[body["model"]]
+    if isinstance(answer, int):
+      return httpx.Response(answer, json={"error": {"message": "overloaded"}})
+    return httpx.Response(200, json={
+      "id": "chatcmpl-test",
+      "object": "chat.completion",
+      "created": 0,
+      "model": body["model"],
+      "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": json.dumps(answer)}}],
+      "usage": {"prompt_tokens": 1000, "completion_tokens": 200, "total_tokens": 1200},
+    })
+
+  return AsyncOpenAI(
+    api_key="test",
+    base_url="http://openai.test/v1",
+    max_retries=0,
+    http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+  )
+
+
+def _router():
+  return ModelRouter(
+    "gpt-4o",
+    routes=parse_routes("recovery_day=gpt-4o-mini>gpt-4.1-mini, generic=gpt-4o-mini"),
+    prices=parse_prices("gpt-4o=2.50/10.00,gpt-4o-mini=0.15/0.60"),
+  )
+
+
+def _script(answers, request_class="recovery_day"):
+  seen = []
+  router = _router()
+
+  async def scenario():
+    client = _openai(answers, seen)
+    try:
+      service = LLMService("test", "gpt-4o", client=client, router=router)
+      return await service.routed_script("prompt", request_class=request_class)
+    finally:
+      await client.close()
+
+  return scenario, seen, router
+
+
+def test_classes_and_model_chains():
+  assert classify({"recovery_milestone": " walk-unaided "}) == "milestone"
+  assert classify({"recovery_day": 3}) == "recovery_day"
+  assert classify({}) == "explainer"
+  router = _router()
+  assert router.models("recovery_day") == ("gpt-4o-mini", "gpt-4.1-mini", "gpt-4o")
+  assert router.models("explainer") == ("gpt-4o",)
+  with pytest.raises(ValueError, match="Unknown LLM route"):
+    parse_routes("discharge=gpt-4o-mini")
+
+
+def test_a_usable_answer_from_the_cheap_model_is_kept(run):
+  scenario, seen, router = _script({"gpt-4o-mini": GOOD})
+  assert run(scenario())["title"] == GOOD["title"]
+  assert seen == ["gpt-4o-mini"]
+  route = router.report()["routes"]["recovery_day"]
+  assert (route["requests"], route["escalated"], route["served_by"]) == (1, 0, {"gpt-4o-mini": 1})
+  assert route["cost_usd"] == pytest.approx((1000 * 0.15 + 200 * 0.60) / 1_000_000)
+
+
+def test_rejected_answers_and_errors_escalate_to_the_next_model(run):
+  scenario, seen, router = _script({"gpt-4o-mini": SHORT, "gpt-4.1-mini": 500, "gpt-4o": GOOD})
+  assert run(scenario())["closing"] == GOOD["closing"]
+  assert seen == ["gpt-4o-mini", "gpt-4.1-mini", "gpt-4o"]
+  report = router.report()
+  route = report["routes"]["recovery_day"]
+  assert (route["requests"], route["escalated"], route["served_by"]) == (1, 1, {"gpt-4o": 1})
+  calls = route["calls"]
+  assert (calls["gpt-4o-mini"]["rejected"], calls["gpt-4.1-mini"]["errors"], calls["gpt-4o"]["accepted"]) == (1, 1, 1)
+  # The rejected cheap call is still paid for.
+  assert route["cost_usd"] == pytest.approx((150 + 120 + 2500 + 2000) / 1_000_000)
+  assert report["unpriced_models"] == ["gpt-4.1-mini"]
+
+
+def test_the_last_model_answer_is_kept_even_if_it_fails_validation(run):
+  scenario, seen, _ = _script({"gpt-4o-mini": SHORT, "gpt-4.1-mini": SHORT, "gpt-4o": SHORT})
+  assert run(scenario())["title"] == "Day 3"
+  assert len(seen) == 3
+
+
+def test_recovery_scripts_must_mention_the_days_objectives():
+  context = {"recovery_plan": {"day": 3, "title": "Gentle stretching", "checklist": ["Ice the knee twice"]}}
+  assert check_script("recovery_day", GOOD, context) is None
+  vague = {**GOOD, "intro": {"narration": "Hello there."}, "closing": {"narration": "Take care."}}
+  assert check_script("recovery_day", vague, context) == "does not mention day 3's objectives"
+  assert check_script("generic", GOOD) == "no narration for brain_intro, what_is, benign_vs_malignant, symptoms, diagnosis"
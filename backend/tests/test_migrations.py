@@ -0,0 +1,102 @@
+import asyncio
+import re
+
+import aiosqlite
+
+from app.services import migrations
+from app.services.migrations import (
+  HOT_QUERIES,
+  MIGRATIONS,
+  apply_sqlite_migrations,
+  check_query_plans,
+  render_postgres_script,
+)
+
+
+async def _rows(conn, query):
+  async with conn.execute(query) as cursor:
+    return await cursor.fetchall()
+
+
+async def _schema(conn):
+  return sorted(await _rows(conn, "SELECT type, name, sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'"))
+
+
+def test_versions_are_unique_and_increasing():
+  versions = [migration.version for migration in MIGRATIONS]
+  assert versions == sorted(set(versions))
+  assert versions[0] == 1
+  assert len({migration.name for migration in MIGRATIONS}) == len(MIGRATIONS)
+
+
+def test_fresh_database_applies_every_migration_in_order_once(tmp_path, run):
+  async def scenario():
+    async with aiosqlite.connect(tmp_path / "amma.db") as conn:
+      assert await apply_sqlite_migrations(conn) == MIGRATIONS[-1].version
+      applied = await _rows(conn, "SELECT version, name FROM schema_migrations ORDER BY rowid")
+      assert applied == [(m.version, m.name) for m in MIGRATIONS]
+
+      schema = await _schema(conn)
+      assert await apply_sqlite_migrations(conn) == MIGRATIONS[-1].version
+      assert await _rows(conn, "SELECT COUNT(*) FROM schema_migrations") == [(len(MIGRATIONS),)]
+      assert await _schema(conn) == schema
+
+  run(scenario())
+
+
+def test_upgrading_step_by_step_matches_a_fresh_schema(tmp_path, run, monkeypatch):
+  async def scenario():
+    async with aiosqlite.connect(tmp_path / "fresh.db") as conn:
+      await apply_sqlite_migrations(conn)
+      fresh = await _schema(conn)
+
+    async with aiosqlite.connect(tmp_path / "upgraded.db") as conn:
+      for upto in range(1, len(MIGRATIONS) + 1):
+        monkeypatch.setattr(migrations, "MIGRATIONS", MIGRATIONS[:upto])
+        assert await apply_sqlite_migrations(conn) == MIGRATIONS[upto - 1].version
+        if upto == 1:
+          await conn.execute(
+            "INSERT INTO users (email, first_name, last_name, user_type) VALUES ('a@b.c', 'A', 'B', 'patient')"
+          )
+          await conn.commit()
+      assert await _schema(conn) == fresh
+      assert await _rows(conn, "SELECT email FROM users") == [("a@b.c",)]
+
+  run(scenario())
+
+
+def test_concurrent_connections_apply_each_migration_once(tmp_path, run):
+  async def scenario():
+    async with aiosqlite.connect(tmp_path / "amma.db") as first, aiosqlite.connect(tmp_path / "amma.db") as second:
+      versions = await asyncio.gather(apply_sqlite_migrations(first), apply_sqlite_migrations(second))
+      assert versions == [MIGRATIONS[-1].version] * 2
+      applied = await _rows(first, "SELECT version FROM schema_migrations ORDER BY version")
+      assert applied == [(m.version,) for m in MIGRATIONS]
+
+  run(scenario())
+
+
+def test_hot_queries_use_their_indexes(tmp_path, run):
+  async def scenario():
+    async with aiosqlite.connect(tmp_path / "amma.db") as conn:
+      await apply_sqlite_migrations(conn)
+      assert await check_query_plans(conn) == []
+      _, index = HOT_QUERIES["patients_by_diagnosis"]
+      await conn.execute(f"DROP INDEX {index}")
+      await conn.commit()
+
+    # A new connection, so no statement prepared before the DROP is reused.
+    async with aiosqlite.connect(tmp_path / "amma.db") as conn:
+      problems = await check_query_plans(conn)
+      assert problems[0].startswith("patients_by_diagnosis: expected index")
+      assert all(problem.startswith("patients_by_diagnosis: ") for problem in problems)
+
+  run(scenario())
+
+
+def test_postgres_script_lists_newer_migrations_in_order():
+  since = MIGRATIONS[2].version
+  script = render_postgres_script(since)
+  rendered = [int(version) for version in re.findall(r"^-- (\d{3})_", script, re.M)]
+  assert rendered == [m.version for m in MIGRATIONS if m.version > since and m.postgres]
+  assert script.count("BEGIN;") == script.count("COMMIT;") == len(rendered)
@@ -0,0 +1,85 @@
+from app.services.cache import MemoryCache
+from app.services.notes_digest import (
+  build_notes_digest,
+  digest_signature,
+  estimate_tokens,
+  relevance_terms,
+  split_sections,
+)
+from app.services.supabase import SupabaseService
+
+
+PATIENT = "anika@example.com"
+
+NOTE = """ASSESSMENT:
+Blood pressure remains elevated at 158/96 despite amlodipine.
+
+SOCIAL HISTORY:
+Lives with her daughter. Enjoys gardening and weekend walks in the park.
+
+PLAN:
+Increase amlodipine to 10 mg daily. Recheck blood pressure in two weeks.
+"""
+
+
+def test_sections_split_on_headings_and_blank_lines():
+  assert split_sections(NOTE) == [
+    ("ASSESSMENT:", "Blood pressure remains elevated at 158/96 despite amlodipine."),
+    ("SOCIAL HISTORY:", "Lives with her daughter. Enjoys gardening and weekend walks in the park."),
+    ("PLAN:", "Increase amlodipine to 10 mg daily. Recheck blood pressure in two weeks."),
+  ]
+
+
+def test_digest_keeps_relevant_sections_within_budget_in_note_order():
+  terms = relevance_terms(["Essential (primary) hypertension", "Amlodipine"])
+  assert terms == ["amlodipine", "essential", "hypertension", "primary"]
+  digest = build_notes_digest([NOTE], token_budget=45, terms=terms)
+  assert estimate_tokens(digest) <= 45
+  assert digest.startswith("ASSESSMENT:") and "PLAN:" in digest
+  assert "gardening" not in digest
+
+
+def test_digest_drops_sections_repeated_in_older_notes():
+  older = "PLAN:\nIncrease  amlodipine to 10 mg daily.   Recheck blood pressure in two weeks.\n\nFollow up with cardiology."
+  digest = build_notes_digest([NOTE, older], token_budget=1000)
+  assert digest.count("Increase amlodipine") == 1
+  assert digest.endswith("Follow up with cardiology.")
+  assert build_notes_digest([None, ""], token_budget=1000) is None
+
+
+def test_signature_changes_with_any_input_the_digest_depends_on():
+  files = [{"id": 1, "created_at": "2026-01-02", "text_revision": 0}, {"id": 2, "created_at": "2026-01-01"}]
+  base = digest_signature(files, token_budget=500, terms=["hypertension"])
+  assert digest_signature([dict(f) for f in files], token_budget=500, terms=["hypertension"]) == base
+  edited = [{**files[0], "text_revision": 1}, files[1]]
+  assert digest_signature(edited, token_budget=500, terms=["hypertension"]) != base
+  assert digest_signature(files[:1], token_budget=500, terms=["hypertension"]) != base
+  assert digest_signature(files, token_budget=600, terms=["hypertension"]) != base
+  assert digest_signature(files, token_budget=500, terms=["asthma"]) != base
+
+
+def test_editing_a_file_in_place_invalidates_the_cached_digest(tmp_path, run):
+  async def scenario():
+    service = SupabaseService(db_path=str(tmp_path / "amma.db"), cache=MemoryCache())
+    try:
+      await service._ensure_connected()
+      row = await service._db.insert("patient_files", {
+        "doctor_email": "dr.rao@amma.health",
+        "patient_email": PATIENT,
+        "file_type": "file",
+        "file_url": "/storage/files/visit.pdf",
+        "extracted_text": "PLAN:\nStart amlodipine 5 mg daily.",
+      })
+      assert "5 mg" in await service._recent_notes_digest(PATIENT, ["amlodipine"])
+
+      await service._db.execute(
+        "UPDATE patient_files SET extracted_text = ? WHERE id = ?",
+        ("PLAN:\nIncrease amlodipine to 10 mg daily.", row["id"]),
+      )
+      revision = await service._db.query("SELECT text_revision FROM patient_files WHERE id = ?", (row["id"],))
+      assert revision == [{"text_revision": 1}]
+      assert "10 mg" in await service._recent_notes_digest(PATIENT, ["amlodipine"])
+    finally:
+      await service.close()
+
+  run(scenario())
@@ -0,0 +1,125 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.dependencies import get_supabase_service
+from app.routers import patients
+from app.services.supabase import SupabaseService, _fts_match_expression
+
+
+DOCTOR = "dr.rao@amma.health"
+PATIENT = "anika@example.com"
+
+
+@pytest.fixture
+def client(tmp_path):
+  async def local_service():
+    service = SupabaseService(db_path=str(tmp_path / "amma.db"))
+    try:
+      yield service
+    finally:
+      await service.close()
+
+  app = FastAPI()
+  app.include_router(patients.router)
+  app.dependency_overrides[get_supabase_service] = local_service
+  return TestClient(app)
+
+
+def _add_files(tmp_path, run, rows):
+  async def insert():
+    service = SupabaseService(db_path=str(tmp_path / "amma.db"))
+    try:
+      await service._ensure_connected()
+      return await service._db.insert_many("patient_files", [{"doctor_email": DOCTOR, **row} for row in rows])
+    finally:
+      await service.close()
+
+  return run(insert())
+
+
+def _file(name, text, patient=PATIENT):
+  return {"patient_email": patient, "file_type": "file", "file_url": f"/storage/files/{name}", "file_name": name, "extracted_text": text}
+
+
+def test_match_expression_quotes_every_term_and_scopes_to_the_patient():
+  match = _fts_match_expression(PATIENT, 'diabetes" OR file_name:* NEAR(insulin')
+  owner = "p" + PATIENT.encode("utf-8").hex().upper()
+  assert match == f'search_owner:{owner} AND "diabetes" AND "OR" AND "file_name" AND "NEAR" AND "insulin"'
+  assert _fts_match_expression(PATIENT, '"* ( ) -') is None
+
+
+def test_search_ranks_matches_and_escapes_snippets(tmp_path, run, client):
+  _add_files(tmp_path, run, [
+    _file("labs.pdf", "HbA1c 8.1%. Diabetes control is poor; <script>alert(1)</script> diabetes diet reviewed."),
+    _file("visit.pdf", "Knee pain after a fall. Mentions diabetes once."),
+    _file("other.pdf", "Diabetes diabetes diabetes.", patient="someone@example.com"),
+  ])
+
+  res = client.get(f"/patients/{PATIENT}/files/search", params={"q": "diabetes"})
+  assert res.status_code == 200
+  results = res.json()["results"]
+  assert [hit["file_name"] for hit in results] == ["labs.pdf", "visit.pdf"]
+  snippet = results[0]["snippet"]
+  assert "<mark>Diabetes</mark>" in snippet and "&lt;script&gt;" in snippet and "<script>" not in snippet
+
+  res = client.get(f"/patients/{PATIENT}/files/search", params={"q": "diabetes", "limit": 1})
+  assert res.json()["next_offset"] == 1
+
+
+@pytest.mark.parametrize("query, expected", [
+  ('"', []),
+  ("-knee ^fall", ["visit.pdf"]),
+  ("NEAR(knee fall)", []),
+  ("diabetes OR cancer", []),
+  ("patient_email:*", []),
+])
+def test_search_operators_are_treated_as_words(tmp_path, run, client, query, expected):
+  # Every word has to appear, operator names included, and none of them is a syntax error.
+  _add_files(tmp_path, run, [_file("visit.pdf", "Knee pain after a fall. Mentions diabetes once.")])
+  res = client.get(f"/patients/{PATIENT}/files/search", params={"q": query})
+  assert res.status_code == 200
+  assert [hit["file_name"] for hit in res.json()["results"]] == expected
+
+
+def _video(name, created_at, patient=PATIENT):
+  return {"patient_email": patient, "file_type": "video", "file_url": f"/storage/videos/{name}", "file_name": name, "created_at": created_at}
+
+
+def test_video_pages_follow_the_cursor_through_equal_timestamps(tmp_path, run, client):
+  ids = _add_files(tmp_path, run, [
+    _video("a.mp4", "2026-01-01 09:00:00"),
+    _video("b.mp4", "2026-01-02 09:00:00"),
+    _video("c.mp4", "2026-01-02 09:00:00"),
+    _video("d.mp4", "2026-01-02 09:00:00"),
+    _video("e.mp4", "2026-01-03 09:00:00"),
+    _video("x.mp4", "2026-01-04 09:00:00", patient="someone@example.com"),
+  ])
+
+  seen, cursor = [], None
+  while True:
+    res = client.get(f"/patients/{PATIENT}/videos", params={"limit": 2, **({"cursor": cursor} if cursor else {})})
+    assert res.status_code == 200
+    page = res.json()
+    seen += [video["id"] for video in page["videos"]]
+    cursor = page["next_cursor"]
+    if cursor is None:
+      break
+  # Newest first, ties broken by id, nothing skipped or repeated across pages.
+  assert seen == [ids[4], ids[3], ids[2], ids[1], ids[0]]
+  assert client.get(f"/patients/{PATIENT}/videos", params={"cursor": "not-a-cursor"}).status_code == 400
+
+
+def test_an_unchanged_video_page_returns_304(tmp_path, run, client):
+  _add_files(tmp_path, run, [_video("a.mp4", "2026-01-01 09:00:00")])
+  first = client.get(f"/patients/{PATIENT}/videos")
+  etag = first.headers["etag"]
+  assert etag.startswith('W/"') and first.headers["cache-control"] == "private, no-cache"
+
+  again = client.get(f"/patients/{PATIENT}/videos", headers={"If-None-Match": etag})
+  assert again.status_code == 304 and again.content == b"" and again.headers["etag"] == etag
+
+  _add_files(tmp_path, run, [_video("b.mp4", "2026-01-02 09:00:00")])
+  changed = client.get(f"/patients/{PATIENT}/videos", headers={"If-None-Match": etag})
+  assert changed.status_code == 200 and changed.headers["etag"] != etag
+  assert [video["file_name"] for video in changed.json()["videos"]] == ["b.mp4", "a.mp4"]
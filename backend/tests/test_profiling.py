@@ -0,0 +1,94 @@
+import asyncio
+import json
+import pstats
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.services.profiling import LoopLagMonitor, ProfileMiddleware, Profiler, ProfilerBusy
+
+
+def _block_the_loop(seconds):
+  time.sleep(seconds)
+
+
+def _busy(seconds):
+  end = time.perf_counter() + seconds
+  while time.perf_counter() < end:
+    pass
+
+
+def test_a_blocked_loop_is_recorded_with_the_blocking_stack(run):
+  async def scenario():
+    monitor = LoopLagMonitor(threshold=0.05, interval=0.01)
+    monitor.start()
+    try:
+      await asyncio.sleep(0.05)
+      _block_the_loop(0.3)
+      await asyncio.sleep(0.05)
+    finally:
+      await monitor.stop()
+    return monitor.snapshot()
+
+  snapshot = run(scenario())
+  assert snapshot["stalls"] == 1 and not snapshot["running"]
+  stall = snapshot["recent_stalls"][0]
+  assert stall["lag_ms"] >= 250
+  assert any(line.endswith("in _block_the_loop") for line in stall["stack"])
+
+
+def test_sampled_captures_show_where_the_loop_spent_its_time(run):
+  async def scenario():
+    profiler = Profiler(sample_interval=0.002)
+    async with profiler.capture("collapsed", name="busy") as collapsed_id:
+      _busy(0.1)
+    async with profiler.capture("speedscope", name="busy") as speedscope_id:
+      _busy(0.1)
+    return profiler.artifacts[collapsed_id], profiler.artifacts[speedscope_id]
+
+  collapsed, speedscope = run(scenario())
+  assert "_busy (tests/test_profiling.py:" in collapsed.content.decode()
+  profile = json.loads(speedscope.content)
+  assert "_busy" in {frame["name"] for frame in profile["shared"]["frames"]}
+  assert profile["profiles"][0]["endValue"] > 0.05
+  assert speedscope.filename.endswith(".speedscope.json")
+
+
+def test_pstats_captures_load_and_do_not_overlap(tmp_path, run):
+  async def scenario():
+    profiler = Profiler()
+    async with profiler.capture("pstats", name="window") as capture_id:
+      _busy(0.02)
+      with pytest.raises(ProfilerBusy):
+        async with profiler.capture("pstats", name="second"):
+          pass
+    return profiler.artifacts[capture_id]
+
+  artifact = run(scenario())
+  (tmp_path / "profile").write_bytes(artifact.content)
+  functions = {name for _, _, name in pstats.Stats(str(tmp_path / "profile")).stats}
+  assert "_busy" in functions
+
+
+def test_middleware_profiles_only_authorized_requests(run):
+  profiler = Profiler()
+  app = FastAPI()
+
+  @app.get("/ping")
+  async def ping():
+    return {"ok": True}
+
+  app.add_middleware(ProfileMiddleware, profiler=lambda: profiler, authorize=lambda token: token == "secret")
+  client = TestClient(app)
+
+  res = client.get("/ping", headers={"X-Profile": "collapsed", "X-Admin-Token": "secret"})
+  assert res.json() == {"ok": True}
+  assert res.headers["x-profile-id"] in profiler.artifacts
+  assert profiler.artifacts[res.headers["x-profile-id"]].name == "GET /ping"
+
+  res = client.get("/ping", headers={"X-Profile": "collapsed", "X-Admin-Token": "wrong"})
+  assert "x-profile-id" not in res.headers and len(profiler.artifacts) == 1
+  res = client.get("/ping", headers={"X-Profile": "flamegraph", "X-Admin-Token": "secret"})
+  assert res.status_code == 400
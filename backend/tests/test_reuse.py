@@ -0,0 +1,85 @@
+import pytest
+
+from app.services.cache import MemoryCache
+from app.services.reuse import ReuseHierarchy, is_icd10, match_depth, normalize_code, parse_specialty_prefixes
+from app.services.supabase import SupabaseService
+
+
+DOCTOR = "dr.rao@amma.health"
+PATIENT = "anika@example.com"
+
+
+@pytest.mark.parametrize("code, other, depth", [
+  ("E1165", "E1169", 4),
+  ("E1165", "E119", 3),
+  ("E1165", "E131", 1),
+  ("E1165", "I10", 0),
+  ("E1165", "E1165", 5),
+])
+def test_match_depth_counts_icd10_levels(code, other, depth):
+  assert match_depth(code, other) == depth
+
+
+def test_codes_are_normalized_and_snomed_ids_have_no_hierarchy():
+  assert normalize_code(" e11.65 ") == "E1165"
+  assert is_icd10("E11.65") and is_icd10("I10")
+  assert not is_icd10("44054006") and not is_icd10("")
+
+
+def test_closest_prefers_the_deepest_match_then_the_newest_video():
+  candidates = [
+    {"case_key": "e119-old", "diagnosis_code": "E119", "created_at": "2026-01-01"},
+    {"case_key": "e119-new", "diagnosis_code": "E119", "created_at": "2026-03-01"},
+    {"case_key": "e1169", "diagnosis_code": "E1169", "created_at": "2025-06-01"},
+    {"case_key": "e131", "diagnosis_code": "E131", "created_at": "2026-04-01"},
+  ]
+  hierarchy = ReuseHierarchy(default_mode="hierarchical")
+  assert [row["case_key"] for row in hierarchy.closest("E11.65", candidates, min_prefix=3)] == [
+    "e1169", "e119-new", "e119-old",
+  ]
+  assert [row["case_key"] for row in hierarchy.closest("E11.65", candidates, min_prefix=1)][-1] == "e131"
+
+
+def test_specialties_can_require_a_deeper_match_or_exact_reuse():
+  hierarchy = ReuseHierarchy(min_prefix=3, specialty_prefix=parse_specialty_prefixes("Oncology=exact, endocrinology=4"))
+  assert hierarchy.min_prefix(None) == 3
+  assert hierarchy.min_prefix("oncology") is None
+  assert hierarchy.min_prefix("Endocrinology") == 4
+  with pytest.raises(ValueError):
+    ReuseHierarchy(default_mode="fuzzy")
+
+
+def test_related_videos_share_procedure_milestone_and_specialty(tmp_path, run):
+  async def scenario():
+    service = SupabaseService(db_path=str(tmp_path / "amma.db"), cache=MemoryCache())
+    try:
+      for case_key, code, procedure in (
+        ("e1169", "E11.69", "99213"),
+        ("e119", "E11.9", "99213"),
+        ("e119-surgery", "E11.9", "27447"),
+        ("i10", "I10", "99213"),
+        ("e1165", "E11.65", "99213"),
+      ):
+        await service.save_video_metadata(
+          doctor_email=DOCTOR, patient_email=PATIENT, file_url=f"/storage/videos/{case_key}.mp4",
+          file_name=f"{case_key}.mp4", case_key=case_key, diagnosis_code=code, procedure_code=procedure,
+          doctor_specialty="Endocrinology",
+        )
+      related = await service.find_related_videos(
+        case_key="e1165", diagnosis_code="E11.65", procedure_code="99213",
+        recovery_milestone=None, doctor_specialty="endocrinology", min_prefix=3,
+      )
+      closest = ReuseHierarchy().closest("E11.65", related, min_prefix=3)
+      assert [row["case_key"] for row in closest] == ["e1169", "e119"]
+      assert closest[0]["file_url"] == "/storage/videos/e1169.mp4"
+
+      # Real case keys fold in the specialty, so this is another case.
+      other_specialty = await service.find_related_videos(
+        case_key="e1165-cardiology", diagnosis_code="E11.65", procedure_code="99213",
+        recovery_milestone=None, doctor_specialty="cardiology", min_prefix=3,
+      )
+      assert other_specialty == []
+    finally:
+      await service.close()
+
+  run(scenario())
@@ -0,0 +1,93 @@
+import asyncio
+
+from app.services.admission import StageLimiter
+from app.services.jobs import JobQueue
+from app.services.scheduler import Candidate, FairPolicy, Ticket, parse_weights, scheduled_as, tenant_for
+
+
+def _candidate(item, priority, tenant, since):
+  return Candidate(rank=["interactive", "recovery", "warming"].index(priority), tenant=tenant, since=since, item=item)
+
+
+def test_pick_orders_by_class_then_tenant_share_then_age():
+  policy = FairPolicy(aging_seconds=0)
+  candidates = [
+    _candidate("warming", "warming", "a", 0),
+    _candidate("recovery-busy", "recovery", "busy", 1),
+    _candidate("recovery-idle", "recovery", "idle", 2),
+    _candidate("recovery-idle-newer", "recovery", "idle", 3),
+  ]
+  held = {"busy": 2}
+  order = []
+  while candidates:
+    chosen = policy.pick(candidates, held, now=10)
+    order.append(chosen.item)
+    candidates.remove(chosen)
+  assert order == ["recovery-idle", "recovery-idle-newer", "recovery-busy", "warming"]
+  assert policy.pick([], held) is None
+
+
+def test_tenant_weights_and_aging():
+  weighted = FairPolicy(aging_seconds=0, weights=parse_weights("big.org=4, small.org=1"))
+  candidates = [_candidate("big", "recovery", "big.org", 1), _candidate("small", "recovery", "small.org", 0)]
+  # Three slots at weight 4 is still a smaller share than one at weight 1.
+  assert weighted.pick(candidates, {"big.org": 3, "small.org": 1}, now=10).item == "big"
+
+  aging = FairPolicy(aging_seconds=60)
+  candidates = [_candidate("old-warming", "warming", "a", 0), _candidate("new-recovery", "recovery", "b", 10)]
+  assert aging.pick(candidates, {}, now=30).item == "new-recovery"
+  # Two minutes of waiting lift warming work to the top class, where it is the oldest.
+  assert aging.pick(candidates, {}, now=130).item == "old-warming"
+
+
+def test_tenant_for_falls_back_to_the_clinic_domain():
+  assert tenant_for(" Dr.Rao@Clinic.org ") == "dr.rao@clinic.org"
+  assert tenant_for("dr.rao@clinic.org", "domain") == "clinic.org"
+  assert tenant_for(None) == "anonymous"
+
+
+def test_claim_interleaves_tenants_and_serves_interactive_first(tmp_path, run):
+  async def scenario():
+    queue = JobQueue(str(tmp_path / "jobs.db"), policy=FairPolicy(aging_seconds=0))
+    try:
+      bulk = [await queue.enqueue({"doctor_email": "bulk@clinic-a.org"}) for _ in range(3)]
+      other = await queue.enqueue({"doctor_email": "dr@clinic-b.org"})
+      urgent = await queue.enqueue({"doctor_email": "bulk@clinic-a.org"}, priority="interactive")
+      claimed = [(await queue.claim("worker")).id for _ in range(5)]
+      assert claimed == [urgent.id, other.id, bulk[0].id, bulk[1].id, bulk[2].id]
+    finally:
+      await queue.close()
+
+  run(scenario())
+
+
+def test_stage_slots_go_to_the_highest_class_then_the_least_served_tenant(run):
+  async def scenario():
+    limiter = StageLimiter("render", 2, queue_size=10, queue_timeout=30, policy=FairPolicy(aging_seconds=0))
+    order = []
+    gate, long_gate = asyncio.Event(), asyncio.Event()
+
+    async def use(ticket, label, until=gate):
+      with scheduled_as(ticket):
+        async with limiter.slot():
+          order.append(label)
+          await until.wait()
+
+    # Tenant a keeps one slot for the whole test, so it holds more than b.
+    long_render = asyncio.create_task(use(Ticket("recovery", "a"), "long", long_gate))
+    first = asyncio.create_task(use(Ticket("recovery", "c"), "first"))
+    await asyncio.sleep(0.01)
+    waiters = [
+      asyncio.create_task(use(Ticket("warming", "c"), "warming")),
+      asyncio.create_task(use(Ticket("recovery", "a"), "recovery-a")),
+      asyncio.create_task(use(Ticket("recovery", "b"), "recovery-b")),
+      asyncio.create_task(use(Ticket("interactive", "a"), "interactive")),
+    ]
+    await asyncio.sleep(0.01)
+    gate.set()
+    await asyncio.gather(first, *waiters)
+    long_gate.set()
+    await long_render
+    assert order == ["long", "first", "interactive", "recovery-b", "recovery-a", "warming"]
+
+  run(scenario())
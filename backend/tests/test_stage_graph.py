@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from app.services.stage_graph import Finish, Stage, StageGraph, StageTimeout, TraceLog
+
+
+def _spans(trace):
+  return {span.stage: span.status for span in trace.spans}
+
+
+def _returning(value, delay=0.0):
+  async def stage(results):
+    await asyncio.sleep(delay)
+    return value
+
+  return stage
+
+
+def test_independent_stages_overlap_and_see_earlier_results(run):
+  seen = {}
+
+  async def combine(results):
+    seen.update(results)
+    return "video"
+
+  graph = StageGraph([
+    Stage("context", _returning("ctx")),
+    Stage("script", _returning("script", 0.1), after=("context",)),
+    Stage("reuse", _returning(None, 0.1), after=("context",)),
+    Stage("render", combine, after=("script", "reuse")),
+  ])
+  traces = TraceLog()
+
+  async def scenario():
+    started = asyncio.get_running_loop().time()
+    assert await graph.run(name="generate", on_trace=traces.record) is None
+    return asyncio.get_running_loop().time() - started
+
+  elapsed = run(scenario())
+  assert elapsed < 0.18
+  assert seen == {"context": "ctx", "script": "script", "reuse": None}
+  trace = traces.recent()[-1]
+  assert trace.outcome == "completed" and set(_spans(trace).values()) == {"ok"}
+
+
+def test_finish_ends_the_run_and_cancels_the_other_branch(run):
+  cancelled = asyncio.Event()
+
+  async def slow_script(results):
+    try:
+      await asyncio.sleep(10)
+    except asyncio.CancelledError:
+      cancelled.set()
+      raise
+
+  graph = StageGraph([
+    Stage("context", _returning("ctx")),
+    Stage("script", slow_script, after=("context",)),
+    Stage("reuse", _returning(Finish("cached.mp4"), 0.01), after=("context",)),
+    Stage("render", _returning("video"), after=("script", "reuse")),
+  ])
+  traces = TraceLog()
+
+  async def scenario():
+    finish = await asyncio.wait_for(graph.run(on_trace=traces.record), 2)
+    assert finish.value == "cached.mp4" and cancelled.is_set()
+
+  run(scenario())
+  trace = traces.recent()[-1]
+  assert trace.outcome == "finished"
+  assert _spans(trace) == {"context": "ok", "script": "cancelled", "reuse": "finish", "render": "cancelled"}
+
+
+def test_skipped_stages_unblock_their_dependents(run):
+  graph = StageGraph([
+    Stage("script", _returning("fresh"), skip=lambda: True),
+    Stage("render", _returning("video"), after=("script",)),
+  ])
+  traces = TraceLog()
+  run(graph.run(on_trace=traces.record))
+  assert _spans(traces.recent()[-1]) == {"script": "skipped", "render": "ok"}
+
+
+def test_a_stage_timeout_fails_the_run(run):
+  graph = StageGraph([
+    Stage("script", _returning("late", 1.0), timeout=0.05),
+    Stage("reuse", _returning(None, 1.0)),
+  ])
+  traces = TraceLog()
+  with pytest.raises(StageTimeout, match="Stage script did not finish within 0.05s"):
+    run(graph.run(on_trace=traces.record))
+  trace = traces.recent()[-1]
+  assert trace.outcome == "failed"
+  assert _spans(trace) == {"script": "timeout", "reuse": "cancelled"}
+
+
+def test_stages_must_follow_their_dependencies():
+  with pytest.raises(ValueError, match="undeclared"):
+    StageGraph([Stage("render", _returning(None), after=("script",)), Stage("script", _returning(None))])
+  with pytest.raises(ValueError, match="Duplicate"):
+    StageGraph([Stage("script", _returning(None)), Stage("script", _returning(None))])
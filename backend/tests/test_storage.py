@@ -0,0 +1,111 @@
+import asyncio
+import hashlib
+import os
+import time
+
+import httpx
+
+from app.services import storage
+from app.services.storage import StorageService
+
+
+VIDEO = os.urandom(2 * 1024 * 1024 + 5)
+URL = "https://render.test/v.mp4"
+
+
+class _Origin:
+  """Serves VIDEO with Range support; can cut the body short or hold it back."""
+
+  def __init__(self, *, cut_at=None, gate=None):
+    self.cut_at = cut_at
+    self.gate = gate
+    self.ranges = []
+
+  async def handler(self, request):
+    start = int(request.headers["Range"][len("bytes="):-1]) if "Range" in request.headers else 0
+    self.ranges.append(start)
+    if self.gate is not None:
+      await self.gate.wait()
+    cut_at, self.cut_at = self.cut_at, None
+
+    async def body():
+      yield VIDEO[start:cut_at or len(VIDEO)]
+      if cut_at:
+        raise httpx.ReadError("connection reset")
+
+    return httpx.Response(206 if start else 200, content=body())
+
+
+async def _download(tmp_path, origin, scenario):
+  http = httpx.AsyncClient(transport=httpx.MockTransport(origin.handler))
+  try:
+    await scenario(StorageService(storage_dir=str(tmp_path), http_client=http))
+  finally:
+    await http.aclose()
+
+
+def _key():
+  return hashlib.sha1(URL.encode()).hexdigest()
+
+
+def _partials(tmp_path):
+  return sorted(os.listdir(tmp_path / "partial"))
+
+
+def test_interrupted_download_resumes_with_a_range_request(tmp_path, run):
+  origin = _Origin(cut_at=1024 * 1024)
+
+  async def scenario(service):
+    try:
+      await service._download(URL)
+    except httpx.ReadError:
+      pass
+    # What was fetched is left under the URL's resume name.
+    assert _partials(tmp_path) == [f"{_key()}.part"]
+    path = await service._download(URL)
+    assert path.read_bytes() == VIDEO
+    assert origin.ranges == [0, 1024 * 1024]
+
+  run(_download(tmp_path, origin, scenario))
+
+
+def test_concurrent_downloads_of_one_url_do_not_share_a_file(tmp_path, run):
+  gate = asyncio.Event()
+  origin = _Origin(gate=gate)
+
+  async def scenario(service):
+    (tmp_path / "partial").mkdir()
+    key = _key()
+    (tmp_path / "partial" / f"{key}.part").write_bytes(VIDEO[:1000])
+    downloads = [asyncio.create_task(service._download(URL)) for _ in range(2)]
+    await asyncio.sleep(0.05)
+    gate.set()
+    first, second = await asyncio.gather(*downloads)
+    assert first != second
+    assert first.read_bytes() == second.read_bytes() == VIDEO
+    # One resumed the interrupted file, the other started over.
+    assert sorted(origin.ranges) == [0, 1000]
+
+  run(_download(tmp_path, origin, scenario))
+
+
+def test_stale_files_of_dead_downloads_are_resumed(tmp_path, run):
+  origin = _Origin()
+
+  async def scenario(service):
+    (tmp_path / "partial").mkdir()
+    key = _key()
+    orphan = tmp_path / "partial" / f"{key}.dead.part"
+    orphan.write_bytes(VIDEO[:500])
+    live = tmp_path / "partial" / f"{key}.live.part"
+    live.write_bytes(VIDEO[:700])
+    stale = time.time() - storage._ORPHANED_PARTIAL_AGE - 10
+    os.utime(orphan, (stale, stale))
+
+    path = await service._download(URL)
+    assert path.read_bytes() == VIDEO
+    assert origin.ranges == [500]
+    # A file still being written by another download is left alone.
+    assert _partials(tmp_path) == sorted([live.name, path.name])
+
+  run(_download(tmp_path, origin, scenario))
@@ -0,0 +1,36 @@
+import asyncio
+
+from app.services import supabase
+from app.services.cache import MemoryCache
+from app.services.supabase import SupabaseService
+
+
+DOCTOR = "dr.rao@amma.health"
+PATIENT = "anika@example.com"
+
+
+async def _services(tmp_path, scenario, count=1):
+  """``count`` services on one database, each with its own cache like separate worker processes."""
+  services = [SupabaseService(db_path=str(tmp_path / "amma.db"), cache=MemoryCache()) for _ in range(count)]
+  try:
+    await scenario(*services)
+  finally:
+    for service in services:
+      await service.close()
+
+
+def test_reuse_miss_expires_when_another_worker_saves_the_video(tmp_path, run, monkeypatch):
+  monkeypatch.setattr(supabase, "REUSE_MISS_TTL", 0.2)
+
+  async def scenario(first, second):
+    assert await first.find_reusable_video("I10|knee|day-3|ortho") is None
+    # The other worker's save invalidates its own cache entry, not this one's.
+    await second.save_video_metadata(
+      doctor_email=DOCTOR, patient_email=PATIENT, file_url="/storage/videos/v1.mp4",
+      file_name="v1.mp4", case_key="I10|knee|day-3|ortho",
+    )
+    await asyncio.sleep(0.3)
+    found = await first.find_reusable_video("I10|knee|day-3|ortho")
+    assert found["file_url"] == "/storage/videos/v1.mp4"
+
+  run(_services(tmp_path, scenario, count=2))
@@ -0,0 +1,202 @@
+import asyncio
+import os
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.dependencies import get_video_cache
+from app.routers import storage as storage_router
+from app.services.storage import StorageService
+from app.services.video_cache import VideoCache
+
+
+class _Bucket:
+  def __init__(self, objects):
+    self.objects = objects
+    self.signed = []
+
+  def create_signed_url(self, path, expires_in):
+    if path not in self.objects:
+      raise RuntimeError(f"Object not found: {path}")
+    self.signed.append(path)
+    return {"signedURL": f"https://bucket.test/{path}"}
+
+
+class _Storage:
+  def __init__(self, bucket):
+    self.bucket = bucket
+
+  def from_(self, name):
+    return self.bucket
+
+
+class _Supabase:
+  """The slice of the Supabase client the read-through path uses."""
+
+  def __init__(self, objects):
+    self.storage = _Storage(_Bucket(objects))
+
+
+def _bucket_http(objects, gate=None):
+  async def handler(request):
+    if gate is not None:
+      await gate.wait()
+    return httpx.Response(200, content=objects[request.url.path.lstrip("/")])
+
+  return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+async def _put(cache, name, size):
+  tmp = await cache.temp_path(name)
+  tmp.write_bytes(b"v" * size)
+  return await cache.put(name, tmp)
+
+
+async def _serve(cache, name):
+  assert await cache.acquire(name) is not None
+  await cache.release(name)
+
+
+def _names(directory):
+  return sorted(os.listdir(directory))
+
+
+def test_put_moves_the_file_and_lru_evicts_the_least_recently_served(tmp_path, run):
+  async def scenario():
+    cache = VideoCache(tmp_path / "videos", max_bytes=25)
+    path = await _put(cache, "a.mp4", 10)
+    assert path.read_bytes() == b"v" * 10
+    await _put(cache, "b.mp4", 10)
+    await _serve(cache, "a.mp4")
+    await _put(cache, "c.mp4", 10)
+    assert _names(tmp_path / "videos") == ["a.mp4", "c.mp4"]
+    assert cache.used_bytes == 20
+
+  run(scenario())
+
+
+def test_lfu_evicts_the_least_frequently_served(tmp_path, run):
+  async def scenario():
+    cache = VideoCache(tmp_path / "videos", max_bytes=25, policy="lfu")
+    await _put(cache, "a.mp4", 10)
+    await _put(cache, "b.mp4", 10)
+    for _ in range(3):
+      await _serve(cache, "a.mp4")
+    await _serve(cache, "b.mp4")
+    # a was served longest ago, but most often.
+    await _put(cache, "c.mp4", 10)
+    assert _names(tmp_path / "videos") == ["a.mp4", "c.mp4"]
+
+  run(scenario())
+
+
+def test_pinned_videos_are_not_evicted_until_released(tmp_path, run):
+  async def scenario():
+    cache = VideoCache(tmp_path / "videos", max_bytes=15)
+    await _put(cache, "a.mp4", 10)
+    assert await cache.acquire("a.mp4") is not None
+    await _put(cache, "b.mp4", 10)
+    # Over quota while a is streaming; b is the newest write and also kept.
+    assert _names(tmp_path / "videos") == ["a.mp4", "b.mp4"]
+    await cache.release("a.mp4")
+    assert _names(tmp_path / "videos") == ["b.mp4"]
+
+  run(scenario())
+
+
+def test_startup_scan_drops_partial_files_and_enforces_the_quota(tmp_path, run):
+  directory = tmp_path / "videos"
+  directory.mkdir()
+  for name, age in (("old.mp4", 300), ("new.mp4", 0)):
+    (directory / name).write_bytes(b"v" * 10)
+    os.utime(directory / name, (1_700_000_000 - age, 1_700_000_000 - age))
+  (directory / "new.mp4.1234.part").write_bytes(b"half")
+
+  async def scenario():
+    cache = VideoCache(directory, max_bytes=15)
+    assert await cache.contains("new.mp4")
+    assert _names(directory) == ["new.mp4"]
+
+  run(scenario())
+
+
+def test_read_through_streams_a_miss_once_for_concurrent_requests(tmp_path, run):
+  objects = {"videos/v1.mp4": b"m" * 4096}
+
+  async def scenario():
+    supabase = _Supabase(objects)
+    http = _bucket_http(objects)
+    cache = VideoCache(tmp_path / "videos", max_bytes=1 << 20, supabase_client=supabase, http_client=http)
+    try:
+      paths = await asyncio.gather(*(cache.acquire("v1.mp4") for _ in range(5)))
+      assert all(path.read_bytes() == objects["videos/v1.mp4"] for path in paths)
+      assert supabase.storage.bucket.signed == ["videos/v1.mp4"]
+      assert await cache.acquire("missing.mp4") is None
+      assert _names(tmp_path / "videos") == ["v1.mp4"]
+    finally:
+      await http.aclose()
+
+  run(scenario())
+
+
+def test_waiter_takes_over_when_the_downloading_request_is_cancelled(tmp_path, run):
+  objects = {"videos/v1.mp4": b"m" * 1024}
+
+  async def scenario():
+    gate = asyncio.Event()
+    supabase = _Supabase(objects)
+    http = _bucket_http(objects, gate)
+    cache = VideoCache(tmp_path / "videos", max_bytes=1 << 20, supabase_client=supabase, http_client=http)
+    try:
+      owner = asyncio.create_task(cache.acquire("v1.mp4"))
+      await asyncio.sleep(0.05)
+      waiter = asyncio.create_task(cache.acquire("v1.mp4"))
+      await asyncio.sleep(0.05)
+      owner.cancel()
+      await asyncio.sleep(0.05)
+      gate.set()
+      path = await asyncio.wait_for(waiter, 2)
+      assert path.read_bytes() == objects["videos/v1.mp4"]
+      assert owner.cancelled()
+      assert not [name for name in _names(tmp_path / "videos") if name.endswith(".part")]
+    finally:
+      await http.aclose()
+
+  run(scenario())
+
+
+def test_serve_video_is_private_to_the_browser(tmp_path):
+  (tmp_path / "videos").mkdir()
+  (tmp_path / "videos" / "v1.mp4").write_bytes(b"v" * 100)
+  cache = VideoCache(tmp_path / "videos", max_bytes=1 << 20)
+  app = FastAPI()
+  app.include_router(storage_router.router)
+  app.dependency_overrides[get_video_cache] = lambda: cache
+  client = TestClient(app)
+
+  res = client.get("/storage/videos/v1.mp4")
+  assert res.status_code == 200 and res.content == b"v" * 100
+  assert res.headers["cache-control"] == "private, max-age=86400"
+  assert res.headers["etag"]
+  assert client.get("/storage/videos/nope.mp4").status_code == 404
+
+
+@pytest.mark.parametrize("with_cache", [True, False])
+def test_upload_from_url_streams_to_disk_and_leaves_no_partial_file(tmp_path, run, with_cache):
+  video = os.urandom(3 * 1024 * 1024 + 17)
+
+  async def scenario():
+    http = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=video)))
+    cache = VideoCache(tmp_path / "storage" / "videos", max_bytes=1 << 30) if with_cache else None
+    service = StorageService(storage_dir=str(tmp_path / "storage"), video_cache=cache, http_client=http)
+    try:
+      url = await service.upload_from_url("https://render.test/v.mp4", case_key="I10")
+    finally:
+      await http.aclose()
+    assert url.startswith("/storage/videos/I10-")
+    assert (tmp_path / "storage" / "videos" / url.rsplit("/", 1)[1]).read_bytes() == video
+    assert _names(tmp_path / "storage" / "partial") == []
+
+  run(scenario())